@@ -0,0 +1,319 @@
+"""
+管理命令延迟基准测试
+
+在临时目录中创建一个ChatServer（不监听端口），放入N个在线用户（socket用丢弃数据的对象代替），
+若干个聊天线程持续模拟收到聊天消息：检查禁言状态后向所有人广播。
+在这样的聊天负载下，由管理员“用户0”对用户表中最后加入的用户循环执行op、unop、shutup、unshutup、kick、ban、unban，比较：
+  inline  - 改动前聊天中ADMIN_COMMAND的写法：每个命令遍历client_nicknames查找目标socket，
+            ban要经过resolve_ban_target、取自己的IP、ban_rules、kick_banned_clients、kick_user多次取锁
+            （改动前的unshutup在持有self.lock时广播，会和broadcast_message再次取锁死锁，这里已把广播移到锁外）
+  engine  - execute_admin_command：命令表分派，按昵称反向索引查找，查找目标和修改管理状态只取一次锁
+统计每条命令的延迟，以及命令线程取得self.lock的次数（包括广播时复制客户端列表）和
+查找修改阶段的持锁时间（持锁期间聊天线程无法处理消息）。
+
+用法：python benchmarks/admin_commands.py [--users 100,1000,5000] [--chatters 4] [--rate 50] [--rounds 30]
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import server  # noqa: E402
+
+
+class NullSocket:
+    """丢弃所有数据的socket"""
+    def send(self, data):
+        return len(data)
+
+    def sendall(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+class TimedLock:
+    """包装self.lock，统计指定线程的取锁次数和持锁时间"""
+    def __init__(self, lock):
+        self.lock = lock
+        self.owner = None  # 被统计的线程
+        self.count = 0
+        self.held = 0.0
+        self.acquired_at = 0.0
+
+    def acquire(self, *args):
+        result = self.lock.acquire(*args)
+        if result and threading.current_thread() is self.owner:
+            self.count += 1
+            self.acquired_at = time.perf_counter()
+        return result
+
+    def release(self):
+        if threading.current_thread() is self.owner:
+            self.held += time.perf_counter() - self.acquired_at
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def inline_op(chat_server, target_nickname):
+    target_socket = None
+    with chat_server.lock:
+        for sock, n in chat_server.client_nicknames.items():
+            if n == target_nickname:
+                target_socket = sock
+                break
+        chat_server.admins.add(target_nickname)
+    broadcast_msg = f"系统: {target_nickname} 已成为管理员"
+    chat_server.broadcast_message(broadcast_msg)
+    if target_socket:
+        chat_server.send_to(target_socket, f"OP:{broadcast_msg}")
+    chat_server.broadcast_user_list()
+
+
+def inline_unop(chat_server, target_nickname):
+    is_admin = False
+    target_socket = None
+    with chat_server.lock:
+        for sock, n in chat_server.client_nicknames.items():
+            if n == target_nickname:
+                target_socket = sock
+                break
+        if target_nickname in chat_server.admins:
+            chat_server.admins.remove(target_nickname)
+            is_admin = True
+    if is_admin:
+        broadcast_msg = f"系统: {target_nickname} 已被撤销管理员权限"
+        chat_server.broadcast_message(broadcast_msg)
+        if target_socket:
+            chat_server.send_to(target_socket, f"UNOP:{broadcast_msg}")
+        chat_server.broadcast_user_list()
+
+
+def inline_shutup(chat_server, target_nickname, duration):
+    target_socket = None
+    with chat_server.lock:
+        for sock, n in chat_server.client_nicknames.items():
+            if n == target_nickname:
+                target_socket = sock
+                break
+        chat_server.muted_users[target_nickname] = (time.time(), duration)
+    broadcast_msg = f"系统: {target_nickname} 已被禁言 {duration} 分钟"
+    chat_server.broadcast_message(broadcast_msg)
+    if target_socket:
+        chat_server.send_to(target_socket, f"MUTED:{broadcast_msg}")
+
+
+def inline_unshutup(chat_server, target_nickname):
+    target_socket = None
+    is_muted = False
+    with chat_server.lock:
+        for sock, n in chat_server.client_nicknames.items():
+            if n == target_nickname:
+                target_socket = sock
+                break
+        if target_nickname in chat_server.muted_users:
+            del chat_server.muted_users[target_nickname]
+            is_muted = True
+    if is_muted:
+        broadcast_msg = f"系统: {target_nickname} 已被解除禁言"
+        chat_server.broadcast_message(broadcast_msg)
+        if target_socket:
+            chat_server.send_to(target_socket, f"UNMUTED:{broadcast_msg}")
+
+
+def inline_kick_user(chat_server, target_nickname):
+    target_socket = None
+    with chat_server.lock:
+        for sock, nickname in chat_server.client_nicknames.items():
+            if nickname == target_nickname:
+                target_socket = sock
+                break
+    if target_socket:
+        chat_server.send_to(target_socket, "KICKED:你已被管理员踢出聊天室")
+        target_socket.close()
+        chat_server.broadcast_message(f"系统: {target_nickname} 已被管理员踢出聊天室")
+
+
+def inline_resolve_ban_target(chat_server, target):
+    try:
+        return server.parse_ip_ban_rules(target), None
+    except ValueError:
+        pass
+    with chat_server.lock:
+        for sock, n in chat_server.client_nicknames.items():
+            if n == target:
+                profile = chat_server.client_profiles.get(sock)
+                if profile and profile.get('ip_address'):
+                    return server.parse_ip_ban_rules(profile['ip_address']), target
+                break
+    return [], target
+
+
+def inline_ban(chat_server, actor_socket, target):
+    rules, target_user = inline_resolve_ban_target(chat_server, target)
+    with chat_server.lock:
+        own_ip = chat_server.client_profiles.get(actor_socket, {}).get('ip_address')
+    if rules and not (own_ip and server.IPPrefixTrie(rules).match(own_ip)):
+        with chat_server.lock:
+            added = [rule for rule in rules if rule not in chat_server.banned_ips]
+            for rule in added:
+                chat_server.banned_ips.add(rule)
+        if added:
+            with chat_server.lock:
+                targets = [chat_server.client_nicknames[sock] for sock, profile in chat_server.client_profiles.items()
+                           if sock in chat_server.client_nicknames and chat_server.banned_ips.match(profile['ip_address'])]
+            for target_nickname in targets:
+                inline_kick_user(chat_server, target_nickname)
+            chat_server.broadcast_message(f"系统: 用户 {target_user} 的IP {', '.join(rules)} 已被管理员封禁")
+
+
+def inline_unban(chat_server, target):
+    rules, target_user = inline_resolve_ban_target(chat_server, target)
+    if rules:
+        with chat_server.lock:
+            removed = [rule for rule in rules if rule in chat_server.banned_ips]
+            for rule in removed:
+                chat_server.banned_ips.remove(rule)
+        if removed:
+            chat_server.broadcast_message(f"系统: 用户 {target_user} 的IP {', '.join(removed)} 已被管理员解除封禁")
+
+
+def inline_commands(chat_server, actor, target):
+    actor_socket = next(sock for sock, nickname in chat_server.client_nicknames.items() if nickname == actor)
+    return [
+        ("op", lambda: inline_op(chat_server, target)),
+        ("unop", lambda: inline_unop(chat_server, target)),
+        ("shutup", lambda: inline_shutup(chat_server, target, 5)),
+        ("unshutup", lambda: inline_unshutup(chat_server, target)),
+        ("kick", lambda: inline_kick_user(chat_server, target)),
+        ("ban", lambda: inline_ban(chat_server, actor_socket, target)),
+        ("unban", lambda: inline_unban(chat_server, target)),
+    ]
+
+
+def engine_commands(chat_server, actor, target):
+    return [
+        ("op", lambda: chat_server.execute_admin_command("op", target, actor)),
+        ("unop", lambda: chat_server.execute_admin_command("unop", target, actor)),
+        ("shutup", lambda: chat_server.execute_admin_command("shutup", f"{target} 5", actor)),
+        ("unshutup", lambda: chat_server.execute_admin_command("unshutup", target, actor)),
+        ("kick", lambda: chat_server.execute_admin_command("kick", target, actor)),
+        ("ban", lambda: chat_server.execute_admin_command("ban", target, actor)),
+        ("unban", lambda: chat_server.execute_admin_command("unban", target, actor)),
+    ]
+
+
+def make_server(users):
+    chat_server = server.ChatServer()
+    for index in range(users):
+        sock = NullSocket()
+        nickname = f"用户{index}"
+        chat_server.client_sockets.append(sock)
+        chat_server.client_nicknames[sock] = nickname
+        chat_server.client_profiles[sock] = {"nickname": nickname, "ip_address": f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"}
+    chat_server.lock = TimedLock(chat_server.lock)
+    return chat_server
+
+
+def chatter(chat_server, nickname, rate, stop_event, counter):
+    """模拟一个用户持续发言：检查禁言后广播"""
+    interval = 1.0 / rate if rate > 0 else 0
+    next_time = time.perf_counter()
+    while not stop_event.is_set():
+        with chat_server.lock:
+            muted = nickname in chat_server.muted_users
+        if not muted:
+            chat_server.broadcast_message(f"{nickname}: 今天晚上一起吃饭吗？", publish=False)
+        counter[0] += 1
+        if interval:
+            next_time += interval
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def run(users, make_commands, chatters, rate, rounds):
+    chat_server = make_server(users)
+    target = f"用户{users - 1}"
+    commands = make_commands(chat_server, "用户0", target)
+    stop_event = threading.Event()
+    counter = [0]
+    threads = []
+    for index in range(chatters):
+        thread = threading.Thread(target=chatter, args=(chat_server, f"用户{index}", rate, stop_event, counter))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    chat_start = time.perf_counter()
+    time.sleep(0.2)
+
+    lock = chat_server.lock
+    lock.owner = threading.current_thread()
+    samples = {name: ([], [], []) for name, _ in commands}  # 命令 -> (延迟, 取锁次数, 持锁时间)
+    for _ in range(rounds):
+        for name, command in commands:
+            count, held = lock.count, lock.held
+            began = time.perf_counter()
+            command()
+            latencies, counts, helds = samples[name]
+            latencies.append(time.perf_counter() - began)
+            counts.append(lock.count - count)
+            helds.append(lock.held - held)
+    time.sleep(0.2)
+    stop_event.set()
+    chat_rate = counter[0] / (time.perf_counter() - chat_start)
+    for thread in threads:
+        thread.join()
+    results = {name: (statistics.median(latencies), statistics.mean(counts), statistics.median(helds))
+               for name, (latencies, counts, helds) in samples.items()}
+    return results, chat_rate
+
+def main():
+    parser = argparse.ArgumentParser(description="管理命令延迟基准测试")
+    parser.add_argument("--users", default="100,1000,5000", help="在线用户数，多个用逗号分隔")
+    parser.add_argument("--chatters", type=int, default=4, help="持续发言的聊天线程数")
+    parser.add_argument("--rate", type=float, default=50, help="每个聊天线程每秒的消息数，0表示不限速")
+    parser.add_argument("--rounds", type=int, default=30, help="每条命令的执行次数")
+    args = parser.parse_args()
+
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # ChatServer从当前目录读取配置，关闭管理状态持久化，避免测量磁盘写入
+        os.chdir(directory)
+        with open(server.CONFIG_FILE, "w", encoding="utf-8") as f:
+            f.write("moderation_store=false\n")
+        try:
+            print(f"聊天线程: {args.chatters}，每线程 {args.rate:g} 条/秒，每条命令执行 {args.rounds} 次，取中位数")
+            for users in (int(value) for value in args.users.split(",")):
+                # ban踢出用户时会打印结果，测量时不输出
+                with contextlib.redirect_stdout(io.StringIO()):
+                    inline, inline_chat = run(users, inline_commands, args.chatters, args.rate, args.rounds)
+                    engine, engine_chat = run(users, engine_commands, args.chatters, args.rate, args.rounds)
+                print(f"在线用户: {users}，聊天吞吐 inline {inline_chat:.0f} 条/秒，engine {engine_chat:.0f} 条/秒")
+                print(f"{'命令':<10}{'延迟(ms)':>18}{'取锁次数':>14}{'持锁(us)':>18}")
+                print(f"{'':<10}{'inline':>9}{'engine':>9}{'inline':>7}{'engine':>7}{'inline':>9}{'engine':>9}")
+                for name in inline:
+                    (old_latency, old_locks, old_held), (new_latency, new_locks, new_held) = inline[name], engine[name]
+                    print(f"{name:<10}{old_latency * 1000:>9.2f}{new_latency * 1000:>9.2f}{old_locks:>7.0f}{new_locks:>7.0f}"
+                          f"{old_held * 1e6:>9.1f}{new_held * 1e6:>9.1f}")
+        finally:
+            os.chdir(previous)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+工具箱文件加解密基准测试
+
+生成临时文件后比较以下加密方式的吞吐量和峰值内存（tracemalloc统计的Python分配）：
+  cbc_whole     - 改动前文本模式的写法：整个文件读入内存，CBC填充后转十六进制
+  gcm_64k       - aes_crypt_file：AES-GCM流式加密，每块64KB
+  gcm_1m        - aes_crypt_file：每块1MB（工具箱实际使用的块大小）
+  gcm_4m        - aes_crypt_file：每块4MB
+  decrypt_1m    - aes_crypt_file：流式解密并校验认证标签
+
+用法：python benchmarks/aes_file.py [--size-mb 128] [--repeat 3]
+"""
+import argparse
+import binascii
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Crypto.Cipher import AES  # noqa: E402
+from Crypto.Util.Padding import pad  # noqa: E402
+
+import client_pyqt5 as client  # noqa: E402
+
+KEY = b"0123456789abcdef0123456789abcdef"
+
+
+def cbc_whole(source_path, target_path):
+    with open(source_path, "rb") as f:
+        data = f.read()
+    cipher = AES.new(KEY, AES.MODE_CBC, b'0000000000000000')
+    with open(target_path, "wb") as f:
+        f.write(binascii.b2a_hex(cipher.encrypt(pad(data, AES.block_size))))
+
+
+def with_chunk_size(chunk_size, decrypt=False):
+    def run(source_path, target_path):
+        original = client.AES_FILE_CHUNK_SIZE
+        client.AES_FILE_CHUNK_SIZE = chunk_size
+        try:
+            client.aes_crypt_file(KEY, source_path, target_path, decrypt)
+        finally:
+            client.AES_FILE_CHUNK_SIZE = original
+    return run
+
+
+def measure(func, source_path, target_path, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(source_path, target_path)
+        samples.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(source_path, target_path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(samples), statistics.median(samples), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="工具箱文件加解密基准测试")
+    parser.add_argument("--size-mb", type=int, default=128, help="临时文件大小（MB）")
+    parser.add_argument("--repeat", type=int, default=3, help="每种方式的重复次数")
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as directory:
+        plain_path = os.path.join(directory, "plain.bin")
+        block = os.urandom(1024 * 1024)
+        with open(plain_path, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(block)
+        encrypted_path = os.path.join(directory, "plain.bin.lcaes")
+        client.aes_crypt_file(KEY, plain_path, encrypted_path)
+        output_path = os.path.join(directory, "output.bin")
+
+        cases = [
+            ("cbc_whole", plain_path, cbc_whole),
+            ("gcm_64k", plain_path, with_chunk_size(64 * 1024)),
+            ("gcm_1m", plain_path, with_chunk_size(1024 * 1024)),
+            ("gcm_4m", plain_path, with_chunk_size(4 * 1024 * 1024)),
+            ("decrypt_1m", encrypted_path, with_chunk_size(1024 * 1024, decrypt=True)),
+        ]
+        print(f"文件: {args.size_mb} MB")
+        print(f"{'方式':<14}{'最快(s)':>10}{'中位(s)':>10}{'吞吐(MB/s)':>12}{'峰值内存(MB)':>14}")
+        for name, source_path, func in cases:
+            fastest, median, peak = measure(func, source_path, output_path, args.repeat)
+            print(f"{name:<14}{fastest:>10.3f}{median:>10.3f}{size / fastest / (1024 * 1024):>12.1f}"
+                  f"{peak / (1024 * 1024):>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
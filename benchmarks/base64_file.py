@@ -0,0 +1,100 @@
+"""
+工具箱文件编解码基准测试
+
+生成临时文件后比较以下方式的耗时和峰值内存（tracemalloc统计的Python分配）：
+  whole_text    - 改动前文本模式的写法：整个内容一次编码，结果放进QTextEdit（--widget-mb限制大小）
+  whole         - 整个文件一次读入内存编码后写出，不经过界面
+  stream_encode - codec_file：分块编码写入文件，结果区只显示预览
+  stream_decode - codec_file：分块解码，忽略空白字符
+
+用法：python benchmarks/base64_file.py [--size-mb 64] [--widget-mb 8] [--format base64] [--repeat 3]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PyQt5.QtWidgets import QApplication, QTextEdit  # noqa: E402
+
+import client_pyqt5 as client  # noqa: E402
+
+
+def measure(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(samples), statistics.median(samples), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="工具箱文件编解码基准测试")
+    parser.add_argument("--size-mb", type=int, default=64, help="临时文件大小（MB）")
+    parser.add_argument("--widget-mb", type=int, default=8, help="whole_text使用的输入大小（MB），QTextEdit处理大文本很慢")
+    parser.add_argument("--format", choices=[name for name, _ in client.CODEC_FORMATS], default="base64")
+    parser.add_argument("--repeat", type=int, default=3, help="每种方式的重复次数")
+    args = parser.parse_args()
+    # 只用于保持QApplication存活，QTextEdit等控件必须在它存在时创建，后面不会读取app
+    app = QApplication.instance() or QApplication(sys.argv)  # noqa: F841
+    encoder = client.CODEC_FUNCTIONS[args.format][0]
+    size = args.size_mb * 1024 * 1024
+    widget_size = min(args.widget_mb, args.size_mb) * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as directory:
+        source_path = os.path.join(directory, "plain.bin")
+        block = os.urandom(1024 * 1024)
+        with open(source_path, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(block)
+        encoded_path = os.path.join(directory, "encoded.txt")
+        output_path = os.path.join(directory, "output.bin")
+        client.codec_file(args.format, source_path, encoded_path)
+        result = QTextEdit()
+
+        def whole_text():
+            with open(source_path, "rb") as f:
+                data = f.read(widget_size)
+            result.setPlainText(encoder(data).decode("ascii"))
+
+        def whole():
+            with open(source_path, "rb") as f:
+                data = f.read()
+            with open(output_path, "wb") as f:
+                f.write(encoder(data))
+
+        def stream_encode():
+            _, preview = client.codec_file(args.format, source_path, output_path)
+            result.setPlainText(preview.decode("ascii"))
+
+        def stream_decode():
+            client.codec_file(args.format, encoded_path, output_path, decode=True)
+
+        cases = [
+            ("whole_text", widget_size, whole_text),
+            ("whole", size, whole),
+            ("stream_encode", size, stream_encode),
+            ("stream_decode", os.path.getsize(encoded_path), stream_decode),
+        ]
+        print(f"格式: {args.format}，文件: {args.size_mb} MB，块大小: {client.CODEC_CHUNK_SIZE // 1024} KB")
+        print(f"{'方式':<16}{'输入(MB)':>10}{'最快(s)':>10}{'中位(s)':>10}{'吞吐(MB/s)':>12}{'峰值内存(MB)':>14}")
+        for name, total, func in cases:
+            fastest, median, peak = measure(func, args.repeat)
+            print(f"{name:<16}{total / (1024 * 1024):>10.0f}{fastest:>10.3f}{median:>10.3f}"
+                  f"{total / fastest / (1024 * 1024):>12.1f}{peak / (1024 * 1024):>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
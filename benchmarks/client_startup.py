@@ -0,0 +1,98 @@
+"""
+客户端启动耗时基准测试
+
+在全新的Python进程中分阶段测量client_pyqt5的启动耗时：
+  import   - 导入client_pyqt5模块
+  license  - 创建QApplication并显示法律声明窗口
+  connect  - 创建主窗口并显示连接界面
+  chat     - 首次进入聊天室时创建聊天界面
+  toolbox  - 首次打开工具箱
+
+第一次运行前会删除client_pyqt5的字节码缓存，作为冷启动数据；
+之后的运行复用缓存和系统文件缓存，作为热启动数据。
+
+用法：python benchmarks/client_startup.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD_CODE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, ROOT)
+import client_pyqt5 as client
+t_import = time.perf_counter()
+
+app = client.QApplication(sys.argv)
+license_window = client.LicenseWindow()
+license_window.show()
+app.processEvents()
+t_license = time.perf_counter()
+
+window = client.ChatClient()
+# 只测量界面构建，跳过壁纸、一言和更新检查等网络请求
+window.startup_tasks_scheduled = True
+window.show()
+app.processEvents()
+t_connect = time.perf_counter()
+
+if window.chat_frame is None:
+    window.init_chat_frame()
+app.processEvents()
+t_chat = time.perf_counter()
+
+window.show_toolbox()
+app.processEvents()
+t_toolbox = time.perf_counter()
+
+print(json.dumps({
+    "import": t_import - t0,
+    "license": t_license - t_import,
+    "connect": t_connect - t_license,
+    "chat": t_chat - t_connect,
+    "toolbox": t_toolbox - t_chat,
+    "total_to_license": t_license - t0,
+}))
+""".replace("ROOT", repr(ROOT))
+
+STAGES = ("import", "license", "connect", "chat", "toolbox", "total_to_license")
+
+
+def run_once():
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    output = subprocess.check_output([sys.executable, "-c", CHILD_CODE], env=env, cwd=ROOT)
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def clear_bytecode_cache():
+    cache_dir = os.path.join(ROOT, "__pycache__")
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            if name.startswith("client_pyqt5."):
+                os.remove(os.path.join(cache_dir, name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="client_pyqt5启动耗时基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="热启动测量次数")
+    args = parser.parse_args()
+
+    clear_bytecode_cache()
+    cold = run_once()
+    warm_runs = [run_once() for _ in range(args.runs)]
+
+    print(f"{'阶段':<18}{'冷启动(ms)':>12}{'热启动中位数(ms)':>18}")
+    for stage in STAGES:
+        warm = statistics.median(run[stage] for run in warm_runs)
+        print(f"{stage:<18}{cold[stage] * 1000:>12.1f}{warm * 1000:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+消息压缩基准测试
+
+针对典型负载比较三种发送方式的带宽和CPU开销：
+  raw     - 不压缩（旧协议和未启用deflate的客户端）
+  deflate - raw deflate，不使用预置字典
+  dict    - raw deflate + server.py中的COMPRESSION_DICTIONARY（协议实际使用的方式）
+
+负载包括不同在线人数下的USERS_LIST、加入/离开等系统消息和长聊天消息。
+最后按"每次有人进出都向所有在线用户广播一次用户列表"估算整个聊天室的流量：
+广播时压缩结果在客户端之间复用，所以CPU开销只和广播次数有关，与在线人数无关。
+
+用法：python benchmarks/compression.py [--repeat 200] [--levels 1,6,9]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import server  # noqa: E402
+
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗"
+WORDS = ("小明", "同学", "zhang", "li_wei", "Alice", "bob", "测试", "学习委员", "2024", "_pc", "值班", "mvp")
+
+
+def make_nicknames(count, seed=0):
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        names.add(rng.choice(SURNAMES) + rng.choice(WORDS) + str(rng.randint(0, 999)))
+    return sorted(names)
+
+
+def make_users_list(count):
+    names = make_nicknames(count)
+    # 少量管理员带前缀
+    users = [f"ADMIN：{name}" if index % 50 == 0 else name for index, name in enumerate(names)]
+    return f"USERS_LIST:{','.join(users)}"
+
+
+def make_payloads():
+    payloads = [
+        ("join", "系统: 王小明123 加入了聊天室"),
+        ("leave", "系统: 李同学45 离开了聊天室"),
+        ("chat_long", "王小明123: " + "今天的作业是第三章的练习题，明天上课前交给课代表。" * 30),
+    ]
+    for count in (100, 1000, 5000):
+        payloads.append((f"roster_{count}", make_users_list(count)))
+    return payloads
+
+
+def compress_plain(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_dict(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=server.COMPRESSION_DICTIONARY)
+    return compressor.compress(data) + compressor.flush()
+
+
+def time_call(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="消息压缩带宽和CPU开销基准测试")
+    parser.add_argument("--repeat", type=int, default=200, help="每项计时的重复次数")
+    parser.add_argument("--levels", default="1,6,9", help="比较的压缩级别，逗号分隔")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.levels.split(",")]
+
+    print(f"协议压缩级别: {server.COMPRESSION_LEVEL}，字典大小: {len(server.COMPRESSION_DICTIONARY)}字节")
+    print(f"{'负载':<14}{'级别':>4}{'原始(B)':>10}{'deflate(B)':>12}{'dict(B)':>10}{'压缩率':>8}{'压缩(us)':>10}{'解压(us)':>10}")
+    results = {}
+    for name, message in make_payloads():
+        data = message.encode("utf-8")
+        for level in levels:
+            plain = compress_plain(data, level)
+            compressed = compress_dict(data, level)
+            assert server.decompress_payload(compressed) == data
+            compress_time = time_call(lambda: compress_dict(data, level), args.repeat)
+            decompress_time = time_call(lambda: zlib.decompressobj(-15, zdict=server.COMPRESSION_DICTIONARY).decompress(compressed), args.repeat)
+            results[(name, level)] = (len(data), len(compressed), compress_time)
+            print(f"{name:<14}{level:>4}{len(data):>10}{len(plain):>12}{len(compressed):>10}"
+                  f"{len(compressed) / len(data):>8.2f}{compress_time * 1e6:>10.1f}{decompress_time * 1e6:>10.1f}")
+
+    # 整个聊天室的估算：每次进出广播一次用户列表
+    level = server.COMPRESSION_LEVEL
+    print()
+    print(f"每次进出广播用户列表（级别{level}，压缩一次发给所有人）")
+    print(f"{'在线人数':<10}{'原始流量(KB)':>14}{'压缩流量(KB)':>14}{'节省':>8}{'压缩CPU(ms)':>13}")
+    for count in (100, 1000, 5000):
+        raw_size, compressed_size, compress_time = results[(f"roster_{count}", level)]
+        print(f"{count:<10}{raw_size * count / 1024:>14.1f}{compressed_size * count / 1024:>14.1f}"
+              f"{1 - compressed_size / raw_size:>8.0%}{compress_time * 1000:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+局域网发现基准测试
+
+在本机启动若干个模拟服务器（各自监听一个UDP端口，应答前人为等待不同的时间），
+用discover_servers向它们单播发现请求，统计：
+  首个结果(ms)  - 第一台服务器出现在列表中的时间，界面此时已可选择
+  完成(ms)      - 整次搜索结束的时间（最后一轮请求后还要等待DISCOVERY_TIMEOUT）
+  排序正确      - 结果是否按模拟延迟从低到高排列
+丢包率模拟应答丢失，多轮请求使丢包时仍能发现服务器。
+
+用法：python benchmarks/discovery.py [--servers 8] [--loss 0.3] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import client_pyqt5 as client  # noqa: E402
+
+
+def responder(sock, index, delay, loss, stop_event, rng):
+    sock.settimeout(0.1)
+    while not stop_event.is_set():
+        try:
+            data, address = sock.recvfrom(1024)
+        except socket.timeout:
+            continue
+        magic, nonce = data.decode("utf-8").split(" ", 1)
+        if magic != client.DISCOVERY_MAGIC or rng.random() < loss:
+            continue
+        time.sleep(delay)
+        info = {"name": f"bench-{index}", "port": 7891 + index, "version": "bench",
+                "online": index, "max_user": 100, "load": index / 100, "tls": "off", "nonce": nonce}
+        sock.sendto(f"{client.DISCOVERY_REPLY} {json.dumps(info)}".encode("utf-8"), address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="局域网发现基准测试")
+    parser.add_argument("--servers", type=int, default=8, help="模拟服务器数量")
+    parser.add_argument("--loss", type=float, default=0.3, help="应答丢包率")
+    parser.add_argument("--repeat", type=int, default=5, help="搜索次数")
+    args = parser.parse_args()
+    rng = random.Random(42)
+    stop_event = threading.Event()
+    delays = [0.002 * (index + 1) for index in range(args.servers)]
+    targets = []
+    for index, delay in enumerate(delays):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        targets.append(sock.getsockname())
+        thread = threading.Thread(target=responder, args=(sock, index, delay, args.loss, stop_event, rng))
+        thread.daemon = True
+        thread.start()
+
+    first_times, total_times, found_counts, ordered = [], [], [], 0
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        first = []
+
+        def on_found(server):
+            if not first:
+                first.append(time.perf_counter() - start)
+
+        servers = client.discover_servers(on_found=on_found, targets=targets)
+        total_times.append(time.perf_counter() - start)
+        first_times.append(first[0] if first else float("nan"))
+        found_counts.append(len(servers))
+        ports = [server["port"] for server in servers]
+        ordered += ports == sorted(ports)
+    stop_event.set()
+
+    print(f"模拟服务器: {args.servers}，应答延迟: {delays[0] * 1000:.0f}~{delays[-1] * 1000:.0f} ms，"
+          f"丢包率: {args.loss:.0%}，每次搜索 {client.DISCOVERY_PROBES} 轮请求")
+    print(f"{'首个结果(ms)':>14}{'完成(ms)':>10}{'平均发现':>10}{'排序正确':>10}")
+    print(f"{statistics.median(first_times) * 1000:>14.1f}{statistics.median(total_times) * 1000:>10.0f}"
+          f"{statistics.mean(found_counts):>10.1f}{ordered:>6}/{args.repeat}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+工具箱文件校验基准测试
+
+生成临时文件后比较以下计算方式的吞吐量：
+  md5_4k        - 改动前的写法：4KB读取，只算MD5，界面线程中执行
+  md5           - hash_file：大块读入复用缓冲区，只算MD5
+  all_serial    - hash_file：一次读取依次计算MD5/SHA-1/SHA-256/BLAKE2b
+  all_parallel  - hash_file：各算法在线程池中并行计算（工具箱实际使用的方式）
+  files_parallel- 多个文件同时计算，每个文件都并行计算四种算法
+
+第一遍读取会把文件放进系统缓存，之后的结果反映的是CPU开销而不是磁盘速度。
+
+用法：python benchmarks/file_hashing.py [--size-mb 256] [--files 4] [--repeat 3]
+"""
+import argparse
+import hashlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import client_pyqt5 as client  # noqa: E402
+
+
+def md5_4k(file_path):
+    md5_hash = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            md5_hash.update(chunk)
+    return md5_hash.hexdigest()
+
+
+def make_file(directory, index, size):
+    file_path = os.path.join(directory, f"hash_{index}.bin")
+    block = os.urandom(1024 * 1024)
+    with open(file_path, "wb") as f:
+        for _ in range(size // len(block)):
+            f.write(block)
+    return file_path
+
+
+def best_time(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return min(samples), statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="工具箱文件校验吞吐量基准测试")
+    parser.add_argument("--size-mb", type=int, default=256, help="每个临时文件的大小（MB）")
+    parser.add_argument("--files", type=int, default=4, help="files_parallel使用的文件数")
+    parser.add_argument("--repeat", type=int, default=3, help="每种方式的重复次数")
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+    md5_only = client.HASH_ALGORITHMS[:1]
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = [make_file(directory, index, size) for index in range(args.files)]
+        first = files[0]
+        with ThreadPoolExecutor(max(1, (os.cpu_count() or 1) - 1)) as hash_pool:
+            def files_parallel():
+                with ThreadPoolExecutor(client.HASH_PARALLEL_FILES) as file_pool:
+                    list(file_pool.map(lambda path: client.hash_file(path, executor=hash_pool), files))
+
+            cases = [
+                ("md5_4k", size, lambda: md5_4k(first)),
+                ("md5", size, lambda: client.hash_file(first, md5_only)),
+                ("all_serial", size, lambda: client.hash_file(first)),
+                ("all_parallel", size, lambda: client.hash_file(first, executor=hash_pool)),
+                ("files_parallel", size * len(files), files_parallel),
+            ]
+            # 预热系统文件缓存
+            for path in files:
+                md5_4k(path)
+            print(f"CPU核心数: {os.cpu_count()}，文件: {args.files} x {args.size_mb} MB，读取块: {client.HASH_READ_SIZE // 1024} KB")
+            print(f"{'方式':<16}{'最快(s)':>10}{'中位(s)':>10}{'吞吐(MB/s)':>12}")
+            for name, total, func in cases:
+                fastest, median = best_time(func, args.repeat)
+                print(f"{name:<16}{fastest:>10.3f}{median:>10.3f}{total / fastest / (1024 * 1024):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
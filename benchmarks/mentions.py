@@ -0,0 +1,112 @@
+"""
+提醒词匹配基准测试
+
+随机生成N条聊天消息（约5%包含提醒词），对不同数量的提醒词（@昵称 + 关键字）比较找出所有命中位置的耗时：
+  find_loop     - 对每个提醒词分别在消息中循环str.find（改动前只查@昵称时的写法扩展到多个关键字）
+  regex         - 所有提醒词拼成一个不区分大小写的正则，re.finditer逐个位置尝试
+  matcher       - MentionMatcher：同样的正则，每次命中后从命中起点的下一个字符继续查找，再合并区间
+同时核对三种方式标出的位置是否一致。随机消息里没有互相重叠的提醒词，另外单独核对一组重叠的例子，
+普通的finditer匹配完一个提醒词后从其结尾继续，会漏掉与它重叠的下一个提醒词。
+
+用法：python benchmarks/mentions.py [--messages 20000] [--keywords 1,10,100] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import client_pyqt5 as client  # noqa: E402
+
+WORDS = ["今天", "晚上", "一起", "吃饭", "服务器", "重启", "hello", "world", "ok", "收到", "明天", "开会", "文件", "发一下"]
+
+
+def find_loop(texts, patterns):
+    patterns = [pattern.lower() for pattern in patterns]
+    results = []
+    for text in texts:
+        folded = text.lower()
+        marks = set()
+        for pattern in patterns:
+            index = folded.find(pattern)
+            while index != -1:
+                marks.update(range(index, index + len(pattern)))
+                index = folded.find(pattern, index + 1)
+        results.append(marks)
+    return results
+
+
+def regex(texts, patterns):
+    # 长的在前，同一位置优先匹配较长的提醒词
+    expression = re.compile("|".join(re.escape(pattern) for pattern in sorted(patterns, key=len, reverse=True)),
+                            re.IGNORECASE)
+    results = []
+    for text in texts:
+        marks = set()
+        for match in expression.finditer(text):
+            marks.update(range(match.start(), match.end()))
+        results.append(marks)
+    return results
+
+
+def matcher(texts, patterns):
+    matcher = client.MentionMatcher(patterns)
+    results = []
+    for text in texts:
+        marks = set()
+        for start, end in matcher.find(text):
+            marks.update(range(start, end))
+        results.append(marks)
+    return results
+
+
+def best_time(func, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    return min(samples), statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="提醒词匹配基准测试")
+    parser.add_argument("--messages", type=int, default=20000, help="消息条数")
+    parser.add_argument("--keywords", default="1,10,100", help="提醒词数量，多个用逗号分隔")
+    parser.add_argument("--repeat", type=int, default=3, help="每种方式的重复次数")
+    args = parser.parse_args()
+    rng = random.Random(42)
+    keyword_pool = [f"项目{index}" for index in range(1000)]
+
+    print(f"消息数: {args.messages}")
+    print(f"{'提醒词':>6}  {'方式':<14}{'最快(ms)':>10}{'中位(ms)':>10}{'每条(us)':>10}{'结果一致':>10}")
+    for count in (int(value) for value in args.keywords.split(",")):
+        patterns = ["@Alice"] + keyword_pool[:count - 1]
+        texts = []
+        for _ in range(args.messages):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(3, 20))]
+            if rng.random() < 0.05:
+                words.insert(rng.randrange(len(words) + 1), rng.choice(patterns).upper())
+            texts.append(" ".join(words))
+        expected = None
+        for name, func in (("find_loop", find_loop), ("regex", regex), ("matcher", matcher)):
+            fastest, median, result = best_time(lambda: func(texts, patterns), args.repeat)
+            expected = result if expected is None else expected
+            print(f"{count:>6}  {name:<14}{fastest * 1000:>10.1f}{median * 1000:>10.1f}"
+                  f"{fastest / args.messages * 1e6:>10.2f}{'是' if result == expected else '否':>10}")
+
+    overlap_texts, overlap_patterns = ["ABCD abc", "xbcdx"], ["abc", "bcd"]
+    expected = find_loop(overlap_texts, overlap_patterns)
+    print(f"重叠提醒词 {overlap_patterns} 与find_loop一致: "
+          f"regex {'是' if regex(overlap_texts, overlap_patterns) == expected else '否'}，"
+          f"matcher {'是' if matcher(overlap_texts, overlap_patterns) == expected else '否'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+接收线程消息解析基准测试
+
+对每种服务器消息分别测量解析并分派一条消息的耗时（不含界面处理）：
+  if_chain  - 改动前receive_messages的写法：依次message.startswith检查各个前缀，命中后再split取字段
+  table     - parse_server_message：取第一个冒号之前的前缀查SERVER_MESSAGE_TYPES，
+              解析为__slots__消息对象，再按类型查处理函数表
+普通聊天消息在if_chain中要经过全部前缀检查才落到最后的else，是最常见也最受影响的一种。
+
+用法：python benchmarks/message_parsing.py [--count 200000] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import client_pyqt5 as client  # noqa: E402
+
+SAMPLES = [
+    ("chat", "张三: 今天晚上一起吃饭吗？@李四"),
+    ("system", "系统: 王五 加入了聊天室"),
+    ("users_list", "USERS_LIST:张三,李四,王五,赵六,ADMIN：管理员"),
+    ("profile", "PROFILE:张三|192.168.1.23|2025-01-01 12:00:00|Windows 11"),
+    ("profile_error", "PROFILE_ERROR:用户不存在"),
+    ("file", 'FILE_ACK:{"id": 1234567890, "offset": 262144}'),
+    ("kicked", "KICKED:你已被管理员踢出聊天室"),
+    ("shutdown", "SHUTDOWN:服务器维护|RECONNECT:30"),
+    ("muted", "MUTED:系统: 你已被管理员禁言 10 分钟"),
+    ("unop", "UNOP:系统: 你的管理员权限已被撤销"),
+]
+
+
+def if_chain(message):
+    """改动前的分支顺序和字段提取，返回(类型, 字段)代替原来的信号发送"""
+    if message.startswith("USERS_LIST:"):
+        users_part = message.split(":", 1)[1]
+        return "users_list", users_part.split(",") if users_part else []
+    elif message.startswith("PROFILE:"):
+        profile_data = message.split(":", 1)[1].split("|")
+        if len(profile_data) == 4:
+            return "profile", tuple(profile_data)
+        return None
+    elif message.startswith("PROFILE_ERROR:"):
+        return "profile_error", message.split(":", 1)[1]
+    elif message.startswith("FILE_"):
+        return "file", message
+    elif message.startswith("KICKED:"):
+        return "kicked", message.split(":", 1)[1]
+    elif message.startswith("SHUTDOWN:"):
+        parts = message.split(":", 1)[1].split("|")
+        reconnect_after = -1
+        for part in parts[1:]:
+            if part.startswith("RECONNECT:"):
+                try:
+                    reconnect_after = int(part[len("RECONNECT:"):])
+                except ValueError:
+                    pass
+        return "shutdown", (parts[0], reconnect_after)
+    elif message.startswith("MUTED:"):
+        return "muted", message.split(":", 1)[1]
+    elif message.startswith("UNMUTED:"):
+        return "unmuted", message.split(":", 1)[1]
+    elif message.startswith("OP:"):
+        return "op", message.split(":", 1)[1]
+    elif message.startswith("UNOP:"):
+        return "unop", message.split(":", 1)[1]
+    else:
+        return "chat", message
+
+
+def make_table():
+    handlers = {message_type: (lambda message: message) for message_type in client.SERVER_MESSAGE_TYPES.values()}
+    handlers[client.ChatMessage] = handlers[client.FileControlMessage] = lambda message: message
+
+    def table(message):
+        parsed = client.parse_server_message(message)
+        if parsed is not None:
+            return handlers[type(parsed)](parsed)
+    return table
+
+
+def per_message(func, message, count, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(count):
+            func(message)
+        samples.append((time.perf_counter() - start) / count)
+    return min(samples), statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="接收线程消息解析基准测试")
+    parser.add_argument("--count", type=int, default=200000, help="每种消息的解析次数")
+    parser.add_argument("--repeat", type=int, default=5, help="重复次数")
+    args = parser.parse_args()
+    table = make_table()
+
+    print(f"每种消息解析 {args.count} 次，取{args.repeat}次中最快的一次")
+    print(f"{'消息类型':<16}{'if_chain(ns)':>14}{'table(ns)':>12}{'加速':>8}")
+    for name, message in SAMPLES:
+        old, _ = per_message(if_chain, message, args.count, args.repeat)
+        new, _ = per_message(table, message, args.count, args.repeat)
+        print(f"{name:<16}{old * 1e9:>14.0f}{new * 1e9:>12.0f}{old / new:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+本地消息记录基准测试
+
+在临时目录中写入N条消息（分布在几个服务器上），比较：
+  per_message   - 每条消息单独INSERT并commit（默认回滚日志），在调用线程中执行，相当于直接在界面线程写库
+  store         - MessageStore.append：调用方只放入队列，后台线程批量事务写入（WAL）
+对store分别统计调用方耗时（界面线程实际被占用的时间）和全部写入完成的耗时，
+然后在写满的库上测量进入聊天室时读取最近消息（recent）和离线搜索（search）的耗时。
+
+用法：python benchmarks/message_store.py [--messages 20000] [--servers 4] [--repeat 5]
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import client_pyqt5 as client  # noqa: E402
+
+
+def make_messages(count, servers):
+    return [(f"192.168.1.{index % servers + 1}:7891", f"用户{index % 37}: 第{index}条消息 hello world {index * 7919 % 100003}",
+             index % 5 == 0) for index in range(count)]
+
+
+def per_message(path, messages):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY, server TEXT, time REAL, is_self INTEGER, text TEXT)")
+    start = time.perf_counter()
+    for server, text, is_self in messages:
+        connection.execute("INSERT INTO messages (server, time, is_self, text) VALUES (?, ?, ?, ?)",
+                           (server, time.time(), int(is_self), text))
+        connection.commit()
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return elapsed, elapsed
+
+
+def batched(path, messages):
+    store = client.MessageStore(path)
+    start = time.perf_counter()
+    for server, text, is_self in messages:
+        store.append(server, text, is_self)
+    caller = time.perf_counter() - start
+    store.flush()
+    total = time.perf_counter() - start
+    return store, caller, total
+
+
+def best_time(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return min(samples), statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地消息记录基准测试")
+    parser.add_argument("--messages", type=int, default=20000, help="写入的消息数")
+    parser.add_argument("--servers", type=int, default=4, help="消息分布的服务器数")
+    parser.add_argument("--repeat", type=int, default=5, help="读取测试的重复次数")
+    args = parser.parse_args()
+    messages = make_messages(args.messages, args.servers)
+
+    with tempfile.TemporaryDirectory() as directory:
+        naive_caller, naive_total = per_message(os.path.join(directory, "naive.db"), messages)
+        store, caller, total = batched(os.path.join(directory, "store.db"), messages)
+        print(f"消息数: {args.messages}，服务器数: {args.servers}")
+        print(f"{'写入方式':<14}{'调用方(ms)':>12}{'每条(us)':>10}{'完成(ms)':>12}")
+        for name, caller_time, total_time in (("per_message", naive_caller, naive_total), ("store", caller, total)):
+            print(f"{name:<14}{caller_time * 1000:>12.1f}{caller_time / args.messages * 1e6:>10.2f}{total_time * 1000:>12.1f}")
+
+        server = messages[-1][0]
+        cases = [
+            (f"recent({client.HISTORY_RESTORE_LIMIT})", lambda: store.recent(server)),
+            ("search 全部", lambda: store.search("hello world 42")),
+            ("search 单服务器", lambda: store.search("hello world 42", server)),
+            ("search 无结果", lambda: store.search("不存在的关键字")),
+        ]
+        print(f"{'读取':<16}{'最快(ms)':>10}{'中位(ms)':>10}")
+        for name, func in cases:
+            fastest, median = best_time(func, args.repeat)
+            print(f"{name:<16}{fastest * 1000:>10.2f}{median * 1000:>10.2f}")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+幂/求根计算器批量模式基准测试
+
+随机生成N行输入（其中一半是完全立方数），比较以下方式的耗时和整数根的正确率：
+  old_float     - 改动前的写法：逐个计算float(x) ** (1 / n)
+  float_loop    - calc_batch浮点模式，没有NumPy时逐个计算（带整数根校正）
+  numpy         - calc_batch浮点模式，NumPy整列向量化计算
+  exact         - calc_batch高精度模式，整数牛顿迭代开方 + decimal
+
+"整数根正确"统计完全立方数中结果恰好显示为整数的行数。
+
+用法：python benchmarks/power_root.py [--rows 100000] [--precision 30] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import client_pyqt5 as client  # noqa: E402
+
+
+def old_float(rows):
+    results = []
+    for x_text, n_text in rows:
+        result = float(x_text) ** (1 / float(n_text))
+        if result.is_integer():
+            result = int(result)
+        results.append(str(result))
+    return results
+
+
+def float_loop(rows):
+    xs = [float(x) for x, _ in rows]
+    ns = [float(n) for _, n in rows]
+    return [client.format_float(client._float_root(x, n)) for x, n in zip(xs, ns)]
+
+
+def best_time(func, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    return min(samples), statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="幂/求根计算器批量模式基准测试")
+    parser.add_argument("--rows", type=int, default=100000, help="输入行数")
+    parser.add_argument("--precision", type=int, default=30, help="高精度模式的有效数字位数")
+    parser.add_argument("--repeat", type=int, default=3, help="每种方式的重复次数")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    rows, expected = [], []
+    for index in range(args.rows):
+        if index % 2 == 0:
+            root = rng.randrange(1, 200000)
+            rows.append((str(root ** 3), "3"))
+            expected.append(str(root))
+        else:
+            rows.append((str(rng.randrange(1, 10 ** 15)), "3"))
+            expected.append(None)
+
+    cases = [
+        ("old_float", lambda: old_float(rows)),
+        ("float_loop", lambda: float_loop(rows)),
+        ("numpy", lambda: client.calc_batch("root", rows, exact=False)[0]),
+        ("exact", lambda: client.calc_batch("root", rows, exact=True, precision=args.precision)[0]),
+    ]
+    cubes = sum(1 for value in expected if value is not None)
+    print(f"行数: {args.rows}（完全立方数 {cubes} 行），高精度位数: {args.precision}")
+    print(f"{'方式':<12}{'最快(ms)':>10}{'中位(ms)':>10}{'每行(us)':>10}{'整数根正确':>12}")
+    for name, func in cases:
+        fastest, median, results = best_time(func, args.repeat)
+        correct = sum(1 for result, value in zip(results, expected) if value is not None and result == value)
+        print(f"{name:<12}{fastest * 1000:>10.1f}{median * 1000:>10.1f}{fastest / args.rows * 1e6:>10.2f}"
+              f"{correct:>8}/{cubes}")
+
+
+if __name__ == "__main__":
+    main()
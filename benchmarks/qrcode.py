@@ -0,0 +1,66 @@
+"""
+本地二维码生成基准测试
+
+比较不同长度内容的编码（选择版本、Reed-Solomon纠错、8种掩码评分）和渲染耗时：
+  matrix        - qrcode_matrix：只生成模块矩阵
+  pixmap        - 清空缓存后调用qrcode_pixmap：编码并渲染为QPixmap
+  cached        - 再次调用qrcode_pixmap：命中按内容缓存的图片
+
+改动前每次打开对话框都要请求公网IP接口和二维码图片接口，离线时无法生成。
+
+用法：python benchmarks/qrcode.py [--repeat 20]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+import client_pyqt5 as client  # noqa: E402
+
+
+def median_time(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地二维码生成基准测试")
+    parser.add_argument("--repeat", type=int, default=20, help="每种方式的重复次数")
+    args = parser.parse_args()
+    # 只用于保持QApplication存活，qrcode_pixmap创建QPixmap时必须已有QApplication，后面不会读取app
+    app = QApplication.instance() or QApplication(sys.argv)  # noqa: F841
+
+    payloads = [
+        "littlechat://192.168.1.10:7981",
+        "littlechat://192.168.100.200:65535?tls=1",
+        "x" * 200,
+        "x" * 1000,
+    ]
+    print(f"{'内容长度':>8}{'版本':>6}{'matrix(ms)':>12}{'pixmap(ms)':>12}{'cached(us)':>12}")
+    for payload in payloads:
+        version = (len(client.qrcode_matrix(payload)) - 17) // 4
+
+        def uncached():
+            client.qrcode_pixmap.cache_clear()
+            client.qrcode_pixmap(payload)
+
+        matrix = median_time(lambda: client.qrcode_matrix(payload), args.repeat)
+        pixmap = median_time(uncached, args.repeat)
+        cached = median_time(lambda: client.qrcode_pixmap(payload), args.repeat)
+        print(f"{len(payload):>8}{version:>6}{matrix * 1000:>12.2f}{pixmap * 1000:>12.2f}{cached * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
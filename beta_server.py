@@ -1,8 +1,15 @@
 import socket
+import struct
 import threading
 import time
 import os
-import requests
+import json
+import hashlib
+import ipaddress
+import queue
+import ssl
+import zlib
+from collections import deque
 from flask import Flask, render_template_string, jsonify, request
 
 # 版本信息
@@ -12,6 +19,46 @@ CURRENT_VERSION = "3.2.0"
 GITEE_OWNER = "MVPS680"
 GITEE_REPO = "MVPLittlechat"
 
+# 协议扩展配置
+# 服务端在SUCCESS响应中声明支持的扩展，客户端回复CAPS:选择启用，旧客户端不受影响
+SERVER_CAPS = ("frame", "ping", "file", "deflate", "shutdown")
+# 关闭服务器时先发送SHUTDOWN:原因[|RECONNECT:秒数]，等客户端收完剩余消息主动断开，超时后再强制关闭
+SHUTDOWN_DRAIN_TIMEOUT = 5
+# 帧格式：4字节负载长度 + 1字节标志位 + 负载
+FRAME_HEADER = struct.Struct("!IB")
+MAX_FRAME_SIZE = 1024 * 1024  # 单帧上限，超过视为协议错误
+FRAMED_RECV_SIZE = 65536
+FRAME_FLAG_BINARY = 0x01  # 负载为二进制数据（文件分块）而不是UTF-8文本
+# 文件分块头：传输ID + 分块在文件中的偏移 + 分块CRC32，其后为分块数据
+FILE_CHUNK_HEADER = struct.Struct("!QQI")
+# 压缩扩展：达到阈值的文本帧使用带预置字典的raw deflate压缩，并设置该标志
+FRAME_FLAG_COMPRESSED = 0x02
+COMPRESSION_LEVEL = 6
+# 预置字典收录协议中反复出现的片段，服务端和客户端必须完全一致，越常用的片段放得越靠后
+COMPRESSION_DICTIONARY = "".join((
+    "FILE_OFFER:FILE_ACCEPT:FILE_CANCEL:PROFILE:MUTED:ERROR:",
+    "{\"id\": \"size\": \"name\": \"to\": ",
+    "系统: 用户 的IP 已被管理员封禁 已被管理员解除禁言",
+    "KICKED:你已被管理员踢出聊天室",
+    "ERROR:您已被禁言 分钟，无法发送消息",
+    "系统: 已被管理员禁言 分钟",
+    "系统: 已被管理员踢出聊天室",
+    "系统: 离开了聊天室",
+    "系统: 加入了聊天室",
+    "USERS_LIST:ADMIN：",
+)).encode('utf-8')
+
+# 更新检查结果的磁盘缓存，避免每次重启都等待网络请求
+UPDATE_CACHE_FILE = "LittleChat.updatecache"
+
+# 更新下载配置
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_PARALLEL = 4  # 服务器支持Range时的最大并行分段数
+DOWNLOAD_MIN_SEGMENT_SIZE = 2 * 1024 * 1024  # 每个分段的最小大小，小文件不拆分
+DOWNLOAD_PROGRESS_INTERVAL = 0.25  # 进度回调的最小间隔（秒）
+DOWNLOAD_RETRIES = 3  # 单个分段网络错误的重试次数
+HTTP_POOL_SIZE = 4  # 共享HTTP客户端对每个主机保持的keep-alive连接数
+
 def compare_versions(current_ver, latest_ver):
     """比较版本号，返回版本差异信息
     返回值：
@@ -52,65 +99,411 @@ def compare_versions(current_ver, latest_ver):
         # 版本号格式错误，默认不需要更新
         return 0
 
-def download_latest_release(download_url, latest_version, file_name=None):
-    """下载最新版本"""
+class DownloadCancelled(Exception):
+    """下载被取消，已下载的部分会保留以便下次续传"""
+
+class ChecksumMismatch(Exception):
+    """下载文件的SHA256与发布的校验和不一致"""
+
+def _parse_content_range_total(content_range):
+    """从Content-Range响应头（bytes 0-0/12345）中解析文件总大小，未知时返回None"""
     try:
-        # 设置请求头，不包含Token认证
-        headers = {
-        }
-        
-        # 获取文件大小
-        response = requests.get(download_url, headers=headers, stream=True, timeout=10)
-        response.raise_for_status()
-        
-        total_size = int(response.headers.get("content-length", 0))
-        
-        # 如果没有提供文件名，生成默认文件名
-        if not file_name:
-            file_name = f"{GITEE_REPO}_server_v{latest_version}.zip"
-        
-        # 开始下载
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 开始下载更新: {file_name}")
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 文件大小: {total_size / 1024:.2f} KB")
-        
-        downloaded_size = 0
-        with open(file_name, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
+        total = content_range.rsplit("/", 1)[1].strip()
+        return int(total) if total != "*" else None
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def _save_download_meta(meta_file, meta):
+    """原子写入续传进度记录，替换前先落盘，断电后不会留下内容为空的记录"""
+    temp_file = meta_file + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, meta_file)
+
+def _load_download_meta(meta_file, part_file, url, total_size, validator):
+    """读取续传进度记录，与当前文件不匹配时返回None"""
+    try:
+        with open(meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("url") != url or meta.get("size") != total_size or meta.get("validator") != validator:
+        return None
+    if not validator:
+        # 没有ETag/Last-Modified时无法确认服务器上的文件未变化，不续传
+        return None
+    if not os.path.exists(part_file) or os.path.getsize(part_file) != total_size:
+        return None
+    return meta
+
+class HttpClient:
+    """共享的HTTP客户端：同一主机的请求复用keep-alive连接，并按URL和参数在内存中缓存响应
+    ttl为None时不缓存；否则ttl秒内直接返回缓存的响应，过期后带If-None-Match/If-Modified-Since
+    重新验证，服务器返回304时继续使用缓存（ttl为0表示每次都重新验证）
+    """
+    def __init__(self, pool_size=HTTP_POOL_SIZE):
+        self.pool_size = pool_size
+        self.session = None  # 第一次请求时创建，没有安装requests时不影响其他功能
+        self.cache = {}  # {(url, 参数): [过期时间, 响应]}
+        self.lock = threading.Lock()
+    
+    def get_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        with self.lock:
+            if self.session is None:
+                self.session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                self.session.mount("http://", adapter)
+                self.session.mount("https://", adapter)
+            return self.session
+    
+    def get(self, url, params=None, headers=None, timeout=10, ttl=None):
+        """发送GET请求，返回requests的Response；4xx/5xx响应抛出HTTPError"""
+        key = (url, tuple(sorted((params or {}).items())))
+        request_headers = dict(headers or {})
+        entry = None
+        if ttl is not None:
+            with self.lock:
+                entry = self.cache.get(key)
+        if entry is not None:
+            expires_at, cached = entry
+            if time.monotonic() < expires_at:
+                return cached
+            if cached.headers.get("ETag"):
+                request_headers["If-None-Match"] = cached.headers["ETag"]
+            if cached.headers.get("Last-Modified"):
+                request_headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+        
+        response = self.get_session().get(url, params=params, headers=request_headers, timeout=timeout)
+        if entry is not None and response.status_code == 304:
+            response = entry[1]
+        else:
+            response.raise_for_status()
+        if ttl is not None:
+            with self.lock:
+                self.cache[key] = [time.monotonic() + ttl, response]
+        return response
+
+http_client = HttpClient()
+
+def file_sha256(file_name):
+    """计算文件的SHA256"""
+    sha256 = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def find_release_checksum(assets, file_name):
+    """在发行版附件中查找file_name的SHA256（<文件名>.sha256 或 SHA256SUMS），找不到返回None"""
+    import requests
+    candidates = (file_name.lower() + ".sha256", "sha256sums", "sha256sums.txt")
+    for asset in assets:
+        if asset.get("name", "").lower() not in candidates:
+            continue
+        url = asset.get("browser_download_url", "")
+        if url and not (url.startswith("http://") or url.startswith("https://")):
+            url = f"https://gitee.com{url}"
+        try:
+            response = http_client.get(url, timeout=10)
+        except requests.exceptions.RequestException:
+            continue
+        for line in response.text.splitlines():
+            parts = line.split()
+            # 单独的.sha256文件可以只有校验和，SHA256SUMS中需要文件名匹配
+            if parts and (len(parts) == 1 or parts[-1].lstrip("*") == file_name):
+                return parts[0].lower()
+    return None
+
+def download_file(url, file_name, expected_sha256=None, parallel=DOWNLOAD_PARALLEL,
+                  progress_callback=None, cancel_event=None, headers=None, timeout=10):
+    """支持断点续传和分段并行的文件下载
+    数据先写入 <file_name>.part，各分段进度记录在 <file_name>.part.json，
+    中断或取消后再次调用会从断点继续；服务器不支持Range时退化为单连接完整下载。
+    progress_callback(已下载字节, 总字节) 的调用间隔不小于DOWNLOAD_PROGRESS_INTERVAL，总大小未知时为0。
+    下载完成并通过校验后重命名为file_name并返回。
+    """
+    import requests
+    part_file = file_name + ".part"
+    meta_file = part_file + ".json"
+    base_headers = dict(headers or {})
+    cancel_event = cancel_event or threading.Event()
+    
+    with requests.Session() as session:
+        # 只请求第一个字节，同时探测文件大小和服务器是否支持Range
+        probe_headers = dict(base_headers, Range="bytes=0-0")
+        probe = session.get(url, headers=probe_headers, stream=True, timeout=timeout, allow_redirects=True)
+        probe.raise_for_status()
+        total_size = _parse_content_range_total(probe.headers.get("Content-Range")) if probe.status_code == 206 else None
+        # If-Range不接受弱ETag，此时改用Last-Modified
+        etag = probe.headers.get("ETag", "")
+        validator = etag if etag and not etag.startswith("W/") else probe.headers.get("Last-Modified", "")
+        url = probe.url  # 后续请求直接使用重定向后的地址
+        
+        if total_size is None:
+            # 不支持Range：沿用探测请求的响应（或重新请求）完整下载
+            if probe.status_code == 206:
+                probe.close()
+                probe = session.get(url, headers=base_headers, stream=True, timeout=timeout)
+                probe.raise_for_status()
+            _download_whole(probe, part_file, progress_callback, cancel_event)
+            if os.path.exists(meta_file):
+                os.remove(meta_file)
+        else:
+            probe.close()
+            meta = _load_download_meta(meta_file, part_file, url, total_size, validator)
+            if meta is None:
+                meta = {"url": url, "size": total_size, "validator": validator,
+                        "segments": _split_segments(total_size, parallel)}
+                with open(part_file, "wb") as f:
+                    f.truncate(total_size)
+                _save_download_meta(meta_file, meta)
+            _download_segments(session, url, base_headers, validator, timeout, part_file, meta_file, meta,
+                               progress_callback, cancel_event)
+    
+    if expected_sha256 and file_sha256(part_file) != expected_sha256.lower():
+        # 校验失败的数据不能用于续传
+        os.remove(part_file)
+        if os.path.exists(meta_file):
+            os.remove(meta_file)
+        raise ChecksumMismatch(f"{file_name} 的SHA256校验失败")
+    
+    os.replace(part_file, file_name)
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+    return file_name
+
+def _split_segments(total_size, parallel):
+    """将文件按字节范围拆分为分段，格式: [[起始, 结束, 下一个待下载字节], ...]"""
+    count = max(1, min(parallel, total_size // DOWNLOAD_MIN_SEGMENT_SIZE))
+    segment_size = -(-total_size // count) if total_size else 0
+    segments = []
+    for start in range(0, total_size, segment_size or 1):
+        end = min(start + segment_size, total_size) - 1
+        segments.append([start, end, start])
+    return segments
+
+def _download_whole(response, part_file, progress_callback, cancel_event):
+    """不支持Range时的单连接下载，取消后不保留部分文件"""
+    total_size = int(response.headers.get("content-length", 0))
+    downloaded_size = 0
+    last_report = 0.0
+    try:
+        with open(part_file, "wb") as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if cancel_event.is_set():
+                    raise DownloadCancelled()
                 if chunk:
                     f.write(chunk)
                     downloaded_size += len(chunk)
-                    
-                    # 显示下载进度
-                    if total_size > 0:
-                        progress = (downloaded_size / total_size) * 100
-                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 下载进度: {progress:.1f}% ({downloaded_size / 1024:.2f} KB / {total_size / 1024:.2f} KB)", end="\r")
+                    now = time.monotonic()
+                    if progress_callback and now - last_report >= DOWNLOAD_PROGRESS_INTERVAL:
+                        last_report = now
+                        progress_callback(downloaded_size, total_size)
+    except BaseException:
+        response.close()
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        raise
+    if total_size and not response.headers.get("content-encoding") and downloaded_size != total_size:
+        os.remove(part_file)
+        raise IOError(f"下载不完整: {downloaded_size}/{total_size} 字节")
+    if progress_callback:
+        progress_callback(downloaded_size, total_size)
+
+def _download_segments(session, url, base_headers, validator, timeout, part_file, meta_file, meta,
+                       progress_callback, cancel_event):
+    """并行下载尚未完成的分段，写入预先分配好的.part文件"""
+    import requests
+    segments = meta["segments"]
+    total_size = meta["size"]
+    lock = threading.Lock()
+    stop_event = threading.Event()  # 任一分段失败时通知其它分段停止
+    errors = []
+    state = {"last_report": 0.0, "stale": False}
+    
+    def downloaded():
+        return sum(segment[2] - segment[0] for segment in segments)
+    
+    def report(data_file, force=False):
+        # 调用方需持有lock；各分段只把已flush的数据计入进度，对同一文件fsync即可让所有已计入的数据落盘
+        now = time.monotonic()
+        if force or now - state["last_report"] >= DOWNLOAD_PROGRESS_INTERVAL:
+            state["last_report"] = now
+            # 先落盘数据再保存进度，断电后续传不会跳过没有写入磁盘的区间
+            os.fsync(data_file.fileno())
+            _save_download_meta(meta_file, meta)
+            if progress_callback:
+                progress_callback(downloaded(), total_size)
+    
+    def worker(segment):
+        retries = 0
+        with open(part_file, "r+b") as f:
+            while segment[2] <= segment[1]:
+                if cancel_event.is_set() or stop_event.is_set():
+                    return
+                range_headers = dict(base_headers, Range=f"bytes={segment[2]}-{segment[1]}")
+                if validator:
+                    # 文件在服务器上已变化时会返回200而不是206
+                    range_headers["If-Range"] = validator
+                attempt_start = segment[2]
+                try:
+                    with session.get(url, headers=range_headers, stream=True, timeout=timeout) as response:
+                        response.raise_for_status()
+                        if response.status_code != 206:
+                            state["stale"] = True
+                            raise IOError("服务器上的文件已变化，请重新下载")
+                        f.seek(segment[2])
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            if cancel_event.is_set() or stop_event.is_set():
+                                return
+                            chunk = chunk[:segment[1] + 1 - segment[2]]
+                            f.write(chunk)
+                            f.flush()
+                            with lock:
+                                segment[2] += len(chunk)
+                                report(f)
+                            if segment[2] > segment[1]:
+                                break
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError):
+                    # 网络抖动时从当前位置重试，有进展的连接不计入重试次数
+                    retries = 0 if segment[2] > attempt_start else retries + 1
+                    if retries > DOWNLOAD_RETRIES:
+                        raise
+                    time.sleep(min(retries, 5))
+    
+    def run(segment):
+        try:
+            worker(segment)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+            stop_event.set()
+    
+    pending = [segment for segment in segments if segment[2] <= segment[1]]
+    threads = [threading.Thread(target=run, args=(segment,), daemon=True) for segment in pending[1:]]
+    for thread in threads:
+        thread.start()
+    if pending:
+        run(pending[0])
+    for thread in threads:
+        thread.join()
+    
+    with lock, open(part_file, "r+b") as f:
+        report(f, force=True)
+    if errors:
+        if state["stale"]:
+            # 旧的部分文件已无效，下次重新下载
+            os.remove(meta_file)
+        raise errors[0]
+    if cancel_event.is_set():
+        raise DownloadCancelled()
+
+def download_latest_release(download_url, latest_version, file_name=None, expected_sha256=None):
+    """下载最新版本，中断后再次下载会从断点继续"""
+    import requests
+    # 如果没有提供文件名，生成默认文件名
+    if not file_name:
+        file_name = f"{GITEE_REPO}_server_v{latest_version}.zip"
+    
+    def show_progress(downloaded_size, total_size):
+        # 显示下载进度
+        if total_size > 0:
+            progress = (downloaded_size / total_size) * 100
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 下载进度: {progress:.1f}% ({downloaded_size / 1024:.2f} KB / {total_size / 1024:.2f} KB)", end="\r")
+        else:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 已下载: {downloaded_size / 1024:.2f} KB", end="\r")
+    
+    try:
+        # 开始下载
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 开始下载更新: {file_name}")
+        if os.path.exists(file_name + ".part.json"):
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [信息] 发现未完成的下载，将从断点继续")
+        
+        download_file(download_url, file_name, expected_sha256=expected_sha256, progress_callback=show_progress)
         
         print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 下载完成: {file_name}")
+        if expected_sha256:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] SHA256校验通过")
         
+    except ChecksumMismatch as e:
+        print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 下载失败: {str(e)}，已删除损坏的文件")
     except requests.exceptions.RequestException as e:
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 下载失败: 网络请求错误 - {str(e)}")
+        print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 下载失败: 网络请求错误 - {str(e)}")
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [信息] 再次下载将从断点继续")
     except Exception as e:
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 下载失败: {str(e)}")
+        print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 下载失败: {str(e)}")
 
-def check_for_updates():
-    """检查Gitee仓库是否有新的发行版"""
+def fetch_latest_release(cache_ttl=0):
+    """获取Gitee最新发行版信息
+    cache_ttl秒内的磁盘缓存直接使用；过期后带上次的ETag/Last-Modified重新验证，未变化时服务器只返回304；
+    网络请求失败时退回到过期的缓存
+    返回值：(发行版信息, 是否来自缓存)
+    """
+    import requests
+    cached = None
+    try:
+        with open(UPDATE_CACHE_FILE, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = None
+    
+    if cached and cache_ttl > 0 and 0 <= time.time() - cached.get("checked_at", 0) < cache_ttl:
+        return cached.get("release", {}), True
+    
+    # 构建API请求URL
+    url = f"https://gitee.com/api/v5/repos/{GITEE_OWNER}/{GITEE_REPO}/releases/latest"
+    
+    # 设置请求头，不包含Token认证
+    headers = {
+        "Content-Type": "application/json"
+    }
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+    
+    # 发送请求
+    try:
+        response = http_client.get(url, headers=headers, timeout=10)
+        if response.status_code == 304 and cached:
+            latest_release = cached.get("release", {})
+            etag, last_modified = cached.get("etag", ""), cached.get("last_modified", "")
+        else:
+            latest_release = response.json()
+            etag, last_modified = response.headers.get("ETag", ""), response.headers.get("Last-Modified", "")
+    except requests.exceptions.RequestException:
+        if cached:
+            return cached.get("release", {}), True
+        raise
+    
+    # 写入缓存，先写临时文件再替换，避免中途退出留下损坏的缓存
+    try:
+        temp_file = UPDATE_CACHE_FILE + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump({"checked_at": time.time(), "release": latest_release,
+                       "etag": etag, "last_modified": last_modified}, f, ensure_ascii=False)
+        os.replace(temp_file, UPDATE_CACHE_FILE)
+    except OSError as e:
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [警告] 更新检查缓存写入失败: {str(e)}")
+    return latest_release, False
+
+def check_for_updates(cache_ttl=0, interactive=True):
+    """检查Gitee仓库是否有新的发行版
+    interactive为False时只输出检查结果，不询问是否下载（后台检查时使用）
+    """
+    import requests
     try:
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [信息] 正在检查更新...")
         
-        # 构建API请求URL
-        url = f"https://gitee.com/api/v5/repos/{GITEE_OWNER}/{GITEE_REPO}/releases/latest"
-        
-        # 设置请求头，不包含Token认证
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        # 发送请求
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        # 解析响应
-        latest_release = response.json()
+        # 获取最新发行版信息
+        latest_release, from_cache = fetch_latest_release(cache_ttl)
+        if from_cache:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [信息] 使用缓存的版本信息（{UPDATE_CACHE_FILE}）")
         latest_version = latest_release.get("tag_name", "").lstrip("v")
         
         # 获取assets
@@ -128,6 +521,10 @@ def check_for_updates():
             print(release_notes)
             
             # 强制更新询问用户
+            if not interactive:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [提示] 输入 'update' 命令可下载更新")
+                return
+            
             choice = input("是否立即下载更新？: ").strip().lower()
             if choice == 'y':
                 # 查找zip文件附件
@@ -198,7 +595,7 @@ def check_for_updates():
                     download_url = f"https://gitee.com{download_url}"
                 
                 if download_url:
-                    download_latest_release(download_url, latest_version, file_name)
+                    download_latest_release(download_url, latest_version, file_name, expected_sha256=find_release_checksum(assets, file_name))
                 else:
                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 获取下载链接失败！")
         elif version_diff == 1:
@@ -210,6 +607,10 @@ def check_for_updates():
             print(release_notes)
             
             # 询问用户是否更新
+            if not interactive:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [提示] 输入 'update' 命令可下载更新")
+                return
+            
             choice = input("是否下载更新？: ").strip().lower()
             if choice == 'y':
                 # 查找zip文件附件
@@ -280,7 +681,7 @@ def check_for_updates():
                     download_url = f"https://gitee.com{download_url}"
                 
                 if download_url:
-                    download_latest_release(download_url, latest_version, file_name)
+                    download_latest_release(download_url, latest_version, file_name, expected_sha256=find_release_checksum(assets, file_name))
                 else:
                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 获取下载链接失败！")
         elif version_diff == 0:
@@ -297,9 +698,58 @@ def check_for_updates():
     except Exception as e:
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 检查更新失败：{str(e)}")
 
-def load_config():
-    """加载配置文件，若不存在则生成默认配置"""
-    config_file = "LittleChat.serverset"
+CONFIG_FILE = "LittleChat.serverset"
+CONFIG_WATCH_INTERVAL = 2  # 检查配置文件是否被修改的间隔（秒）
+
+# 运行中修改后立即生效的配置项，格式: {配置项: (类型, 约束)}；其余配置项需要重启服务器才能生效
+LIVE_CONFIG_SETTINGS = {
+    "max_user": ("int", 1),
+    "socket_timeout": ("int", 1),
+    "admin_prefix": ("str", None),
+    "log_level": ("choice", ("info", "warn", "error")),
+    "message_size_limit": ("int", 1),
+    "tcp_keepalive": ("bool", None),
+    "tcp_keepalive_idle": ("int", 1),
+    "tcp_keepalive_interval": ("int", 1),
+    "file_transfer": ("bool", None),
+    "file_max_size": ("int", 0),
+    "compress_threshold": ("int", 0),
+    "caps_wait": ("int", 0),
+}
+
+def parse_config_value(kind, constraint, raw):
+    """按LIVE_CONFIG_SETTINGS中的类型解析配置值，取值无效时抛出ValueError"""
+    if kind == "int":
+        try:
+            value = int(raw)
+        except ValueError:
+            raise ValueError("必须是整数")
+        if value < constraint:
+            raise ValueError(f"不能小于{constraint}")
+        return value
+    if kind == "bool":
+        if raw.lower() not in ("true", "false"):
+            raise ValueError("只能是true或false")
+        return raw.lower() == "true"
+    if kind == "choice":
+        if raw.lower() not in constraint:
+            raise ValueError(f"只能是{'、'.join(constraint)}")
+        return raw.lower()
+    return raw
+
+def config_file_state():
+    """配置文件的(修改时间, 大小)，用于判断文件是否被修改，文件不存在时返回None"""
+    try:
+        stat = os.stat(CONFIG_FILE)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def load_config(strict=False):
+    """加载配置文件，若不存在则生成默认配置
+    strict为True时读取失败直接抛出异常，供重新加载时使用，避免把默认配置当作新配置应用
+    """
+    config_file = CONFIG_FILE
     default_config = {
         "server_port": "7891",
         "max_user": "5",
@@ -310,7 +760,25 @@ def load_config():
         "log_level": "info",
         "message_size_limit": "1024",
         "web_port": "5000",
-        "web_enabled": "true"
+        "web_enabled": "true",
+        "heartbeat_interval": "15",
+        "heartbeat_timeout": "45",
+        "caps_wait": "300",
+        "tcp_keepalive": "true",
+        "tcp_keepalive_idle": "60",
+        "tcp_keepalive_interval": "10",
+        "update_check": "true",
+        "update_check_ttl": "21600",
+        "file_transfer": "true",
+        "file_max_size": "104857600",
+        "compress_threshold": "256",
+        "tls_mode": "off",
+        "tls_cert": "LittleChat.crt",
+        "tls_key": "LittleChat.key",
+        "moderation_store": "true",
+        "moderation_fsync": "interval",
+        "moderation_compact_entries": "1000",
+        "discovery": "true"
     }
     
     # 检查配置文件是否存在
@@ -347,6 +815,60 @@ def load_config():
                 elif key == "message_size_limit":
                     f.write("# 单个消息的最大长度（字节）\n")
                     f.write(f"{key}={value} # 默认消息大小：1024字节\n\n")
+                elif key == "heartbeat_interval":
+                    f.write("# 向客户端发送心跳PING的间隔（秒），0表示关闭心跳\n")
+                    f.write(f"{key}={value} # 默认间隔：15秒\n\n")
+                elif key == "heartbeat_timeout":
+                    f.write("# 支持心跳的客户端超过该时间无任何数据即判定掉线（秒）\n")
+                    f.write(f"{key}={value} # 默认超时：45秒\n\n")
+                elif key == "caps_wait":
+                    f.write("# 新连接等待客户端回复CAPS的最长时间（毫秒），超时的客户端本次连接按旧协议通信，高延迟网络可适当调大，0表示不启用协议扩展\n")
+                    f.write(f"{key}={value} # 默认等待：300毫秒\n\n")
+                elif key == "tcp_keepalive":
+                    f.write("# 是否为客户端连接开启TCP保活（true/false）\n")
+                    f.write(f"{key}={value} # 默认开启：true\n\n")
+                elif key == "tcp_keepalive_idle":
+                    f.write("# 连接空闲多久后开始发送TCP保活探测（秒）\n")
+                    f.write(f"{key}={value} # 默认空闲时间：60秒\n\n")
+                elif key == "tcp_keepalive_interval":
+                    f.write("# TCP保活探测的间隔（秒）\n")
+                    f.write(f"{key}={value} # 默认探测间隔：10秒\n\n")
+                elif key == "update_check":
+                    f.write("# 启动后是否在后台检查更新（true/false），离线环境可关闭\n")
+                    f.write(f"{key}={value} # 默认开启：true\n\n")
+                elif key == "update_check_ttl":
+                    f.write("# 更新检查结果的缓存时间（秒），缓存期内启动不再请求网络\n")
+                    f.write(f"{key}={value} # 默认缓存：21600秒（6小时）\n\n")
+                elif key == "file_transfer":
+                    f.write("# 是否允许用户之间传输文件（true/false），服务器只转发不保存文件\n")
+                    f.write(f"{key}={value} # 默认开启：true\n\n")
+                elif key == "file_max_size":
+                    f.write("# 单个文件传输的最大大小（字节）\n")
+                    f.write(f"{key}={value} # 默认大小：104857600字节（100MB）\n\n")
+                elif key == "compress_threshold":
+                    f.write("# 达到该长度（字节）的消息对支持压缩的客户端使用deflate压缩发送，0表示关闭压缩\n")
+                    f.write(f"{key}={value} # 默认阈值：256字节\n\n")
+                elif key == "tls_mode":
+                    f.write("# 加密连接：off关闭，optional同时接受加密和明文连接，required只接受加密连接\n")
+                    f.write(f"{key}={value} # 默认关闭：off\n\n")
+                elif key == "tls_cert":
+                    f.write("# TLS证书文件，不存在时自动生成自签名证书\n")
+                    f.write(f"{key}={value} # 默认：LittleChat.crt\n\n")
+                elif key == "tls_key":
+                    f.write("# TLS私钥文件\n")
+                    f.write(f"{key}={value} # 默认：LittleChat.key\n\n")
+                elif key == "moderation_store":
+                    f.write("# 是否把管理员、封禁和禁言保存到磁盘，重启后自动恢复（true/false）\n")
+                    f.write(f"{key}={value} # 默认开启：true\n\n")
+                elif key == "moderation_fsync":
+                    f.write("# 管理状态写盘策略：always每次修改都fsync，interval每秒最多fsync一次，never交给操作系统\n")
+                    f.write(f"{key}={value} # 默认：interval\n\n")
+                elif key == "moderation_compact_entries":
+                    f.write("# 操作日志累计多少条后写入新快照并清空日志\n")
+                    f.write(f"{key}={value} # 默认：1000条\n\n")
+                elif key == "discovery":
+                    f.write(f"# 是否响应局域网发现请求，客户端连接界面据此列出附近的服务器（UDP端口{DISCOVERY_PORT}）\n")
+                    f.write(f"{key}={value} # 默认开启：true\n\n")
                 elif key == "web_port":
                     f.write("# Web管理界面端口号\n")
                     f.write(f"{key}={value} # 默认Web端口：5000\n\n")
@@ -379,6 +901,8 @@ def load_config():
                     key, value = line.split("=", 1)
                     config[key.strip()] = value.strip()
     except Exception as e:
+        if strict:
+            raise
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 配置文件读取错误: {e}")
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 使用默认配置")
         return default_config
@@ -793,11 +1317,17 @@ HTML_TEMPLATE = """
                         <i class="bi bi-shield-x me-2"></i>封禁IP列表
                     </div>
                     <div class="card-body">
+                        <div class="input-group mb-3">
+                            <input type="text" class="form-control" id="banRuleInput" placeholder="IP、CIDR网段(10.0.0.0/24、2001:db8::/32)或范围(起始IP-结束IP)">
+                            <button class="btn btn-danger" onclick="banRule()">
+                                <i class="bi bi-shield-x"></i> 封禁
+                            </button>
+                        </div>
                         <div class="table-responsive">
                             <table class="table table-hover" id="bannedTable">
                                 <thead>
                                     <tr>
-                                        <th>IP地址</th>
+                                        <th>IP/网段</th>
                                         <th>操作</th>
                                     </tr>
                                 </thead>
@@ -942,6 +1472,8 @@ HTML_TEMPLATE = """
                 </div>
                 <div class="modal-body">
                     <p>您确定要停止服务器吗？此操作将断开所有用户连接。</p>
+                    <label for="stopReconnectInput" class="form-label">计划内重启时，客户端自动重连的等待时间（秒，留空表示不重连）</label>
+                    <input type="number" min="0" class="form-control" id="stopReconnectInput" placeholder="例如 30">
                 </div>
                 <div class="modal-footer">
                     <button type="button" class="btn btn-secondary" data-bs-dismiss="modal">取消</button>
@@ -1240,6 +1772,38 @@ HTML_TEMPLATE = """
             }
         }
 
+        async function banRule() {
+            const rule = document.getElementById('banRuleInput').value.trim();
+            if (!rule) return;
+            
+            showLoading();
+            
+            try {
+                const response = await fetch('/api/action', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({ action: 'ban', username: rule })
+                });
+                
+                const result = await response.json();
+                
+                if (result.success) {
+                    showToast(result.message, 'success');
+                    document.getElementById('banRuleInput').value = '';
+                    await refreshData();
+                } else {
+                    showToast(result.message, 'danger');
+                }
+            } catch (error) {
+                console.error('封禁失败:', error);
+                showToast('操作失败', 'danger');
+            } finally {
+                hideLoading();
+            }
+        }
+        
         async function unmuteUser(username) {
             if (!confirm(`确定要解除 ${username} 的禁言吗？`)) return;
             
@@ -1307,8 +1871,13 @@ HTML_TEMPLATE = """
             showLoading();
             
             try {
+                const reconnect = document.getElementById('stopReconnectInput').value;
                 const response = await fetch('/api/stop', {
-                    method: 'POST'
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({reconnect: reconnect})
                 });
                 
                 const result = await response.json();
@@ -1351,7 +1920,7 @@ HTML_TEMPLATE = """
                 const result = await response.json();
                 
                 if (result.success) {
-                    showToast('配置保存成功，请重启服务器生效', 'success');
+                    showToast(result.message, 'success');
                 } else {
                     showToast(result.message, 'danger');
                 }
@@ -1368,10 +1937,572 @@ HTML_TEMPLATE = """
 """
 
 
-class ChatServer:
+def encode_frame(payload, flags=0):
+    """将字节负载编码为长度前缀帧"""
+    return FRAME_HEADER.pack(len(payload), flags) + payload
+
+def compress_payload(data):
+    """使用预置字典压缩帧负载"""
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, zdict=COMPRESSION_DICTIONARY)
+    return compressor.compress(data) + compressor.flush()
+
+def decompress_payload(data):
+    """解压帧负载，解压后超过单帧上限视为协议错误，防止压缩炸弹"""
+    decompressor = zlib.decompressobj(-15, zdict=COMPRESSION_DICTIONARY)
+    result = decompressor.decompress(data, MAX_FRAME_SIZE)
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError("压缩帧数据不完整或解压后超过上限")
+    return result
+
+class FrameReader:
+    """从TCP字节流中切分出完整的长度前缀帧"""
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+    
+    def feed(self, data):
+        """追加收到的数据，返回已完整的帧列表 [(flags, payload), ...]"""
+        self.buffer.extend(data)
+        frames = []
+        while len(self.buffer) >= FRAME_HEADER.size:
+            length, flags = FRAME_HEADER.unpack_from(self.buffer)
+            if length > self.max_frame_size:
+                raise ValueError(f"帧长度 {length} 超过上限 {self.max_frame_size}")
+            frame_end = FRAME_HEADER.size + length
+            if len(self.buffer) < frame_end:
+                break
+            frames.append((flags, bytes(self.buffer[FRAME_HEADER.size:frame_end])))
+            del self.buffer[:frame_end]
+        return frames
+
+class ClientSession:
+    """单个客户端连接的协议状态"""
+    def __init__(self, client_socket, client_address):
+        self.socket = client_socket
+        self.address = client_address
+        self.caps = set()  # 已协商启用的协议扩展
+        self.framed = False  # 是否使用长度前缀帧
+        self.reader = FrameReader()
+        self.pending = deque()  # 已收到但尚未处理的消息
+        self.send_lock = threading.Lock()  # 多个线程可能同时向同一连接发送
+        self.last_seen = time.time()
+        self.backlog = None  # 协议协商结束前暂存的待发送消息，协商结束后为None
+        self.awaiting_caps = False  # 尚未收到客户端数据，此时收到的CAPS:行用于协商协议扩展
+
+class FileTransfer:
+    """服务端转发中的一次文件传输"""
+    def __init__(self, transfer_id, sender, receiver, size):
+        self.id = transfer_id
+        self.sender = sender  # 发送方socket
+        self.receiver = receiver  # 接收方socket
+        self.size = size
+        self.accepted = False  # 接收方同意前不转发分块
+
+class NicknameMap(dict):
+    """socket到昵称的映射，同时维护昵称到socket的反向索引，按昵称查找在线用户时不必遍历整个用户表"""
     def __init__(self):
+        super().__init__()
+        self.sockets = {}  # 昵称 -> socket
+    
+    def __setitem__(self, sock, nickname):
+        old = self.get(sock)
+        if old is not None and self.sockets.get(old) is sock:
+            del self.sockets[old]
+        super().__setitem__(sock, nickname)
+        self.sockets[nickname] = sock
+    
+    def __delitem__(self, sock):
+        nickname = self[sock]
+        super().__delitem__(sock)
+        # 同名用户已由新的socket接替时保留新的索引
+        if self.sockets.get(nickname) is sock:
+            del self.sockets[nickname]
+    
+    def pop(self, sock, *default):
+        if sock in self:
+            nickname = self[sock]
+            del self[sock]
+            return nickname
+        return super().pop(sock, *default)
+    
+    def clear(self):
+        super().clear()
+        self.sockets.clear()
+    
+    def socket_of(self, nickname):
+        """返回昵称对应的socket，不在线时返回None"""
+        return self.sockets.get(nickname)
+
+class ReplicatedSet(set):
+    """修改会通知持久化回调的集合"""
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+        self.journal = None  # 持久化回调，参数: (名称, 操作, 键, 值)
+    
+    def add(self, item):
+        super().add(item)
+        if self.journal:
+            self.journal(self.name, "add", item, None)
+    
+    def remove(self, item):
+        super().remove(item)
+        if self.journal:
+            self.journal(self.name, "remove", item, None)
+    
+    def discard(self, item):
+        if item in self:
+            self.remove(item)
+    
+    def apply(self, op, key, value):
+        """应用日志或快照中的修改，不会再次记录"""
+        if op == "add":
+            super().add(key)
+        elif op == "remove":
+            super().discard(key)
+        elif op == "reset":
+            super().clear()
+            super().update(value)
+    
+    def snapshot(self):
+        return list(self)
+
+class ReplicatedDict(dict):
+    """修改会通知持久化回调的字典"""
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+        self.journal = None
+    
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if self.journal:
+            self.journal(self.name, "set", key, value)
+    
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        if self.journal:
+            self.journal(self.name, "delete", key, None)
+    
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return super().pop(key, *default)
+    
+    def apply(self, op, key, value):
+        """应用日志或快照中的修改，JSON读回的列表还原为元组"""
+        if op == "set":
+            super().__setitem__(key, tuple(value) if isinstance(value, list) else value)
+        elif op == "delete":
+            super().pop(key, None)
+        elif op == "reset":
+            super().clear()
+            for item_key, item_value in value.items():
+                super().__setitem__(item_key, tuple(item_value) if isinstance(item_value, list) else item_value)
+    
+    def snapshot(self):
+        return dict(self)
+
+def ip_ban_network(text):
+    """解析单个IP或CIDR网段，IPv4映射的IPv6地址（::ffff:a.b.c.d）按IPv4处理"""
+    network = ipaddress.ip_network(text.strip(), strict=False)
+    if network.version == 6 and network.prefixlen == 128 and network.network_address.ipv4_mapped:
+        network = ipaddress.ip_network(network.network_address.ipv4_mapped)
+    return network
+
+def format_ban_rule(network):
+    """单个地址的规则直接写成IP，与旧版本的封禁列表保持兼容"""
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+def parse_ip_ban_rules(text):
+    """把封禁目标解析为规范化的规则列表，不是IP格式时抛出ValueError
+    支持单个IP、CIDR网段（10.0.0.0/24、2001:db8::/32）和地址范围（10.0.0.5-10.0.0.20），
+    地址范围会拆成最少的若干个CIDR网段
+    """
+    text = text.strip()
+    if "-" in text:
+        first, last = (ipaddress.ip_address(part.strip()) for part in text.split("-", 1))
+        if first.version != last.version:
+            raise ValueError("地址范围两端的IP版本不一致")
+        if first > last:
+            first, last = last, first
+        networks = ipaddress.summarize_address_range(first, last)
+    else:
+        networks = [ip_ban_network(text)]
+    return [format_ban_rule(network) for network in networks]
+
+class IPPrefixTrie:
+    """IP封禁规则的二进制前缀树，IPv4和IPv6各一棵
+    规则按网络地址的二进制位逐位插入，查询沿目标地址的位向下走，
+    耗时只与前缀长度有关（最多32或128步），与规则数量无关
+    """
+    def __init__(self, rules=()):
+        # 节点格式: [0分支, 1分支, 在此结束的规则]
+        self.roots = {4: [None, None, None], 6: [None, None, None]}
+        for rule in rules:
+            self.insert(rule)
+    
+    @staticmethod
+    def _bits(network):
+        """网络地址的前prefixlen位，从高位到低位"""
+        value = int(network.network_address)
+        top = network.max_prefixlen - 1
+        return ((value >> (top - index)) & 1 for index in range(network.prefixlen))
+    
+    def insert(self, rule):
+        network = ip_ban_network(rule)
+        node = self.roots[network.version]
+        for bit in self._bits(network):
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        node[2] = rule
+    
+    def remove(self, rule):
+        try:
+            network = ip_ban_network(rule)
+        except ValueError:
+            return
+        node = self.roots[network.version]
+        path = []
+        for bit in self._bits(network):
+            path.append((node, bit))
+            node = node[bit]
+            if node is None:
+                return
+        node[2] = None
+        # 清理不再通向任何规则的分支
+        for parent, bit in reversed(path):
+            child = parent[bit]
+            if child[0] is None and child[1] is None and child[2] is None:
+                parent[bit] = None
+            else:
+                break
+    
+    def match(self, target):
+        """返回覆盖目标IP或网段的最宽的规则，没有时返回None"""
+        try:
+            network = ip_ban_network(target)
+        except ValueError:
+            return None
+        node = self.roots[network.version]
+        if node[2] is not None:
+            return node[2]
+        for bit in self._bits(network):
+            node = node[bit]
+            if node is None:
+                return None
+            if node[2] is not None:
+                return node[2]
+        return None
+
+class IPBanSet(ReplicatedSet):
+    """IP封禁规则集合，元素为规范化的规则字符串（单个IP或CIDR网段）
+    同时维护前缀树，检查新连接时不必逐条比较规则
+    """
+    def __init__(self, name):
+        super().__init__(name)
+        self.trie = IPPrefixTrie()
+    
+    def add(self, item):
+        self.trie.insert(item)
+        super().add(item)
+    
+    def remove(self, item):
+        super().remove(item)
+        self.trie.remove(item)
+    
+    def apply(self, op, key, value):
+        super().apply(op, key, value)
+        if op == "add":
+            self._index(key)
+        elif op == "remove":
+            self.trie.remove(key)
+        else:
+            self.trie = IPPrefixTrie()
+            for rule in self:
+                self._index(rule)
+    
+    def _index(self, rule):
+        try:
+            self.trie.insert(rule)
+        except ValueError:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [警告] 忽略无法解析的封禁规则: {rule}")
+    
+    def match(self, target):
+        """返回覆盖目标IP的封禁规则，未被封禁时返回None"""
+        return self.trie.match(target)
+
+MODERATION_JOURNAL_FILE = "LittleChat.modjournal"
+MODERATION_SNAPSHOT_FILE = "LittleChat.modsnapshot"
+MODERATION_FSYNC_INTERVAL = 1.0  # interval策略下两次fsync的最小间隔（秒）
+
+class ModerationStore:
+    """管理状态（管理员、封禁、禁言）的磁盘存储：追加写的操作日志 + 定期快照
+    启动时先读快照再按顺序重放日志，耗时与文件大小成正比。运行中的修改只放入队列，
+    由后台线程批量写入，不阻塞聊天线程。日志条目达到上限时写入新快照并清空日志，
+    过期的禁言在写快照时被丢弃。
+    """
+    def __init__(self, snapshot_state, fsync_policy="interval", compact_entries=1000,
+                 journal_file=MODERATION_JOURNAL_FILE, snapshot_file=MODERATION_SNAPSHOT_FILE):
+        self.snapshot_state = snapshot_state  # 返回当前完整状态的函数，写快照时调用
+        self.fsync_policy = fsync_policy  # always：每批写入后fsync；interval：每秒最多一次；never：交给操作系统
+        self.compact_entries = compact_entries
+        self.journal_file = journal_file
+        self.snapshot_file = snapshot_file
+        self.queue = queue.Queue()
+        self.journal = None
+        self.journal_entries = 0
+        self.thread = None
+    
+    def load(self, containers):
+        """读取快照和日志恢复状态，返回重放的日志条目数；日志末尾写了一半的行会被跳过"""
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            for name, container in containers.items():
+                if name in snapshot:
+                    container.apply("reset", None, snapshot[name])
+        
+        replayed = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    container = containers.get(entry.get("n"))
+                    if container is not None:
+                        container.apply(entry["o"], entry.get("k"), entry.get("v"))
+                        replayed += 1
+        return replayed
+    
+    def start(self):
+        """整理一次已有数据后启动后台写入线程"""
+        self.compact()
+        self.thread = threading.Thread(target=self.writer_loop)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def record(self, name, op, key, value):
+        """记录一次修改，只入队不做磁盘操作"""
+        self.queue.put({"n": name, "o": op, "k": key, "v": value})
+    
+    def close(self):
+        """写完队列中剩余的修改后停止"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+            self.thread = None
+    
+    def writer_loop(self):
+        last_sync = time.time()
+        unsynced = False
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self.queue.get(timeout=MODERATION_FSYNC_INTERVAL)]
+            except queue.Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = [entry for entry in batch if entry is not None]
+            
+            try:
+                if batch:
+                    self.journal.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch))
+                    self.journal.flush()
+                    self.journal_entries += len(batch)
+                    unsynced = True
+                if unsynced and self.fsync_policy != "never" and (
+                        self.fsync_policy == "always" or stopping or time.time() - last_sync >= MODERATION_FSYNC_INTERVAL):
+                    os.fsync(self.journal.fileno())
+                    unsynced = False
+                    last_sync = time.time()
+                if self.journal_entries >= self.compact_entries:
+                    self.compact()
+                    unsynced = False
+            except (OSError, ValueError) as e:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 写入管理状态失败: {str(e)}")
+        self.journal.close()
+        self.journal = None
+    
+    def compact(self):
+        """把当前状态写成新快照（先写临时文件再替换），然后清空日志"""
+        state = self.snapshot_state()
+        now = time.time()
+        state["muted_users"] = {nickname: value for nickname, value in state.get("muted_users", {}).items()
+                                if value[0] + value[1] * 60 > now}
+        temp_file = self.snapshot_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            if self.fsync_policy != "never":
+                os.fsync(f.fileno())
+        os.replace(temp_file, self.snapshot_file)
+        
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.journal_file, "w", encoding="utf-8")
+        self.journal_entries = 0
+
+def enable_tcp_keepalive(sock, idle, interval, count=5):
+    """开启TCP保活并尽量调整探测参数，兼容Linux、macOS和Windows"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+    elif hasattr(socket, "TCP_KEEPALIVE"):
+        # macOS使用TCP_KEEPALIVE表示空闲时间
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+    if hasattr(socket, "TCP_KEEPCNT"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+    if hasattr(socket, "SIO_KEEPALIVE_VALS"):
+        # Windows通过ioctl设置，单位为毫秒
+        sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+
+TLS_HANDSHAKE_TIMEOUT = 10  # 客户端完成TLS握手的最长时间（秒）
+
+def generate_self_signed_cert(cert_file, key_file, common_name, days=3650):
+    """生成自签名证书，优先使用cryptography库，未安装时调用openssl命令行
+    使用ECDSA P-256密钥，服务端握手签名的开销远小于RSA-2048
+    """
+    try:
+        from cryptography import x509
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.x509.oid import NameOID
+    except ImportError:
+        x509 = None
+    
+    if x509 is not None:
+        import datetime
+        key = ec.generate_private_key(ec.SECP256R1())
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cert = (x509.CertificateBuilder()
+                .subject_name(name)
+                .issuer_name(name)
+                .public_key(key.public_key())
+                .serial_number(x509.random_serial_number())
+                .not_valid_before(now - datetime.timedelta(days=1))
+                .not_valid_after(now + datetime.timedelta(days=days))
+                .add_extension(x509.SubjectAlternativeName([x509.DNSName(common_name)]), critical=False)
+                .sign(key, hashes.SHA256()))
+        with open(key_file, "wb") as f:
+            f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                      serialization.NoEncryption()))
+        with open(cert_file, "wb") as f:
+            f.write(cert.public_bytes(serialization.Encoding.PEM))
+    else:
+        import subprocess
+        try:
+            subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                            "-nodes", "-keyout", key_file, "-out", cert_file, "-days", str(days),
+                            "-subj", f"/CN={common_name}"], check=True, capture_output=True)
+        except FileNotFoundError:
+            raise RuntimeError("未安装cryptography库且找不到openssl命令，请执行 pip install cryptography 后重试")
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"openssl生成证书失败: {e.stderr.decode('utf-8', 'replace').strip()}")
+    try:
+        # 私钥只允许当前用户读取
+        os.chmod(key_file, 0o600)
+    except OSError:
+        pass
+
+def certificate_fingerprint(der_bytes):
+    """证书的SHA256指纹，客户端首次连接时记录，之后用于校验服务器身份"""
+    digest = hashlib.sha256(der_bytes).hexdigest().upper()
+    return ":".join(digest[i:i + 2] for i in range(0, len(digest), 2))
+
+def create_server_tls_context(cert_file, key_file):
+    """创建服务端TLS上下文
+    所有连接共享同一个上下文：TLS 1.3的会话票据密钥和TLS 1.2的会话缓存都保存在上下文中，
+    客户端断线重连时复用会话，跳过证书签名和完整的密钥协商
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(cert_file, key_file)
+    context.options &= ~ssl.OP_NO_TICKET
+    if hasattr(context, "num_tickets"):
+        # 客户端每次只保存一张票据，多发没有意义
+        context.num_tickets = 1
+    return context
+
+def prepare_tls_context(mode, cert_file, key_file):
+    """按配置准备TLS上下文，证书不存在时自动生成自签名证书
+    optional模式下失败只打印警告并返回None（仍接受明文连接），required模式下抛出异常
+    """
+    try:
+        if not (os.path.exists(cert_file) and os.path.exists(key_file)):
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [TLS] 未找到证书，正在生成自签名证书 {cert_file} ...")
+            generate_self_signed_cert(cert_file, key_file, socket.gethostname())
+        context = create_server_tls_context(cert_file, key_file)
+        with open(cert_file, "r", encoding="utf-8") as f:
+            fingerprint = certificate_fingerprint(ssl.PEM_cert_to_DER_cert(f.read()))
+    except Exception as e:
+        if mode == "required":
+            raise RuntimeError(f"TLS初始化失败: {str(e)}")
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [警告] TLS初始化失败，只接受明文连接: {str(e)}")
+        return None
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [TLS] TLS已启用（{mode}），证书指纹 SHA256: {fingerprint}")
+    return context
+
+DISCOVERY_PORT = 7893  # 局域网发现使用的UDP端口，所有服务器共用
+DISCOVERY_GROUP = "239.255.78.93"  # 局域网发现的组播地址，广播被路由器或防火墙拦截时仍可发现
+DISCOVERY_MAGIC = "LCDISCOVER1"  # 发现请求前缀，后面跟客户端生成的随机串
+DISCOVERY_REPLY = "LCSERVER1"  # 发现应答前缀，后面跟JSON
+DISCOVERY_PACKET_SIZE = 1024  # 发现请求的最大长度
+
+def local_lan_ip():
+    """本机在局域网中的IP地址，UDP的connect只查路由表不发送数据，离线时也能使用"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.connect(("10.255.255.255", 1))
+            return probe.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+
+# 管理命令的参数格式，聊天中的ADMIN_COMMAND、控制台命令和网页管理共用同一张命令表
+ADMIN_COMMAND_USAGE = {
+    "kick": "kick <用户名>",
+    "op": "op <用户名>",
+    "unop": "unop <用户名>",
+    "ban": "ban <用户名|IP|网段|起始IP-结束IP>",
+    "unban": "unban <用户名|IP|网段|起始IP-结束IP>",
+    "shutup": "shutup <用户名> <时间（分钟）>",
+    "unshutup": "unshutup <用户名>",
+}
+
+# 网页管理的操作名到管理命令的对应关系
+WEB_ADMIN_ACTIONS = {
+    "kick": "kick",
+    "ban": "ban",
+    "op": "op",
+    "unop": "unop",
+    "mute": "shutup",
+}
+
+class ChatServer:
+    def __init__(self, tls_context=None):
         # 加载配置
         config = load_config()
+        self.config = config  # 当前生效的配置，重新加载时用来判断哪些配置项被修改
+        self.config_state = config_file_state()
         self.port = int(config["server_port"])
         self.max_user = int(config["max_user"])
         self.max_attempts = int(config["max_attempts"])
@@ -1382,18 +2513,64 @@ class ChatServer:
         self.message_size_limit = int(config["message_size_limit"])
         self.web_port = int(config.get("web_port", "5000"))
         self.web_enabled = config.get("web_enabled", "true").lower() == "true"
+        self.heartbeat_interval = int(config["heartbeat_interval"])
+        self.heartbeat_timeout = int(config["heartbeat_timeout"])
+        self.caps_wait = int(config["caps_wait"])
+        self.tcp_keepalive = config["tcp_keepalive"].lower() == "true"
+        self.tcp_keepalive_idle = int(config["tcp_keepalive_idle"])
+        self.tcp_keepalive_interval = int(config["tcp_keepalive_interval"])
+        self.update_check = config["update_check"].lower() == "true"
+        self.update_check_ttl = int(config["update_check_ttl"])
+        self.file_transfer = config["file_transfer"].lower() == "true"
+        self.file_max_size = int(config["file_max_size"])
+        self.compress_threshold = int(config["compress_threshold"])
+        self.tls_mode = config["tls_mode"].lower()
+        if self.tls_mode not in ("off", "optional", "required"):
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] tls_mode 只能是 off、optional 或 required，已关闭TLS")
+            self.tls_mode = "off"
+        self.tls_cert = config["tls_cert"]
+        self.tls_key = config["tls_key"]
+        self.tls_context = tls_context
+        self.discovery = config["discovery"].lower() == "true"
+        if self.heartbeat_interval > 0 and self.heartbeat_timeout <= self.heartbeat_interval:
+            # 超时时间必须覆盖至少一次心跳间隔，否则正常客户端也会被误判掉线
+            self.heartbeat_timeout = self.heartbeat_interval * 3
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] heartbeat_timeout 需大于 heartbeat_interval，已调整为 {self.heartbeat_timeout} 秒")
         
         self.server_socket = None
         self.client_sockets = []
-        self.client_nicknames = {}
+        self.client_nicknames = NicknameMap()
         self.client_profiles = {}
-        self.admins = set()  # 管理员列表
-        self.banned_users = set()  # 封禁的用户名列表（保留兼容，实际使用IP封禁）
-        self.banned_ips = set()  # 封禁的IP地址列表
-        self.muted_users = {}  # 禁言的用户名和禁言时长，格式: {nickname: (mute_time, duration)}
+        self.client_sessions = {}  # 客户端协议状态，格式: {socket: ClientSession}
+        self.file_transfers = {}  # 转发中的文件传输，格式: {transfer_id: FileTransfer}
+        self.admins = ReplicatedSet("admins")  # 管理员列表
+        self.banned_users = ReplicatedSet("banned_users")  # 封禁的用户名列表（保留兼容，实际使用IP封禁）
+        self.banned_ips = IPBanSet("banned_ips")  # IP封禁规则（单个IP或CIDR网段）
+        self.muted_users = ReplicatedDict("muted_users")  # 禁言的用户名和禁言时长，格式: {nickname: (mute_time, duration)}
+        # 管理命令表，三个入口都通过execute_admin_command执行
+        self.admin_commands = {
+            "kick": self.command_kick,
+            "op": self.command_op,
+            "unop": self.command_unop,
+            "ban": self.command_ban,
+            "unban": self.command_unban,
+            "shutup": self.command_shutup,
+            "unshutup": self.command_unshutup,
+        }
+        # 管理状态持久化，重启后自动恢复
+        self.moderation_store = None
+        if config["moderation_store"].lower() == "true":
+            self.moderation_store = ModerationStore(self.moderation_snapshot, config["moderation_fsync"].lower(),
+                                                    int(config["moderation_compact_entries"]))
+            self.moderation_store.load(self.moderation_state())
+            for container in self.moderation_state().values():
+                container.journal = self.moderation_store.record
         self.lock = threading.Lock()  # 线程锁，保护客户端列表
         self.running = False
         self.start_time = None  # 服务器启动时间
+        self.stopped = False
+        self.reconnect_hint = None  # 关闭时建议客户端重连的等待秒数，None表示不再重连
+        self.discovery_socket = None  # 响应局域网发现请求的UDP socket
         
         # Flask 应用
         self.app = Flask(__name__)
@@ -1412,7 +2589,7 @@ class ChatServer:
                 chat_port=self.port,
                 web_port=self.web_port,
                 max_user=self.max_user,
-                server_ip=socket.gethostbyname(socket.gethostname()),
+                server_ip=local_lan_ip(),
                 message_size_limit=self.message_size_limit,
                 admin_prefix=self.admin_prefix
             )
@@ -1467,97 +2644,16 @@ class ChatServer:
             if not action or not username:
                 return jsonify({'success': False, 'message': '参数错误'})
             
-            try:
-                if action == 'kick':
-                    self.kick_user(username)
-                    return jsonify({'success': True, 'message': f'已踢出用户 {username}'})
-                
-                elif action == 'ban':
-                    target_ip = None
-                    with self.lock:
-                        for sock, n in self.client_nicknames.items():
-                            if n == username:
-                                if sock in self.client_profiles:
-                                    target_ip = self.client_profiles[sock]['ip_address']
-                                break
-                    
-                    if target_ip:
-                        with self.lock:
-                            self.banned_ips.add(target_ip)
-                        self.kick_user(username)
-                        self.broadcast_message(f"系统: 用户 {username} 的IP {target_ip} 已被管理员封禁")
-                        return jsonify({'success': True, 'message': f'已封禁IP {target_ip}（用户：{username}）'})
-                    else:
-                        return jsonify({'success': False, 'message': '找不到用户或其IP地址'})
-                
-                elif action == 'op':
-                    target_socket = None
-                    with self.lock:
-                        for sock, n in self.client_nicknames.items():
-                            if n == username:
-                                target_socket = sock
-                                break
-                        self.admins.add(username)
-                    
-                    broadcast_msg = f"系统: {username} 已成为管理员"
-                    self.broadcast_message(broadcast_msg)
-                    if target_socket:
-                        try:
-                            target_socket.send(f"OP:{broadcast_msg}".encode('utf-8'))
-                        except:
-                            pass
-                    self.broadcast_user_list()
-                    return jsonify({'success': True, 'message': f'已将 {username} 设为管理员'})
-                
-                elif action == 'unop':
-                    is_admin = False
-                    target_socket = None
-                    with self.lock:
-                        for sock, n in self.client_nicknames.items():
-                            if n == username:
-                                target_socket = sock
-                                break
-                        if username in self.admins:
-                            self.admins.remove(username)
-                            is_admin = True
-                    
-                    if is_admin:
-                        broadcast_msg = f"系统: {username} 已被撤销管理员权限"
-                        self.broadcast_message(broadcast_msg)
-                        if target_socket:
-                            try:
-                                target_socket.send(f"UNOP:{broadcast_msg}".encode('utf-8'))
-                            except:
-                                pass
-                        self.broadcast_user_list()
-                        return jsonify({'success': True, 'message': f'已撤销 {username} 的管理员权限'})
-                    else:
-                        return jsonify({'success': False, 'message': '该用户不是管理员'})
-                
-                elif action == 'mute':
-                    duration = data.get('duration', 10)
-                    target_socket = None
-                    with self.lock:
-                        for sock, n in self.client_nicknames.items():
-                            if n == username:
-                                target_socket = sock
-                                break
-                        self.muted_users[username] = (time.time(), duration)
-                    
-                    broadcast_msg = f"系统: {username} 已被管理员禁言 {duration} 分钟"
-                    self.broadcast_message(broadcast_msg)
-                    if target_socket:
-                        try:
-                            target_socket.send(f"MUTED:{broadcast_msg}".encode('utf-8'))
-                        except:
-                            pass
-                    return jsonify({'success': True, 'message': f'已禁言 {username} {duration} 分钟'})
-                
-                else:
-                    return jsonify({'success': False, 'message': '不支持的操作'})
+            command = WEB_ADMIN_ACTIONS.get(action)
+            if command is None:
+                return jsonify({'success': False, 'message': '不支持的操作'})
+            argument = f"{username} {data.get('duration', 10)}" if command == 'shutup' else username
             
+            try:
+                success, result = self.execute_admin_command(command, argument)
             except Exception as e:
                 return jsonify({'success': False, 'message': f'操作失败: {str(e)}'})
+            return jsonify({'success': success, 'message': result})
         
         @self.app.route('/api/unban', methods=['POST'])
         def api_unban():
@@ -1568,17 +2664,8 @@ class ChatServer:
             if not ip:
                 return jsonify({'success': False, 'message': '参数错误'})
             
-            is_banned = False
-            with self.lock:
-                if ip in self.banned_ips:
-                    self.banned_ips.remove(ip)
-                    is_banned = True
-            
-            if is_banned:
-                self.broadcast_message(f"系统: IP {ip} 已被管理员解除封禁")
-                return jsonify({'success': True, 'message': f'已解除IP {ip} 的封禁'})
-            else:
-                return jsonify({'success': False, 'message': '该IP未被封禁'})
+            success, result = self.execute_admin_command('unban', ip)
+            return jsonify({'success': success, 'message': result})
         
         @self.app.route('/api/unmute', methods=['POST'])
         def api_unmute():
@@ -1589,29 +2676,8 @@ class ChatServer:
             if not username:
                 return jsonify({'success': False, 'message': '参数错误'})
             
-            target_socket = None
-            is_muted = False
-            
-            with self.lock:
-                for sock, n in self.client_nicknames.items():
-                    if n == username:
-                        target_socket = sock
-                        break
-                if username in self.muted_users:
-                    del self.muted_users[username]
-                    is_muted = True
-            
-            if is_muted:
-                broadcast_msg = f"系统: {username} 已被管理员解除禁言"
-                self.broadcast_message(broadcast_msg)
-                if target_socket:
-                    try:
-                        target_socket.send(f"UNMUTED:{broadcast_msg}".encode('utf-8'))
-                    except:
-                        pass
-                return jsonify({'success': True, 'message': f'已解除 {username} 的禁言'})
-            else:
-                return jsonify({'success': False, 'message': '该用户未被禁言'})
+            success, result = self.execute_admin_command('unshutup', username)
+            return jsonify({'success': success, 'message': result})
         
         @self.app.route('/api/kickall', methods=['POST'])
         def api_kickall():
@@ -1626,7 +2692,18 @@ class ChatServer:
         
         @self.app.route('/api/stop', methods=['POST'])
         def api_stop():
-            """停止服务器API"""
+            """停止服务器API，可选reconnect参数通知客户端在指定秒数后自动重连"""
+            data = request.get_json(silent=True) or {}
+            reconnect = data.get('reconnect')
+            if reconnect not in (None, ''):
+                try:
+                    reconnect = int(reconnect)
+                except (TypeError, ValueError):
+                    reconnect = -1
+                if reconnect < 0:
+                    return jsonify({'success': False, 'message': '重连等待时间必须是非负整数'})
+                self.reconnect_hint = reconnect
+            # 与控制台命令走同一条关闭流程：主循环退出后由stop()通知客户端并等待断开
             self.running = False
             return jsonify({'success': True, 'message': '服务器正在关闭'})
         
@@ -1635,7 +2712,6 @@ class ChatServer:
             """保存配置API"""
             try:
                 data = request.get_json()
-                config_file = "LittleChat.serverset"
                 
                 # 读取现有配置
                 config = load_config()
@@ -1646,8 +2722,16 @@ class ChatServer:
                 config['message_size_limit'] = str(data.get('message_size_limit', config['message_size_limit']))
                 config['admin_prefix'] = str(data.get('admin_prefix', config['admin_prefix']))
                 
-                # 保存配置文件
-                with open(config_file, "w", encoding="utf-8") as f:
+                # 写入前先校验，取值无效时不修改配置文件
+                for key, (kind, constraint) in LIVE_CONFIG_SETTINGS.items():
+                    try:
+                        parse_config_value(kind, constraint, config[key])
+                    except ValueError as e:
+                        return jsonify({'success': False, 'message': f'{key}={config[key]}（{e}）'})
+                
+                # 先写临时文件再替换，配置监视线程不会读到写了一半的文件
+                temp_file = CONFIG_FILE + ".tmp"
+                with open(temp_file, "w", encoding="utf-8") as f:
                     f.write("# LittleChat服务器配置文件\n")
                     f.write("# 编辑此文件修改服务器设置\n")
                     f.write("# 支持完整注释行和行末注释\n\n")
@@ -1663,8 +2747,17 @@ class ChatServer:
                             f.write(f"{key}={value}\n\n")
                         else:
                             f.write(f"{key}={value}\n\n")
+                os.replace(temp_file, CONFIG_FILE)
                 
-                return jsonify({'success': True, 'message': '配置保存成功'})
+                # 立即应用可在运行中修改的配置项
+                self.config_state = config_file_state()
+                changed, restart_required = self.reload_config()
+                message = '配置保存成功'
+                if changed:
+                    message += f"，已生效: {', '.join(changed)}"
+                if restart_required:
+                    message += f"，需要重启服务器才能生效: {', '.join(restart_required)}"
+                return jsonify({'success': True, 'message': message})
             
             except Exception as e:
                 return jsonify({'success': False, 'message': f'保存失败: {str(e)}'})
@@ -1677,6 +2770,48 @@ class ChatServer:
         except Exception as e:
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] Web服务器启动失败: {str(e)}")
     
+    def shutdown_message(self, session):
+        """按客户端是否支持shutdown扩展构造关闭通知"""
+        if self.reconnect_hint is None:
+            reason = "服务器已关闭"
+        else:
+            reason = "服务器正在重启"
+        if session is None or "shutdown" not in session.caps:
+            return f"系统: {reason}，连接即将断开"
+        if self.reconnect_hint is None:
+            return f"SHUTDOWN:{reason}"
+        return f"SHUTDOWN:{reason}|RECONNECT:{self.reconnect_hint}"
+    
+    def say_goodbye(self, client):
+        """发送关闭通知后半关闭连接：已发送的数据照常送达，客户端读到EOF后断开"""
+        try:
+            self.send_to(client, self.shutdown_message(self.client_sessions.get(client)))
+            if not isinstance(client, ssl.SSLSocket):
+                # SSLSocket.shutdown会丢弃加密状态，加密连接只等客户端收到通知后自己断开
+                client.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+    
+    def drain_clients(self, clients):
+        """向所有客户端发送关闭通知，在SHUTDOWN_DRAIN_TIMEOUT内等待它们断开
+        直接close()时接收缓冲区里未读的数据会让内核发送RST，客户端可能因此丢掉还没读到的消息
+        """
+        deadline = time.time() + SHUTDOWN_DRAIN_TIMEOUT
+        threads = []
+        for client in clients:
+            # 发送可能被慢客户端阻塞，每个连接单独发送
+            thread = threading.Thread(target=self.say_goodbye, args=(client,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
+        while time.time() < deadline:
+            with self.lock:
+                if not any(client in self.client_sockets for client in clients):
+                    return
+            time.sleep(0.05)
+    
     def _get_running_time(self):
         """计算服务器运行时间"""
         if not self.start_time:
@@ -1702,7 +2837,22 @@ class ChatServer:
     def handle_client(self, client_socket, client_address):
         """处理单个客户端连接"""
         nickname = "未知用户"
+        session = ClientSession(client_socket, client_address)
         try:
+            # 开启TCP保活，作为不支持心跳的旧客户端的兜底掉线检测
+            if self.tcp_keepalive:
+                try:
+                    enable_tcp_keepalive(client_socket, self.tcp_keepalive_idle, self.tcp_keepalive_interval)
+                except OSError as e:
+                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 设置TCP保活失败: {str(e)}")
+            
+            # 加密连接先完成TLS握手
+            if self.tls_context is not None:
+                client_socket = self.accept_tls(client_socket, client_address)
+                if client_socket is None:
+                    return
+                session.socket = client_socket
+            
             # 接收客户端昵称
             nickname_data = client_socket.recv(1024).decode('utf-8')
             if nickname_data:
@@ -1710,19 +2860,20 @@ class ChatServer:
             
             # 检查用户IP是否被封禁
             with self.lock:
-                # 先检查IP是否被封禁
-                if client_address[0] in self.banned_ips:
+                # 先检查IP是否被封禁，前缀树查找，耗时与规则数量无关
+                ban_rule = self.banned_ips.match(client_address[0])
+                if ban_rule:
                     # IP已被封禁，发送错误消息并关闭连接
                     error_message = "ERROR:您的IP已被封禁，无法连接"
-                    client_socket.send(error_message.encode('utf-8'))
+                    self.send_to(client_socket, error_message)
                     client_socket.close()
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 被封禁IP {client_address[0]} 尝试连接，使用昵称: {nickname}")
+                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 被封禁IP {client_address[0]} 尝试连接（规则: {ban_rule}），使用昵称: {nickname}")
                     return
                 # 保留用户名封禁检查，兼容旧逻辑
                 if nickname in self.banned_users:
                     # 用户已被封禁，发送错误消息并关闭连接
                     error_message = "ERROR:您已被封禁，无法连接"
-                    client_socket.send(error_message.encode('utf-8'))
+                    self.send_to(client_socket, error_message)
                     client_socket.close()
                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 被封禁用户 {nickname} 尝试连接")
                     return
@@ -1731,13 +2882,13 @@ class ChatServer:
                 if nickname in self.client_nicknames.values():
                     # 昵称已存在，发送错误消息并关闭连接
                     error_message = "ERROR:昵称已被使用，请选择其他昵称"
-                    client_socket.send(error_message.encode('utf-8'))
+                    self.send_to(client_socket, error_message)
                     client_socket.close()
                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 尝试使用已存在的昵称: {nickname}")
                     return
                 
-                # 昵称可用，线程安全地添加客户端
-                self.client_sockets.append(client_socket)
+                # 昵称可用，线程安全地登记客户端
+                self.client_sessions[client_socket] = session
                 self.client_nicknames[client_socket] = nickname
                 # 存储用户profile信息
                 self.client_profiles[client_socket] = {
@@ -1749,19 +2900,28 @@ class ChatServer:
             
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 已连接，昵称为: {nickname}")
             
-            # 发送成功消息给客户端
-            success_message = "SUCCESS:连接成功"
-            client_socket.send(success_message.encode('utf-8'))
+            # 发送成功消息给客户端，附带服务端支持的协议扩展
+            success_message = f"SUCCESS:连接成功|CAPS:{','.join(self.get_server_caps())}"
+            if self.heartbeat_interval > 0:
+                success_message += f"|HEARTBEAT:{self.heartbeat_interval},{self.heartbeat_timeout}"
+            self.send_to(client_socket, success_message)
+            # 不等客户端回复CAPS就加入广播列表，协商结束前发给它的消息先暂存，避免收到格式不一致的消息
+            session.backlog = []
+            session.awaiting_caps = True
+            
+            with self.lock:
+                self.client_sockets.append(client_socket)
             
             # 广播新用户加入消息
             self.broadcast_message(f"系统: {nickname} 加入了聊天室", exclude_socket=client_socket)
             # 广播更新后的在线用户列表
             self.broadcast_user_list()
+            self.negotiate_caps(session)
             
             # 处理客户端消息
             while True:
-                message = client_socket.recv(self.message_size_limit).decode('utf-8')
-                if not message:
+                message = self.receive_message(session)
+                if message is None:
                     break
                 
                 if message.startswith("PROFILE_REQUEST:"):
@@ -1784,12 +2944,15 @@ class ChatServer:
                         # 构造profile响应
                         profile_message = f"PROFILE:{profile_data['nickname']}|{profile_data['ip_address']}|{profile_data['join_time']}|{profile_data['os_version']}"
                         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] sending profile: {profile_message}")
-                        client_socket.send(profile_message.encode('utf-8'))
+                        self.send_to(client_socket, profile_message)
                     else:
                         # 用户不存在
                         error_message = "PROFILE_ERROR:用户不存在"
                         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] sending profile error: {error_message}")
-                        client_socket.send(error_message.encode('utf-8'))
+                        self.send_to(client_socket, error_message)
+                elif "file" in session.caps and message.startswith("FILE_"):
+                    # 处理文件传输控制消息
+                    self.handle_file_message(session, nickname, message)
                 elif message.startswith("ADMIN_COMMAND:"):
                     # 处理管理员命令
                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 收到ADMIN_COMMAND: {message}")
@@ -1797,243 +2960,23 @@ class ChatServer:
                     parts = message.split(":", 2)
                     if len(parts) == 3:
                         admin_command = parts[1].lower()
-                        target_nickname = parts[2].strip()
                         
                         # 检查发送者是否是管理员
                         with self.lock:
                             is_admin = nickname in self.admins
                         
                         if is_admin:
-                            # 执行管理员命令
-                            if admin_command == 'kick':
-                                # 防止管理员自己踢自己
-                                if target_nickname != nickname:
-                                    self.kick_user(target_nickname)
-                                else:
-                                    # 发送错误消息给管理员
-                                    error_message = "ERROR:您不能对自己执行此操作"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试踢自己")
-                            elif admin_command == 'op':
-                                # 防止管理员自己给自己设为管理员
-                                if target_nickname != nickname:
-                                    # 查找目标用户的socket
-                                    target_socket = None
-                                    with self.lock:
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                target_socket = sock
-                                                break
-                                        self.admins.add(target_nickname)
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 管理员 {nickname} 已将 {target_nickname} 设为管理员")
-                                    # 通知所有用户
-                                    broadcast_msg = f"系统: {target_nickname} 已被管理员设为管理员"
-                                    self.broadcast_message(broadcast_msg)
-                                    # 向被设为管理员的用户发送特定消息，触发客户端弹窗
-                                    if target_socket:
-                                        try:
-                                            target_socket.send(f"OP:{broadcast_msg}".encode('utf-8'))
-                                        except:
-                                            pass
-                                    # 更新所有客户端的用户列表，显示管理员标识
-                                    self.broadcast_user_list()
-                                else:
-                                    # 发送错误消息给管理员
-                                    error_message = "ERROR:您已经是管理员"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试给自己设为管理员")
-                            elif admin_command == 'unop':
-                                # 防止管理员自己撤销自己的权限
-                                if target_nickname != nickname:
-                                    is_admin = False
-                                    target_socket = None
-                                    with self.lock:
-                                        # 查找目标用户的socket
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                target_socket = sock
-                                                break
-                                        if target_nickname in self.admins:
-                                            self.admins.remove(target_nickname)
-                                            is_admin = True
-                                    
-                                    if is_admin:
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 管理员 {nickname} 已撤销 {target_nickname} 的管理员权限")
-                                        # 通知所有用户 - 移出锁范围，避免死锁
-                                        broadcast_msg = f"系统: {target_nickname} 已被管理员撤销管理员权限"
-                                        self.broadcast_message(broadcast_msg)
-                                        # 向被撤销管理员权限的用户发送特定消息，触发客户端弹窗
-                                        if target_socket:
-                                            try:
-                                                target_socket.send(f"UNOP:{broadcast_msg}".encode('utf-8'))
-                                            except:
-                                                pass
-                                        # 更新所有客户端的用户列表，恢复原昵称显示
-                                        self.broadcast_user_list()
-                                    else:
-                                        error_message = "ERROR:该用户不是管理员"
-                                        client_socket.send(error_message.encode('utf-8'))
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试撤销非管理员 {target_nickname} 的权限")
-                                else:
-                                    # 发送错误消息给管理员
-                                    error_message = "ERROR:您不能撤销自己的管理员权限"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试撤销自己的权限")
-                            elif admin_command == 'ban':
-                                # 防止管理员自己封禁自己
-                                if target_nickname != nickname:
-                                    # 查找目标用户的IP地址
-                                    target_ip = None
-                                    with self.lock:
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                # 找到目标用户，获取其IP地址
-                                                if sock in self.client_profiles:
-                                                    target_ip = self.client_profiles[sock]['ip_address']
-                                                break
-                                    
-                                    if target_ip:
-                                        # 封禁目标用户的IP
-                                        with self.lock:
-                                            self.banned_ips.add(target_ip)
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 管理员 {nickname} 已封禁IP {target_ip}（用户：{target_nickname}）")
-                                        # 踢出该用户（如果在线）
-                                        self.kick_user(target_nickname)
-                                        # 通知所有用户
-                                        self.broadcast_message(f"系统: 用户 {target_nickname} 的IP {target_ip} 已被管理员封禁")
-                                    else:
-                                        # 用户不在线或找不到IP
-                                        error_message = f"ERROR:找不到用户 {target_nickname} 或其IP地址"
-                                        client_socket.send(error_message.encode('utf-8'))
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试封禁不存在的用户 {target_nickname}")
-                                else:
-                                    # 发送错误消息给管理员
-                                    error_message = "ERROR:您不能封禁自己"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试封禁自己")
-                            elif admin_command == 'unban':
-                                # 支持两种方式解除封禁：直接使用IP地址，或通过用户名查找IP
-                                target_ip = None
-                                target_user = target_nickname  # 保存原始目标名称
-                                
-                                # 检查目标是否是IP地址格式
-                                import re
-                                ip_pattern = r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$'
-                                if re.match(ip_pattern, target_nickname):
-                                    # 直接使用IP地址
-                                    target_ip = target_nickname
-                                else:
-                                    # 尝试通过用户名查找IP地址
-                                    with self.lock:
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                # 找到目标用户，获取其IP地址
-                                                if sock in self.client_profiles:
-                                                    target_ip = self.client_profiles[sock]['ip_address']
-                                                break
-                                
-                                if target_ip:
-                                    with self.lock:
-                                        if target_ip in self.banned_ips:
-                                            self.banned_ips.remove(target_ip)
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 管理员 {nickname} 已解除IP {target_ip} 的封禁")
-                                            # 通知所有用户
-                                            if target_user != target_ip:
-                                                self.broadcast_message(f"系统: 用户 {target_user} 的IP {target_ip} 已被管理员解除封禁")
-                                            else:
-                                                self.broadcast_message(f"系统: IP {target_ip} 已被管理员解除封禁")
-                                        else:
-                                            error_message = f"ERROR:该IP {target_ip} 未被封禁"
-                                            client_socket.send(error_message.encode('utf-8'))
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试解除未封禁IP {target_ip} 的封禁")
-                                else:
-                                    # 无法找到目标IP
-                                    error_message = f"ERROR:找不到目标 {target_nickname} 或其IP地址"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试解除不存在的目标 {target_nickname} 的封禁")
-                            elif admin_command == 'shutup':
-                                # 提取禁言时长
-                                duration_part = target_nickname.split(' ', 1)
-                                if len(duration_part) == 2:
-                                    actual_target = duration_part[0]
-                                    try:
-                                        duration = int(duration_part[1])
-                                        if duration > 0:
-                                            # 防止管理员自己禁言自己
-                                            if actual_target != nickname:
-                                                # 查找目标用户的socket
-                                                target_socket = None
-                                                with self.lock:
-                                                    for sock, n in self.client_nicknames.items():
-                                                        if n == actual_target:
-                                                            target_socket = sock
-                                                            break
-                                                    self.muted_users[actual_target] = (time.time(), duration)
-                                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 管理员 {nickname} 已禁言 {actual_target} {duration} 分钟")
-                                                # 通知所有用户
-                                                broadcast_msg = f"系统: {actual_target} 已被管理员禁言 {duration} 分钟"
-                                                self.broadcast_message(broadcast_msg)
-                                                # 向被禁言的用户发送特定消息，触发客户端弹窗
-                                                if target_socket:
-                                                    try:
-                                                        target_socket.send(f"MUTED:{broadcast_msg}".encode('utf-8'))
-                                                    except:
-                                                        pass
-                                            else:
-                                                error_message = "ERROR:您不能禁言自己"
-                                                client_socket.send(error_message.encode('utf-8'))
-                                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试禁言自己")
-                                        else:
-                                            error_message = "ERROR:禁言时长必须大于0"
-                                            client_socket.send(error_message.encode('utf-8'))
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试使用无效的禁言时长")
-                                    except ValueError:
-                                        error_message = "ERROR:命令格式错误: /shutup <用户名> <时间（分钟）>"
-                                        client_socket.send(error_message.encode('utf-8'))
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试使用错误的命令格式")
-                                else:
-                                    error_message = "ERROR:命令格式错误: /shutup <用户名> <时间（分钟）>"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试使用错误的命令格式")
-                            elif admin_command == 'unshutup':
-                                # 防止管理员自己解除自己的禁言
-                                if target_nickname != nickname:
-                                    # 查找目标用户的socket
-                                    target_socket = None
-                                    with self.lock:
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                target_socket = sock
-                                                break
-                                        if target_nickname in self.muted_users:
-                                            del self.muted_users[target_nickname]
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 管理员 {nickname} 已解除 {target_nickname} 的禁言")
-                                            # 通知所有用户
-                                            broadcast_msg = f"系统: {target_nickname} 已被管理员解除禁言"
-                                            self.broadcast_message(broadcast_msg)
-                                            # 向被解禁的用户发送特定消息，触发客户端弹窗
-                                            if target_socket:
-                                                try:
-                                                    target_socket.send(f"UNMUTED:{broadcast_msg}".encode('utf-8'))
-                                                except:
-                                                    pass
-                                        else:
-                                            error_message = "ERROR:该用户未被禁言"
-                                            client_socket.send(error_message.encode('utf-8'))
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试解除未禁言用户 {target_nickname} 的禁言")
-                                else:
-                                    error_message = "ERROR:您不能解除自己的禁言"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试解除自己的禁言")
+                            success, result = self.execute_admin_command(admin_command, parts[2], actor=nickname)
+                            if success:
+                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 管理员 {nickname}: {result}")
                             else:
-                                # 不支持的命令
-                                error_message = f"ERROR:不支持的命令: {admin_command}"
-                                client_socket.send(error_message.encode('utf-8'))
-                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试执行不支持的命令: {admin_command}")
+                                # 发送错误消息给管理员
+                                self.send_to(client_socket, f"ERROR:{result}")
+                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 执行 {admin_command} 失败: {result}")
                         else:
                             # 发送错误消息给非管理员用户
                             error_message = "ERROR:您没有权限执行此命令"
-                            client_socket.send(error_message.encode('utf-8'))
+                            self.send_to(client_socket, error_message)
                             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 非管理员用户 {nickname} 尝试执行管理员命令")
                 else:
                     # 检查用户是否被禁言
@@ -2059,7 +3002,7 @@ class ChatServer:
                     if is_muted:
                         # 用户被禁言，发送错误消息
                         error_message = f"ERROR:您已被禁言 {mute_duration} 分钟，无法发送消息"
-                        client_socket.send(error_message.encode('utf-8'))
+                        self.send_to(client_socket, error_message)
                         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 被禁言用户 {nickname} 尝试发送消息")
                     else:
                         # 普通消息，广播给其他用户
@@ -2068,6 +3011,8 @@ class ChatServer:
                 
         except ConnectionResetError:
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 强制断开连接")
+        except socket.timeout:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 心跳超时（{self.heartbeat_timeout}秒无响应），判定为掉线")
         except UnicodeDecodeError:
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 发送了无效的UTF-8数据")
         except Exception as e:
@@ -2077,10 +3022,13 @@ class ChatServer:
             with self.lock:
                 if client_socket in self.client_sockets:
                     self.client_sockets.remove(client_socket)
+                if self.client_sessions.get(client_socket) is session:
+                    del self.client_sessions[client_socket]
                     if client_socket in self.client_nicknames:
                         del self.client_nicknames[client_socket]
                     if client_socket in self.client_profiles:
                         del self.client_profiles[client_socket]
+            self.cancel_file_transfers(client_socket)
             
             # 关闭客户端连接
             try:
@@ -2089,10 +3037,323 @@ class ChatServer:
                 pass
             
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 已断开连接")
-            # 广播用户离开消息
-            self.broadcast_message(f"系统: {nickname} 离开了聊天室")
-            # 广播更新后的在线用户列表
-            self.broadcast_user_list()
+            if self.running:
+                # 广播用户离开消息
+                self.broadcast_message(f"系统: {nickname} 离开了聊天室")
+                # 广播更新后的在线用户列表
+                self.broadcast_user_list()
+    
+    def moderation_state(self):
+        return {
+            "admins": self.admins,
+            "banned_users": self.banned_users,
+            "banned_ips": self.banned_ips,
+            "muted_users": self.muted_users,
+        }
+    
+    def moderation_snapshot(self):
+        """当前管理状态的完整副本，供写快照使用"""
+        with self.lock:
+            return {name: container.snapshot() for name, container in self.moderation_state().items()}
+    
+    def accept_tls(self, client_socket, client_address):
+        """区分加密和明文连接：TLS握手的第一个字节固定为0x16，而明文客户端首先发送的昵称是可见字符
+        加密连接完成握手后返回SSLSocket；required模式下明文连接被拒绝，返回None
+        """
+        client_socket.settimeout(TLS_HANDSHAKE_TIMEOUT)
+        try:
+            first_byte = client_socket.recv(1, socket.MSG_PEEK)
+            if first_byte == b"\x16":
+                tls_socket = self.tls_context.wrap_socket(client_socket, server_side=True, do_handshake_on_connect=False)
+                tls_socket.do_handshake()
+                tls_socket.settimeout(None)
+                resumed = "，复用会话" if tls_socket.session_reused else ""
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [TLS] 客户端 {client_address} 已建立加密连接（{tls_socket.version()}{resumed}）")
+                return tls_socket
+        except (ssl.SSLError, OSError) as e:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} TLS握手失败: {str(e)}")
+            client_socket.close()
+            return None
+        
+        if self.tls_mode == "required":
+            try:
+                client_socket.sendall("ERROR:服务器只接受加密连接，请勾选“加密连接（TLS）”后重试".encode('utf-8'))
+            except OSError:
+                pass
+            client_socket.close()
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 已拒绝客户端 {client_address} 的明文连接")
+            return None
+        client_socket.settimeout(None)
+        return client_socket
+    
+    def get_server_caps(self):
+        """返回当前配置下服务端声明支持的协议扩展"""
+        caps = list(SERVER_CAPS)
+        if self.heartbeat_interval <= 0:
+            caps.remove("ping")
+        if not self.file_transfer:
+            caps.remove("file")
+        if self.compress_threshold <= 0:
+            caps.remove("deflate")
+        return caps
+    
+    def negotiate_caps(self, session):
+        """等待客户端回复CAPS:选择协议扩展，最多等待caps_wait毫秒，旧客户端不会回复，超时后按旧协议处理
+        协议确定前发给客户端的消息都暂存在session.backlog中，确定后才按选定的格式发出
+        """
+        client_socket = session.socket
+        data = None
+        if self.caps_wait > 0:
+            client_socket.settimeout(self.caps_wait / 1000)
+            try:
+                data = client_socket.recv(FRAMED_RECV_SIZE)
+            except socket.timeout:
+                pass
+            finally:
+                client_socket.settimeout(None)
+        
+        if data == b"":
+            # 对端已关闭，交给消息循环处理
+            session.pending.append(None)
+        elif data is not None:
+            self._queue_received_data(session, data)
+        # 等待时间内没有收到CAPS:行，本次连接按旧协议通信，之后才到达的CAPS:行不会被确认
+        self.settle_caps(session, set())
+    
+    def apply_caps(self, session, data):
+        """处理客户端的CAPS:行，返回其后的数据；确认启用帧格式时后面的数据已经是帧格式"""
+        caps_line, _, rest = data.partition(b"\n")
+        requested = caps_line[len(b"CAPS:"):].decode('utf-8').split(",")
+        caps = {cap.strip() for cap in requested if cap.strip() in self.get_server_caps()}
+        if "frame" not in caps:
+            # 心跳等扩展依赖帧格式
+            caps = set()
+        if not self.settle_caps(session, caps):
+            # 客户端收不到确认帧，会继续使用原始协议
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {session.address} 超过{self.caps_wait}毫秒才回复CAPS，按旧协议处理")
+            return rest
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {session.address} 启用协议扩展: {','.join(sorted(session.caps)) or '无'}")
+        if "ping" in session.caps:
+            # 支持心跳的客户端会定期回复PONG，超时未收到任何数据即判定掉线
+            session.socket.settimeout(self.heartbeat_timeout)
+        return rest
+    
+    def settle_caps(self, session, caps):
+        """确定会话使用的协议并按该格式发出暂存的消息，协议已经确定时返回False
+        启用帧格式时先发送CAPS:确认帧，客户端收到确认帧前一直按原始协议解析，两端不会对格式作出不同的判断
+        """
+        with session.send_lock:
+            if session.backlog is None:
+                return False
+            session.caps = caps
+            session.framed = "frame" in caps
+            if session.framed:
+                session.socket.sendall(encode_frame(f"CAPS:{','.join(sorted(caps))}".encode('utf-8')))
+            for message in session.backlog:
+                data = message.encode('utf-8')
+                if session.framed:
+                    data = self.encode_message_frame(session, data)
+                session.socket.sendall(data)
+            session.backlog = None
+        return True
+    
+    def receive_message(self, session):
+        """接收下一条客户端消息，自动应答心跳帧；连接关闭时返回None"""
+        while not session.pending:
+            if session.framed:
+                data = session.socket.recv(FRAMED_RECV_SIZE)
+            else:
+                data = session.socket.recv(self.message_size_limit)
+            if not data:
+                return None
+            self._queue_received_data(session, data)
+        return session.pending.popleft()
+    
+    def _queue_received_data(self, session, data):
+        """解析收到的数据并放入待处理队列"""
+        session.last_seen = time.time()
+        if not session.framed:
+            if session.awaiting_caps:
+                session.awaiting_caps = False
+                if data.startswith(b"CAPS:"):
+                    rest = self.apply_caps(session, data)
+                    if rest:
+                        self._queue_received_data(session, rest)
+                    return
+            session.pending.append(data.decode('utf-8'))
+            return
+        
+        for flags, payload in session.reader.feed(data):
+            if flags & FRAME_FLAG_BINARY:
+                # 文件分块不进入消息队列，直接转发给接收方
+                self.relay_file_chunk(session, payload)
+                continue
+            if flags & FRAME_FLAG_COMPRESSED:
+                try:
+                    payload = decompress_payload(payload)
+                except (zlib.error, ValueError) as e:
+                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {session.address} 发送了无法解压的消息: {str(e)}")
+                    continue
+            message = payload.decode('utf-8')
+            if message.startswith("PING:"):
+                self.send_to(session.socket, f"PONG:{message[5:]}")
+            elif message.startswith("PONG:"):
+                # 心跳应答只用于刷新活跃时间
+                continue
+            elif len(payload) > self.message_size_limit:
+                self.send_to(session.socket, f"ERROR:消息过长，单条消息不能超过{self.message_size_limit}字节")
+            else:
+                session.pending.append(message)
+    
+    def send_to(self, client_socket, message, cache=None):
+        """按照客户端协商的协议向其发送一条消息"""
+        data = message.encode('utf-8')
+        session = self.client_sessions.get(client_socket)
+        if session is None:
+            client_socket.send(data)
+            return
+        
+        with session.send_lock:
+            if session.backlog is not None:
+                # 协议协商结束前暂存，协商后按选定的格式发出
+                session.backlog.append(message)
+                return
+            if session.framed:
+                data = self.encode_message_frame(session, data, cache)
+            client_socket.sendall(data)
+    
+    def encode_message_frame(self, session, data, cache=None):
+        """把文本消息编码为帧，启用deflate的客户端收到的长消息会被压缩
+        广播时传入同一个cache字典，压缩结果在所有客户端之间复用，每条广播只压缩一次
+        """
+        compress = self.compress_threshold > 0 and "deflate" in session.caps and len(data) >= self.compress_threshold
+        key = "deflate" if compress else "frame"
+        if cache is not None and key in cache:
+            return cache[key]
+        
+        frame = None
+        if compress:
+            compressed = compress_payload(data)
+            if len(compressed) < len(data):
+                frame = encode_frame(compressed, FRAME_FLAG_COMPRESSED)
+        if frame is None:
+            frame = encode_frame(data)
+        if cache is not None:
+            cache[key] = frame
+        return frame
+    
+    def send_binary(self, client_socket, payload):
+        """向使用帧格式的客户端发送二进制帧"""
+        session = self.client_sessions.get(client_socket)
+        if session is None or not session.framed:
+            return
+        with session.send_lock:
+            client_socket.sendall(encode_frame(payload, FRAME_FLAG_BINARY))
+    
+    def handle_file_message(self, session, nickname, message):
+        """处理文件传输控制消息，服务端只校验并转发，不保存文件内容"""
+        command, _, body = message.partition(":")
+        try:
+            info = json.loads(body)
+            transfer_id = int(info["id"])
+        except (ValueError, KeyError, TypeError):
+            self.send_to(session.socket, "FILE_ERROR:" + json.dumps({"id": None, "reason": "文件传输消息格式错误"}, ensure_ascii=False))
+            return
+        
+        if command == "FILE_OFFER":
+            target_nickname = str(info.get("to", ""))
+            size = info.get("size")
+            error = None
+            with self.lock:
+                target_socket = None
+                for sock, n in self.client_nicknames.items():
+                    # 用户列表中的管理员带有前缀
+                    if n == target_nickname or f"{self.admin_prefix}{n}" == target_nickname:
+                        target_socket = sock
+                        break
+                target_session = self.client_sessions.get(target_socket)
+                if transfer_id in self.file_transfers:
+                    error = "传输ID重复，请重新发送"
+                elif target_session is None or "file" not in target_session.caps:
+                    error = f"{target_nickname} 不在线或其客户端不支持文件传输"
+                elif target_socket is session.socket:
+                    error = "不能给自己发送文件"
+                elif not isinstance(size, int) or size < 0 or size > self.file_max_size:
+                    error = f"文件大小超过服务器限制（{self.file_max_size // (1024 * 1024)}MB）"
+                else:
+                    self.file_transfers[transfer_id] = FileTransfer(transfer_id, session.socket, target_socket, size)
+            if error:
+                self.send_to(session.socket, "FILE_ERROR:" + json.dumps({"id": transfer_id, "reason": error}, ensure_ascii=False))
+                return
+            
+            info["from"] = nickname
+            info["to"] = self.client_nicknames.get(target_socket, target_nickname)
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [信息] {nickname} 向 {info['to']} 发送文件: {info.get('name', '')} ({size} 字节)")
+            try:
+                self.send_to(target_socket, "FILE_OFFER:" + json.dumps(info, ensure_ascii=False))
+            except OSError:
+                self.finish_file_transfer(transfer_id, "对方已断开连接")
+            return
+        
+        with self.lock:
+            transfer = self.file_transfers.get(transfer_id)
+        if transfer is None:
+            # 已结束的传输可能还有迟到的确认消息，直接忽略
+            return
+        
+        if session.socket is transfer.receiver and command in ("FILE_ACCEPT", "FILE_REJECT", "FILE_ACK", "FILE_RESUME", "FILE_COMPLETE", "FILE_CANCEL"):
+            peer_socket = transfer.sender
+            if command == "FILE_ACCEPT":
+                transfer.accepted = True
+        elif session.socket is transfer.sender and command == "FILE_CANCEL":
+            peer_socket = transfer.receiver
+        else:
+            return
+        
+        if command in ("FILE_REJECT", "FILE_COMPLETE", "FILE_CANCEL"):
+            with self.lock:
+                self.file_transfers.pop(transfer_id, None)
+        try:
+            self.send_to(peer_socket, message)
+        except OSError:
+            self.finish_file_transfer(transfer_id, "对方已断开连接")
+    
+    def relay_file_chunk(self, session, payload):
+        """把发送方的文件分块转发给接收方"""
+        if len(payload) < FILE_CHUNK_HEADER.size:
+            return
+        transfer_id = FILE_CHUNK_HEADER.unpack_from(payload)[0]
+        with self.lock:
+            transfer = self.file_transfers.get(transfer_id)
+        if transfer is None or transfer.sender is not session.socket or not transfer.accepted:
+            return
+        try:
+            self.send_binary(transfer.receiver, payload)
+        except OSError:
+            self.finish_file_transfer(transfer_id, "对方已断开连接")
+    
+    def finish_file_transfer(self, transfer_id, reason, exclude_socket=None):
+        """中止一次文件传输并通知仍在线的一方"""
+        with self.lock:
+            transfer = self.file_transfers.pop(transfer_id, None)
+        if transfer is None:
+            return
+        cancel_message = "FILE_CANCEL:" + json.dumps({"id": transfer_id, "reason": reason}, ensure_ascii=False)
+        for sock in (transfer.sender, transfer.receiver):
+            if sock is exclude_socket:
+                continue
+            try:
+                self.send_to(sock, cancel_message)
+            except OSError:
+                pass
+    
+    def cancel_file_transfers(self, client_socket):
+        """客户端断开时中止其参与的所有文件传输"""
+        with self.lock:
+            transfer_ids = [transfer_id for transfer_id, transfer in self.file_transfers.items()
+                            if client_socket in (transfer.sender, transfer.receiver)]
+        for transfer_id in transfer_ids:
+            self.finish_file_transfer(transfer_id, "对方已断开连接", exclude_socket=client_socket)
     
     def broadcast_message(self, message, exclude_socket=None):
         """广播消息给所有客户端，可选排除特定客户端"""
@@ -2100,12 +3361,14 @@ class ChatServer:
             # 创建客户端列表副本，避免在迭代时修改列表
             clients_copy = self.client_sockets.copy()
         
+        # 同一条广播的帧编码和压缩结果在客户端之间复用
+        frame_cache = {}
         for client in clients_copy:
             if client == exclude_socket:
                 continue
             
             try:
-                client.send(message.encode('utf-8'))
+                self.send_to(client, message, frame_cache)
             except BrokenPipeError:
                 # 处理客户端断开但未从列表中移除的情况
                 with self.lock:
@@ -2137,30 +3400,361 @@ class ChatServer:
         user_list_message = f"USERS_LIST:{','.join(users)}"
         self.broadcast_message(user_list_message)
     
+    def execute_admin_command(self, command, argument, actor=None):
+        """执行管理命令，聊天中的ADMIN_COMMAND、控制台命令和网页管理共用
+        argument为命令参数（shutup为"用户名 分钟"），actor为发出命令的管理员昵称，控制台和网页管理为None
+        每个命令只在查找目标和修改管理状态时持有一次self.lock，广播和发送在锁外进行
+        返回(是否成功, 结果说明)
+        """
+        handler = self.admin_commands.get(command)
+        if handler is None:
+            return False, f"不支持的命令: {command}"
+        argument = argument.strip()
+        if not argument:
+            return False, f"命令格式错误: {ADMIN_COMMAND_USAGE[command]}"
+        return handler(argument, actor)
+    
+    def notify_moderation(self, target_socket, kind, broadcast_msg):
+        """广播管理操作，并向被操作的在线用户发送kind前缀的消息，触发客户端弹窗"""
+        self.broadcast_message(broadcast_msg)
+        if target_socket:
+            try:
+                self.send_to(target_socket, f"{kind}:{broadcast_msg}")
+            except:
+                pass
+    
+    def command_kick(self, target, actor):
+        """kick <用户名>"""
+        if target == actor:
+            return False, "您不能对自己执行此操作"
+        with self.lock:
+            target_socket = self.client_nicknames.socket_of(target)
+        return self.kick_socket(target_socket, target)
+    
+    def command_op(self, target, actor):
+        """op <用户名>"""
+        if target == actor:
+            return False, "您已经是管理员"
+        with self.lock:
+            target_socket = self.client_nicknames.socket_of(target)
+            self.admins.add(target)
+        self.notify_moderation(target_socket, "OP", f"系统: {target} 已被管理员设为管理员")
+        # 更新所有客户端的用户列表，显示管理员标识
+        self.broadcast_user_list()
+        return True, f"已将 {target} 设为管理员"
+    
+    def command_unop(self, target, actor):
+        """unop <用户名>"""
+        if target == actor:
+            return False, "您不能撤销自己的管理员权限"
+        with self.lock:
+            target_socket = self.client_nicknames.socket_of(target)
+            is_admin = target in self.admins
+            if is_admin:
+                self.admins.remove(target)
+        if not is_admin:
+            return False, f"{target} 不是管理员"
+        self.notify_moderation(target_socket, "UNOP", f"系统: {target} 已被管理员撤销管理员权限")
+        # 更新所有客户端的用户列表，恢复原昵称显示
+        self.broadcast_user_list()
+        return True, f"已撤销 {target} 的管理员权限"
+    
+    def command_ban(self, target, actor):
+        """ban <目标>，目标可以是用户名、IP、CIDR网段或地址范围；是用户名时封禁其IP"""
+        with self.lock:
+            rules, target_user = self.resolve_ban_target(target)
+            own_profile = self.client_profiles.get(self.client_nicknames.socket_of(actor)) if actor else None
+            own_ip = own_profile.get('ip_address') if own_profile else None
+            if actor is not None and (target_user == actor or (rules and own_ip and IPPrefixTrie(rules).match(own_ip))):
+                # 防止管理员封禁自己
+                return False, "您不能封禁自己"
+            added = [rule for rule in rules if rule not in self.banned_ips]
+            for rule in added:
+                self.banned_ips.add(rule)
+            banned_clients = self.banned_clients(added) if added else []
+        if not rules:
+            return False, f"找不到用户 {target} 或其IP地址"
+        rule_text = ", ".join(rules)
+        if not added:
+            return False, f"IP {rule_text} 已在封禁列表中"
+        self.kick_clients(banned_clients)
+        if target_user:
+            self.broadcast_message(f"系统: 用户 {target_user} 的IP {rule_text} 已被管理员封禁")
+            return True, f"已封禁IP {rule_text}（用户：{target_user}）"
+        self.broadcast_message(f"系统: IP {rule_text} 已被管理员封禁")
+        return True, f"已封禁IP {rule_text}"
+    
+    def command_unban(self, target, actor):
+        """unban <目标>，目标格式同ban"""
+        with self.lock:
+            rules, target_user = self.resolve_ban_target(target)
+            removed = [rule for rule in rules if rule in self.banned_ips]
+            for rule in removed:
+                self.banned_ips.remove(rule)
+            # 目标本身没有单独的规则时，查出仍然覆盖它的网段规则
+            covering = self.banned_ips.match(rules[0]) if not removed and len(rules) == 1 else None
+        if not rules:
+            return False, f"找不到目标 {target} 或其IP地址"
+        if covering:
+            return False, f"{target} 属于封禁网段 {covering}，请解除该网段的封禁"
+        if not removed:
+            return False, f"IP {', '.join(rules)} 未被封禁"
+        rule_text = ", ".join(removed)
+        if target_user:
+            self.broadcast_message(f"系统: 用户 {target_user} 的IP {rule_text} 已被管理员解除封禁")
+        else:
+            self.broadcast_message(f"系统: IP {rule_text} 已被管理员解除封禁")
+        return True, f"已解除IP {rule_text} 的封禁"
+    
+    def command_shutup(self, target, actor):
+        """shutup <用户名> <时间（分钟）>"""
+        nickname, _, minutes = target.rpartition(' ')
+        nickname = nickname.strip()
+        try:
+            duration = int(minutes)
+        except ValueError:
+            duration = None
+        if not nickname or duration is None:
+            return False, f"命令格式错误: {ADMIN_COMMAND_USAGE['shutup']}"
+        if duration <= 0:
+            return False, "禁言时长必须大于0"
+        if nickname == actor:
+            return False, "您不能禁言自己"
+        with self.lock:
+            target_socket = self.client_nicknames.socket_of(nickname)
+            self.muted_users[nickname] = (time.time(), duration)
+        self.notify_moderation(target_socket, "MUTED", f"系统: {nickname} 已被管理员禁言 {duration} 分钟")
+        return True, f"已禁言 {nickname} {duration} 分钟"
+    
+    def command_unshutup(self, target, actor):
+        """unshutup <用户名>"""
+        if target == actor:
+            return False, "您不能解除自己的禁言"
+        with self.lock:
+            target_socket = self.client_nicknames.socket_of(target)
+            is_muted = target in self.muted_users
+            if is_muted:
+                del self.muted_users[target]
+        if not is_muted:
+            return False, f"{target} 未被禁言"
+        self.notify_moderation(target_socket, "UNMUTED", f"系统: {target} 已被管理员解除禁言")
+        return True, f"已解除 {target} 的禁言"
+    
+    def kick_socket(self, target_socket, target_nickname):
+        """踢出已查到socket的用户，返回(是否成功, 结果说明)；会广播消息，调用时不能持有self.lock"""
+        if not target_socket:
+            return False, f"用户 {target_nickname} 不存在或已离线"
+        try:
+            # 发送踢出消息给目标用户
+            self.send_to(target_socket, "KICKED:你已被管理员踢出聊天室")
+            # 关闭连接
+            target_socket.close()
+            # 广播踢出消息
+            self.broadcast_message(f"系统: {target_nickname} 已被管理员踢出聊天室")
+        except Exception as e:
+            return False, f"踢出用户 {target_nickname} 时发生错误: {str(e)}"
+        return True, f"已踢出用户: {target_nickname}"
+    
+    def kick_clients(self, targets):
+        """踢出[(socket, 昵称)]中的用户，结果打印到控制台"""
+        for target_socket, target_nickname in targets:
+            success, result = self.kick_socket(target_socket, target_nickname)
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {'[成功]' if success else '[错误]'} {result}")
+    
     def kick_user(self, target_nickname):
         """踢出指定用户"""
-        target_socket = None
-        
         with self.lock:
-            # 查找目标用户的socket
-            for sock, nickname in self.client_nicknames.items():
-                if nickname == target_nickname:
-                    target_socket = sock
-                    break
-        
-        if target_socket:
+            target_socket = self.client_nicknames.socket_of(target_nickname)
+        self.kick_clients([(target_socket, target_nickname)])
+    
+    def resolve_ban_target(self, target):
+        """把ban/unban的目标解析为封禁规则，返回(规则列表, 用户名)，调用时需持有self.lock
+        目标可以是IP、CIDR网段、地址范围或在线用户名；是用户名时取其IP，找不到时规则列表为空
+        """
+        try:
+            return parse_ip_ban_rules(target), None
+        except ValueError:
+            pass
+        profile = self.client_profiles.get(self.client_nicknames.socket_of(target))
+        if profile and profile.get('ip_address'):
+            return parse_ip_ban_rules(profile['ip_address']), target
+        return [], target
+    
+    def banned_clients(self, rules=None):
+        """返回IP命中封禁规则的在线用户[(socket, 昵称)]，调用时需持有self.lock
+        传入rules时只检查这些新增的规则：单个IP的规则直接比较字符串，只有网段规则才需要解析在线用户的IP
+        """
+        if rules is None:
+            match = self.banned_ips.match
+        else:
+            hosts = {rule for rule in rules if "/" not in rule}
+            networks = IPPrefixTrie(rule for rule in rules if "/" in rule) if len(hosts) < len(rules) else None
+            
+            def match(ip):
+                # IPv4映射的IPv6地址（::ffff:a.b.c.d）按IPv4比较
+                if ip in hosts or (ip.startswith("::ffff:") and ip[7:] in hosts):
+                    return True
+                return networks is not None and networks.match(ip) is not None
+        return [(sock, self.client_nicknames[sock]) for sock, profile in self.client_profiles.items()
+                if sock in self.client_nicknames and match(profile['ip_address'])]
+    
+    def kick_banned_clients(self):
+        """踢出IP命中封禁规则的在线用户"""
+        with self.lock:
+            targets = self.banned_clients()
+        self.kick_clients(targets)
+    
+    def reload_config(self):
+        """重新读取配置文件，全部校验通过后一次性应用可在运行中修改的配置项
+        返回(已生效的配置项, 需要重启才能生效的配置项)；有任何取值无效时抛出ValueError，不修改任何配置
+        """
+        if not os.path.exists(CONFIG_FILE):
+            raise ValueError(f"配置文件 {CONFIG_FILE} 不存在")
+        config = load_config(strict=True)
+        values = {}
+        errors = []
+        for key, (kind, constraint) in LIVE_CONFIG_SETTINGS.items():
             try:
-                # 发送踢出消息给目标用户
-                target_socket.send("KICKED:你已被管理员踢出聊天室".encode('utf-8'))
-                # 关闭连接
-                target_socket.close()
-                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 已踢出用户: {target_nickname}")
-                # 广播踢出消息
-                self.broadcast_message(f"系统: {target_nickname} 已被管理员踢出聊天室")
-            except Exception as e:
-                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 踢出用户 {target_nickname} 时发生错误: {str(e)}")
+                values[key] = parse_config_value(kind, constraint, config[key])
+            except ValueError as e:
+                errors.append(f"{key}={config[key]}（{e}）")
+        if errors:
+            raise ValueError("；".join(errors))
+        
+        with self.lock:
+            changed = [key for key, value in values.items() if getattr(self, key) != value]
+            for key in changed:
+                setattr(self, key, values[key])
+                self.config[key] = config[key]
+        restart_required = [key for key, value in config.items()
+                            if key in self.config and key not in LIVE_CONFIG_SETTINGS and self.config[key] != value]
+        if "max_user" in changed and self.server_socket is not None:
+            # 与启动时一样作为监听队列长度，对已监听的socket再次调用listen会更新队列长度
+            self.server_socket.listen(self.max_user)
+        if "admin_prefix" in changed:
+            self.broadcast_user_list()
+        return changed, restart_required
+    
+    def apply_config_reload(self):
+        """重新加载配置文件并输出结果，由配置监视线程和reload命令调用"""
+        self.config_state = config_file_state()
+        try:
+            changed, restart_required = self.reload_config()
+        except Exception as e:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 配置文件有误，未应用任何修改: {e}")
+            return
+        if changed:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 配置已重新加载，已生效: {', '.join(f'{key}={self.config[key]}' for key in changed)}")
         else:
-            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 用户 {target_nickname} 不存在或已离线")
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [信息] 配置已重新加载，没有可立即生效的修改")
+        if restart_required:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [警告] 以下配置项需要重启服务器才能生效: {', '.join(restart_required)}")
+    
+    def config_watch_loop(self):
+        """轮询配置文件的修改时间和大小，文件变化后自动重新加载
+        标准库没有跨平台的文件变化通知接口，每隔几秒stat一次的开销可以忽略
+        """
+        while self.running:
+            time.sleep(CONFIG_WATCH_INTERVAL)
+            state = config_file_state()
+            if state is not None and state != self.config_state:
+                self.apply_config_reload()
+    
+    def heartbeat_loop(self):
+        """定期向启用心跳的客户端发送PING，掉线判定由各处理线程的接收超时完成"""
+        next_ping = time.time() + self.heartbeat_interval
+        while self.running:
+            time.sleep(1)
+            if time.time() < next_ping:
+                continue
+            next_ping = time.time() + self.heartbeat_interval
+            
+            with self.lock:
+                sessions = [self.client_sessions[sock] for sock in self.client_sockets if sock in self.client_sessions]
+            
+            ping_message = f"PING:{int(time.time() * 1000)}"
+            for session in sessions:
+                if "ping" not in session.caps:
+                    continue
+                try:
+                    self.send_to(session.socket, ping_message)
+                except OSError:
+                    # 发送失败说明连接已不可用，关闭读写使处理线程尽快退出并清理
+                    try:
+                        session.socket.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+    
+    def discovery_info(self):
+        """发现应答中的服务器信息"""
+        with self.lock:
+            online = len(self.client_nicknames)
+        info = {
+            "name": f"{socket.gethostname()}:{self.port}",
+            "port": self.port,
+            "version": CURRENT_VERSION,
+            "online": online,
+            "max_user": self.max_user,
+            "load": round(online / self.max_user, 3),
+            "tls": self.tls_mode,
+        }
+        if hasattr(os, "getloadavg"):
+            info["cpu"] = round(os.getloadavg()[0] / (os.cpu_count() or 1), 3)
+        return info
+    
+    def open_discovery_socket(self):
+        """监听局域网发现请求，同一台机器上的多个服务器共用端口，各自应答"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(("", DISCOVERY_PORT))
+        except OSError as e:
+            sock.close()
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [警告] 局域网发现端口 {DISCOVERY_PORT} 绑定失败，客户端将无法自动发现本服务器: {str(e)}")
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            socket.inet_aton(DISCOVERY_GROUP) + socket.inet_aton("0.0.0.0"))
+        except OSError:
+            # 没有可用的组播路由时只响应广播
+            pass
+        sock.settimeout(self.socket_timeout)
+        self.discovery_socket = sock
+        thread = threading.Thread(target=self.discovery_loop)
+        thread.daemon = True
+        thread.start()
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [信息] 局域网发现已启用，UDP端口: {DISCOVERY_PORT}")
+    
+    def close_discovery_socket(self):
+        if self.discovery_socket is None:
+            return
+        try:
+            self.discovery_socket.close()
+        except OSError:
+            pass
+        self.discovery_socket = None
+    
+    def discovery_loop(self):
+        """应答发现请求：原样带回客户端的随机串，客户端据此匹配请求并计算往返延迟"""
+        sock = self.discovery_socket
+        while self.running and self.discovery_socket is not None:
+            try:
+                data, address = sock.recvfrom(DISCOVERY_PACKET_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            parts = data.decode("utf-8", "replace").split(" ", 1)
+            if len(parts) != 2 or parts[0] != DISCOVERY_MAGIC or not 0 < len(parts[1]) <= 64:
+                continue
+            info = dict(self.discovery_info(), nonce=parts[1])
+            reply = f"{DISCOVERY_REPLY} {json.dumps(info, ensure_ascii=False)}"
+            try:
+                sock.sendto(reply.encode("utf-8"), address)
+            except OSError:
+                continue
     
     def start(self):
         """启动服务器"""
@@ -2168,9 +3762,6 @@ class ChatServer:
         print("" * 20 + "聊天服务器启动中...")
         print("=" * 60)
         
-        # 检查更新
-        check_for_updates()
-        
         # 启动 Web 服务器
         if self.web_enabled:
             web_thread = threading.Thread(target=self.run_web_server)
@@ -2179,6 +3770,16 @@ class ChatServer:
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [Web] Web管理界面启动中...")
         
         try:
+            # 准备TLS证书
+            if self.tls_mode != "off" and self.tls_context is None:
+                self.tls_context = prepare_tls_context(self.tls_mode, self.tls_cert, self.tls_key)
+            
+            # 启动管理状态的后台写入
+            if self.moderation_store is not None:
+                self.moderation_store.start()
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [信息] 已恢复管理状态: {len(self.admins)} 个管理员，"
+                      f"{len(self.banned_ips)} 个封禁IP，{len(self.muted_users)} 个禁言")
+            
             bind_attempts = 0
             bind_success = False
             
@@ -2212,7 +3813,7 @@ class ChatServer:
                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 服务器状态: 运行中")
                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 监听地址: 0.0.0.0")
                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 监听端口: {self.port}")
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 服务器IP: {socket.gethostbyname(socket.gethostname())}")
+                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 服务器IP: {local_lan_ip()}")
                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 最大连接数: {self.max_user}")
                     if self.web_enabled:
                         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [Web] Web管理界面: http://localhost:{self.web_port}")
@@ -2258,18 +3859,33 @@ class ChatServer:
                                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [警告] 收到退出命令，正在关闭服务器...")
                                 self.running = False
                                 break
+                            elif command.startswith('stop '):
+                                seconds = command[5:].strip()
+                                if seconds.isdigit():
+                                    print("\n" + "=" * 60)
+                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [警告] 收到退出命令，正在关闭服务器，客户端将在 {seconds} 秒后自动重连...")
+                                    self.reconnect_hint = int(seconds)
+                                    self.running = False
+                                    break
+                                else:
+                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 命令格式错误: stop <重连等待秒数>")
                             elif command in ['help', '?']:
                                 print("-" * 60)
                                 print("可用命令:")
                                 print("  quit, exit, stop  - 关闭服务器")
+                                print("  stop <秒数>       - 关闭服务器，通知客户端在指定秒数后自动重连（计划内重启时使用）")
                                 print("  help, ?          - 显示帮助信息")
                                 print("  status           - 显示服务器状态")
                                 print("  version          - 显示当前版本号")
+                                print("  update           - 检查并下载更新")
+                                print("  gencert          - 重新生成TLS自签名证书（重启后生效）")
+                                print("  reload           - 立即重新加载配置文件（修改后也会自动加载）")
                                 print("  op <用户名>       - 将指定用户设置为管理员")
                                 print("  unop <用户名>     - 撤销指定用户的管理员权限")
                                 print("  kick <用户名>     - 踢出指定用户")
-                                print("  ban <用户名>      - 封禁指定用户的IP")
-                                print("  unban <用户名或IP>    - 解除指定IP的封禁")
+                                print("  ban <目标>        - 封禁IP，目标可以是用户名、IP、CIDR网段(10.0.0.0/24、2001:db8::/32)或范围(起始IP-结束IP)")
+                                print("  unban <目标>      - 解除封禁，目标格式同ban")
+                                print("  banlist          - 列出所有IP封禁规则")
                                 print("  shutup <用户名> <时间> - 禁言指定时长（分钟）")
                                 print("  unshutup <用户名> - 解除指定用户的禁言")
                                 print("-" * 60)
@@ -2277,6 +3893,25 @@ class ChatServer:
                                 print("-" * 60)
                                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [信息] 服务器版本: v{CURRENT_VERSION}")
                                 print("-" * 60)
+                            elif command == 'update':
+                                print("-" * 60)
+                                check_for_updates()
+                                print("-" * 60)
+                            elif command == 'gencert':
+                                print("-" * 60)
+                                try:
+                                    generate_self_signed_cert(self.tls_cert, self.tls_key, socket.gethostname())
+                                    with open(self.tls_cert, "r", encoding="utf-8") as f:
+                                        fingerprint = certificate_fingerprint(ssl.PEM_cert_to_DER_cert(f.read()))
+                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [TLS] 已生成新证书 {self.tls_cert}，指纹 SHA256: {fingerprint}")
+                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [TLS] 重启服务器后生效，客户端会提示证书指纹已变化")
+                                except Exception as e:
+                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 生成证书失败: {str(e)}")
+                                print("-" * 60)
+                            elif command == 'reload':
+                                print("-" * 60)
+                                self.apply_config_reload()
+                                print("-" * 60)
                             elif command == 'status':
                                 print("-" * 60)
                                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [信息] 服务器状态: {'运行中' if self.running else '已关闭'}")
@@ -2284,208 +3919,23 @@ class ChatServer:
                                 with self.lock:
                                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [信息] 在线客户端: {len(self.client_sockets)}")
                                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [信息] 运行时长: {self._get_running_time()}")
+                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [TLS] 加密连接: {self.tls_mode if self.tls_context is not None else 'off'}")
                                 if self.web_enabled:
                                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [Web] Web管理界面: http://localhost:{self.web_port}")
                                 print("-" * 60)
-                            elif command.startswith('op '):
-                                # 处理op命令
-                                parts = command.split(' ', 1)
-                                if len(parts) == 2:
-                                    target_nickname = parts[1].strip()
-                                    # 查找目标用户的socket
-                                    target_socket = None
-                                    with self.lock:
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                target_socket = sock
-                                                break
-                                        self.admins.add(target_nickname)
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 已将 {target_nickname} 设置为管理员")
-                                    # 通知所有用户
-                                    broadcast_msg = f"系统: {target_nickname} 已成为管理员"
-                                    self.broadcast_message(broadcast_msg)
-                                    # 向被设为管理员的用户发送特定消息，触发客户端弹窗
-                                    if target_socket:
-                                        try:
-                                            target_socket.send(f"OP:{broadcast_msg}".encode('utf-8'))
-                                        except:
-                                            pass
-                                    # 更新所有客户端的用户列表，显示管理员标识
-                                    self.broadcast_user_list()
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 命令格式错误: op <用户名>")
-                            elif command.startswith('unop '):
-                                # 处理unop命令
-                                parts = command.split(' ', 1)
-                                if len(parts) == 2:
-                                    target_nickname = parts[1].strip()
-                                    is_admin = False
-                                    target_socket = None
-                                    with self.lock:
-                                        # 查找目标用户的socket
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                target_socket = sock
-                                                break
-                                        if target_nickname in self.admins:
-                                            self.admins.remove(target_nickname)
-                                            is_admin = True
-                                    
-                                    if is_admin:
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 已撤销 {target_nickname} 的管理员权限")
-                                        # 通知所有用户
-                                        broadcast_msg = f"系统: {target_nickname} 已被撤销管理员权限"
-                                        self.broadcast_message(broadcast_msg)
-                                        # 向被撤销管理员权限的用户发送特定消息，触发客户端弹窗
-                                        if target_socket:
-                                            try:
-                                                target_socket.send(f"UNOP:{broadcast_msg}".encode('utf-8'))
-                                            except:
-                                                pass
-                                        # 更新所有客户端的用户列表，恢复原昵称显示
-                                        self.broadcast_user_list()
-                                    else:
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] {target_nickname} 不是管理员")
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 命令格式错误: unop <用户名>")
-                            elif command.startswith('ban '):
-                                # 处理ban命令
-                                parts = command.split(' ', 1)
-                                if len(parts) == 2:
-                                    target_nickname = parts[1].strip()
-                                    # 查找目标用户的IP地址
-                                    target_ip = None
-                                    with self.lock:
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                # 找到目标用户，获取其IP地址
-                                                if sock in self.client_profiles:
-                                                    target_ip = self.client_profiles[sock]['ip_address']
-                                                break
-                                    
-                                    if target_ip:
-                                        # 封禁目标用户的IP
-                                        with self.lock:
-                                            self.banned_ips.add(target_ip)
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 已封禁IP {target_ip}（用户：{target_nickname}）")
-                                        # 踢出该用户（如果在线）
-                                        self.kick_user(target_nickname)
-                                        # 通知所有用户
-                                        self.broadcast_message(f"系统: 用户 {target_nickname} 的IP {target_ip} 已被封禁")
-                                    else:
-                                        # 用户不在线或找不到IP
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 找不到用户 {target_nickname} 或其IP地址")
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 命令格式错误: ban <用户名>")
-                            elif command.startswith('unban '):
-                                # 处理unban命令
-                                parts = command.split(' ', 1)
-                                if len(parts) == 2:
-                                    target = parts[1].strip()
-                                    target_ip = None
-                                    target_user = target  # 保存原始目标名称
-                                    
-                                    # 检查目标是否是IP地址格式
-                                    import re
-                                    ip_pattern = r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$'
-                                    if re.match(ip_pattern, target):
-                                        # 直接使用IP地址
-                                        target_ip = target
-                                    else:
-                                        # 尝试通过用户名查找IP地址
-                                        with self.lock:
-                                            for sock, n in self.client_nicknames.items():
-                                                if n == target:
-                                                    # 找到目标用户，获取其IP地址
-                                                    if sock in self.client_profiles:
-                                                        target_ip = self.client_profiles[sock]['ip_address']
-                                                    break
-                                    
-                                    if target_ip:
-                                        with self.lock:
-                                            if target_ip in self.banned_ips:
-                                                self.banned_ips.remove(target_ip)
-                                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 已解除IP {target_ip} 的封禁")
-                                                # 通知所有用户
-                                                if target_user != target_ip:
-                                                    self.broadcast_message(f"系统: 用户 {target_user} 的IP {target_ip} 已被管理员解除封禁")
-                                                else:
-                                                    self.broadcast_message(f"系统: IP {target_ip} 已被管理员解除封禁")
-                                            else:
-                                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] IP {target_ip} 未被封禁")
-                                    else:
-                                        # 无法找到目标IP
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 找不到目标 {target} 或其IP地址")
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 命令格式错误: unban <用户名或IP>")
-                            elif command.startswith('shutup '):
-                                # 处理shutup命令
-                                parts = command.split(' ', 2)
-                                if len(parts) == 3:
-                                    target_nickname = parts[1].strip()
-                                    try:
-                                        duration = int(parts[2].strip())
-                                        if duration > 0:
-                                            # 查找目标用户的socket
-                                            target_socket = None
-                                            with self.lock:
-                                                for sock, n in self.client_nicknames.items():
-                                                    if n == target_nickname:
-                                                        target_socket = sock
-                                                        break
-                                                self.muted_users[target_nickname] = (time.time(), duration)
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 已禁言 {target_nickname} {duration} 分钟")
-                                            # 通知所有用户
-                                            broadcast_msg = f"系统: {target_nickname} 已被禁言 {duration} 分钟"
-                                            self.broadcast_message(broadcast_msg)
-                                            # 向被禁言的用户发送特定消息，触发客户端弹窗
-                                            if target_socket:
-                                                try:
-                                                    target_socket.send(f"MUTED:{broadcast_msg}".encode('utf-8'))
-                                                except:
-                                                    pass
-                                        else:
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 禁言时长必须大于0")
-                                    except ValueError:
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 命令格式错误: shutup <用户名> <时间（分钟）>")
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 命令格式错误: shutup <用户名> <时间（分钟）>")
-                            elif command.startswith('unshutup '):
-                                # 处理unshutup命令
-                                parts = command.split(' ', 1)
-                                if len(parts) == 2:
-                                    target_nickname = parts[1].strip()
-                                    target_socket = None
-                                    with self.lock:
-                                        # 查找目标用户的socket
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                target_socket = sock
-                                                break
-                                        if target_nickname in self.muted_users:
-                                            del self.muted_users[target_nickname]
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [成功] 已解除 {target_nickname} 的禁言")
-                                            # 通知所有用户
-                                            broadcast_msg = f"系统: {target_nickname} 已被管理员解除禁言"
-                                            self.broadcast_message(broadcast_msg)
-                                            # 向被解禁的用户发送特定消息，触发客户端弹窗
-                                            if target_socket:
-                                                try:
-                                                    target_socket.send(f"UNMUTED:{broadcast_msg}".encode('utf-8'))
-                                                except:
-                                                    pass
-                                        else:
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] {target_nickname} 未被禁言")
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 命令格式错误: unshutup <用户名>")
-                            elif command.startswith('kick '):
-                                # 处理kick命令
-                                parts = command.split(' ', 1)
-                                if len(parts) == 2:
-                                    target_nickname = parts[1].strip()
-                                    self.kick_user(target_nickname)
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 命令格式错误: kick <用户名>")
+                            elif command.partition(' ')[0] in self.admin_commands:
+                                # op/unop/kick/ban/unban/shutup/unshutup由命令表统一执行
+                                admin_command, _, argument = command.partition(' ')
+                                success, result = self.execute_admin_command(admin_command, argument)
+                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {'[成功]' if success else '[错误]'} {result}")
+                            elif command == 'banlist':
+                                with self.lock:
+                                    rules = sorted(self.banned_ips)
+                                print("-" * 60)
+                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 共 {len(rules)} 条IP封禁规则")
+                                for rule in rules:
+                                    print(f"  {rule}")
+                                print("-" * 60)
                             elif command:
                                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [错误] 未知命令: {command}")
                                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [提示] 输入 'help' 查看可用命令")
@@ -2509,6 +3959,27 @@ class ChatServer:
                 command_thread.daemon = True  # 设置为守护线程
                 command_thread.start()
                 
+                # 启动心跳线程
+                if self.heartbeat_interval > 0:
+                    heartbeat_thread = threading.Thread(target=self.heartbeat_loop)
+                    heartbeat_thread.daemon = True
+                    heartbeat_thread.start()
+                
+                # 响应局域网发现请求
+                if self.discovery:
+                    self.open_discovery_socket()
+                
+                # 监视配置文件，修改后自动重新加载
+                config_thread = threading.Thread(target=self.config_watch_loop)
+                config_thread.daemon = True
+                config_thread.start()
+                
+                # 在后台检查更新，不阻塞端口监听
+                if self.update_check:
+                    update_thread = threading.Thread(target=check_for_updates, kwargs={"cache_ttl": self.update_check_ttl, "interactive": False})
+                    update_thread.daemon = True
+                    update_thread.start()
+                
                 while self.running:
                     try:
                         # 设置超时，定期检查running状态
@@ -2540,37 +4011,50 @@ class ChatServer:
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [提示] 建议: 检查端口是否被占用或权限是否足够")
             self.running = False
         finally:
+            self.close_discovery_socket()
+            if self.moderation_store is not None:
+                self.moderation_store.close()
             self.stop()
     
     def stop(self):
-        """停止服务器"""
-        if not self.running:
+        """停止服务器：先停止接受新连接，通知客户端并等它们收完剩余消息，最后关闭仍未断开的连接"""
+        if self.stopped:
             return
+        self.stopped = True
         
         print("-" * 60)
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [信息] 正在关闭服务器...")
         self.running = False
         
-        # 关闭所有客户端连接
+        # 关闭服务器套接字
+        if self.server_socket:
+            try:
+                self.server_socket.close()
+            except:
+                pass
+        
+        with self.lock:
+            transfer_ids = list(self.file_transfers)
+        for transfer_id in transfer_ids:
+            self.finish_file_transfer(transfer_id, "服务器正在关闭")
+        
         with self.lock:
             client_count = len(self.client_sockets)
             clients_copy = self.client_sockets.copy()
+        self.drain_clients(clients_copy)
+        
+        # 关闭超时仍未断开的连接
+        with self.lock:
+            remaining = self.client_sockets.copy()
             self.client_sockets.clear()
             self.client_nicknames.clear()
         
-        for client in clients_copy:
+        for client in remaining:
             try:
                 client.close()
             except:
                 pass
         
-        # 关闭服务器套接字
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except:
-                pass
-        
         print("=" * 60)
         print("" * 20 + "[成功] 服务器已关闭")
         print("=" * 60)
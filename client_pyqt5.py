@@ -1,16 +1,31 @@
 import sys
+import os
+import json
+import hashlib
+import functools
+import math
+import csv
+import base64
+import binascii
+import queue
+import random
+import re
 import socket
+import sqlite3
+import struct
 import threading
 import time
-import requests
+import zlib
+from collections import deque
+from decimal import Decimal, DecimalException, InvalidOperation, getcontext, localcontext, MAX_EMAX, MIN_EMIN
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QGridLayout,
     QLabel, QLineEdit, QPushButton, QTextEdit, QFrame, QListWidget,
     QListWidgetItem, QMenu, QAction, QMessageBox, QProgressDialog,
-    QTabWidget, QGroupBox, QComboBox, QDialog
+    QTabWidget, QGroupBox, QComboBox, QDialog, QCheckBox, QSpinBox, QInputDialog
 )
 from PyQt5.QtCore import Qt, pyqtSignal, QObject, QThread, pyqtSlot, QTimer
-from PyQt5.QtGui import QFont, QColor, QTextCharFormat, QTextCursor, QPixmap, QBrush
+from PyQt5.QtGui import QFont, QTextCursor, QPixmap, QBrush, QImage, QPainter
 from PyQt5.QtWidgets import QGraphicsBlurEffect
 
 # 应用版本信息
@@ -18,6 +33,114 @@ CURRENT_VERSION = "3.2.0"
 # Gitee仓库信息
 GITEE_OWNER = "MVPS680"
 GITEE_REPO = "MVPLittlechat"
+# 客户端支持的协议扩展，仅在服务端声明支持时启用
+CLIENT_CAPS = ("frame", "ping", "file", "deflate", "shutdown")
+# 帧格式：4字节负载长度 + 1字节标志位 + 负载
+FRAME_HEADER = struct.Struct("!IB")
+MAX_FRAME_SIZE = 1024 * 1024
+FRAMED_RECV_SIZE = 65536
+FRAME_FLAG_BINARY = 0x01  # 负载为二进制数据（文件分块）而不是UTF-8文本
+# 文件分块头：传输ID + 分块在文件中的偏移 + 分块CRC32，其后为分块数据
+FILE_CHUNK_HEADER = struct.Struct("!QQI")
+# 压缩扩展：达到阈值的文本帧使用带预置字典的raw deflate压缩，并设置该标志
+FRAME_FLAG_COMPRESSED = 0x02
+COMPRESSION_LEVEL = 6
+# 预置字典收录协议中反复出现的片段，服务端和客户端必须完全一致，越常用的片段放得越靠后
+COMPRESSION_DICTIONARY = "".join((
+    "FILE_OFFER:FILE_ACCEPT:FILE_CANCEL:PROFILE:MUTED:ERROR:",
+    "{\"id\": \"size\": \"name\": \"to\": ",
+    "系统: 用户 的IP 已被管理员封禁 已被管理员解除禁言",
+    "KICKED:你已被管理员踢出聊天室",
+    "ERROR:您已被禁言 分钟，无法发送消息",
+    "系统: 已被管理员禁言 分钟",
+    "系统: 已被管理员踢出聊天室",
+    "系统: 离开了聊天室",
+    "系统: 加入了聊天室",
+    "USERS_LIST:ADMIN：",
+)).encode('utf-8')
+COMPRESS_THRESHOLD = 256  # 达到该长度（字节）的消息压缩后发送
+FILE_CHUNK_SIZE = 32 * 1024
+FILE_WINDOW_SIZE = 8 * FILE_CHUNK_SIZE  # 发送方最多保持的未确认字节数
+FILE_RECEIVE_DIR = "LittleChat_files"  # 接收文件的保存目录
+# 加密连接：服务器使用自签名证书，首次连接时记录证书指纹，之后校验指纹是否变化
+KNOWN_HOSTS_FILE = "LittleChat.knownhosts"
+TLS_HANDSHAKE_TIMEOUT = 10
+# 本地消息记录：按服务器保存聊天区域显示过的消息，连接后立即显示，也可离线搜索
+HISTORY_DB_FILE = "LittleChat.history"
+HISTORY_BATCH_SIZE = 500  # 后台线程每个事务最多写入的消息数
+HISTORY_RESTORE_LIMIT = 50  # 进入聊天室时恢复显示的最近消息数
+HISTORY_SEARCH_LIMIT = 200  # 搜索结果最多显示的条数
+# 提醒：消息中的@昵称和自定义关键字高亮显示，并在聊天区域上方的通知栏中合并提示
+MENTION_KEYWORDS_FILE = "LittleChat.keywords"  # 每行一个关键字
+MENTION_HIGHLIGHT_COLOR = "#FFF59D"
+NOTIFY_COALESCE_INTERVAL = 300  # 收到通知后等待同类通知一起显示的时间（毫秒）
+NOTIFY_DISPLAY_TIME = 10  # 通知在通知栏中保留的时间（秒），期间的同类通知合并到同一条
+NOTIFY_MAX_ENTRIES = 3
+
+# 更新下载配置
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_PARALLEL = 4  # 服务器支持Range时的最大并行分段数
+DOWNLOAD_MIN_SEGMENT_SIZE = 2 * 1024 * 1024  # 每个分段的最小大小，小文件不拆分
+DOWNLOAD_PROGRESS_INTERVAL = 0.25  # 进度回调的最小间隔（秒）
+DOWNLOAD_RETRIES = 3  # 单个分段网络错误的重试次数
+HTTP_POOL_SIZE = 4  # 共享HTTP客户端对每个主机保持的keep-alive连接数
+
+# 工具箱文件校验配置
+HASH_ALGORITHMS = (("md5", "MD5"), ("sha1", "SHA-1"), ("sha256", "SHA-256"), ("blake2b", "BLAKE2b"))
+HASH_READ_SIZE = 4 * 1024 * 1024  # 每次读取的字节数，大块读取减少系统调用，hashlib处理时释放GIL
+HASH_PARALLEL_FILES = max(1, min(4, os.cpu_count() or 1))  # 同时计算的文件数
+HASH_PROGRESS_INTERVAL = 0.25  # 进度回调的最小间隔（秒）
+# 工具箱文件加解密配置
+AES_FILE_MAGIC = b"LCAESGCM1"
+AES_FILE_NONCE_SIZE = 12
+AES_FILE_TAG_SIZE = 16
+AES_FILE_CHUNK_SIZE = 1024 * 1024  # 每次处理的字节数，内存占用约为两倍
+AES_FILE_SUFFIX = ".lcaes"
+# 工具箱文件编解码配置
+CODEC_FORMATS = (("base64", "Base64"), ("base32", "Base32"), ("hex", "十六进制"))
+CODEC_SUFFIXES = {"base64": ".b64", "base32": ".b32", "hex": ".hex"}
+CODEC_CHUNK_SIZE = 15 * 64 * 1024  # 3和5的公倍数，Base64/Base32编码时每块都没有跨块余数
+CODEC_PREVIEW_SIZE = 4096  # 结果区只显示输出的开头，避免QTextEdit渲染数MB文本
+# 工具箱幂/求根计算配置
+CALC_DEFAULT_PRECISION = 50  # 非整数结果默认的有效数字位数
+CALC_MAX_PRECISION = 1000
+CALC_MAX_EXACT_DIGITS = 30000  # 精确整数结果的最大位数（QLineEdit默认最多显示32767个字符），更大时用科学计数法
+# 二维码配置
+QRCODE_EC_LEVEL = "M"  # 纠错等级，约15%的码字损坏时仍可识别
+QRCODE_MODULE_SIZE = 10  # 每个模块渲染的像素数
+QRCODE_QUIET_ZONE = 4  # 四周空白的模块数，规范要求至少4个
+# 各纠错等级在版本1~40下每块的纠错码字数和块数（ISO/IEC 18004）
+QR_ECC_CODEWORDS_PER_BLOCK = {
+    "L": (7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28,
+          28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    "M": (10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26,
+          26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    "Q": (13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30,
+          28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    "H": (17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28,
+          30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+}
+QR_ERROR_CORRECTION_BLOCKS = {
+    "L": (1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8,
+          8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),
+    "M": (1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16,
+          17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    "Q": (1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20,
+          23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    "H": (1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25,
+          25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+}
+QR_EC_FORMAT_BITS = {"L": 1, "M": 0, "Q": 3, "H": 2}
+QR_LONG_RUN = re.compile(r"0{5,}|1{5,}")
+QR_RUN = re.compile(r"0+|1+")
+# 局域网发现配置，需与服务器一致
+DISCOVERY_PORT = 7893
+DISCOVERY_GROUP = "239.255.78.93"
+DISCOVERY_MAGIC = "LCDISCOVER1"
+DISCOVERY_REPLY = "LCSERVER1"
+DISCOVERY_PROBES = 3  # 每次搜索发送的请求轮数，丢包时仍能收到应答，延迟取各轮最小值
+DISCOVERY_PROBE_INTERVAL = 0.2  # 两轮请求的间隔（秒）
+DISCOVERY_TIMEOUT = 1.0  # 最后一轮请求后继续等待应答的时间（秒）
 
 # MIT许可证内容
 MIT_LICENSE = """MIT License 
@@ -43,6 +166,1324 @@ MIT_LICENSE = """MIT License
  SOFTWARE. 
  """
 
+def certificate_fingerprint(der_bytes):
+    """证书的SHA256指纹，格式与服务端控制台显示的一致"""
+    digest = hashlib.sha256(der_bytes).hexdigest().upper()
+    return ":".join(digest[i:i + 2] for i in range(0, len(digest), 2))
+
+def encode_frame(payload, flags=0):
+    """将字节负载编码为长度前缀帧"""
+    return FRAME_HEADER.pack(len(payload), flags) + payload
+
+def compress_payload(data):
+    """使用预置字典压缩帧负载"""
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, zdict=COMPRESSION_DICTIONARY)
+    return compressor.compress(data) + compressor.flush()
+
+def decompress_payload(data):
+    """解压帧负载，解压后超过单帧上限视为协议错误，防止压缩炸弹"""
+    decompressor = zlib.decompressobj(-15, zdict=COMPRESSION_DICTIONARY)
+    result = decompressor.decompress(data, MAX_FRAME_SIZE)
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError("压缩帧数据不完整或解压后超过上限")
+    return result
+
+class FrameReader:
+    """从TCP字节流中切分出完整的长度前缀帧"""
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+    
+    def feed(self, data):
+        """追加收到的数据，返回已完整的帧列表 [(flags, payload), ...]"""
+        self.buffer.extend(data)
+        frames = []
+        while len(self.buffer) >= FRAME_HEADER.size:
+            length, flags = FRAME_HEADER.unpack_from(self.buffer)
+            if length > self.max_frame_size:
+                raise ValueError(f"帧长度 {length} 超过上限 {self.max_frame_size}")
+            frame_end = FRAME_HEADER.size + length
+            if len(self.buffer) < frame_end:
+                break
+            frames.append((flags, bytes(self.buffer[FRAME_HEADER.size:frame_end])))
+            del self.buffer[:frame_end]
+        return frames
+
+class ServerMessage:
+    """服务器发来的一条文本消息。接收线程按前缀查SERVER_MESSAGE_TYPES解析一次，
+    各类型只用__slots__保存解析后的字段，再按类型分派给ChatClient的处理函数
+    """
+    __slots__ = ()
+    prefix = None
+    
+    @classmethod
+    def parse(cls, prefix, body):
+        """解析前缀之后的内容，格式错误时返回None（忽略该消息）"""
+        return cls(body)
+
+class ChatMessage(ServerMessage):
+    """聊天消息或系统消息，原样显示在聊天区域"""
+    __slots__ = ("text",)
+    
+    def __init__(self, text):
+        self.text = text
+
+class ProfileErrorMessage(ChatMessage):
+    __slots__ = ()
+    prefix = "PROFILE_ERROR"
+
+class KickedMessage(ChatMessage):
+    __slots__ = ()
+    prefix = "KICKED"
+
+class MutedMessage(ChatMessage):
+    __slots__ = ()
+    prefix = "MUTED"
+
+class UnmutedMessage(ChatMessage):
+    __slots__ = ()
+    prefix = "UNMUTED"
+
+class OpMessage(ChatMessage):
+    __slots__ = ()
+    prefix = "OP"
+
+class UnopMessage(ChatMessage):
+    __slots__ = ()
+    prefix = "UNOP"
+
+class UsersListMessage(ServerMessage):
+    """USERS_LIST:昵称1,昵称2,..."""
+    __slots__ = ("users",)
+    prefix = "USERS_LIST"
+    
+    def __init__(self, body):
+        self.users = body.split(",") if body else []
+
+class ProfileMessage(ServerMessage):
+    """PROFILE:昵称|IP|加入时间|系统版本"""
+    __slots__ = ("nickname", "ip_address", "join_time", "os_version")
+    prefix = "PROFILE"
+    
+    def __init__(self, nickname, ip_address, join_time, os_version):
+        self.nickname = nickname
+        self.ip_address = ip_address
+        self.join_time = join_time
+        self.os_version = os_version
+    
+    @classmethod
+    def parse(cls, prefix, body):
+        fields = body.split("|")
+        return cls(*fields) if len(fields) == 4 else None
+
+class ShutdownMessage(ServerMessage):
+    """SHUTDOWN:原因[|RECONNECT:秒数]，reconnect_after为-1表示不建议重连"""
+    __slots__ = ("reason", "reconnect_after")
+    prefix = "SHUTDOWN"
+    
+    def __init__(self, reason, reconnect_after=-1):
+        self.reason = reason
+        self.reconnect_after = reconnect_after
+    
+    @classmethod
+    def parse(cls, prefix, body):
+        parts = body.split("|")
+        reconnect_after = -1
+        for part in parts[1:]:
+            if part.startswith("RECONNECT:"):
+                try:
+                    reconnect_after = int(part[len("RECONNECT:"):])
+                except ValueError:
+                    pass
+        return cls(parts[0], reconnect_after)
+
+class FileControlMessage(ServerMessage):
+    """FILE_*:<json>，交给FileTransferManager处理"""
+    __slots__ = ("command", "body")
+    
+    def __init__(self, command, body):
+        self.command = command
+        self.body = body
+    
+    @classmethod
+    def parse(cls, prefix, body):
+        return cls(prefix, body)
+
+SERVER_MESSAGE_TYPES = {message_type.prefix: message_type for message_type in (
+    UsersListMessage, ProfileMessage, ProfileErrorMessage, KickedMessage, ShutdownMessage,
+    MutedMessage, UnmutedMessage, OpMessage, UnopMessage,
+)}
+
+def parse_server_message(frame):
+    """把一条服务器文本消息解析为消息对象：取第一个冒号之前的部分查表，不是协议前缀的作为聊天消息
+    已知类型但格式错误时返回None
+    """
+    prefix, separator, body = frame.partition(":")
+    if separator:
+        message_type = SERVER_MESSAGE_TYPES.get(prefix)
+        if message_type is None and prefix.startswith("FILE_"):
+            message_type = FileControlMessage
+        if message_type is not None:
+            return message_type.parse(prefix, body)
+    return ChatMessage(frame)
+
+class DownloadCancelled(Exception):
+    """下载被取消，已下载的部分会保留以便下次续传"""
+
+class ChecksumMismatch(Exception):
+    """下载文件的SHA256与发布的校验和不一致"""
+
+def _parse_content_range_total(content_range):
+    """从Content-Range响应头（bytes 0-0/12345）中解析文件总大小，未知时返回None"""
+    try:
+        total = content_range.rsplit("/", 1)[1].strip()
+        return int(total) if total != "*" else None
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def _save_download_meta(meta_file, meta):
+    """原子写入续传进度记录，替换前先落盘，断电后不会留下内容为空的记录"""
+    temp_file = meta_file + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, meta_file)
+
+def _load_download_meta(meta_file, part_file, url, total_size, validator):
+    """读取续传进度记录，与当前文件不匹配时返回None"""
+    try:
+        with open(meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("url") != url or meta.get("size") != total_size or meta.get("validator") != validator:
+        return None
+    if not validator:
+        # 没有ETag/Last-Modified时无法确认服务器上的文件未变化，不续传
+        return None
+    if not os.path.exists(part_file) or os.path.getsize(part_file) != total_size:
+        return None
+    return meta
+
+class HttpClient:
+    """共享的HTTP客户端：同一主机的请求复用keep-alive连接，并按URL和参数在内存中缓存响应
+    ttl为None时不缓存；否则ttl秒内直接返回缓存的响应，过期后带If-None-Match/If-Modified-Since
+    重新验证，服务器返回304时继续使用缓存（ttl为0表示每次都重新验证）
+    """
+    def __init__(self, pool_size=HTTP_POOL_SIZE):
+        self.pool_size = pool_size
+        self.session = None  # 第一次请求时创建，没有安装requests时不影响其他功能
+        self.cache = {}  # {(url, 参数): [过期时间, 响应]}
+        self.lock = threading.Lock()
+    
+    def get_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        with self.lock:
+            if self.session is None:
+                self.session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                self.session.mount("http://", adapter)
+                self.session.mount("https://", adapter)
+            return self.session
+    
+    def get(self, url, params=None, headers=None, timeout=10, ttl=None):
+        """发送GET请求，返回requests的Response；4xx/5xx响应抛出HTTPError"""
+        key = (url, tuple(sorted((params or {}).items())))
+        request_headers = dict(headers or {})
+        entry = None
+        if ttl is not None:
+            with self.lock:
+                entry = self.cache.get(key)
+        if entry is not None:
+            expires_at, cached = entry
+            if time.monotonic() < expires_at:
+                return cached
+            if cached.headers.get("ETag"):
+                request_headers["If-None-Match"] = cached.headers["ETag"]
+            if cached.headers.get("Last-Modified"):
+                request_headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+        
+        response = self.get_session().get(url, params=params, headers=request_headers, timeout=timeout)
+        if entry is not None and response.status_code == 304:
+            response = entry[1]
+        else:
+            response.raise_for_status()
+        if ttl is not None:
+            with self.lock:
+                self.cache[key] = [time.monotonic() + ttl, response]
+        return response
+
+http_client = HttpClient()
+
+def file_sha256(file_name):
+    """计算文件的SHA256"""
+    sha256 = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def find_release_checksum(assets, file_name):
+    """在发行版附件中查找file_name的SHA256（<文件名>.sha256 或 SHA256SUMS），找不到返回None"""
+    import requests
+    candidates = (file_name.lower() + ".sha256", "sha256sums", "sha256sums.txt")
+    for asset in assets:
+        if asset.get("name", "").lower() not in candidates:
+            continue
+        url = asset.get("browser_download_url", "")
+        if url and not (url.startswith("http://") or url.startswith("https://")):
+            url = f"https://gitee.com{url}"
+        try:
+            response = http_client.get(url, timeout=10)
+        except requests.exceptions.RequestException:
+            continue
+        for line in response.text.splitlines():
+            parts = line.split()
+            # 单独的.sha256文件可以只有校验和，SHA256SUMS中需要文件名匹配
+            if parts and (len(parts) == 1 or parts[-1].lstrip("*") == file_name):
+                return parts[0].lower()
+    return None
+
+def download_file(url, file_name, expected_sha256=None, parallel=DOWNLOAD_PARALLEL,
+                  progress_callback=None, cancel_event=None, headers=None, timeout=10):
+    """支持断点续传和分段并行的文件下载
+    数据先写入 <file_name>.part，各分段进度记录在 <file_name>.part.json，
+    中断或取消后再次调用会从断点继续；服务器不支持Range时退化为单连接完整下载。
+    progress_callback(已下载字节, 总字节) 的调用间隔不小于DOWNLOAD_PROGRESS_INTERVAL，总大小未知时为0。
+    下载完成并通过校验后重命名为file_name并返回。
+    """
+    import requests
+    part_file = file_name + ".part"
+    meta_file = part_file + ".json"
+    base_headers = dict(headers or {})
+    cancel_event = cancel_event or threading.Event()
+    
+    with requests.Session() as session:
+        # 只请求第一个字节，同时探测文件大小和服务器是否支持Range
+        probe_headers = dict(base_headers, Range="bytes=0-0")
+        probe = session.get(url, headers=probe_headers, stream=True, timeout=timeout, allow_redirects=True)
+        probe.raise_for_status()
+        total_size = _parse_content_range_total(probe.headers.get("Content-Range")) if probe.status_code == 206 else None
+        # If-Range不接受弱ETag，此时改用Last-Modified
+        etag = probe.headers.get("ETag", "")
+        validator = etag if etag and not etag.startswith("W/") else probe.headers.get("Last-Modified", "")
+        url = probe.url  # 后续请求直接使用重定向后的地址
+        
+        if total_size is None:
+            # 不支持Range：沿用探测请求的响应（或重新请求）完整下载
+            if probe.status_code == 206:
+                probe.close()
+                probe = session.get(url, headers=base_headers, stream=True, timeout=timeout)
+                probe.raise_for_status()
+            _download_whole(probe, part_file, progress_callback, cancel_event)
+            if os.path.exists(meta_file):
+                os.remove(meta_file)
+        else:
+            probe.close()
+            meta = _load_download_meta(meta_file, part_file, url, total_size, validator)
+            if meta is None:
+                meta = {"url": url, "size": total_size, "validator": validator,
+                        "segments": _split_segments(total_size, parallel)}
+                with open(part_file, "wb") as f:
+                    f.truncate(total_size)
+                _save_download_meta(meta_file, meta)
+            _download_segments(session, url, base_headers, validator, timeout, part_file, meta_file, meta,
+                               progress_callback, cancel_event)
+    
+    if expected_sha256 and file_sha256(part_file) != expected_sha256.lower():
+        # 校验失败的数据不能用于续传
+        os.remove(part_file)
+        if os.path.exists(meta_file):
+            os.remove(meta_file)
+        raise ChecksumMismatch(f"{file_name} 的SHA256校验失败")
+    
+    os.replace(part_file, file_name)
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+    return file_name
+
+def _split_segments(total_size, parallel):
+    """将文件按字节范围拆分为分段，格式: [[起始, 结束, 下一个待下载字节], ...]"""
+    count = max(1, min(parallel, total_size // DOWNLOAD_MIN_SEGMENT_SIZE))
+    segment_size = -(-total_size // count) if total_size else 0
+    segments = []
+    for start in range(0, total_size, segment_size or 1):
+        end = min(start + segment_size, total_size) - 1
+        segments.append([start, end, start])
+    return segments
+
+def _download_whole(response, part_file, progress_callback, cancel_event):
+    """不支持Range时的单连接下载，取消后不保留部分文件"""
+    total_size = int(response.headers.get("content-length", 0))
+    downloaded_size = 0
+    last_report = 0.0
+    try:
+        with open(part_file, "wb") as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if cancel_event.is_set():
+                    raise DownloadCancelled()
+                if chunk:
+                    f.write(chunk)
+                    downloaded_size += len(chunk)
+                    now = time.monotonic()
+                    if progress_callback and now - last_report >= DOWNLOAD_PROGRESS_INTERVAL:
+                        last_report = now
+                        progress_callback(downloaded_size, total_size)
+    except BaseException:
+        response.close()
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        raise
+    if total_size and not response.headers.get("content-encoding") and downloaded_size != total_size:
+        os.remove(part_file)
+        raise IOError(f"下载不完整: {downloaded_size}/{total_size} 字节")
+    if progress_callback:
+        progress_callback(downloaded_size, total_size)
+
+def _download_segments(session, url, base_headers, validator, timeout, part_file, meta_file, meta,
+                       progress_callback, cancel_event):
+    """并行下载尚未完成的分段，写入预先分配好的.part文件"""
+    import requests
+    segments = meta["segments"]
+    total_size = meta["size"]
+    lock = threading.Lock()
+    stop_event = threading.Event()  # 任一分段失败时通知其它分段停止
+    errors = []
+    state = {"last_report": 0.0, "stale": False}
+    
+    def downloaded():
+        return sum(segment[2] - segment[0] for segment in segments)
+    
+    def report(data_file, force=False):
+        # 调用方需持有lock；各分段只把已flush的数据计入进度，对同一文件fsync即可让所有已计入的数据落盘
+        now = time.monotonic()
+        if force or now - state["last_report"] >= DOWNLOAD_PROGRESS_INTERVAL:
+            state["last_report"] = now
+            # 先落盘数据再保存进度，断电后续传不会跳过没有写入磁盘的区间
+            os.fsync(data_file.fileno())
+            _save_download_meta(meta_file, meta)
+            if progress_callback:
+                progress_callback(downloaded(), total_size)
+    
+    def worker(segment):
+        retries = 0
+        with open(part_file, "r+b") as f:
+            while segment[2] <= segment[1]:
+                if cancel_event.is_set() or stop_event.is_set():
+                    return
+                range_headers = dict(base_headers, Range=f"bytes={segment[2]}-{segment[1]}")
+                if validator:
+                    # 文件在服务器上已变化时会返回200而不是206
+                    range_headers["If-Range"] = validator
+                attempt_start = segment[2]
+                try:
+                    with session.get(url, headers=range_headers, stream=True, timeout=timeout) as response:
+                        response.raise_for_status()
+                        if response.status_code != 206:
+                            state["stale"] = True
+                            raise IOError("服务器上的文件已变化，请重新下载")
+                        f.seek(segment[2])
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            if cancel_event.is_set() or stop_event.is_set():
+                                return
+                            chunk = chunk[:segment[1] + 1 - segment[2]]
+                            f.write(chunk)
+                            f.flush()
+                            with lock:
+                                segment[2] += len(chunk)
+                                report(f)
+                            if segment[2] > segment[1]:
+                                break
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError):
+                    # 网络抖动时从当前位置重试，有进展的连接不计入重试次数
+                    retries = 0 if segment[2] > attempt_start else retries + 1
+                    if retries > DOWNLOAD_RETRIES:
+                        raise
+                    time.sleep(min(retries, 5))
+    
+    def run(segment):
+        try:
+            worker(segment)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+            stop_event.set()
+    
+    pending = [segment for segment in segments if segment[2] <= segment[1]]
+    threads = [threading.Thread(target=run, args=(segment,), daemon=True) for segment in pending[1:]]
+    for thread in threads:
+        thread.start()
+    if pending:
+        run(pending[0])
+    for thread in threads:
+        thread.join()
+    
+    with lock, open(part_file, "r+b") as f:
+        report(f, force=True)
+    if errors:
+        if state["stale"]:
+            # 旧的部分文件已无效，下次重新下载
+            os.remove(meta_file)
+        raise errors[0]
+    if cancel_event.is_set():
+        raise DownloadCancelled()
+
+class UpdateDownloadThread(QThread):
+    """在后台线程中下载更新，进度通过信号通知界面"""
+    progress_changed = pyqtSignal(int, int)  # 已下载字节, 总字节（未知时为0）
+    download_finished = pyqtSignal(str, bool)  # 文件名, 是否经过SHA256校验
+    download_failed = pyqtSignal(str)
+    download_cancelled = pyqtSignal()
+    
+    def __init__(self, download_url, file_name, assets=None, parent=None):
+        super().__init__(parent)
+        self.download_url = download_url
+        self.file_name = file_name
+        self.assets = assets or []
+        self.cancel_event = threading.Event()
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def run(self):
+        import requests
+        try:
+            # 校验和文件也在后台获取，避免阻塞界面
+            expected_sha256 = find_release_checksum(self.assets, os.path.basename(self.file_name))
+            download_file(self.download_url, self.file_name, expected_sha256=expected_sha256,
+                          headers={"Accept": "*/*"}, progress_callback=self.progress_changed.emit,
+                          cancel_event=self.cancel_event)
+            self.download_finished.emit(self.file_name, bool(expected_sha256))
+        except DownloadCancelled:
+            self.download_cancelled.emit()
+        except ChecksumMismatch as e:
+            self.download_failed.emit(f"{str(e)}，已删除损坏的文件，请重新下载")
+        except requests.exceptions.RequestException as e:
+            self.download_failed.emit(f"网络请求错误：{str(e)}\n再次下载将从断点继续")
+        except Exception as e:
+            self.download_failed.emit(f"下载错误：{str(e)}")
+
+class HashCancelled(Exception):
+    """文件校验被取消"""
+
+def hash_file(file_path, algorithms=HASH_ALGORITHMS, progress_callback=None, cancel_event=None, executor=None):
+    """读取一遍文件同时计算多种哈希，返回{算法名: 十六进制摘要}
+    数据按HASH_READ_SIZE读入复用的缓冲区；executor不为None时每块数据的各个算法在线程池中并行计算，
+    hashlib处理大块数据时释放GIL，单个大文件也能用上多个核心。
+    progress_callback(本次处理的字节数) 每读完一块调用一次。
+    """
+    hashers = [hashlib.new(name) for name, _ in algorithms]
+    buffer = bytearray(HASH_READ_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, "rb") as f:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise HashCancelled()
+            size = f.readinto(buffer)
+            if not size:
+                break
+            chunk = view[:size]
+            if executor is None or len(hashers) == 1:
+                for hasher in hashers:
+                    hasher.update(chunk)
+            else:
+                futures = [executor.submit(hasher.update, chunk) for hasher in hashers[1:]]
+                hashers[0].update(chunk)
+                for future in futures:
+                    future.result()
+            if progress_callback:
+                progress_callback(size)
+    return {name: hasher.hexdigest() for (name, _), hasher in zip(algorithms, hashers)}
+
+class FileHashThread(QThread):
+    """在后台线程中计算多个文件的哈希，最多同时计算HASH_PARALLEL_FILES个文件"""
+    progress_changed = pyqtSignal(object, object, float)  # 已处理字节, 总字节, 吞吐量（字节/秒）
+    file_finished = pyqtSignal(str, object)  # 文件路径, {算法名: 摘要}
+    file_failed = pyqtSignal(str, str)  # 文件路径, 错误信息
+    hash_finished = pyqtSignal(float)  # 总耗时（秒）
+    hash_cancelled = pyqtSignal()
+    
+    def __init__(self, file_paths, algorithms=HASH_ALGORITHMS, parent=None):
+        super().__init__(parent)
+        self.file_paths = list(file_paths)
+        self.algorithms = algorithms
+        self.cancel_event = threading.Event()
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def run(self):
+        from concurrent.futures import ThreadPoolExecutor
+        total_size = 0
+        for file_path in self.file_paths:
+            try:
+                total_size += os.path.getsize(file_path)
+            except OSError:
+                pass
+        lock = threading.Lock()
+        state = {"done": 0, "last_report": 0.0}
+        start = time.monotonic()
+        
+        def on_progress(size):
+            with lock:
+                state["done"] += size
+                now = time.monotonic()
+                if now - state["last_report"] < HASH_PROGRESS_INTERVAL:
+                    return
+                state["last_report"] = now
+                done = state["done"]
+            self.progress_changed.emit(done, total_size, done / max(now - start, 1e-6))
+        
+        # 文件和算法使用不同的线程池，文件任务等待算法任务时不会占满同一个池而死锁
+        with ThreadPoolExecutor(HASH_PARALLEL_FILES) as file_pool, \
+                ThreadPoolExecutor(max(1, (os.cpu_count() or 1) - 1)) as hash_pool:
+            futures = [(file_path, file_pool.submit(hash_file, file_path, self.algorithms, on_progress,
+                                                    self.cancel_event, hash_pool))
+                       for file_path in self.file_paths]
+            for file_path, future in futures:
+                try:
+                    self.file_finished.emit(file_path, future.result())
+                except HashCancelled:
+                    pass
+                except Exception as e:
+                    self.file_failed.emit(file_path, str(e))
+        
+        if self.cancel_event.is_set():
+            self.hash_cancelled.emit()
+        else:
+            self.progress_changed.emit(state["done"], total_size, state["done"] / max(time.monotonic() - start, 1e-6))
+            self.hash_finished.emit(time.monotonic() - start)
+
+class CryptCancelled(Exception):
+    """文件加解密被取消"""
+
+def _crypt_stream(cipher, decrypt, source, target, length, progress_callback, cancel_event):
+    """分块处理length字节，输入输出各复用一个缓冲区，内存占用与文件大小无关"""
+    buffer = bytearray(AES_FILE_CHUNK_SIZE)
+    output = bytearray(AES_FILE_CHUNK_SIZE)
+    view = memoryview(buffer)
+    output_view = memoryview(output)
+    remaining = length
+    while remaining > 0:
+        if cancel_event is not None and cancel_event.is_set():
+            raise CryptCancelled()
+        size = source.readinto(view[:min(remaining, AES_FILE_CHUNK_SIZE)])
+        if not size:
+            raise ValueError("文件不完整")
+        if decrypt:
+            cipher.decrypt(view[:size], output=output_view[:size])
+        else:
+            cipher.encrypt(view[:size], output=output_view[:size])
+        target.write(output_view[:size])
+        remaining -= size
+        if progress_callback:
+            progress_callback(size)
+
+def aes_crypt_file(key, source_path, target_path, decrypt=False, progress_callback=None, cancel_event=None):
+    """用AES-GCM流式加密或解密文件，需要PyCryptodome
+    加密文件格式：AES_FILE_MAGIC + 12字节随机nonce + 密文 + 16字节认证标签，文件头作为附加认证数据。
+    结果先写入<target_path>.part，解密时认证标签校验通过后才改名为target_path，
+    密钥错误或文件被篡改时抛出ValueError，不会留下未经认证的明文。
+    """
+    from Crypto.Cipher import AES
+    part_path = target_path + ".part"
+    try:
+        with open(source_path, "rb") as source, open(part_path, "wb") as target:
+            if decrypt:
+                header = source.read(len(AES_FILE_MAGIC) + AES_FILE_NONCE_SIZE)
+                length = os.path.getsize(source_path) - len(header) - AES_FILE_TAG_SIZE
+                if not header.startswith(AES_FILE_MAGIC) or length < 0:
+                    raise ValueError("不是工具箱加密的文件")
+                cipher = AES.new(key, AES.MODE_GCM, nonce=header[len(AES_FILE_MAGIC):])
+                cipher.update(header)
+                _crypt_stream(cipher, True, source, target, length, progress_callback, cancel_event)
+                try:
+                    cipher.verify(source.read(AES_FILE_TAG_SIZE))
+                except ValueError:
+                    raise ValueError("认证失败：密钥错误或文件已被修改")
+            else:
+                header = AES_FILE_MAGIC + os.urandom(AES_FILE_NONCE_SIZE)
+                cipher = AES.new(key, AES.MODE_GCM, nonce=header[len(AES_FILE_MAGIC):])
+                cipher.update(header)
+                target.write(header)
+                _crypt_stream(cipher, False, source, target, os.path.getsize(source_path),
+                              progress_callback, cancel_event)
+                target.write(cipher.digest())
+        os.replace(part_path, target_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return target_path
+
+class AesFileThread(QThread):
+    """在后台线程中加密或解密文件"""
+    progress_changed = pyqtSignal(object, object, float)  # 已处理字节, 总字节, 吞吐量（字节/秒）
+    crypt_finished = pyqtSignal(str, float)  # 输出文件, 耗时（秒）
+    crypt_failed = pyqtSignal(str)
+    crypt_cancelled = pyqtSignal()
+    
+    def __init__(self, key, source_path, target_path, decrypt=False, parent=None):
+        super().__init__(parent)
+        self.key = key
+        self.source_path = source_path
+        self.target_path = target_path
+        self.decrypt = decrypt
+        self.cancel_event = threading.Event()
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def run(self):
+        total_size = os.path.getsize(self.source_path)
+        state = {"done": 0, "last_report": 0.0}
+        start = time.monotonic()
+        
+        def on_progress(size):
+            state["done"] += size
+            now = time.monotonic()
+            if now - state["last_report"] >= HASH_PROGRESS_INTERVAL:
+                state["last_report"] = now
+                self.progress_changed.emit(state["done"], total_size, state["done"] / max(now - start, 1e-6))
+        
+        try:
+            aes_crypt_file(self.key, self.source_path, self.target_path, self.decrypt, on_progress, self.cancel_event)
+            self.crypt_finished.emit(self.target_path, time.monotonic() - start)
+        except CryptCancelled:
+            self.crypt_cancelled.emit()
+        except ImportError:
+            self.crypt_failed.emit("文件加解密需要PyCryptodome库，请安装：pip install pycryptodome")
+        except Exception as e:
+            self.crypt_failed.emit(str(e))
+
+class CodecCancelled(Exception):
+    """文件编解码被取消"""
+
+# 格式 -> (编码函数, 解码函数, 解码时的字符分组长度)
+CODEC_FUNCTIONS = {
+    "base64": (lambda data: binascii.b2a_base64(data, newline=False),
+               lambda data: base64.b64decode(data, validate=True), 4),
+    "base32": (base64.b32encode, base64.b32decode, 8),
+    "hex": (binascii.hexlify, binascii.unhexlify, 2),
+}
+
+def codec_file(codec_format, source_path, target_path, decode=False, progress_callback=None, cancel_event=None):
+    """流式编码或解码文件，返回(输出字节数, 输出开头的预览)
+    编码时每次读取CODEC_CHUNK_SIZE字节，块大小是3和5的公倍数，各块的编码结果直接拼接即可；
+    解码时忽略空白字符，不足一个分组的余数留到下一块，内存占用与文件大小无关。
+    结果先写入<target_path>.part，完成后才改名为target_path。
+    """
+    encoder, decoder, group_size = CODEC_FUNCTIONS[codec_format]
+    convert = decoder if decode else encoder
+    part_path = target_path + ".part"
+    output_size = 0
+    preview = b""
+    pending = b""
+    try:
+        with open(source_path, "rb") as source, open(part_path, "wb") as target:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise CodecCancelled()
+                chunk = source.read(CODEC_CHUNK_SIZE)
+                if decode:
+                    # 行尾换行、折行等空白不属于编码内容，按完整分组解码
+                    data = pending + chunk.translate(None, b" \t\r\n")
+                    usable = len(data) - len(data) % group_size if chunk else len(data)
+                    data, pending = data[:usable], data[usable:]
+                else:
+                    data = chunk
+                if data:
+                    try:
+                        output = convert(data)
+                    except (binascii.Error, ValueError) as e:
+                        raise ValueError(f"输入不是有效的{dict(CODEC_FORMATS)[codec_format]}内容：{e}")
+                    target.write(output)
+                    output_size += len(output)
+                    if len(preview) < CODEC_PREVIEW_SIZE:
+                        preview += output[:CODEC_PREVIEW_SIZE - len(preview)]
+                if progress_callback and chunk:
+                    progress_callback(len(chunk))
+                if not chunk:
+                    break
+        os.replace(part_path, target_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return output_size, preview
+
+class CodecFileThread(QThread):
+    """在后台线程中编码或解码文件"""
+    progress_changed = pyqtSignal(object, object, float)  # 已读取字节, 总字节, 吞吐量（字节/秒）
+    codec_finished = pyqtSignal(str, object, bytes, float)  # 输出文件, 输出字节数, 输出预览, 耗时（秒）
+    codec_failed = pyqtSignal(str)
+    codec_cancelled = pyqtSignal()
+    
+    def __init__(self, codec_format, source_path, target_path, decode=False, parent=None):
+        super().__init__(parent)
+        self.codec_format = codec_format
+        self.source_path = source_path
+        self.target_path = target_path
+        self.decode = decode
+        self.cancel_event = threading.Event()
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def run(self):
+        total_size = os.path.getsize(self.source_path)
+        state = {"done": 0, "last_report": 0.0}
+        start = time.monotonic()
+        
+        def on_progress(size):
+            state["done"] += size
+            now = time.monotonic()
+            if now - state["last_report"] >= HASH_PROGRESS_INTERVAL:
+                state["last_report"] = now
+                self.progress_changed.emit(state["done"], total_size, state["done"] / max(now - start, 1e-6))
+        
+        try:
+            output_size, preview = codec_file(self.codec_format, self.source_path, self.target_path,
+                                              self.decode, on_progress, self.cancel_event)
+            self.codec_finished.emit(self.target_path, output_size, preview, time.monotonic() - start)
+        except CodecCancelled:
+            self.codec_cancelled.emit()
+        except Exception as e:
+            self.codec_failed.emit(str(e))
+
+def parse_decimal(text):
+    """把输入文本解析为有限的Decimal，无效时抛出ValueError"""
+    try:
+        value = Decimal(str(text).strip())
+    except InvalidOperation:
+        raise ValueError(f"无效的数字：{text}")
+    if not value.is_finite():
+        raise ValueError(f"无效的数字：{text}")
+    return value
+
+def is_integral(value):
+    return value == value.to_integral_value()
+
+def integer_nth_root(x, n):
+    """非负整数x的n次方根（向下取整），牛顿迭代只使用整数运算，不受浮点精度限制"""
+    if x < 2:
+        return x
+    # 初值2^ceil(位数/n)不小于真实的根，之后的迭代单调递减直到收敛
+    root = 1 << -(-x.bit_length() // n)
+    while True:
+        next_root = ((n - 1) * root + x // root ** (n - 1)) // n
+        if next_root >= root:
+            return root
+        root = next_root
+
+def format_decimal(value):
+    """整数值显示为不带小数点的整数，其余去掉末尾的0，需要在计算所用的decimal上下文中调用
+    超过有效数字位数的整数用科学计数法显示，避免把舍入后补的0当成精确结果。
+    """
+    if is_integral(value) and value.adjusted() < getcontext().prec:
+        return str(int(value))
+    return str(value.normalize())
+
+def exact_power(base, exponent, precision=CALC_DEFAULT_PRECISION):
+    """计算base^exponent（Decimal），返回结果文本
+    整数底数和非负整数指数用Python整数精确计算；结果超过CALC_MAX_EXACT_DIGITS位或不是整数时，
+    用decimal按precision位有效数字计算。
+    """
+    if is_integral(base) and is_integral(exponent) and exponent >= 0:
+        int_base, int_exponent = int(base), int(exponent)
+        # 先估算结果位数，避免计算和显示数百万位的整数
+        if abs(int_base) < 2 or int_exponent * math.log10(abs(int_base)) < CALC_MAX_EXACT_DIGITS:
+            return str(int_base ** int_exponent)
+    if base < 0 and not is_integral(exponent):
+        raise ValueError("负数的非整数次幂不是实数")
+    if base == 0 and exponent < 0:
+        raise ValueError("0的负数次幂没有定义")
+    with localcontext() as context:
+        context.prec = precision
+        context.Emax = MAX_EMAX
+        context.Emin = MIN_EMIN
+        try:
+            return format_decimal(base ** exponent)
+        except DecimalException:
+            raise ValueError("结果超出可表示的范围")
+
+def exact_root(radicand, index, precision=CALC_DEFAULT_PRECISION):
+    """计算radicand的index次方根（Decimal），返回结果文本
+    整数的正整数次方根先用integer_nth_root判断是否开得尽，开得尽时给出精确整数，
+    否则用decimal按precision位有效数字计算。
+    """
+    if index == 0:
+        raise ValueError("根指数不能为0")
+    odd_index = is_integral(index) and int(index) % 2 == 1
+    if radicand < 0 and not odd_index:
+        raise ValueError("负数只能开奇数次方根")
+    if is_integral(index) and index > 0 and is_integral(radicand):
+        n, x = int(index), int(radicand)
+        root = integer_nth_root(abs(x), n)
+        if root ** n == abs(x):
+            return str(-root if x < 0 else root)
+    if radicand == 0 and index < 0:
+        raise ValueError("0的负数次方根没有定义")
+    with localcontext() as context:
+        # 多算几位再舍入到precision位，保证显示的最后一位正确
+        context.prec = precision + 5
+        context.Emax = MAX_EMAX
+        context.Emin = MIN_EMIN
+        try:
+            result = abs(radicand) ** (Decimal(1) / index)
+            context.prec = precision
+            return format_decimal(-result if radicand < 0 else +result)
+        except DecimalException:
+            raise ValueError("结果超出可表示的范围")
+
+def format_float(value):
+    """格式化浮点计算结果"""
+    if math.isnan(value):
+        return "错误：结果不是实数或没有定义"
+    if math.isinf(value):
+        return "错误：结果溢出"
+    if value.is_integer() and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(value)
+
+def _float_power(x, y):
+    try:
+        value = x ** y
+    except (OverflowError, ZeroDivisionError):
+        return math.nan if x == 0 else math.inf
+    return math.nan if isinstance(value, complex) else float(value)
+
+def _float_root(x, n):
+    if n == 0 or (x < 0 and not (n.is_integer() and int(n) % 2 == 1)):
+        return math.nan
+    value = _float_power(abs(x), 1 / n)
+    if x < 0:
+        value = -value
+    # 浮点开方会把整数根算成2.9999999999999996，取最近的整数验证一次
+    rounded = round(value) if math.isfinite(value) else value
+    return float(rounded) if _float_power(rounded, n) == x else value
+
+def calc_batch(kind, rows, exact=True, precision=CALC_DEFAULT_PRECISION):
+    """批量计算，kind为"power"（x^y）或"root"（x的y次方根），rows为[(x文本, y文本), ...]
+    高精度模式逐行调用exact_power/exact_root；否则有NumPy时整列向量化计算，没有时逐个浮点计算。
+    返回(结果文本列表, 计算方式)，无法计算的行结果为"错误：..."。
+    """
+    if exact:
+        calculate = exact_power if kind == "power" else exact_root
+        results = []
+        for x_text, y_text in rows:
+            try:
+                results.append(calculate(parse_decimal(x_text), parse_decimal(y_text), precision))
+            except ValueError as e:
+                results.append(f"错误：{e}")
+        return results, "高精度逐个计算"
+    
+    xs, ys, valid = [], [], []
+    for x_text, y_text in rows:
+        try:
+            x, y = float(x_text), float(y_text)
+            valid.append(math.isfinite(x) and math.isfinite(y))
+        except ValueError:
+            x, y = 0.0, 1.0
+            valid.append(False)
+        xs.append(x)
+        ys.append(y)
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    if np is not None:
+        x_array, y_array = np.array(xs), np.array(ys)
+        with np.errstate(all="ignore"):
+            if kind == "power":
+                values = np.where((x_array == 0) & (y_array < 0), np.nan, np.power(x_array, y_array))
+            else:
+                odd = np.mod(y_array, 2) == 1
+                values = np.where((x_array < 0) & odd, -np.power(-x_array, 1 / y_array), np.power(x_array, 1 / y_array))
+                rounded = np.rint(values)
+                values = np.where(np.power(rounded, y_array) == x_array, rounded, values)
+                values = np.where(y_array == 0, np.nan, values)
+        values = values.tolist()
+        method = "NumPy向量化"
+    else:
+        calculate = _float_power if kind == "power" else _float_root
+        values = [calculate(x, y) for x, y in zip(xs, ys)]
+        method = "浮点逐个计算"
+    return [format_float(value) if ok else "错误：无效的数字" for value, ok in zip(values, valid)], method
+
+def _qr_gf_tables():
+    """GF(256)的指数表和对数表，本原多项式x^8+x^4+x^3+x^2+1"""
+    exp_table = [0] * 512
+    log_table = [0] * 256
+    value = 1
+    for i in range(255):
+        exp_table[i] = value
+        log_table[value] = i
+        value <<= 1
+        if value & 0x100:
+            value ^= 0x11D
+    for i in range(255, 512):
+        exp_table[i] = exp_table[i - 255]
+    return exp_table, log_table
+
+QR_GF_EXP, QR_GF_LOG = _qr_gf_tables()
+
+def _qr_gf_multiply(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return QR_GF_EXP[QR_GF_LOG[a] + QR_GF_LOG[b]]
+
+def _qr_rs_remainder(data, degree):
+    """Reed-Solomon纠错码：data乘以x^degree后除以生成多项式的余数"""
+    generator = [1]
+    for i in range(degree):
+        generator = generator + [0]
+        for j in range(len(generator) - 1, 0, -1):
+            generator[j] ^= _qr_gf_multiply(generator[j - 1], QR_GF_EXP[i])
+    remainder = [0] * degree
+    for byte in data:
+        factor = byte ^ remainder[0]
+        remainder = remainder[1:] + [0]
+        if factor:
+            for i in range(degree):
+                remainder[i] ^= _qr_gf_multiply(generator[i + 1], factor)
+    return remainder
+
+def _qr_raw_modules(version):
+    """版本version中除功能图形外可放数据和纠错码的模块数"""
+    result = (16 * version + 128) * version + 64
+    if version >= 2:
+        alignment_count = version // 7 + 2
+        result -= (25 * alignment_count - 10) * alignment_count - 55
+        if version >= 7:
+            result -= 36
+    return result
+
+def _qr_data_capacity(version, ec_level):
+    """版本version在纠错等级ec_level下可容纳的数据码字数"""
+    return (_qr_raw_modules(version) // 8
+            - QR_ECC_CODEWORDS_PER_BLOCK[ec_level][version - 1] * QR_ERROR_CORRECTION_BLOCKS[ec_level][version - 1])
+
+def _qr_alignment_positions(version):
+    if version == 1:
+        return []
+    count = version // 7 + 2
+    size = version * 4 + 17
+    step = 26 if version == 32 else (version * 4 + count * 2 + 1) // (count * 2 - 2) * 2
+    return [6] + sorted(size - 7 - i * step for i in range(count - 1))
+
+def _qr_codewords(data, ec_level):
+    """选择能容纳data的最小版本，按字节模式编码并加上交织后的纠错码，返回(版本, 码字列表)"""
+    for version in range(1, 41):
+        count_bits = 8 if version <= 9 else 16
+        capacity = _qr_data_capacity(version, ec_level)
+        if 4 + count_bits + len(data) * 8 <= capacity * 8:
+            break
+    else:
+        raise ValueError("二维码内容过长")
+    
+    bits = [0, 1, 0, 0]  # 字节模式
+    bits += [(len(data) >> i) & 1 for i in range(count_bits - 1, -1, -1)]
+    for byte in data:
+        bits += [(byte >> i) & 1 for i in range(7, -1, -1)]
+    bits += [0] * min(4, capacity * 8 - len(bits))  # 结束符
+    bits += [0] * (-len(bits) % 8)
+    codewords = [int("".join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8)]
+    for pad in range(capacity - len(codewords)):
+        codewords.append(0xEC if pad % 2 == 0 else 0x11)
+    
+    # 分块计算纠错码，前面的短块比后面的长块少一个数据码字，最后按列交织
+    block_count = QR_ERROR_CORRECTION_BLOCKS[ec_level][version - 1]
+    ecc_length = QR_ECC_CODEWORDS_PER_BLOCK[ec_level][version - 1]
+    raw_codewords = _qr_raw_modules(version) // 8
+    short_count = block_count - raw_codewords % block_count
+    short_length = raw_codewords // block_count - ecc_length
+    data_blocks, ecc_blocks = [], []
+    offset = 0
+    for index in range(block_count):
+        length = short_length + (0 if index < short_count else 1)
+        block = codewords[offset:offset + length]
+        offset += length
+        data_blocks.append(block)
+        ecc_blocks.append(_qr_rs_remainder(block, ecc_length))
+    result = []
+    for i in range(short_length + 1):
+        result += [block[i] for block in data_blocks if i < len(block)]
+    for i in range(ecc_length):
+        result += [block[i] for block in ecc_blocks]
+    return version, result
+
+QR_MASKS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+
+def _qr_penalty(modules):
+    """按规范的四条规则计算掩码后的惩罚分，分数最低的掩码最容易识别"""
+    size = len(modules)
+    rows = ["".join("1" if cell else "0" for cell in row) for row in modules]
+    columns = ["".join(column) for column in zip(*rows)]
+    border = "0" * size
+    penalty = 0
+    for line in rows + columns:
+        # 规则1：同色连续5个及以上
+        for run in QR_LONG_RUN.findall(line):
+            penalty += len(run) - 2
+        # 规则3：深浅交替宽度为1:1:3:1:1的类定位图形，一侧有至少4倍宽的浅色区域，符号外的空白也算浅色
+        # 两侧补上浅色后游程从浅色开始，奇数下标都是深色游程
+        runs = [len(run) for run in QR_RUN.findall(border + line + border)]
+        for i in range(1, len(runs) - 5, 2):
+            n = runs[i]
+            if runs[i + 2] == 3 * n and runs[i + 1] == runs[i + 3] == runs[i + 4] == n:
+                before, after = runs[i - 1], runs[i + 5]
+                penalty += 40 * ((before >= 4 * n and after >= n) + (after >= 4 * n and before >= n))
+    # 规则2：2x2同色块，每行作为整数，用位运算同时比较一行中的所有相邻模块
+    row_bits = [int(row, 2) for row in rows]
+    pair_mask = (1 << (size - 1)) - 1
+    for upper, lower in zip(row_bits, row_bits[1:]):
+        same_vertical = ~(upper ^ lower)
+        same_horizontal = ~(upper ^ (upper >> 1))
+        penalty += 3 * bin(same_vertical & (same_vertical >> 1) & same_horizontal & pair_mask).count("1")
+    # 规则4：深色模块比例偏离50%，每5%加10分
+    dark = sum(row.count("1") for row in rows)
+    total = size * size
+    penalty += ((abs(dark * 20 - total * 10) + total - 1) // total - 1) * 10
+    return penalty
+
+def qrcode_matrix(text, ec_level=QRCODE_EC_LEVEL, mask=None):
+    """把text（UTF-8字节模式）编码为二维码，返回二维布尔列表，True为深色模块
+    mask为None时依次尝试8种掩码，选择惩罚分最低的一种。
+    """
+    version, codewords = _qr_codewords(text.encode("utf-8"), ec_level)
+    size = version * 4 + 17
+    modules = [[False] * size for _ in range(size)]
+    function = [[False] * size for _ in range(size)]
+    
+    def set_function(x, y, dark):
+        modules[y][x] = dark
+        function[y][x] = True
+    
+    # 定时图形、定位图形、校正图形
+    for i in range(size):
+        set_function(6, i, i % 2 == 0)
+        set_function(i, 6, i % 2 == 0)
+    for cx, cy in ((3, 3), (size - 4, 3), (3, size - 4)):
+        for dy in range(-4, 5):
+            for dx in range(-4, 5):
+                x, y = cx + dx, cy + dy
+                if 0 <= x < size and 0 <= y < size:
+                    set_function(x, y, max(abs(dx), abs(dy)) not in (2, 4))
+    positions = _qr_alignment_positions(version)
+    last = len(positions) - 1
+    for i, cx in enumerate(positions):
+        for j, cy in enumerate(positions):
+            if (i, j) in ((0, 0), (0, last), (last, 0)):
+                continue  # 与定位图形重叠
+            for dy in range(-2, 3):
+                for dx in range(-2, 3):
+                    set_function(cx + dx, cy + dy, max(abs(dx), abs(dy)) != 1)
+    
+    def draw_format(mask_index):
+        data = QR_EC_FORMAT_BITS[ec_level] << 3 | mask_index
+        remainder = data
+        for _ in range(10):
+            remainder = (remainder << 1) ^ ((remainder >> 9) * 0x537)
+        bits = (data << 10 | remainder) ^ 0x5412
+        bit = [bool((bits >> i) & 1) for i in range(15)]
+        for i in range(6):
+            set_function(8, i, bit[i])
+        set_function(8, 7, bit[6])
+        set_function(8, 8, bit[7])
+        set_function(7, 8, bit[8])
+        for i in range(9, 15):
+            set_function(14 - i, 8, bit[i])
+        for i in range(8):
+            set_function(size - 1 - i, 8, bit[i])
+        for i in range(8, 15):
+            set_function(8, size - 15 + i, bit[i])
+        set_function(8, size - 8, True)  # 固定的深色模块
+    
+    draw_format(0)  # 先占住格式信息的位置，选定掩码后再写入
+    if version >= 7:
+        remainder = version
+        for _ in range(12):
+            remainder = (remainder << 1) ^ ((remainder >> 11) * 0x1F25)
+        bits = version << 12 | remainder
+        for i in range(18):
+            dark = bool((bits >> i) & 1)
+            set_function(size - 11 + i % 3, i // 3, dark)
+            set_function(i // 3, size - 11 + i % 3, dark)
+    
+    # 从右下角开始，每两列一组上下蛇形放置数据位，跳过功能图形
+    bit_index = 0
+    total_bits = len(codewords) * 8
+    right = size - 1
+    while right >= 1:
+        if right == 6:
+            right = 5  # 跳过竖直的定时图形
+        upward = ((right + 1) & 2) == 0
+        for vertical in range(size):
+            y = size - 1 - vertical if upward else vertical
+            for x in (right, right - 1):
+                if not function[y][x] and bit_index < total_bits:
+                    modules[y][x] = bool((codewords[bit_index >> 3] >> (7 - (bit_index & 7))) & 1)
+                    bit_index += 1
+        right -= 2
+    
+    def apply_mask(mask_index):
+        condition = QR_MASKS[mask_index]
+        for y in range(size):
+            for x in range(size):
+                if not function[y][x] and condition(x, y):
+                    modules[y][x] = not modules[y][x]
+    
+    if mask is None:
+        best_penalty = None
+        for mask_index in range(8):
+            apply_mask(mask_index)
+            draw_format(mask_index)
+            penalty = _qr_penalty(modules)
+            if best_penalty is None or penalty < best_penalty:
+                best_penalty, mask = penalty, mask_index
+            apply_mask(mask_index)  # 异或两次即恢复
+    apply_mask(mask)
+    draw_format(mask)
+    return modules
+
+@functools.lru_cache(maxsize=16)
+def qrcode_pixmap(text, module_size=QRCODE_MODULE_SIZE):
+    """把text渲染为二维码QPixmap，相同内容直接返回缓存的图片"""
+    modules = qrcode_matrix(text)
+    size = (len(modules) + QRCODE_QUIET_ZONE * 2) * module_size
+    image = QImage(size, size, QImage.Format_RGB32)
+    image.fill(Qt.white)
+    painter = QPainter(image)
+    offset = QRCODE_QUIET_ZONE * module_size
+    for y, row in enumerate(modules):
+        for x, dark in enumerate(row):
+            if dark:
+                painter.fillRect(offset + x * module_size, offset + y * module_size, module_size, module_size, Qt.black)
+    painter.end()
+    return QPixmap.fromImage(image)
+
+def local_lan_ip():
+    """本机在局域网中的IP地址，UDP的connect只查路由表不发送数据，离线时也能使用"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.connect(("10.255.255.255", 1))
+            return probe.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+
+def parse_discovery_reply(data, token, sent_times):
+    """解析服务器的发现应答，返回(服务器信息, 请求轮次)，不是本次搜索的应答时返回None"""
+    try:
+        magic, payload = data.decode("utf-8").split(" ", 1)
+        info = json.loads(payload)
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if magic != DISCOVERY_REPLY or not isinstance(info, dict):
+        return None
+    reply_token, _, seq = str(info.pop("nonce", "")).partition(":")
+    port = info.get("port")
+    if reply_token != token or not seq.isdigit() or int(seq) not in sent_times:
+        return None
+    if not isinstance(port, int) or not 0 < port < 65536:
+        return None
+    return info, int(seq)
+
+def discover_servers(on_found=None, cancel_event=None, targets=None,
+                     probes=DISCOVERY_PROBES, timeout=DISCOVERY_TIMEOUT):
+    """向局域网广播和组播发现请求，返回应答的服务器列表，按往返延迟从低到高排序
+    每个请求带有本次搜索的随机串和轮次，延迟按轮次匹配发送时间计算，同一服务器取各轮的最小值。
+    首次发现某台服务器或它的延迟变小时调用on_found(服务器信息)，信息中的host为应答来源地址
+    """
+    if targets is None:
+        targets = [("<broadcast>", DISCOVERY_PORT), (DISCOVERY_GROUP, DISCOVERY_PORT)]
+    token = os.urandom(8).hex()
+    sent_times = {}
+    servers = {}
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        except OSError:
+            pass
+        sock.bind(("", 0))
+        seq = 0
+        next_probe = time.monotonic()
+        deadline = None
+        while not (cancel_event is not None and cancel_event.is_set()):
+            now = time.monotonic()
+            if seq < probes and now >= next_probe:
+                request = f"{DISCOVERY_MAGIC} {token}:{seq}".encode("utf-8")
+                sent_times[seq] = now
+                for target in targets:
+                    try:
+                        sock.sendto(request, target)
+                    except OSError:
+                        # 没有广播路由或组播路由时只用其余方式
+                        pass
+                seq += 1
+                next_probe = now + DISCOVERY_PROBE_INTERVAL
+                if seq == probes:
+                    deadline = now + timeout
+            if deadline is not None and now >= deadline:
+                break
+            # 最多等待0.1秒就检查一次取消
+            wait = (deadline if seq == probes else next_probe) - now
+            sock.settimeout(min(max(wait, 0.001), 0.1))
+            try:
+                data, address = sock.recvfrom(4096)
+            except (socket.timeout, ConnectionResetError):
+                # Windows下目标端口不可达的ICMP会让下一次recvfrom报ConnectionResetError
+                continue
+            received = time.monotonic()
+            reply = parse_discovery_reply(data, token, sent_times)
+            if reply is None:
+                continue
+            info, reply_seq = reply
+            info["host"] = address[0]
+            info["rtt"] = received - sent_times[reply_seq]
+            key = (info["host"], info["port"])
+            known = servers.get(key)
+            if known is not None and known["rtt"] <= info["rtt"]:
+                continue
+            servers[key] = info
+            if on_found is not None:
+                on_found(dict(info))
+    return sorted(servers.values(), key=lambda server: server["rtt"])
+
+class ServerDiscoveryThread(QThread):
+    """在后台搜索局域网中的服务器，不阻塞连接界面"""
+    server_found = pyqtSignal(dict)
+    discovery_finished = pyqtSignal(int)  # 发现的服务器数量
+    discovery_failed = pyqtSignal(str)
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.cancel_event = threading.Event()
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def run(self):
+        try:
+            servers = discover_servers(on_found=self.server_found.emit, cancel_event=self.cancel_event)
+        except OSError as e:
+            self.discovery_failed.emit(str(e))
+            return
+        self.discovery_finished.emit(len(servers))
+
 class LicenseWindow(QWidget):
     """法律性声明窗口"""
     agreed = pyqtSignal()  # 用户同意信号
@@ -158,6 +1599,11 @@ class Communicate(QObject):
     error_message = pyqtSignal(str)
     notification = pyqtSignal(str, str, str)  # 用于发送通知弹窗，参数：标题、内容、类型
     show_reconnect_dialog_signal = pyqtSignal()  # 用于触发重连对话框的显示
+    server_shutdown = pyqtSignal(str, int)  # 服务器主动关闭，参数：原因、建议的重连等待秒数（-1表示不重连）
+    wallpaper_loaded = pyqtSignal(bytes)  # 后台线程获取到壁纸后通知界面
+    hitokoto_loaded = pyqtSignal(str)  # 后台线程获取到一言后通知界面
+    kicked = pyqtSignal(str)  # 被管理员踢出，参数：提示内容
+    mute_changed = pyqtSignal(bool)  # 被禁言（True）或解禁（False）
 
 class WallpaperSourceDialog(QDialog):
     """壁纸来源选择对话框"""
@@ -319,6 +1765,16 @@ class ToolboxDialog(QDialog):
         self.setAttribute(Qt.WA_TranslucentBackground)
         self.setWindowModality(Qt.ApplicationModal)
     
+    def closeEvent(self, event):
+        # 关闭工具箱时取消未完成的文件校验、加解密和编解码
+        if getattr(self, "hash_thread", None) is not None and self.hash_thread.isRunning():
+            self.hash_thread.cancel()
+        if getattr(self, "aes_thread", None) is not None and self.aes_thread.isRunning():
+            self.aes_thread.cancel()
+        if getattr(self, "codec_thread", None) is not None and self.codec_thread.isRunning():
+            self.codec_thread.cancel()
+        super().closeEvent(event)
+    
     def init_base64_tab(self):
         """初始化Base64编解码标签页"""
         tab = QWidget()
@@ -415,6 +1871,46 @@ class ToolboxDialog(QDialog):
         button_layout.addWidget(self.base64_copy_btn)
         layout.addLayout(button_layout)
         
+        # 文件编解码：后台分块处理，完整结果写入文件，结果区只预览开头部分
+        file_layout = QHBoxLayout()
+        file_layout.addWidget(QLabel("文件格式："))
+        self.base64_format = QComboBox()
+        for codec_format, label in CODEC_FORMATS:
+            self.base64_format.addItem(label, codec_format)
+        self.base64_format.setStyleSheet("""
+            QComboBox {
+                background-color: rgba(245, 245, 245, 0.5);
+                border: 1px solid rgba(224, 224, 224, 0.5);
+                border-radius: 8px;
+                padding: 8px;
+                font-size: 14px;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+            }
+        """)
+        file_layout.addWidget(self.base64_format)
+        for name, text, handler in (("base64EncodeFileBtn", "编码文件", self.base64_encode_file),
+                                    ("base64DecodeFileBtn", "解码文件", self.base64_decode_file)):
+            button = QPushButton(text)
+            button.setObjectName(name)
+            button.setStyleSheet(f"""
+                QPushButton#{name} {{
+                    background-color: rgba(156, 39, 176, 0.8);
+                    color: white;
+                    border: none;
+                    border-radius: 8px;
+                    padding: 10px 20px;
+                    font-size: 14px;
+                    font-weight: bold;
+                    font-family: 'Microsoft YaHei', SimSun, sans-serif;
+                }}
+                QPushButton#{name}:hover {{
+                    background-color: rgba(123, 31, 162, 0.9);
+                }}
+            """)
+            button.clicked.connect(handler)
+            file_layout.addWidget(button)
+        layout.addLayout(file_layout)
+        
         # 结果显示区域
         result_group = QGroupBox("结果")
         result_group.setStyleSheet("""
@@ -592,6 +2088,31 @@ class ToolboxDialog(QDialog):
         button_layout.addWidget(self.aes_copy_btn)
         layout.addLayout(button_layout)
         
+        # 文件加解密按钮，文件模式固定使用带认证的AES-GCM和随机nonce，与上面的加密模式无关
+        file_button_layout = QHBoxLayout()
+        for name, text, handler in (("aesEncryptFileBtn", "加密文件（AES-GCM）", self.aes_encrypt_file),
+                                    ("aesDecryptFileBtn", "解密文件（AES-GCM）", self.aes_decrypt_file)):
+            button = QPushButton(text)
+            button.setObjectName(name)
+            button.setStyleSheet(f"""
+                QPushButton#{name} {{
+                    background-color: rgba(156, 39, 176, 0.8);
+                    color: white;
+                    border: none;
+                    border-radius: 8px;
+                    padding: 10px 20px;
+                    font-size: 14px;
+                    font-weight: bold;
+                    font-family: 'Microsoft YaHei', SimSun, sans-serif;
+                }}
+                QPushButton#{name}:hover {{
+                    background-color: rgba(123, 31, 162, 0.9);
+                }}
+            """)
+            button.clicked.connect(handler)
+            file_button_layout.addWidget(button)
+        layout.addLayout(file_button_layout)
+        
         # 结果显示区域
         result_group = QGroupBox("结果")
         result_group.setStyleSheet("""
@@ -624,7 +2145,7 @@ class ToolboxDialog(QDialog):
         self.tab_widget.addTab(tab, "AES加密")
     
     def init_md5_tab(self):
-        """初始化MD5校验标签页"""
+        """初始化文件校验标签页，一次计算MD5、SHA-1、SHA-256和BLAKE2b"""
         tab = QWidget()
         layout = QVBoxLayout(tab)
         
@@ -706,7 +2227,7 @@ class ToolboxDialog(QDialog):
         
         # 按钮区域
         button_layout = QHBoxLayout()
-        self.md5_calc_btn = QPushButton("计算MD5")
+        self.md5_calc_btn = QPushButton("计算哈希")
         self.md5_calc_btn.setObjectName("md5CalcBtn")
         self.md5_calc_btn.setStyleSheet("""
             QPushButton#md5CalcBtn {
@@ -748,7 +2269,7 @@ class ToolboxDialog(QDialog):
         layout.addLayout(button_layout)
         
         # 结果显示区域
-        result_group = QGroupBox("MD5哈希值")
+        result_group = QGroupBox("哈希值")
         result_group.setStyleSheet("""
             QGroupBox {
                 background-color: rgba(255, 255, 255, 0.2);
@@ -761,10 +2282,10 @@ class ToolboxDialog(QDialog):
             }
         """)
         result_layout = QVBoxLayout(result_group)
-        self.md5_result = QLineEdit()
+        self.md5_result = QTextEdit()
         self.md5_result.setReadOnly(True)
         self.md5_result.setStyleSheet("""
-            QLineEdit {
+            QTextEdit {
                 background-color: rgba(245, 245, 245, 0.5);
                 border: 1px solid rgba(224, 224, 224, 0.5);
                 border-radius: 8px;
@@ -778,7 +2299,7 @@ class ToolboxDialog(QDialog):
         result_layout.addWidget(self.md5_result)
         layout.addWidget(result_group)
         
-        self.tab_widget.addTab(tab, "MD5校验")
+        self.tab_widget.addTab(tab, "文件校验")
     
     def init_power_tab(self):
         """初始化幂计算器标签页"""
@@ -833,6 +2354,24 @@ class ToolboxDialog(QDialog):
             }
         """)
         input_layout.addWidget(self.power_exponent, 1, 1)
+        
+        # 非整数结果的有效数字位数
+        power_precision_label = QLabel("精度（有效数字）：")
+        input_layout.addWidget(power_precision_label, 2, 0)
+        self.power_precision = QSpinBox()
+        self.power_precision.setRange(1, CALC_MAX_PRECISION)
+        self.power_precision.setValue(CALC_DEFAULT_PRECISION)
+        self.power_precision.setStyleSheet("""
+            QSpinBox {
+                background-color: rgba(245, 245, 245, 0.5);
+                border: 1px solid rgba(224, 224, 224, 0.5);
+                border-radius: 8px;
+                padding: 8px;
+                font-size: 14px;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+            }
+        """)
+        input_layout.addWidget(self.power_precision, 2, 1)
         layout.addWidget(input_group)
         
         # 按钮区域
@@ -908,9 +2447,81 @@ class ToolboxDialog(QDialog):
         """)
         result_layout.addWidget(self.power_result)
         layout.addWidget(result_group)
+        layout.addWidget(self.init_batch_group("power", "批量输入：每行一个底数（使用上面的指数），或“底数,指数”，也可导入CSV"))
         
         self.tab_widget.addTab(tab, "幂计算器")
     
+    def init_batch_group(self, prefix, placeholder):
+        """创建幂/求根计算器共用的批量计算区域，控件保存为self.<prefix>_batch_*"""
+        group = QGroupBox("批量计算")
+        group.setStyleSheet("""
+            QGroupBox {
+                background-color: rgba(255, 255, 255, 0.2);
+                border: 1px solid rgba(224, 224, 224, 0.3);
+                border-radius: 8px;
+                padding: 10px;
+                font-size: 14px;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+                color: #333;
+            }
+        """)
+        group_layout = QVBoxLayout(group)
+        text_style = """
+            QTextEdit {
+                background-color: rgba(245, 245, 245, 0.5);
+                border: 1px solid rgba(224, 224, 224, 0.5);
+                border-radius: 8px;
+                padding: 6px;
+                font-size: 13px;
+                font-family: Consolas, 'Microsoft YaHei', monospace;
+            }
+        """
+        batch_input = QTextEdit()
+        batch_input.setPlaceholderText(placeholder)
+        batch_input.setMaximumHeight(100)
+        batch_input.setStyleSheet(text_style)
+        group_layout.addWidget(batch_input)
+        
+        option_layout = QHBoxLayout()
+        batch_exact = QCheckBox("高精度（逐个精确计算，否则用NumPy向量化浮点计算）")
+        batch_exact.setChecked(True)
+        option_layout.addWidget(batch_exact)
+        option_layout.addStretch()
+        for text, handler in (("导入CSV", lambda: self.batch_import_csv(batch_input)),
+                              ("批量计算", getattr(self, f"{prefix}_batch_calculate"))):
+            button = QPushButton(text)
+            button.setStyleSheet("""
+                QPushButton {
+                    background-color: rgba(33, 150, 243, 0.8);
+                    color: white;
+                    border: none;
+                    border-radius: 8px;
+                    padding: 6px 14px;
+                    font-size: 13px;
+                    font-family: 'Microsoft YaHei', SimSun, sans-serif;
+                }
+                QPushButton:hover {
+                    background-color: rgba(25, 118, 210, 0.9);
+                }
+            """)
+            button.clicked.connect(handler)
+            option_layout.addWidget(button)
+        group_layout.addLayout(option_layout)
+        
+        batch_status = QLabel("")
+        group_layout.addWidget(batch_status)
+        batch_result = QTextEdit()
+        batch_result.setReadOnly(True)
+        batch_result.setMaximumHeight(120)
+        batch_result.setStyleSheet(text_style)
+        group_layout.addWidget(batch_result)
+        
+        setattr(self, f"{prefix}_batch_input", batch_input)
+        setattr(self, f"{prefix}_batch_exact", batch_exact)
+        setattr(self, f"{prefix}_batch_status", batch_status)
+        setattr(self, f"{prefix}_batch_result", batch_result)
+        return group
+    
     def init_root_tab(self):
         """初始化求根计算器标签页"""
         tab = QWidget()
@@ -987,6 +2598,24 @@ class ToolboxDialog(QDialog):
         """)
         root_index_layout.addWidget(self.custom_root_index)
         input_layout.addLayout(root_index_layout, 1, 1)
+        
+        # 非整数结果的有效数字位数
+        root_precision_label = QLabel("精度（有效数字）：")
+        input_layout.addWidget(root_precision_label, 2, 0)
+        self.root_precision = QSpinBox()
+        self.root_precision.setRange(1, CALC_MAX_PRECISION)
+        self.root_precision.setValue(CALC_DEFAULT_PRECISION)
+        self.root_precision.setStyleSheet("""
+            QSpinBox {
+                background-color: rgba(245, 245, 245, 0.5);
+                border: 1px solid rgba(224, 224, 224, 0.5);
+                border-radius: 8px;
+                padding: 8px;
+                font-size: 14px;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+            }
+        """)
+        input_layout.addWidget(self.root_precision, 2, 1)
         layout.addWidget(input_group)
         
         # 按钮区域
@@ -1062,6 +2691,7 @@ class ToolboxDialog(QDialog):
         """)
         result_layout.addWidget(self.root_result)
         layout.addWidget(result_group)
+        layout.addWidget(self.init_batch_group("root", "批量输入：每行一个被开方数（使用上面的根指数），或“被开方数,根指数”，也可导入CSV"))
         
         self.tab_widget.addTab(tab, "求根计算器")
     
@@ -1094,15 +2724,80 @@ class ToolboxDialog(QDialog):
         except Exception as e:
             QMessageBox.critical(self, "解码错误", f"解码失败：{str(e)}")
     
-    def base64_copy(self):
-        """复制Base64结果"""
-        result = self.base64_result.toPlainText()
-        if result:
-            clipboard = QApplication.clipboard()
-            clipboard.setText(result)
-            QMessageBox.information(self, "复制成功", "结果已复制到剪贴板")
-        else:
-            QMessageBox.warning(self, "复制失败", "没有可复制的结果")
+    def base64_encode_file(self):
+        """流式编码文件"""
+        self.base64_codec_file(decode=False)
+    
+    def base64_decode_file(self):
+        """流式解码文件"""
+        self.base64_codec_file(decode=True)
+    
+    def base64_codec_file(self, decode):
+        from PyQt5.QtWidgets import QFileDialog
+        codec_format = self.base64_format.currentData()
+        label = self.base64_format.currentText()
+        suffix = CODEC_SUFFIXES[codec_format]
+        action = "解码" if decode else "编码"
+        source_path, _ = QFileDialog.getOpenFileName(self, f"选择要{action}的文件", "", "所有文件 (*.*)")
+        if not source_path:
+            return
+        if decode:
+            default_target = source_path[:-len(suffix)] if source_path.endswith(suffix) else source_path + ".bin"
+        else:
+            default_target = source_path + suffix
+        target_path, _ = QFileDialog.getSaveFileName(self, "保存到", default_target, "所有文件 (*.*)")
+        if not target_path:
+            return
+        if os.path.abspath(target_path) == os.path.abspath(source_path):
+            QMessageBox.warning(self, "路径错误", "输出文件不能与输入文件相同")
+            return
+        
+        progress = QProgressDialog(f"正在{label}{action}...", "取消", 0, 1000, self)
+        progress.setWindowTitle(f"文件{action}")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+        
+        def on_progress(done_size, total_size, throughput):
+            if total_size > 0:
+                progress.setValue(int(done_size * 1000 / total_size))
+            progress.setLabelText(f"正在{label}{action}... {done_size / (1024 * 1024):.1f} MB / "
+                                  f"{total_size / (1024 * 1024):.1f} MB，{throughput / (1024 * 1024):.1f} MB/s")
+        
+        def on_finished(target, output_size, preview, elapsed):
+            progress.close()
+            text = preview.decode('utf-8', errors='replace')
+            if output_size > len(preview):
+                text += f"\n\n……（仅预览前{len(preview)}字节）"
+            self.base64_result.setPlainText(f"{label}{action}完成：{target}\n"
+                                            f"输出 {output_size} 字节，耗时 {elapsed:.2f} 秒\n\n{text}")
+        
+        def on_failed(error_text):
+            progress.close()
+            QMessageBox.critical(self, f"{action}错误", f"文件{action}失败：{error_text}")
+        
+        def on_cancelled():
+            progress.close()
+            QMessageBox.information(self, "已取消", f"文件{action}已取消，未生成输出文件")
+        
+        self.codec_thread = CodecFileThread(codec_format, source_path, target_path, decode, self)
+        self.codec_thread.progress_changed.connect(on_progress)
+        self.codec_thread.codec_finished.connect(on_finished)
+        self.codec_thread.codec_failed.connect(on_failed)
+        self.codec_thread.codec_cancelled.connect(on_cancelled)
+        progress.canceled.connect(self.codec_thread.cancel)
+        self.codec_thread.start()
+    
+    def base64_copy(self):
+        """复制Base64结果"""
+        result = self.base64_result.toPlainText()
+        if result:
+            clipboard = QApplication.clipboard()
+            clipboard.setText(result)
+            QMessageBox.information(self, "复制成功", "结果已复制到剪贴板")
+        else:
+            QMessageBox.warning(self, "复制失败", "没有可复制的结果")
     
     # AES加密解密功能
     def aes_encrypt(self):
@@ -1191,6 +2886,68 @@ class ToolboxDialog(QDialog):
         except Exception as e:
             QMessageBox.critical(self, "解密错误", f"解密失败：{str(e)}")
     
+    def aes_encrypt_file(self):
+        """流式加密文件"""
+        self.aes_crypt_file(decrypt=False)
+    
+    def aes_decrypt_file(self):
+        """流式解密文件，认证失败时不输出任何内容"""
+        self.aes_crypt_file(decrypt=True)
+    
+    def aes_crypt_file(self, decrypt):
+        from PyQt5.QtWidgets import QFileDialog
+        key = self.aes_key.text().encode('utf-8')
+        if len(key) not in [16, 24, 32]:
+            QMessageBox.warning(self, "密钥错误", "密钥长度必须为16、24或32位")
+            return
+        action = "解密" if decrypt else "加密"
+        source_path, _ = QFileDialog.getOpenFileName(self, f"选择要{action}的文件", "", "所有文件 (*.*)")
+        if not source_path:
+            return
+        if decrypt:
+            default_target = source_path[:-len(AES_FILE_SUFFIX)] if source_path.endswith(AES_FILE_SUFFIX) else source_path + ".dec"
+        else:
+            default_target = source_path + AES_FILE_SUFFIX
+        target_path, _ = QFileDialog.getSaveFileName(self, "保存到", default_target, "所有文件 (*.*)")
+        if not target_path:
+            return
+        if os.path.abspath(target_path) == os.path.abspath(source_path):
+            QMessageBox.warning(self, "路径错误", "输出文件不能与输入文件相同")
+            return
+        
+        progress = QProgressDialog(f"正在{action}文件...", "取消", 0, 1000, self)
+        progress.setWindowTitle(f"文件{action}")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+        
+        def on_progress(done_size, total_size, throughput):
+            if total_size > 0:
+                progress.setValue(int(done_size * 1000 / total_size))
+            progress.setLabelText(f"正在{action}文件... {done_size / (1024 * 1024):.1f} MB / "
+                                  f"{total_size / (1024 * 1024):.1f} MB，{throughput / (1024 * 1024):.1f} MB/s")
+        
+        def on_finished(target, elapsed):
+            progress.close()
+            self.aes_result.setPlainText(f"{action}完成：{target}\n耗时 {elapsed:.2f} 秒")
+        
+        def on_failed(error_text):
+            progress.close()
+            QMessageBox.critical(self, f"{action}错误", f"文件{action}失败：{error_text}")
+        
+        def on_cancelled():
+            progress.close()
+            QMessageBox.information(self, "已取消", f"文件{action}已取消，未生成输出文件")
+        
+        self.aes_thread = AesFileThread(key, source_path, target_path, decrypt, self)
+        self.aes_thread.progress_changed.connect(on_progress)
+        self.aes_thread.crypt_finished.connect(on_finished)
+        self.aes_thread.crypt_failed.connect(on_failed)
+        self.aes_thread.crypt_cancelled.connect(on_cancelled)
+        progress.canceled.connect(self.aes_thread.cancel)
+        self.aes_thread.start()
+    
     def aes_copy(self):
         """复制AES结果"""
         result = self.aes_result.toPlainText()
@@ -1203,42 +2960,86 @@ class ToolboxDialog(QDialog):
     
     # MD5校验功能
     def md5_browse_file(self):
-        """浏览文件"""
+        """浏览文件，可以同时选择多个"""
         from PyQt5.QtWidgets import QFileDialog
-        file_path, _ = QFileDialog.getOpenFileName(self, "选择文件", "", "所有文件 (*.*)")
-        if file_path:
-            self.md5_file_path.setText(file_path)
+        file_paths, _ = QFileDialog.getOpenFileNames(self, "选择文件", "", "所有文件 (*.*)")
+        if file_paths:
+            self.md5_files = file_paths
+            self.md5_file_path.setText("; ".join(file_paths))
             self.md5_text.clear()  # 清空文本输入，避免冲突
     
+    def format_hashes(self, hashes):
+        return "\n".join(f"{label}: {hashes[name]}" for name, label in HASH_ALGORITHMS)
+    
     def md5_calculate(self):
-        """计算MD5值"""
-        import hashlib
-        try:
-            file_path = self.md5_file_path.text()
-            text = self.md5_text.toPlainText()
-            
-            if file_path:
-                # 计算文件MD5
-                md5_hash = hashlib.md5()
-                with open(file_path, "rb") as f:
-                    for chunk in iter(lambda: f.read(4096), b""):
-                        md5_hash.update(chunk)
-                md5_value = md5_hash.hexdigest()
-            elif text:
-                # 计算文本MD5
-                md5_hash = hashlib.md5(text.encode('utf-8'))
-                md5_value = md5_hash.hexdigest()
-            else:
+        """计算哈希值，文件在后台线程中计算，可以查看进度和取消"""
+        file_paths = getattr(self, "md5_files", []) if self.md5_file_path.text() else []
+        text = self.md5_text.toPlainText()
+        if not file_paths:
+            if not text:
                 QMessageBox.warning(self, "输入为空", "请选择文件或输入文本")
                 return
-            
-            self.md5_result.setText(md5_value)
-        except Exception as e:
-            QMessageBox.critical(self, "计算错误", f"MD5计算失败：{str(e)}")
+            # 文本很短，直接在界面线程计算
+            data = text.encode('utf-8')
+            self.md5_result.setPlainText(self.format_hashes({name: hashlib.new(name, data).hexdigest()
+                                                             for name, _ in HASH_ALGORITHMS}))
+            return
+        
+        self.md5_result.clear()
+        results = {}
+        errors = {}
+        progress = QProgressDialog(f"正在计算 {len(file_paths)} 个文件的哈希值...", "取消", 0, 1000, self)
+        progress.setWindowTitle("文件校验")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)  # 小文件很快算完，不闪现进度条
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+        
+        def show_results():
+            blocks = []
+            for file_path in file_paths:
+                if file_path in results:
+                    blocks.append(f"{file_path}\n{self.format_hashes(results[file_path])}")
+                elif file_path in errors:
+                    blocks.append(f"{file_path}\n计算失败：{errors[file_path]}")
+            self.md5_result.setPlainText("\n\n".join(blocks))
+        
+        def on_progress(done_size, total_size, throughput):
+            if total_size > 0:
+                progress.setValue(int(done_size * 1000 / total_size))
+            progress.setLabelText(f"正在计算 {len(file_paths)} 个文件的哈希值... "
+                                  f"{done_size / (1024 * 1024):.1f} MB / {total_size / (1024 * 1024):.1f} MB，"
+                                  f"{throughput / (1024 * 1024):.1f} MB/s")
+        
+        def on_file_finished(file_path, hashes):
+            results[file_path] = hashes
+        
+        def on_file_failed(file_path, error_text):
+            errors[file_path] = error_text
+        
+        def on_finished(elapsed):
+            progress.close()
+            show_results()
+            if errors:
+                QMessageBox.warning(self, "计算错误", f"{len(errors)} 个文件计算失败，详见结果")
+        
+        def on_cancelled():
+            progress.close()
+            show_results()
+            QMessageBox.information(self, "已取消", "哈希计算已取消")
+        
+        self.hash_thread = FileHashThread(file_paths, parent=self)
+        self.hash_thread.progress_changed.connect(on_progress)
+        self.hash_thread.file_finished.connect(on_file_finished)
+        self.hash_thread.file_failed.connect(on_file_failed)
+        self.hash_thread.hash_finished.connect(on_finished)
+        self.hash_thread.hash_cancelled.connect(on_cancelled)
+        progress.canceled.connect(self.hash_thread.cancel)
+        self.hash_thread.start()
     
     def md5_copy(self):
-        """复制MD5结果"""
-        result = self.md5_result.text()
+        """复制哈希结果"""
+        result = self.md5_result.toPlainText()
         if result:
             clipboard = QApplication.clipboard()
             clipboard.setText(result)
@@ -1248,7 +3049,7 @@ class ToolboxDialog(QDialog):
     
     # 幂计算器功能
     def power_calculate(self):
-        """计算幂"""
+        """计算幂，整数结果精确计算，其余按设定的有效数字位数计算"""
         try:
             base_text = self.power_base.text()
             exponent_text = self.power_exponent.text()
@@ -1257,19 +3058,62 @@ class ToolboxDialog(QDialog):
                 QMessageBox.warning(self, "输入为空", "请输入底数和指数")
                 return
             
-            base = float(base_text)
-            exponent = float(exponent_text)
-            result = base ** exponent
-            
-            # 格式化结果
-            if result.is_integer():
-                result = int(result)
-            self.power_result.setText(str(result))
-        except ValueError:
-            QMessageBox.critical(self, "输入错误", "请输入有效的数字")
+            result = exact_power(parse_decimal(base_text), parse_decimal(exponent_text), self.power_precision.value())
+            self.power_result.setText(result)
+            self.power_result.setCursorPosition(0)
+        except ValueError as e:
+            QMessageBox.critical(self, "输入错误", str(e))
         except Exception as e:
             QMessageBox.critical(self, "计算错误", f"计算失败：{str(e)}")
     
+    def power_batch_calculate(self):
+        """批量计算幂，每行一个底数（使用上面的指数）或“底数,指数”"""
+        self.batch_calculate("power", self.power_exponent.text().strip(), "指数", self.power_precision.value())
+    
+    def batch_import_csv(self, batch_input):
+        """把CSV文件的内容读入批量输入框"""
+        from PyQt5.QtWidgets import QFileDialog
+        file_path, _ = QFileDialog.getOpenFileName(self, "导入CSV", "", "CSV文件 (*.csv);;文本文件 (*.txt);;所有文件 (*.*)")
+        if not file_path:
+            return
+        try:
+            with open(file_path, "r", encoding="utf-8-sig") as f:
+                batch_input.setPlainText(f.read())
+        except (OSError, UnicodeDecodeError) as e:
+            QMessageBox.critical(self, "导入错误", f"读取文件失败：{str(e)}")
+    
+    def batch_calculate(self, kind, default_second, second_name, precision):
+        """解析批量输入（逗号或制表符分隔，可带表头），计算后按"x,y,结果"逐行输出"""
+        batch_input = getattr(self, f"{kind}_batch_input")
+        text = batch_input.toPlainText()
+        rows = []
+        for record in csv.reader(text.splitlines(), csv.excel_tab if "\t" in text else csv.excel):
+            cells = [cell.strip() for cell in record if cell.strip()]
+            if not cells:
+                continue
+            rows.append((cells[0], cells[1] if len(cells) > 1 else default_second))
+        # 第一行不是数字时视为CSV表头
+        if rows:
+            try:
+                float(rows[0][0])
+            except ValueError:
+                rows.pop(0)
+        if not rows:
+            QMessageBox.warning(self, "输入为空", "请在批量输入框中每行输入一组数据，或导入CSV文件")
+            return
+        if any(not second for _, second in rows):
+            QMessageBox.warning(self, "输入为空", f"请在上方填写{second_name}，或每行写成“x,{second_name}”")
+            return
+        
+        start = time.perf_counter()
+        results, method = calc_batch(kind, rows, getattr(self, f"{kind}_batch_exact").isChecked(), precision)
+        elapsed = time.perf_counter() - start
+        failed = sum(1 for result in results if result.startswith("错误："))
+        getattr(self, f"{kind}_batch_result").setPlainText(
+            "\n".join(f"{x},{y},{result}" for (x, y), result in zip(rows, results)))
+        getattr(self, f"{kind}_batch_status").setText(
+            f"共 {len(rows)} 行（失败 {failed} 行），{method}，耗时 {elapsed * 1000:.1f} 毫秒")
+    
     def power_copy(self):
         """复制幂计算结果"""
         result = self.power_result.text()
@@ -1289,41 +3133,41 @@ class ToolboxDialog(QDialog):
             self.custom_root_index.setEnabled(False)
             self.custom_root_index.clear()
     
+    def root_index_text(self):
+        """当前选择的根指数文本，自定义但未填写时为空字符串"""
+        index = self.root_index.currentIndex()
+        if index == 0:  # 平方根
+            return "2"
+        elif index == 1:  # 立方根
+            return "3"
+        return self.custom_root_index.text().strip()  # 自定义
+    
     def root_calculate(self):
-        """计算根"""
+        """计算根，开得尽的整数根给出精确值，其余按设定的有效数字位数计算"""
         try:
             radicand_text = self.root_radicand.text()
             if not radicand_text:
                 QMessageBox.warning(self, "输入为空", "请输入被开方数")
                 return
             
-            radicand = float(radicand_text)
-            
             # 获取根指数
-            index = self.root_index.currentIndex()
-            if index == 0:  # 平方根
-                root_index = 2
-            elif index == 1:  # 立方根
-                root_index = 3
-            else:  # 自定义
-                custom_index_text = self.custom_root_index.text()
-                if not custom_index_text:
-                    QMessageBox.warning(self, "输入为空", "请输入自定义根指数")
-                    return
-                root_index = float(custom_index_text)
-            
-            # 计算根
-            result = radicand ** (1 / root_index)
+            root_index_text = self.root_index_text()
+            if not root_index_text:
+                QMessageBox.warning(self, "输入为空", "请输入自定义根指数")
+                return
             
-            # 格式化结果
-            if result.is_integer():
-                result = int(result)
-            self.root_result.setText(str(result))
-        except ValueError:
-            QMessageBox.critical(self, "输入错误", "请输入有效的数字")
+            result = exact_root(parse_decimal(radicand_text), parse_decimal(root_index_text), self.root_precision.value())
+            self.root_result.setText(result)
+            self.root_result.setCursorPosition(0)
+        except ValueError as e:
+            QMessageBox.critical(self, "输入错误", str(e))
         except Exception as e:
             QMessageBox.critical(self, "计算错误", f"计算失败：{str(e)}")
     
+    def root_batch_calculate(self):
+        """批量求根，每行一个被开方数（使用上面的根指数）或“被开方数,根指数”"""
+        self.batch_calculate("root", self.root_index_text(), "根指数", self.root_precision.value())
+    
     def root_copy(self):
         """复制求根结果"""
         result = self.root_result.text()
@@ -1334,6 +3178,663 @@ class ToolboxDialog(QDialog):
         else:
             QMessageBox.warning(self, "复制失败", "没有可复制的结果")
 
+class FileTransferTask:
+    """一次文件传输（发送或接收）的状态"""
+    def __init__(self, transfer_id, direction, peer, name, size, sha256, path):
+        self.id = transfer_id
+        self.direction = direction  # "send" 或 "receive"
+        self.peer = peer
+        self.name = name
+        self.size = size
+        self.sha256 = sha256
+        self.path = path  # 发送方为源文件路径，接收方为.part文件路径
+        self.transferred = 0  # 发送方：对方已确认的字节数；接收方：已写入的字节数
+        self.status = "等待对方接收" if direction == "send" else "等待确认"
+        self.finished = False
+        self.condition = threading.Condition()  # 发送线程等待确认窗口
+        self.rewind_to = None  # 接收方要求从该偏移重新发送
+        self.file = None  # 接收方正在写入的文件
+        self.hasher = None  # 接收方增量计算的SHA256
+
+class FileTransferManager(QObject):
+    """管理与其他用户之间的文件传输
+    控制消息为 FILE_*:<json>，文件内容通过带FRAME_FLAG_BINARY标志的分块帧发送，
+    发送方最多保持FILE_WINDOW_SIZE字节未确认，避免大文件挤占聊天消息。
+    """
+    offer_received = pyqtSignal(object)  # FileTransferTask，需要用户确认
+    transfers_changed = pyqtSignal()
+    transfer_message = pyqtSignal(str)  # 在聊天区域显示的提示
+    
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+        self.transfers = {}
+        self.lock = threading.Lock()
+        self.last_update = 0.0
+    
+    def notify_changed(self, force=False):
+        """通知界面刷新，传输过程中限制刷新频率"""
+        now = time.monotonic()
+        if force or now - self.last_update >= DOWNLOAD_PROGRESS_INTERVAL:
+            self.last_update = now
+            self.transfers_changed.emit()
+    
+    def send_control(self, command, **info):
+        self.client.send_to_server(f"{command}:" + json.dumps(info, ensure_ascii=False))
+    
+    def send_file(self, peer, path):
+        """向peer发送文件，先在后台计算SHA256再发出传输请求"""
+        name = os.path.basename(path)
+        size = os.path.getsize(path)
+        transfer_id = int.from_bytes(os.urandom(8), "big")
+        task = FileTransferTask(transfer_id, "send", peer, name, size, None, path)
+        task.status = "正在计算校验和"
+        with self.lock:
+            self.transfers[transfer_id] = task
+        self.notify_changed(force=True)
+        
+        def prepare():
+            try:
+                task.sha256 = file_sha256(path)
+                self.send_control("FILE_OFFER", id=transfer_id, to=peer, name=name, size=size, sha256=task.sha256)
+                task.status = "等待对方接收"
+            except OSError as e:
+                self.finish(task, f"发送失败：{str(e)}")
+            self.notify_changed(force=True)
+        threading.Thread(target=prepare, daemon=True).start()
+    
+    def accept(self, task):
+        """接收方同意接收，存在匹配的未完成文件时从断点继续"""
+        os.makedirs(FILE_RECEIVE_DIR, exist_ok=True)
+        task.path = os.path.join(FILE_RECEIVE_DIR, task.name + ".part")
+        meta_file = task.path + ".json"
+        offset = 0
+        try:
+            with open(meta_file, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("sha256") == task.sha256 and meta.get("size") == task.size and os.path.exists(task.path):
+                offset = min(os.path.getsize(task.path), task.size)
+        except (OSError, ValueError):
+            pass
+        
+        try:
+            task.hasher = hashlib.sha256()
+            if offset:
+                # 续传时先把已有部分计入SHA256
+                with open(task.path, "rb") as f:
+                    remaining = offset
+                    while remaining:
+                        block = f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                        if not block:
+                            break
+                        task.hasher.update(block)
+                        remaining -= len(block)
+            task.file = open(task.path, "r+b" if offset else "wb")
+            task.file.truncate(offset)
+            task.file.seek(offset)
+            with open(meta_file, "w", encoding="utf-8") as f:
+                json.dump({"sha256": task.sha256, "size": task.size, "from": task.peer}, f)
+        except OSError as e:
+            self.send_control("FILE_CANCEL", id=task.id, reason="接收方无法写入文件")
+            self.finish(task, f"无法保存文件：{str(e)}")
+            return
+        
+        task.transferred = offset
+        task.status = "传输中" if offset == 0 else f"从 {offset / (1024 * 1024):.2f} MB 处继续"
+        self.send_control("FILE_ACCEPT", id=task.id, offset=offset)
+        if offset >= task.size:
+            self.complete_receive(task)
+        self.notify_changed(force=True)
+    
+    def reject(self, task):
+        self.send_control("FILE_REJECT", id=task.id)
+        self.finish(task, "已拒绝")
+    
+    def cancel(self, transfer_id):
+        """取消传输，接收方保留已下载的部分以便续传"""
+        with self.lock:
+            task = self.transfers.get(transfer_id)
+        if task is None or task.finished:
+            return
+        try:
+            self.send_control("FILE_CANCEL", id=task.id, reason=f"{self.client.nickname} 取消了传输")
+        except OSError:
+            pass
+        self.finish(task, "已取消")
+    
+    def reset(self, reason):
+        """连接断开时结束所有进行中的传输"""
+        with self.lock:
+            tasks = [task for task in self.transfers.values() if not task.finished]
+        for task in tasks:
+            self.finish(task, reason)
+    
+    def finish(self, task, status):
+        with task.condition:
+            if task.finished:
+                return
+            task.finished = True
+            task.status = status
+            task.condition.notify_all()
+            if task.file:
+                task.file.close()
+                task.file = None
+        self.notify_changed(force=True)
+    
+    def handle_control(self, command, body):
+        """处理服务器转发的FILE_*控制消息（在接收线程中调用）"""
+        try:
+            info = json.loads(body)
+            if command == "FILE_OFFER":
+                task = FileTransferTask(int(info["id"]), "receive", info.get("from", ""),
+                                        os.path.basename(str(info.get("name", ""))) or "未命名文件",
+                                        int(info["size"]), str(info.get("sha256", "")), None)
+        except (ValueError, KeyError, TypeError):
+            return
+        
+        if command == "FILE_OFFER":
+            with self.lock:
+                self.transfers[task.id] = task
+            self.notify_changed(force=True)
+            self.offer_received.emit(task)
+            return
+        
+        with self.lock:
+            task = self.transfers.get(info.get("id"))
+        if task is None or task.finished:
+            if command == "FILE_ERROR" and info.get("reason"):
+                self.transfer_message.emit(f"系统: 文件传输失败：{info['reason']}")
+            return
+        
+        if command == "FILE_ACCEPT" and task.direction == "send":
+            task.transferred = int(info.get("offset", 0))
+            task.status = "传输中"
+            threading.Thread(target=self._send_worker, args=(task,), daemon=True).start()
+        elif command == "FILE_ACK" and task.direction == "send":
+            with task.condition:
+                task.transferred = max(task.transferred, int(info.get("offset", 0)))
+                task.condition.notify_all()
+        elif command == "FILE_RESUME" and task.direction == "send":
+            with task.condition:
+                task.rewind_to = int(info.get("offset", 0))
+                task.condition.notify_all()
+        elif command == "FILE_COMPLETE" and task.direction == "send":
+            if info.get("ok"):
+                task.transferred = task.size
+                self.finish(task, "已完成")
+                self.transfer_message.emit(f"系统: 文件 {task.name} 已发送给 {task.peer}")
+            else:
+                self.finish(task, "对方校验失败")
+        elif command == "FILE_REJECT":
+            self.finish(task, "对方已拒绝")
+        elif command in ("FILE_CANCEL", "FILE_ERROR"):
+            self.finish(task, f"已中止：{info.get('reason', '')}")
+        self.notify_changed()
+    
+    def handle_chunk(self, payload):
+        """写入收到的文件分块并确认（在接收线程中调用）"""
+        if len(payload) < FILE_CHUNK_HEADER.size:
+            return
+        transfer_id, offset, crc = FILE_CHUNK_HEADER.unpack_from(payload)
+        data = payload[FILE_CHUNK_HEADER.size:]
+        with self.lock:
+            task = self.transfers.get(transfer_id)
+        if task is None or task.direction != "receive":
+            return
+        # 与界面线程的取消操作互斥，避免写入已关闭的文件
+        with task.condition:
+            if task.finished or task.file is None:
+                return
+            if offset != task.transferred:
+                # 要求重发后，重发之前已在途的分块直接丢弃
+                return
+            if zlib.crc32(data) != crc:
+                self.send_control("FILE_RESUME", id=task.id, offset=task.transferred)
+                return
+            
+            task.file.write(data)
+            task.hasher.update(data)
+            task.transferred += len(data)
+            self.send_control("FILE_ACK", id=task.id, offset=task.transferred)
+            if task.transferred >= task.size:
+                self.complete_receive(task)
+        self.notify_changed()
+    
+    def complete_receive(self, task):
+        """接收完成后校验SHA256并移到最终文件名"""
+        task.file.close()
+        task.file = None
+        meta_file = task.path + ".json"
+        if task.hasher.hexdigest() != task.sha256:
+            os.remove(task.path)
+            os.remove(meta_file)
+            self.send_control("FILE_COMPLETE", id=task.id, ok=False)
+            self.finish(task, "校验失败，已删除")
+            return
+        
+        # 重名时自动添加序号，不覆盖已有文件
+        base, ext = os.path.splitext(task.name)
+        final_path = os.path.join(FILE_RECEIVE_DIR, task.name)
+        index = 1
+        while os.path.exists(final_path):
+            final_path = os.path.join(FILE_RECEIVE_DIR, f"{base} ({index}){ext}")
+            index += 1
+        try:
+            os.replace(task.path, final_path)
+            os.remove(meta_file)
+        except OSError as e:
+            self.send_control("FILE_COMPLETE", id=task.id, ok=False)
+            self.finish(task, f"无法保存文件：{str(e)}")
+            return
+        task.path = final_path
+        self.send_control("FILE_COMPLETE", id=task.id, ok=True)
+        self.finish(task, "已完成")
+        self.transfer_message.emit(f"系统: 已收到 {task.peer} 发送的文件 {os.path.basename(final_path)}")
+    
+    def _send_worker(self, task):
+        """按确认窗口发送文件分块，聊天消息可以在分块之间插入"""
+        try:
+            with open(task.path, "rb") as f:
+                position = task.transferred
+                while True:
+                    with task.condition:
+                        while (not task.finished and task.rewind_to is None
+                               and (position >= task.size or position - task.transferred >= FILE_WINDOW_SIZE)):
+                            task.condition.wait()
+                        if task.finished:
+                            return
+                        if task.rewind_to is not None:
+                            position = task.rewind_to
+                            task.rewind_to = None
+                    f.seek(position)
+                    data = f.read(FILE_CHUNK_SIZE)
+                    if not data:
+                        raise OSError("源文件已被修改")
+                    self.client.send_binary_to_server(FILE_CHUNK_HEADER.pack(task.id, position, zlib.crc32(data)) + data)
+                    position += len(data)
+        except OSError as e:
+            try:
+                self.send_control("FILE_CANCEL", id=task.id, reason="发送方读取文件失败")
+            except OSError:
+                pass
+            self.finish(task, f"发送失败：{str(e)}")
+
+class FileTransferDialog(QDialog):
+    """文件传输管理窗口"""
+    def __init__(self, manager, parent=None):
+        super().__init__(parent)
+        self.manager = manager
+        self.setWindowTitle("文件传输")
+        self.setMinimumSize(560, 360)
+        
+        layout = QVBoxLayout(self)
+        self.transfer_list = QListWidget()
+        self.transfer_list.setStyleSheet("font-size: 14px; font-family: 'Microsoft YaHei', SimSun, sans-serif;")
+        layout.addWidget(self.transfer_list)
+        
+        button_layout = QHBoxLayout()
+        cancel_button = QPushButton("取消选中的传输")
+        cancel_button.clicked.connect(self.cancel_selected)
+        open_button = QPushButton("打开接收文件夹")
+        open_button.clicked.connect(self.open_receive_dir)
+        clear_button = QPushButton("清除已结束")
+        clear_button.clicked.connect(self.clear_finished)
+        button_layout.addWidget(cancel_button)
+        button_layout.addWidget(open_button)
+        button_layout.addWidget(clear_button)
+        layout.addLayout(button_layout)
+        
+        manager.transfers_changed.connect(self.refresh)
+        self.refresh()
+    
+    def refresh(self):
+        with self.manager.lock:
+            tasks = list(self.manager.transfers.values())
+        selected = self.transfer_list.currentItem()
+        selected_id = selected.data(Qt.UserRole) if selected else None
+        self.transfer_list.clear()
+        for task in tasks:
+            arrow = "↑ 发送给" if task.direction == "send" else "↓ 来自"
+            if task.size:
+                percent = task.transferred * 100 / task.size
+                progress_text = f"{percent:.0f}% ({task.transferred / (1024 * 1024):.2f} MB / {task.size / (1024 * 1024):.2f} MB)"
+            else:
+                progress_text = "0 MB"
+            item = QListWidgetItem(f"{arrow} {task.peer}  {task.name}  {progress_text}  {task.status}")
+            item.setData(Qt.UserRole, task.id)
+            self.transfer_list.addItem(item)
+            if task.id == selected_id:
+                self.transfer_list.setCurrentItem(item)
+    
+    def cancel_selected(self):
+        item = self.transfer_list.currentItem()
+        if item:
+            self.manager.cancel(item.data(Qt.UserRole))
+    
+    def clear_finished(self):
+        with self.manager.lock:
+            for transfer_id in [task.id for task in self.manager.transfers.values() if task.finished]:
+                del self.manager.transfers[transfer_id]
+        self.refresh()
+    
+    def open_receive_dir(self):
+        from PyQt5.QtGui import QDesktopServices
+        from PyQt5.QtCore import QUrl
+        os.makedirs(FILE_RECEIVE_DIR, exist_ok=True)
+        QDesktopServices.openUrl(QUrl.fromLocalFile(os.path.abspath(FILE_RECEIVE_DIR)))
+
+class MentionMatcher:
+    """查找文本中的提醒词（@昵称和关键字），不区分英文大小写，昵称或关键字变化时重新构建
+    所有提醒词编译成一个正则，长的在前，同一位置取最长的提醒词；每次从上一个命中的下一个字符继续查找，
+    互相重叠的提醒词（如abc和bcd）也都能标出
+    """
+    def __init__(self, patterns=()):
+        patterns = sorted({pattern for pattern in patterns if pattern}, key=len, reverse=True)
+        self.expression = None
+        if patterns:
+            self.expression = re.compile("|".join(re.escape(pattern) for pattern in patterns), re.IGNORECASE)
+    
+    def find(self, text):
+        """返回提醒词在text中的位置[(起点, 终点)]，按起点排序，重叠或相邻的区间已合并"""
+        if self.expression is None:
+            return []
+        spans = []
+        search = self.expression.search
+        match = search(text)
+        while match:
+            start, end = match.span()
+            if spans and spans[-1][1] >= start:
+                if end > spans[-1][1]:
+                    spans[-1] = (spans[-1][0], end)
+            else:
+                spans.append((start, end))
+            match = search(text, start + 1)
+        return spans
+
+def highlight_mentions(text, matcher):
+    """用背景色标出text中的提醒词，返回(HTML, 是否包含提醒词)"""
+    spans = matcher.find(text)
+    if not spans:
+        return text, False
+    parts = []
+    last = 0
+    for start, end in spans:
+        parts.append(text[last:start])
+        parts.append(f'<span style="background-color: {MENTION_HIGHLIGHT_COLOR};">{text[start:end]}</span>')
+        last = end
+    parts.append(text[last:])
+    return "".join(parts), True
+
+class NotificationTray(QFrame):
+    """聊天区域上方的非模态通知栏，不阻塞界面
+    通知先进入队列，NOTIFY_COALESCE_INTERVAL后一起显示；同一标题的通知合并为一条并累计条数，
+    NOTIFY_DISPLAY_TIME秒内没有新的同类通知时自动移除
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setObjectName("notificationTray")
+        self.setStyleSheet("""
+            QFrame#notificationTray {
+                background-color: rgba(255, 248, 225, 0.9);
+                border: 1px solid rgba(255, 193, 7, 0.6);
+                border-radius: 10px;
+            }
+            QLabel {
+                font-size: 14px;
+                color: #5D4037;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+            }
+        """)
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(12, 6, 6, 6)
+        self.entries_layout = QVBoxLayout()
+        self.entries_layout.setSpacing(2)
+        layout.addLayout(self.entries_layout, 1)
+        clear_button = QPushButton("×")
+        clear_button.setFixedSize(24, 24)
+        clear_button.setToolTip("清除所有通知")
+        clear_button.setStyleSheet("QPushButton { border: none; font-size: 16px; color: #8D6E63; }")
+        clear_button.clicked.connect(self.clear)
+        layout.addWidget(clear_button, alignment=Qt.AlignTop)
+        
+        self.pending = []  # 等待显示的通知，格式: [(标题, 发送者, 内容)]
+        self.entries = {}  # 正在显示的通知，格式: {标题: {"label", "senders", "count", "content", "expire"}}
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.timeout.connect(self.flush)
+        self.expire_timer = QTimer(self)
+        self.expire_timer.timeout.connect(self.expire)
+        self.hide()
+    
+    def push(self, title, content, sender=None):
+        """加入一条通知，立即返回"""
+        self.pending.append((title, sender, content))
+        if not self.flush_timer.isActive():
+            self.flush_timer.start(NOTIFY_COALESCE_INTERVAL)
+    
+    def flush(self):
+        pending, self.pending = self.pending, []
+        expire = time.monotonic() + NOTIFY_DISPLAY_TIME
+        for title, sender, content in pending:
+            entry = self.entries.get(title)
+            if entry is None:
+                label = QLabel()
+                label.setTextFormat(Qt.PlainText)
+                self.entries_layout.addWidget(label)
+                entry = self.entries[title] = {"label": label, "senders": [], "count": 0}
+            if sender is not None and sender not in entry["senders"]:
+                entry["senders"].append(sender)
+            entry["count"] += 1
+            entry["content"] = content
+            entry["expire"] = expire
+        for title in list(self.entries)[:-NOTIFY_MAX_ENTRIES]:
+            self.remove(title)
+        for title, entry in self.entries.items():
+            entry["label"].setText(self.entry_text(title, entry))
+        if self.entries:
+            self.show()
+            self.expire_timer.start(1000)
+            # 窗口不在前台时闪烁任务栏
+            QApplication.alert(self.window())
+    
+    def entry_text(self, title, entry):
+        senders = entry["senders"]
+        if senders:
+            names = "、".join(senders[:3]) + (f" 等{len(senders)}人" if len(senders) > 3 else "")
+            text = f"{title}：{names} 提到了你"
+        else:
+            text = title
+        if entry["count"] > 1:
+            text += f"（{entry['count']}条）"
+        content = entry["content"]
+        if len(content) > 60:
+            content = content[:60] + "…"
+        return f"{text}：{content}"
+    
+    def remove(self, title):
+        entry = self.entries.pop(title)
+        self.entries_layout.removeWidget(entry["label"])
+        entry["label"].deleteLater()
+    
+    def expire(self):
+        now = time.monotonic()
+        for title in [title for title, entry in self.entries.items() if entry["expire"] <= now]:
+            self.remove(title)
+        if not self.entries:
+            self.expire_timer.stop()
+            self.hide()
+    
+    def clear(self):
+        self.pending = []
+        self.flush_timer.stop()
+        for title in list(self.entries):
+            self.remove(title)
+        self.expire_timer.stop()
+        self.hide()
+
+class MessageStore:
+    """本地消息记录（SQLite），按服务器（ip:port）保存聊天区域显示过的消息
+    写入只放入队列，由后台线程把积压的消息合并成一个事务写入，不阻塞界面线程；
+    读取使用界面线程自己的连接，WAL模式下读取不会被正在进行的写入阻塞。
+    """
+    def __init__(self, path=HISTORY_DB_FILE):
+        self.path = path
+        self.queue = queue.Queue()
+        self.writer_thread = None
+        self.reader = None  # 只在界面线程中使用
+    
+    def open_connection(self):
+        connection = sqlite3.connect(self.path, timeout=5)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")  # WAL模式下只在检查点时fsync，断电最多丢失最近的几条
+        connection.execute("""CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            server TEXT NOT NULL,
+            time REAL NOT NULL,
+            is_self INTEGER NOT NULL,
+            text TEXT NOT NULL)""")
+        connection.execute("CREATE INDEX IF NOT EXISTS messages_server ON messages (server, id)")
+        connection.commit()
+        return connection
+    
+    def append(self, server, text, is_self=False):
+        """记录一条消息，立即返回"""
+        if self.writer_thread is None:
+            self.writer_thread = threading.Thread(target=self.writer_loop, daemon=True)
+            self.writer_thread.start()
+        self.queue.put((server, time.time(), int(is_self), text))
+    
+    def writer_loop(self):
+        try:
+            connection = self.open_connection()
+        except sqlite3.Error as e:
+            print(f"打开消息记录失败: {str(e)}")
+            connection = None
+        while True:
+            rows = [self.queue.get()]
+            while len(rows) < HISTORY_BATCH_SIZE:
+                try:
+                    rows.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            messages = [row for row in rows if row is not None]
+            if connection is not None and messages:
+                try:
+                    with connection:
+                        connection.executemany("INSERT INTO messages (server, time, is_self, text) VALUES (?, ?, ?, ?)",
+                                               messages)
+                except sqlite3.Error as e:
+                    print(f"写入消息记录失败: {str(e)}")
+            for _ in rows:
+                self.queue.task_done()
+            if len(messages) < len(rows):
+                break
+        if connection is not None:
+            connection.close()
+    
+    def flush(self):
+        """等待已记录的消息全部写入"""
+        if self.writer_thread is not None and self.writer_thread.is_alive():
+            self.queue.join()
+    
+    def query(self, sql, parameters=()):
+        self.flush()
+        try:
+            if self.reader is None:
+                self.reader = self.open_connection()
+            return self.reader.execute(sql, parameters).fetchall()
+        except sqlite3.Error as e:
+            print(f"读取消息记录失败: {str(e)}")
+            return []
+    
+    def recent(self, server, limit=HISTORY_RESTORE_LIMIT):
+        """server最近的limit条消息，按时间从早到晚排列，格式: [(时间, 是否自己发送, 内容)]"""
+        rows = self.query("SELECT time, is_self, text FROM messages WHERE server = ? ORDER BY id DESC LIMIT ?",
+                          (server, limit))
+        return rows[::-1]
+    
+    def search(self, keyword, server=None, limit=HISTORY_SEARCH_LIMIT):
+        """搜索包含keyword的消息（不区分英文大小写），server为None时搜索所有服务器，最新的在前
+        格式: [(服务器, 时间, 是否自己发送, 内容)]
+        """
+        pattern = "%" + keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        sql = "SELECT server, time, is_self, text FROM messages WHERE text LIKE ? ESCAPE '\\'"
+        parameters = [pattern]
+        if server is not None:
+            sql += " AND server = ?"
+            parameters.append(server)
+        sql += " ORDER BY id DESC LIMIT ?"
+        parameters.append(limit)
+        return self.query(sql, parameters)
+    
+    def servers(self):
+        """有记录的服务器，最近有消息的在前，格式: [(服务器, 消息数)]"""
+        return self.query("SELECT server, COUNT(*) FROM messages GROUP BY server ORDER BY MAX(id) DESC")
+    
+    def close(self):
+        if self.writer_thread is not None:
+            self.queue.put(None)
+            self.writer_thread.join(5)
+            self.writer_thread = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+class HistoryDialog(QDialog):
+    """搜索本地消息记录，不需要连接服务器"""
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.setWindowTitle("聊天记录")
+        self.setMinimumSize(680, 420)
+        
+        layout = QVBoxLayout(self)
+        search_layout = QHBoxLayout()
+        self.server_combo = QComboBox()
+        self.server_combo.currentIndexChanged.connect(self.search)
+        self.keyword_entry = QLineEdit()
+        self.keyword_entry.setPlaceholderText("输入关键字后回车搜索，留空显示最近的消息")
+        self.keyword_entry.returnPressed.connect(self.search)
+        search_button = QPushButton("搜索")
+        search_button.clicked.connect(self.search)
+        search_layout.addWidget(self.server_combo)
+        search_layout.addWidget(self.keyword_entry, 1)
+        search_layout.addWidget(search_button)
+        layout.addLayout(search_layout)
+        
+        self.result_list = QListWidget()
+        self.result_list.setWordWrap(True)
+        self.result_list.setStyleSheet("font-size: 14px; font-family: 'Microsoft YaHei', SimSun, sans-serif;")
+        layout.addWidget(self.result_list)
+        self.status_label = QLabel("")
+        self.status_label.setStyleSheet("color: #666; font-size: 13px;")
+        layout.addWidget(self.status_label)
+    
+    def refresh_servers(self, current=None):
+        """重新读取有记录的服务器列表，current为默认选中的服务器"""
+        self.server_combo.blockSignals(True)
+        self.server_combo.clear()
+        self.server_combo.addItem("全部服务器", None)
+        for server, count in self.store.servers():
+            self.server_combo.addItem(f"{server}（{count}条）", server)
+        index = self.server_combo.findData(current)
+        self.server_combo.setCurrentIndex(max(index, 0))
+        self.server_combo.blockSignals(False)
+    
+    def search(self):
+        keyword = self.keyword_entry.text().strip()
+        start = time.perf_counter()
+        rows = self.store.search(keyword, self.server_combo.currentData())
+        elapsed = time.perf_counter() - start
+        self.result_list.clear()
+        for server, timestamp, is_self, text in rows:
+            sender = "我: " if is_self else ""
+            self.result_list.addItem(f"[{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))}] {server}  {sender}{text}")
+        status = f"找到 {len(rows)} 条消息"
+        if len(rows) >= HISTORY_SEARCH_LIMIT:
+            status += f"（只显示最近的 {HISTORY_SEARCH_LIMIT} 条）"
+        self.status_label.setText(f"{status}，耗时 {elapsed * 1000:.1f} ms")
+
 class ChatClient(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -1344,28 +3845,90 @@ class ChatClient(QMainWindow):
         self.online_users = []
         self.is_muted = False  # 跟踪用户是否被禁言
         self.showing_reconnect_dialog = False  # 跟踪是否已经显示了重连对话框
+        self.framed = False  # 是否与服务器使用长度前缀帧通信
+        self.session_caps = set()  # 与服务器协商启用的协议扩展
+        self.requested_caps = set()  # 回复CAPS时请求启用的协议扩展
+        self.caps_pending = False  # 已回复CAPS但服务器尚未确定协议，此期间按原始协议接收，发送的消息先暂存
+        self.caps_outbox = []  # 协议确定前暂存的待发送消息
+        self.caps_probe = b""  # 判断服务器协议时不足一个帧头的数据
+        self.server_heartbeat_timeout = None
+        self.frame_reader = FrameReader()
+        self.pending_messages = deque()  # 已收到但尚未处理的消息
+        self.send_lock = threading.Lock()  # 界面线程和接收线程都会发送数据
+        self.toolbox_dialog = None  # 工具箱首次打开时创建
+        self.update_assets = []  # 最新发行版的附件列表，用于查找校验和
+        self.file_manager = FileTransferManager(self)
+        self.tls_context = None  # 首次使用加密连接时创建，重连时复用
+        self.tls_sessions = {}  # 每个服务器最近一次的TLS会话，重连时用于会话复用，格式: {"ip:port": SSLSession}
+        self.server_address = None  # 最近一次成功连接的服务器 (ip, port)，用于生成地址二维码
+        self.server_tls = False
+        self.discovery_thread = None
+        self.discovered_servers = {}  # 局域网搜索到的服务器，格式: {(ip, port): 服务器信息}
+        self.message_store = MessageStore()
+        self.history_server = None  # 当前聊天记录所属的服务器 "ip:port"，连接成功后设置
+        self.history_dialog = None
+        self.mention_keywords = self.load_mention_keywords()
+        self.mention_matcher = MentionMatcher()
+        # 接收线程按消息类型分派的处理函数
+        self.message_handlers = {
+            ChatMessage: self.handle_chat,
+            UsersListMessage: self.handle_users_list,
+            ProfileMessage: self.handle_profile,
+            ProfileErrorMessage: self.handle_profile_error,
+            FileControlMessage: self.handle_file_control,
+            KickedMessage: self.handle_kicked,
+            ShutdownMessage: self.handle_shutdown,
+            MutedMessage: self.handle_muted,
+            UnmutedMessage: self.handle_unmuted,
+            OpMessage: self.handle_op,
+            UnopMessage: self.handle_unop,
+        }
+        self.file_transfer_dialog = None
+        self.download_thread = None
+        self.startup_tasks_scheduled = False
         self.initUI()
         self.setup_signals()
-        # 连接服务器界面显示后1秒获取一言
-        QTimer.singleShot(1000, self.get_hitokoto)
     
     def showEvent(self, event):
         """窗口显示时调用"""
         super().showEvent(event)
-        # 主窗口加载后500ms自动检查更新
-        QTimer.singleShot(500, self.check_for_updates)
+        # 最小化后恢复也会触发showEvent，启动任务只安排一次
+        if self.startup_tasks_scheduled:
+            return
+        self.startup_tasks_scheduled = True
+        # 窗口显示后再在后台加载壁纸和一言，不阻塞首屏
+        QTimer.singleShot(0, self.load_wallpaper_async)
+        QTimer.singleShot(0, self.get_hitokoto)
+        QTimer.singleShot(0, self.start_server_discovery)
+        # 启动完成后再自动检查更新
+        QTimer.singleShot(3000, self.check_for_updates)
 
     def get_wallpaper(self):
         """从https://t.alcy.cc/moe获取壁纸"""
         try:
             url = "https://t.alcy.cc/moe"
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
+            # 每次返回随机壁纸，只复用连接不缓存
+            response = http_client.get(url, timeout=10)
             return response.content
         except Exception as e:
             print(f"获取壁纸失败: {str(e)}")
             return None
     
+    def load_wallpaper_async(self):
+        """在后台线程中获取启动壁纸"""
+        def worker():
+            wallpaper_data = self.get_wallpaper()
+            if wallpaper_data:
+                self.comm.wallpaper_loaded.emit(wallpaper_data)
+        threading.Thread(target=worker, daemon=True).start()
+    
+    def on_wallpaper_loaded(self, wallpaper_data):
+        """启动壁纸获取完成，用户已手动换过壁纸时不覆盖"""
+        if self._wallpaper_data:
+            return
+        self._wallpaper_data = wallpaper_data
+        self._apply_wallpaper(wallpaper_data)
+    
     def update_window_title(self):
         """更新窗口标题，包含一言内容"""
         current_title = self.windowTitle()
@@ -1469,18 +4032,8 @@ class ChatClient(QMainWindow):
         self.setCentralWidget(central_widget)
         main_layout = QVBoxLayout(central_widget)
         
-        # 设置窗口背景壁纸
-        self._wallpaper_data = self.get_wallpaper()
-        if self._wallpaper_data:
-            pixmap = QPixmap()
-            pixmap.loadFromData(self._wallpaper_data)
-            palette = self.palette()
-            brush = QBrush(pixmap.scaled(
-                self.size(), Qt.IgnoreAspectRatio, Qt.SmoothTransformation
-            ))
-            palette.setBrush(self.backgroundRole(), brush)
-            self.setPalette(palette)
-            self.setAutoFillBackground(True)
+        # 窗口背景壁纸在窗口显示后由后台线程加载
+        self._wallpaper_data = None
 
         # 连接界面
         self.connect_frame = QFrame()
@@ -1623,6 +4176,84 @@ QFrame#formContainer {
         nick_layout.addWidget(self.nick_entry)
         form_layout.addLayout(nick_layout)
 
+        # 加密连接选项
+        self.tls_checkbox = QCheckBox("加密连接（TLS）")
+        self.tls_checkbox.setToolTip("服务器开启tls_mode后可用，首次连接会记录服务器证书指纹")
+        self.tls_checkbox.setStyleSheet("""
+            QCheckBox {
+                font-size: 16px;
+                color: #555;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+            }
+        """)
+        form_layout.addWidget(self.tls_checkbox, alignment=Qt.AlignCenter)
+        
+        # 局域网服务器列表
+        discovery_layout = QHBoxLayout()
+        discovery_layout.setSpacing(15)
+        discovery_label = QLabel("局域网服务器:")
+        discovery_label.setStyleSheet("""
+            QLabel {
+                font-size: 18px;
+                font-weight: bold;
+                color: #555;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+                min-width: 120px;
+                text-align: right;
+            }
+        """)
+        self.server_list = QListWidget()
+        self.server_list.setObjectName("serverList")
+        self.server_list.setMaximumHeight(110)
+        self.server_list.setToolTip("按往返延迟从低到高排列，单击填入地址，双击直接连接")
+        self.server_list.itemClicked.connect(self.on_server_selected)
+        self.server_list.itemDoubleClicked.connect(self.on_server_activated)
+        self.server_list.setStyleSheet("""
+            QListWidget#serverList {
+                background-color: rgba(245, 245, 245, 0.3);
+                border: none;
+                border-radius: 10px;
+                padding: 4px;
+                font-size: 14px;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+            }
+            QListWidget#serverList::item {
+                padding: 4px 8px;
+                border-radius: 6px;
+            }
+            QListWidget#serverList::item:hover {
+                background-color: rgba(33, 150, 243, 0.1);
+            }
+            QListWidget#serverList::item:selected {
+                background-color: rgba(33, 150, 243, 0.2);
+                color: #2196F3;
+            }
+        """)
+        self.discover_button = QPushButton("搜索")
+        self.discover_button.setObjectName("discoverButton")
+        self.discover_button.clicked.connect(self.start_server_discovery)
+        self.discover_button.setStyleSheet("""
+            QPushButton#discoverButton {
+                background-color: rgba(33, 150, 243, 0.8);
+                color: white;
+                border: none;
+                border-radius: 10px;
+                padding: 8px 16px;
+                font-size: 16px;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+            }
+            QPushButton#discoverButton:hover {
+                background-color: rgba(25, 118, 210, 0.9);
+            }
+            QPushButton#discoverButton:disabled {
+                background-color: rgba(158, 158, 158, 0.8);
+            }
+        """)
+        discovery_layout.addWidget(discovery_label)
+        discovery_layout.addWidget(self.server_list)
+        discovery_layout.addWidget(self.discover_button, alignment=Qt.AlignTop)
+        form_layout.addLayout(discovery_layout)
+        
         # 状态标签
         self.status_label = QLabel("")
         self.status_label.setStyleSheet("""
@@ -1686,6 +4317,27 @@ QFrame#formContainer {
         """)
         button_layout.addWidget(self.check_update_button)
 
+        # 聊天记录按钮，未连接时也可以搜索
+        self.history_button = QPushButton("聊天记录")
+        self.history_button.setObjectName("historyButton")
+        self.history_button.clicked.connect(self.show_history)
+        self.history_button.setStyleSheet("""
+            QPushButton#historyButton {
+                background-color: rgba(255, 152, 0, 0.8);
+                color: white;
+                border: none;
+                border-radius: 25px;
+                padding: 15px 40px;
+                font-size: 18px;
+                font-weight: bold;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+            }
+            QPushButton#historyButton:hover {
+                background-color: rgba(245, 124, 0, 0.9);
+            }
+        """)
+        button_layout.addWidget(self.history_button)
+        
         form_layout.addLayout(button_layout)
         connect_layout.addWidget(form_container)
         
@@ -1701,15 +4353,103 @@ QFrame#formContainer {
                 margin: 15px 0;
             }
         """)
-        self.hitokoto_label.setAlignment(Qt.AlignCenter)
-        connect_layout.addWidget(self.hitokoto_label)
+        self.hitokoto_label.setAlignment(Qt.AlignCenter)
+        connect_layout.addWidget(self.hitokoto_label)
+        
+        # 作者信息
+        self.author_label = QLabel("作者: MVP")
+        self.author_label.setStyleSheet("color: #666; font-size: 16px; font-family: 'Microsoft YaHei', SimSun, sans-serif;")
+        self.author_label.setAlignment(Qt.AlignCenter)
+        connect_layout.addWidget(self.author_label)
+
+        # 聊天界面在首次连接成功时才创建，缩短启动时间
+        self.chat_frame = None
+        
+        # 添加右下角换壁纸按钮
+        self.change_wallpaper_button = QPushButton("换壁纸")
+        self.change_wallpaper_button.setObjectName("changeWallpaperButton")
+        self.change_wallpaper_button.clicked.connect(self.update_wallpaper)
+        self.change_wallpaper_button.setStyleSheet("""
+            QPushButton#changeWallpaperButton {
+                background-color: rgba(156, 39, 176, 0.8);
+                color: white;
+                border: none;
+                border-radius: 20px;
+                padding: 10px 20px;
+                font-size: 14px;
+                font-weight: bold;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+            }
+            QPushButton#changeWallpaperButton:hover {
+                background-color: rgba(136, 32, 155, 0.9);
+            }
+            QPushButton#changeWallpaperButton:pressed {
+                background-color: rgba(111, 27, 128, 0.9);
+            }
+        """)
+        
+        # 创建底部布局，用于放置换壁纸按钮
+        bottom_layout = QHBoxLayout()
+        bottom_layout.setContentsMargins(10, 10, 10, 10)
+        bottom_layout.addWidget(self.change_wallpaper_button)  # 左侧放置按钮
+        bottom_layout.addStretch()  # 右侧拉伸，将按钮固定在左下角
+        
+        # 添加工具箱按钮到主布局
+        self.toolbox_button = QPushButton("工具箱")
+        self.toolbox_button.setObjectName("toolboxButton")
+        self.toolbox_button.setStyleSheet("""
+            QPushButton#toolboxButton {
+                background-color: rgba(156, 39, 176, 0.8);
+                color: white;
+                border: none;
+                border-radius: 20px;
+                padding: 10px 20px;
+                font-size: 14px;
+                font-weight: bold;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+            }
+            QPushButton#toolboxButton:hover {
+                background-color: rgba(136, 32, 155, 0.9);
+            }
+        """)
+        self.toolbox_button.clicked.connect(self.show_toolbox)
+        
+        # 文件传输管理按钮
+        self.file_transfer_button = QPushButton("文件传输")
+        self.file_transfer_button.setObjectName("fileTransferButton")
+        self.file_transfer_button.setStyleSheet("""
+            QPushButton#fileTransferButton {
+                background-color: rgba(156, 39, 176, 0.8);
+                color: white;
+                border: none;
+                border-radius: 20px;
+                padding: 10px 20px;
+                font-size: 14px;
+                font-weight: bold;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+            }
+            QPushButton#fileTransferButton:hover {
+                background-color: rgba(136, 32, 155, 0.9);
+            }
+        """)
+        self.file_transfer_button.clicked.connect(self.show_file_transfers)
         
-        # 作者信息
-        self.author_label = QLabel("作者: MVP")
-        self.author_label.setStyleSheet("color: #666; font-size: 16px; font-family: 'Microsoft YaHei', SimSun, sans-serif;")
-        self.author_label.setAlignment(Qt.AlignCenter)
-        connect_layout.addWidget(self.author_label)
-
+        # 创建底部功能按钮布局
+        bottom_function_layout = QHBoxLayout()
+        bottom_function_layout.setContentsMargins(10, 10, 10, 10)
+        bottom_function_layout.addWidget(self.change_wallpaper_button)
+        bottom_function_layout.addWidget(self.toolbox_button)
+        bottom_function_layout.addWidget(self.file_transfer_button)
+        bottom_function_layout.addStretch()
+        
+        # 将底部功能布局添加到主布局
+        main_layout.addLayout(bottom_function_layout)
+        
+        # 初始显示连接界面
+        main_layout.addWidget(self.connect_frame)
+    
+    def init_chat_frame(self):
+        """创建聊天界面，仅在第一次进入聊天室时调用"""
         # 聊天界面
         self.chat_frame = QFrame()
         self.chat_frame.setObjectName("chatFrame")
@@ -1721,6 +4461,10 @@ QFrame#formContainer {
         left_layout.setContentsMargins(8, 8, 8, 8)
         left_layout.setSpacing(8)
 
+        # 通知栏，有@提及等通知时显示在聊天记录上方
+        self.notification_tray = NotificationTray()
+        left_layout.addWidget(self.notification_tray)
+        
         # 聊天记录 - 使用更现代化的设计
         self.chat_text = QTextEdit()
         self.chat_text.setReadOnly(True)
@@ -1892,7 +4636,7 @@ QFrame#formContainer {
         users_inner_layout.addWidget(self.check_update_button)
         
         # 添加显示QR码按钮
-        self.show_qrcode_button = QPushButton("IP二维码")
+        self.show_qrcode_button = QPushButton("地址二维码")
         self.show_qrcode_button.setObjectName("showQrcodeButton")
         self.show_qrcode_button.clicked.connect(self.show_qrcode_dialog)
         self.show_qrcode_button.setStyleSheet("""
@@ -1911,6 +4655,46 @@ QFrame#formContainer {
         """)
         users_inner_layout.addWidget(self.show_qrcode_button)
         
+        # 添加聊天记录按钮
+        self.history_button_chat = QPushButton("聊天记录")
+        self.history_button_chat.setObjectName("historyButtonChat")
+        self.history_button_chat.clicked.connect(self.show_history)
+        self.history_button_chat.setStyleSheet("""
+            QPushButton#historyButtonChat {
+                background-color: rgba(255, 152, 0, 0.8);
+                color: white;
+                border: none;
+                border-radius: 10px;
+                padding: 10px 20px;
+                font-size: 16px;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+            }
+            QPushButton#historyButtonChat:hover {
+                background-color: rgba(245, 124, 0, 0.9);
+            }
+        """)
+        users_inner_layout.addWidget(self.history_button_chat)
+        
+        # 添加提醒关键字按钮
+        self.keywords_button = QPushButton("提醒关键字")
+        self.keywords_button.setObjectName("keywordsButton")
+        self.keywords_button.clicked.connect(self.edit_mention_keywords)
+        self.keywords_button.setStyleSheet("""
+            QPushButton#keywordsButton {
+                background-color: rgba(156, 39, 176, 0.7);
+                color: white;
+                border: none;
+                border-radius: 10px;
+                padding: 10px 20px;
+                font-size: 16px;
+                font-family: 'Microsoft YaHei', SimSun, sans-serif;
+            }
+            QPushButton#keywordsButton:hover {
+                background-color: rgba(123, 31, 162, 0.9);
+            }
+        """)
+        users_inner_layout.addWidget(self.keywords_button)
+        
         # 作者信息
         self.author_label_chat = QLabel("作者: MVP")
         self.author_label_chat.setAlignment(Qt.AlignCenter)
@@ -1932,68 +4716,6 @@ QFrame#formContainer {
         
         # 设置整体背景色
         self.chat_frame.setStyleSheet("background-color: transparent;")
-
-        # 添加右下角换壁纸按钮
-        self.change_wallpaper_button = QPushButton("换壁纸")
-        self.change_wallpaper_button.setObjectName("changeWallpaperButton")
-        self.change_wallpaper_button.clicked.connect(self.update_wallpaper)
-        self.change_wallpaper_button.setStyleSheet("""
-            QPushButton#changeWallpaperButton {
-                background-color: rgba(156, 39, 176, 0.8);
-                color: white;
-                border: none;
-                border-radius: 20px;
-                padding: 10px 20px;
-                font-size: 14px;
-                font-weight: bold;
-                font-family: 'Microsoft YaHei', SimSun, sans-serif;
-            }
-            QPushButton#changeWallpaperButton:hover {
-                background-color: rgba(136, 32, 155, 0.9);
-            }
-            QPushButton#changeWallpaperButton:pressed {
-                background-color: rgba(111, 27, 128, 0.9);
-            }
-        """)
-        
-        # 创建底部布局，用于放置换壁纸按钮
-        bottom_layout = QHBoxLayout()
-        bottom_layout.setContentsMargins(10, 10, 10, 10)
-        bottom_layout.addWidget(self.change_wallpaper_button)  # 左侧放置按钮
-        bottom_layout.addStretch()  # 右侧拉伸，将按钮固定在左下角
-        
-        # 添加工具箱按钮到主布局
-        self.toolbox_button = QPushButton("工具箱")
-        self.toolbox_button.setObjectName("toolboxButton")
-        self.toolbox_button.setStyleSheet("""
-            QPushButton#toolboxButton {
-                background-color: rgba(156, 39, 176, 0.8);
-                color: white;
-                border: none;
-                border-radius: 20px;
-                padding: 10px 20px;
-                font-size: 14px;
-                font-weight: bold;
-                font-family: 'Microsoft YaHei', SimSun, sans-serif;
-            }
-            QPushButton#toolboxButton:hover {
-                background-color: rgba(136, 32, 155, 0.9);
-            }
-        """)
-        self.toolbox_button.clicked.connect(self.show_toolbox)
-        
-        # 创建底部功能按钮布局
-        bottom_function_layout = QHBoxLayout()
-        bottom_function_layout.setContentsMargins(10, 10, 10, 10)
-        bottom_function_layout.addWidget(self.change_wallpaper_button)
-        bottom_function_layout.addWidget(self.toolbox_button)
-        bottom_function_layout.addStretch()
-        
-        # 将底部功能布局添加到主布局
-        main_layout.addLayout(bottom_function_layout)
-        
-        # 初始显示连接界面
-        main_layout.addWidget(self.connect_frame)
         # 确保聊天界面初始是隐藏的，并且没有被添加到布局中
         self.chat_frame.hide()
 
@@ -2004,13 +4726,86 @@ QFrame#formContainer {
         self.comm.error_message.connect(self.show_error_message)
         self.comm.notification.connect(self.show_notification)
         self.comm.show_reconnect_dialog_signal.connect(self.show_reconnect_dialog)
+        self.comm.server_shutdown.connect(self.on_server_shutdown)
+        self.comm.wallpaper_loaded.connect(self.on_wallpaper_loaded)
+        self.comm.hitokoto_loaded.connect(self.apply_hitokoto)
+        self.comm.kicked.connect(self.on_kicked)
+        self.comm.mute_changed.connect(self.on_mute_changed)
+        self.file_manager.offer_received.connect(self.on_file_offer)
+        self.file_manager.transfer_message.connect(self.display_message)
     
     def show_toolbox(self):
         """显示工具箱"""
-        self.toolbox_dialog = ToolboxDialog(self)
+        # 工具箱包含较多控件，首次打开时再创建并复用
+        if self.toolbox_dialog is None:
+            self.toolbox_dialog = ToolboxDialog(self)
         # 设置平滑的显示动画
         self.toolbox_dialog.show()
+        self.toolbox_dialog.raise_()
 
+    def start_server_discovery(self):
+        """在后台搜索局域网服务器，结果陆续加入连接界面的列表"""
+        if self.discovery_thread is not None and self.discovery_thread.isRunning():
+            return
+        self.discovered_servers = {}
+        self.server_list.clear()
+        self.discover_button.setEnabled(False)
+        self.discover_button.setText("搜索中")
+        self.discovery_thread = ServerDiscoveryThread(self)
+        self.discovery_thread.server_found.connect(self.on_server_found)
+        self.discovery_thread.discovery_finished.connect(self.on_discovery_finished)
+        self.discovery_thread.discovery_failed.connect(self.on_discovery_failed)
+        self.discovery_thread.start()
+    
+    def on_server_found(self, server):
+        self.discovered_servers[(server["host"], server["port"])] = server
+        selected = self.server_list.currentItem()
+        selected_key = selected.data(Qt.UserRole) if selected is not None else None
+        self.server_list.clear()
+        for key, info in sorted(self.discovered_servers.items(), key=lambda entry: entry[1]["rtt"]):
+            text = (f"{info.get('name') or key[0]}  {key[0]}:{key[1]}  延迟 {info['rtt'] * 1000:.0f} ms"
+                    f"  在线 {info.get('online', '?')}/{info.get('max_user', '?')}")
+            if isinstance(info.get("load"), (int, float)):
+                text += f"  负载 {info['load']:.0%}"
+            if info.get("version"):
+                text += f"  v{info['version']}"
+            if info.get("tls") in ("optional", "required"):
+                text += "  🔒"
+            item = QListWidgetItem(text)
+            item.setData(Qt.UserRole, key)
+            self.server_list.addItem(item)
+            if key == selected_key:
+                self.server_list.setCurrentItem(item)
+    
+    def on_discovery_finished(self, count):
+        self.discover_button.setEnabled(True)
+        self.discover_button.setText("搜索")
+        if count == 0:
+            item = QListWidgetItem("未发现局域网服务器，可点击搜索重试或手动填写地址")
+            item.setFlags(Qt.NoItemFlags)
+            self.server_list.addItem(item)
+    
+    def on_discovery_failed(self, error):
+        self.discover_button.setEnabled(True)
+        self.discover_button.setText("搜索")
+        item = QListWidgetItem(f"搜索失败: {error}")
+        item.setFlags(Qt.NoItemFlags)
+        self.server_list.addItem(item)
+    
+    def on_server_selected(self, item):
+        """把选中的服务器填入地址和端口，服务器开启TLS时同时勾选加密连接"""
+        server = self.discovered_servers.get(item.data(Qt.UserRole))
+        if server is None:
+            return
+        self.ip_entry.setText(server["host"])
+        self.port_entry.setText(str(server["port"]))
+        self.tls_checkbox.setChecked(server.get("tls") in ("optional", "required"))
+    
+    def on_server_activated(self, item):
+        self.on_server_selected(item)
+        if item.data(Qt.UserRole) in self.discovered_servers and not self.connected:
+            self.connect_to_server()
+    
     def connect_to_server(self):
         ip = self.ip_entry.text().strip()
         port = self.port_entry.text().strip()
@@ -2031,13 +4826,13 @@ QFrame#formContainer {
         self.nickname = nickname
 
         try:
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.connect((ip, port))
+            self.client_socket = self.open_server_connection(ip, port)
             # 只发送昵称
             self.client_socket.send(nickname.encode('utf-8'))
             
             # 接收服务器的响应
             response = self.client_socket.recv(1024).decode('utf-8')
+            self.remember_tls_session(ip, port)
             
             if response.startswith("ERROR:"):
                 # 昵称冲突或其他错误
@@ -2046,9 +4841,16 @@ QFrame#formContainer {
                 return
             elif response.startswith("SUCCESS:"):
                 # 连接成功
+                self.negotiate_caps(response)
                 self.connected = True
+                self.server_address = (ip, port)
+                self.server_tls = self.tls_checkbox.isChecked()
+                self.history_server = f"{ip}:{port}"
+                self.update_mention_matcher()
 
                 # 切换到聊天界面
+                if self.chat_frame is None:
+                    self.init_chat_frame()
                 main_layout = self.centralWidget().layout()
                 # 移除连接界面
                 main_layout.removeWidget(self.connect_frame)
@@ -2061,6 +4863,8 @@ QFrame#formContainer {
                 # 更新窗口标题，包含一言和制作者信息
                 self.update_window_title()
                 self.message_entry.setFocus()
+                # 先显示本地保存的上次聊天内容，不等待服务器
+                self.restore_history()
 
                 # 启动接收消息线程
                 receive_thread = threading.Thread(target=self.receive_messages, daemon=True)
@@ -2069,7 +4873,7 @@ QFrame#formContainer {
                 # 显示系统消息：你加入了聊天室
                 self.add_bubble_message("系统: 你加入了聊天室")
                 
-                # QR码现在通过按钮点击生成，不再自动生成
+                # QR码在本地生成，通过按钮点击显示
 
         except ConnectionRefusedError:
             self.status_label.setText("无法连接到服务器：服务器未启动")
@@ -2081,97 +4885,332 @@ QFrame#formContainer {
             if not self.connected and self.client_socket:
                 self.client_socket.close()
 
+    def open_server_connection(self, ip, port):
+        """建立到服务器的连接，勾选加密连接时完成TLS握手并校验证书指纹"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # 聊天消息都很小，关闭Nagle算法；否则TLS 1.2会话复用的最后一个握手包会被延迟约40毫秒
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            sock.connect((ip, port))
+            if self.tls_checkbox.isChecked():
+                sock = self.wrap_tls(sock, ip, port)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+    
+    def wrap_tls(self, sock, ip, port):
+        """在已连接的socket上完成TLS握手，有上次的会话时尝试复用，省去完整握手"""
+        import ssl
+        if self.tls_context is None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.minimum_version = ssl.TLSVersion.TLSv1_2
+            # 服务器使用自签名证书，不走CA校验，改为校验证书指纹
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            self.tls_context = context
+        
+        server_key = f"{ip}:{port}"
+        sock.settimeout(TLS_HANDSHAKE_TIMEOUT)
+        try:
+            tls_sock = self.tls_context.wrap_socket(sock, server_hostname=ip, session=self.tls_sessions.get(server_key))
+        except (ssl.SSLError, socket.timeout):
+            raise ConnectionError("TLS握手失败，服务器可能没有开启加密连接")
+        self.check_server_fingerprint(server_key, certificate_fingerprint(tls_sock.getpeercert(binary_form=True)))
+        tls_sock.settimeout(None)
+        return tls_sock
+    
+    def check_server_fingerprint(self, server_key, fingerprint):
+        """首次连接记录服务器证书指纹，之后指纹变化时拒绝连接"""
+        known_hosts = {}
+        try:
+            with open(KNOWN_HOSTS_FILE, "r", encoding="utf-8") as f:
+                known_hosts = json.load(f)
+        except (OSError, ValueError):
+            pass
+        
+        known = known_hosts.get(server_key)
+        if known is None:
+            known_hosts[server_key] = fingerprint
+            try:
+                with open(KNOWN_HOSTS_FILE, "w", encoding="utf-8") as f:
+                    json.dump(known_hosts, f, ensure_ascii=False, indent=2)
+            except OSError:
+                pass
+        elif known != fingerprint:
+            raise ConnectionError(f"服务器证书指纹与上次连接时不一致，可能存在中间人攻击。"
+                                  f"如果服务器重新生成了证书，请删除 {KNOWN_HOSTS_FILE} 中 {server_key} 的记录")
+    
+    def remember_tls_session(self, ip, port):
+        """保存TLS会话供重连时复用，TLS 1.3的会话票据在握手后随第一批数据到达"""
+        session = getattr(self.client_socket, "session", None)
+        if session is not None:
+            self.tls_sessions[f"{ip}:{port}"] = session
+    
+    def negotiate_caps(self, response):
+        """解析SUCCESS响应中声明的协议扩展，并回复本客户端启用的扩展"""
+        self.file_manager.reset("连接已断开")
+        self.framed = False
+        self.session_caps = set()
+        self.caps_pending = False
+        self.caps_outbox = []
+        self.caps_probe = b""
+        self.frame_reader = FrameReader()
+        self.pending_messages.clear()
+        
+        offered = set()
+        self.server_heartbeat_timeout = None
+        for part in response.split("|")[1:]:
+            if part.startswith("CAPS:"):
+                offered = set(part[len("CAPS:"):].split(","))
+            elif part.startswith("HEARTBEAT:"):
+                try:
+                    self.server_heartbeat_timeout = int(part[len("HEARTBEAT:"):].split(",")[1])
+                except (IndexError, ValueError):
+                    self.server_heartbeat_timeout = None
+        
+        caps = [cap for cap in CLIENT_CAPS if cap in offered]
+        if "frame" not in caps:
+            # 旧版服务器，继续使用原始协议
+            return
+        
+        # 服务器答复CAPS:确认帧后才切换到帧格式，超过等待时间的回复不会被确认，两端都继续使用原始协议
+        self.requested_caps = set(caps)
+        self.caps_pending = True
+        self.client_socket.sendall(f"CAPS:{','.join(caps)}\n".encode('utf-8'))
+    
+    def detect_server_format(self, data):
+        """回复CAPS后根据服务器发来的第一批数据判断协议，返回待解析的数据，不足一个帧头时先缓存
+        服务器确认时第一帧是CAPS:确认帧；原始协议的文本消息按帧头解析出的长度远超上限，不会被误认为帧
+        """
+        data = self.caps_probe + data
+        if len(data) < FRAME_HEADER.size:
+            self.caps_probe = data
+            return b""
+        self.caps_probe = b""
+        length, _ = FRAME_HEADER.unpack_from(data)
+        if length <= MAX_FRAME_SIZE:
+            self.framed = True
+        else:
+            # 服务器没有确认，已按旧协议发送，本次连接不启用扩展
+            self.finish_caps(set())
+        return data
+    
+    def finish_caps(self, caps):
+        """协议确定后启用服务器确认的扩展，并按选定的格式发出暂存的消息"""
+        with self.send_lock:
+            self.session_caps = caps & self.requested_caps
+            self.framed = "frame" in self.session_caps
+            self.caps_pending = False
+            for message in self.caps_outbox:
+                self.client_socket.sendall(self.encode_server_message(message))
+            self.caps_outbox = []
+        if "ping" in self.session_caps and self.server_heartbeat_timeout:
+            # 服务器会定期发送PING，超时未收到任何数据即判定掉线
+            self.client_socket.settimeout(self.server_heartbeat_timeout)
+    
+    def encode_server_message(self, message):
+        """按照协商的协议编码一条发给服务器的消息"""
+        data = message.encode('utf-8')
+        if self.framed:
+            if "deflate" in self.session_caps and len(data) >= COMPRESS_THRESHOLD:
+                data = encode_frame(compress_payload(data), FRAME_FLAG_COMPRESSED)
+            else:
+                data = encode_frame(data)
+        return data
+    
+    def send_to_server(self, message):
+        """按照协商的协议向服务器发送一条消息"""
+        with self.send_lock:
+            if self.caps_pending:
+                # 协议确定前暂存，确定后按选定的格式发出
+                self.caps_outbox.append(message)
+                return
+            self.client_socket.sendall(self.encode_server_message(message))
+    
+    def send_binary_to_server(self, payload):
+        """向服务器发送二进制帧（文件分块），与聊天消息共用发送锁交替发送"""
+        with self.send_lock:
+            self.client_socket.sendall(encode_frame(payload, FRAME_FLAG_BINARY))
+    
+    def receive_server_message(self):
+        """接收下一条服务器消息，自动应答心跳；连接关闭时返回None"""
+        while not self.pending_messages:
+            if self.framed:
+                data = self.client_socket.recv(FRAMED_RECV_SIZE)
+            else:
+                data = self.client_socket.recv(1024)
+            if not data:
+                return None
+            
+            if self.caps_pending and not self.framed:
+                data = self.detect_server_format(data)
+                if not data:
+                    continue
+            
+            if not self.framed:
+                self.pending_messages.append(data.decode('utf-8'))
+                continue
+            
+            for flags, payload in self.frame_reader.feed(data):
+                if flags & FRAME_FLAG_BINARY:
+                    self.file_manager.handle_chunk(payload)
+                    continue
+                if flags & FRAME_FLAG_COMPRESSED:
+                    try:
+                        payload = decompress_payload(payload)
+                    except (zlib.error, ValueError):
+                        continue
+                message = payload.decode('utf-8')
+                if message.startswith("PING:"):
+                    self.send_to_server(f"PONG:{message[5:]}")
+                elif self.caps_pending and message.startswith("CAPS:"):
+                    self.finish_caps(set(message[len("CAPS:"):].split(",")))
+                elif not message.startswith("PONG:"):
+                    self.pending_messages.append(message)
+        return self.pending_messages.popleft()
+    
     def receive_messages(self):
+        """接收线程：解析服务器消息后按类型分派，处理函数只通过信号更新界面"""
         while self.connected:
             try:
-                message = self.client_socket.recv(1024).decode('utf-8')
-                if not message:
+                frame = self.receive_server_message()
+                if frame is None:
                     break
-                
-                # 检查是否是用户列表更新消息
-                if message.startswith("USERS_LIST:"):
-                    # 解析用户列表
-                    users_part = message.split(":", 1)[1]
-                    users = users_part.split(",") if users_part else []
-                    self.comm.user_list_updated.emit(users)
-                elif message.startswith("PROFILE:"):
-                    # 处理用户profile响应
-                    profile_part = message.split(":", 1)[1]
-                    profile_data = profile_part.split("|")
-                    if len(profile_data) == 4:
-                        nickname, ip_address, join_time, os_version = profile_data
-                        # 使用信号来触发GUI操作，确保在主线程中执行
-                        self.comm.profile_received.emit(nickname, ip_address, join_time, os_version)
-                elif message.startswith("PROFILE_ERROR:"):
-                    # 处理profile错误
-                    error_message = message.split(":", 1)[1]
-                    # 使用信号来触发GUI操作，确保在主线程中执行
-                    self.comm.error_message.emit(error_message)
-                elif message.startswith("KICKED:"):
-                    # 处理被踢出消息
-                    kick_message = message.split(":", 1)[1]
-                    # 使用信号来触发GUI操作，确保在主线程中执行
-                    self.comm.error_message.emit(kick_message)
-                    # 关闭连接
-                    self.connected = False
-                    self.client_socket.close()
-                    # 切换回连接界面
-                    self.chat_frame.hide()
-                    self.connect_frame.show()
-                elif message.startswith("MUTED:"):
-                    # 处理被禁言消息
-                    mute_message = message.split(":", 1)[1]
-                    # 使用信号来触发GUI操作，确保在主线程中执行
-                    self.comm.message_received.emit(mute_message)
-                    # 发送信号显示禁言提示，确保在主线程中执行
-                    self.comm.notification.emit("禁言通知", "您已被管理员禁言，无法发送消息", "info")
-                    # 设置禁言状态并禁用输入框
-                    self.is_muted = True
-                    self.message_entry.setDisabled(True)
-                    self.send_button.setDisabled(True)
-                elif message.startswith("UNMUTED:"):
-                    # 处理解禁消息
-                    unmute_message = message.split(":", 1)[1]
-                    # 使用信号来触发GUI操作，确保在主线程中执行
-                    self.comm.message_received.emit(unmute_message)
-                    # 发送信号显示解禁提示，确保在主线程中执行
-                    self.comm.notification.emit("解禁通知", "您已被管理员解禁，可以发送消息", "info")
-                    # 取消禁言状态并启用输入框
-                    self.is_muted = False
-                    self.message_entry.setEnabled(True)
-                    self.send_button.setEnabled(True)
-                elif message.startswith("OP:"):
-                    # 处理设为管理员消息
-                    op_message = message.split(":", 1)[1]
-                    # 使用信号来触发GUI操作，确保在主线程中执行
-                    self.comm.message_received.emit(op_message)
-                    # 发送信号显示设为管理员提示，确保在主线程中执行
-                    self.comm.notification.emit("管理员通知", "您已被设为管理员，获得管理权限", "info")
-                elif message.startswith("UNOP:"):
-                    # 处理撤销管理员消息
-                    unop_message = message.split(":", 1)[1]
-                    # 使用信号来触发GUI操作，确保在主线程中执行
-                    self.comm.message_received.emit(unop_message)
-                    # 发送信号显示撤销管理员提示，确保在主线程中执行
-                    self.comm.notification.emit("管理员通知", "您的管理员权限已被撤销", "info")
-                else:
-                    # 普通消息，显示在聊天记录中
-                    self.comm.message_received.emit(message)
+                message = parse_server_message(frame)
+                if message is not None:
+                    self.message_handlers[type(message)](message)
             except ConnectionResetError:
                 self.comm.message_received.emit("系统: 与服务器断开连接")
                 self.connected = False
                 # 发送信号显示重连对话框，确保在主线程中执行
                 self.comm.show_reconnect_dialog_signal.emit()
                 break
+            except socket.timeout:
+                self.comm.message_received.emit("系统: 长时间未收到服务器心跳，连接已断开")
+                self.connected = False
+                # 发送信号显示重连对话框，确保在主线程中执行
+                self.comm.show_reconnect_dialog_signal.emit()
+                break
             except Exception as e:
                 self.comm.message_received.emit(f"系统: 接收错误 - {str(e)}")
                 self.connected = False
                 # 发送信号显示重连对话框，确保在主线程中执行
                 self.comm.show_reconnect_dialog_signal.emit()
                 break
+    
+    # 以下handle_*在接收线程中调用，不能直接操作控件
+    def handle_chat(self, message):
+        self.comm.message_received.emit(message.text)
+    
+    def handle_users_list(self, message):
+        self.comm.user_list_updated.emit(message.users)
+    
+    def handle_profile(self, message):
+        self.comm.profile_received.emit(message.nickname, message.ip_address, message.join_time, message.os_version)
+    
+    def handle_profile_error(self, message):
+        self.comm.error_message.emit(message.text)
+    
+    def handle_file_control(self, message):
+        self.file_manager.handle_control(message.command, message.body)
+    
+    def handle_kicked(self, message):
+        # 关闭连接后由界面线程切换回连接界面
+        self.connected = False
+        self.client_socket.close()
+        self.comm.kicked.emit(message.text)
+    
+    def handle_shutdown(self, message):
+        # 服务器主动关闭，connected置为False后接收循环结束
+        self.connected = False
+        self.client_socket.close()
+        self.comm.server_shutdown.emit(message.reason, message.reconnect_after)
+    
+    def handle_muted(self, message):
+        self.comm.message_received.emit(message.text)
+        self.comm.notification.emit("禁言通知", "您已被管理员禁言，无法发送消息", "info")
+        self.comm.mute_changed.emit(True)
+    
+    def handle_unmuted(self, message):
+        self.comm.message_received.emit(message.text)
+        self.comm.notification.emit("解禁通知", "您已被管理员解禁，可以发送消息", "info")
+        self.comm.mute_changed.emit(False)
+    
+    def handle_op(self, message):
+        self.comm.message_received.emit(message.text)
+        self.comm.notification.emit("管理员通知", "您已被设为管理员，获得管理权限", "info")
+    
+    def handle_unop(self, message):
+        self.comm.message_received.emit(message.text)
+        self.comm.notification.emit("管理员通知", "您的管理员权限已被撤销", "info")
+    
+    def on_kicked(self, reason):
+        self.return_to_main()
+        self.show_error_message(reason)
+    
+    def on_mute_changed(self, muted):
+        # 被禁言时禁用输入框和发送按钮
+        self.is_muted = muted
+        self.message_entry.setDisabled(muted)
+        self.send_button.setDisabled(muted)
 
-    def add_bubble_message(self, message, is_self=False):
-        """添加气泡消息到聊天记录"""
+    def restore_history(self):
+        """在聊天区域显示本服务器最近的本地消息记录"""
+        self.chat_text.clear()
+        messages = self.message_store.recent(self.history_server)
+        if not messages:
+            return
+        # 批量插入期间暂停重绘，全部插入后只重绘一次
+        self.chat_text.setUpdatesEnabled(False)
+        try:
+            for _, is_self, text in messages:
+                self.add_bubble_message(text, bool(is_self), record=False)
+            self.add_bubble_message(f"系统: 以上是本地保存的最近 {len(messages)} 条消息", record=False)
+        finally:
+            self.chat_text.setUpdatesEnabled(True)
+    
+    def show_history(self):
+        """显示聊天记录搜索窗口，默认选中当前服务器"""
+        if self.history_dialog is None:
+            self.history_dialog = HistoryDialog(self.message_store, self)
+        self.history_dialog.refresh_servers(self.history_server)
+        self.history_dialog.search()
+        self.history_dialog.show()
+        self.history_dialog.raise_()
+    
+    def load_mention_keywords(self):
+        try:
+            with open(MENTION_KEYWORDS_FILE, "r", encoding="utf-8") as f:
+                return [line.strip() for line in f if line.strip()]
+        except OSError:
+            return []
+    
+    def update_mention_matcher(self):
+        """按当前昵称和提醒关键字重新构建匹配器"""
+        self.mention_matcher = MentionMatcher([f"@{self.nickname}"] + self.mention_keywords)
+    
+    def edit_mention_keywords(self):
+        """设置提醒关键字：他人的消息中出现@昵称或这些关键字时高亮并提醒"""
+        text, ok = QInputDialog.getText(self, "提醒关键字", "消息中出现这些关键字时高亮并提醒，多个用逗号分隔：",
+                                        text="，".join(self.mention_keywords))
+        if not ok:
+            return
+        self.mention_keywords = [keyword.strip() for keyword in re.split(r"[,，]", text) if keyword.strip()]
+        try:
+            with open(MENTION_KEYWORDS_FILE, "w", encoding="utf-8") as f:
+                f.write("".join(f"{keyword}\n" for keyword in self.mention_keywords))
+        except OSError as e:
+            self.add_bubble_message(f"系统: 保存提醒关键字失败 - {str(e)}", record=False)
+        self.update_mention_matcher()
+    
+    def add_bubble_message(self, message, is_self=False, record=True):
+        """添加气泡消息到聊天记录，record为True时同时写入本地消息记录
+        他人消息中的提醒词会高亮显示，返回消息是否包含提醒词
+        """
+        if record and self.history_server is not None:
+            self.message_store.append(self.history_server, message, is_self)
+        mentioned = False
         if is_self:
             # 自己发送的消息，右对齐气泡，浅蓝背景
             html = f"""<div style="display: flex; justify-content: flex-end; margin: 12px 0;">
@@ -2193,7 +5232,7 @@ QFrame#formContainer {
             # 他人发送的消息，左对齐气泡，浅灰背景
             sender, msg_content = message.split(":", 1)
             sender = sender.strip()
-            msg_content = msg_content.strip()
+            msg_content, mentioned = highlight_mentions(msg_content.strip(), self.mention_matcher)
             html = f"""<div style="display: flex; justify-content: flex-start; margin: 12px 0;">
                         <div style="max-width: 75%;">
                             <div style="text-align: left; margin-bottom: 4px; font-size: 16px; color: #000000; margin-left: 10px; font-weight: 500;">{sender}</div>
@@ -2233,28 +5272,17 @@ QFrame#formContainer {
         # 自动滚动到聊天记录底部
         self.chat_text.ensureCursorVisible()
         self.chat_text.moveCursor(QTextCursor.End)
+        return mentioned
     
     def display_message(self, message):
-        # 显示气泡消息
-        self.add_bubble_message(message)
-        
-        # 检查是否有@自己的消息
-        if f"@{self.nickname}" in message and not message.startswith("我:"):
-            # 提取发送者昵称
-            if ":" in message:
-                sender = message.split(":", 1)[0].strip()
-                # 弹出通知弹窗
-                QMessageBox.information(self, "@提及通知", f"{sender} 在聊天中提到了你")
-
-    def highlight_mention(self, message):
-        # 高亮显示@自己的消息
-        cursor = self.chat_text.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        cursor.movePosition(QTextCursor.StartOfLine, QTextCursor.KeepAnchor)
-        cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
-        format = QTextCharFormat()
-        format.setBackground(QColor(255, 255, 150))
-        cursor.setCharFormat(format)
+        # 显示气泡消息，@自己或提醒关键字在气泡中高亮
+        if not self.add_bubble_message(message):
+            return
+        sender, content = message.split(":", 1)
+        sender = sender.strip()
+        if sender != self.nickname:
+            # 放入通知栏，连续的提及合并为一条，不弹出模态窗口
+            self.notification_tray.push("@提及", content.strip(), sender)
 
     def send_message(self):
         message = self.message_entry.text().strip()
@@ -2276,7 +5304,7 @@ QFrame#formContainer {
                         if target_nickname != self.nickname:
                             # 发送命令给服务器
                             admin_command = f"ADMIN_COMMAND:{command}:{target_nickname}"
-                            self.client_socket.send(admin_command.encode('utf-8'))
+                            self.send_to_server(admin_command)
                             self.add_bubble_message(message, is_self=True)
                             self.message_entry.clear()
                         else:
@@ -2292,7 +5320,7 @@ QFrame#formContainer {
                         if target_nickname != self.nickname:
                             # 发送命令给服务器
                             admin_command = f"ADMIN_COMMAND:{command}:{target_nickname}"
-                            self.client_socket.send(admin_command.encode('utf-8'))
+                            self.send_to_server(admin_command)
                             self.add_bubble_message(message, is_self=True)
                             self.message_entry.clear()
                         else:
@@ -2308,25 +5336,25 @@ QFrame#formContainer {
                         if target_nickname != self.nickname:
                             # 发送命令给服务器
                             admin_command = f"ADMIN_COMMAND:{command}:{target_nickname}"
-                            self.client_socket.send(admin_command.encode('utf-8'))
+                            self.send_to_server(admin_command)
                             self.add_bubble_message(message, is_self=True)
                             self.message_entry.clear()
                         else:
                             self.add_bubble_message("系统: 您不能封禁自己")
                             self.message_entry.clear()
                     else:
-                        self.add_bubble_message("系统: 命令格式错误: /ban <用户名>")
+                        self.add_bubble_message("系统: 命令格式错误: /ban <用户名|IP|网段|起始IP-结束IP>")
                         self.message_entry.clear()
                 elif command == 'unban':
                     if len(parts) == 2:
                         target_nickname = parts[1].strip()
                         # 发送命令给服务器
                         admin_command = f"ADMIN_COMMAND:{command}:{target_nickname}"
-                        self.client_socket.send(admin_command.encode('utf-8'))
+                        self.send_to_server(admin_command)
                         self.add_bubble_message(message, is_self=True)
                         self.message_entry.clear()
                     else:
-                        self.add_bubble_message("系统: 命令格式错误: /unban <用户名>")
+                        self.add_bubble_message("系统: 命令格式错误: /unban <用户名|IP|网段|起始IP-结束IP>")
                         self.message_entry.clear()
                 elif command == 'shutup':
                     if len(parts) == 2:
@@ -2339,7 +5367,7 @@ QFrame#formContainer {
                             if target_nickname != self.nickname:
                                 # 发送命令给服务器
                                 admin_command = f"ADMIN_COMMAND:{command}:{target_nickname} {duration}"
-                                self.client_socket.send(admin_command.encode('utf-8'))
+                                self.send_to_server(admin_command)
                                 self.add_bubble_message(message, is_self=True)
                                 self.message_entry.clear()
                             else:
@@ -2358,7 +5386,7 @@ QFrame#formContainer {
                         if target_nickname != self.nickname:
                             # 发送命令给服务器
                             admin_command = f"ADMIN_COMMAND:{command}:{target_nickname}"
-                            self.client_socket.send(admin_command.encode('utf-8'))
+                            self.send_to_server(admin_command)
                             self.add_bubble_message(message, is_self=True)
                             self.message_entry.clear()
                         else:
@@ -2373,7 +5401,7 @@ QFrame#formContainer {
                     self.message_entry.clear()
             else:
                 # 普通消息
-                self.client_socket.send(message.encode('utf-8'))
+                self.send_to_server(message)
                 # 在聊天记录中显示自己发送的消息（气泡样式）
                 self.add_bubble_message(message, is_self=True)
                 self.message_entry.clear()
@@ -2398,6 +5426,11 @@ QFrame#formContainer {
         profile_action.triggered.connect(self.request_user_profile)
         menu.addAction(profile_action)
         
+        # 添加发送文件选项
+        send_file_action = QAction("发送文件", self)
+        send_file_action.triggered.connect(self.send_file_to_selected)
+        menu.addAction(send_file_action)
+        
         # 执行菜单
         menu.exec_(self.users_list.mapToGlobal(pos))
 
@@ -2413,6 +5446,44 @@ QFrame#formContainer {
                 self.message_entry.setText(f"@{user} ")
             self.message_entry.setFocus()
 
+    def send_file_to_selected(self):
+        """选择文件发送给选中的用户"""
+        from PyQt5.QtWidgets import QFileDialog
+        selected_items = self.users_list.selectedItems()
+        if not selected_items or not self.connected:
+            return
+        if "file" not in self.session_caps:
+            QMessageBox.warning(self, "发送文件", "当前服务器不支持文件传输")
+            return
+        
+        file_path, _ = QFileDialog.getOpenFileName(self, "选择要发送的文件")
+        if file_path:
+            self.file_manager.send_file(selected_items[0].text(), file_path)
+            self.show_file_transfers()
+    
+    def show_file_transfers(self):
+        """显示文件传输管理窗口"""
+        if self.file_transfer_dialog is None:
+            self.file_transfer_dialog = FileTransferDialog(self.file_manager, self)
+        self.file_transfer_dialog.show()
+        self.file_transfer_dialog.raise_()
+    
+    def on_file_offer(self, task):
+        """收到文件传输请求时询问用户是否接收"""
+        reply = QMessageBox.question(
+            self, "文件传输",
+            f"{task.peer} 想发送文件给您：\n{task.name}（{task.size / (1024 * 1024):.2f} MB）\n\n是否接收？",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if task.finished:
+            # 等待确认期间对方已取消
+            return
+        if reply == QMessageBox.Yes:
+            self.file_manager.accept(task)
+            self.show_file_transfers()
+        else:
+            self.file_manager.reject(task)
+    
     def request_user_profile(self):
         # 请求选中用户的profile
         print("request_user_profile called")
@@ -2424,7 +5495,7 @@ QFrame#formContainer {
             print(f"requesting profile for: {user}")
             # 发送profile请求给服务器
             request_message = f"PROFILE_REQUEST:{user}"
-            self.client_socket.send(request_message.encode('utf-8'))
+            self.send_to_server(request_message)
             print(f"sent profile request: {request_message}")
         else:
             print("not requesting profile: no selection or not connected")
@@ -2439,9 +5510,9 @@ QFrame#formContainer {
         QMessageBox.warning(self, "错误", error_text)
     
     def show_notification(self, title, content, notification_type):
-        # 显示通知消息，在主线程中执行
+        # 显示通知消息，在主线程中执行；普通通知放入通知栏，警告和错误仍弹窗
         if notification_type == "info":
-            QMessageBox.information(self, title, content)
+            self.notification_tray.push(title, content)
         elif notification_type == "warning":
             QMessageBox.warning(self, title, content)
         elif notification_type == "error":
@@ -2456,6 +5527,23 @@ QFrame#formContainer {
             item = QListWidgetItem(user)
             self.users_list.addItem(item)
 
+    def on_server_shutdown(self, reason, reconnect_after):
+        """服务器主动关闭：给出了重连等待时间时到时自动重连，否则返回主界面"""
+        self.display_message(f"系统: {reason}")
+        if reconnect_after < 0:
+            self.show_notification("服务器已关闭", reason, "info")
+            self.return_to_main()
+            return
+        self.display_message(f"系统: 将在约 {reconnect_after} 秒后自动重连")
+        # 随机抖动避免所有客户端同时重连
+        QTimer.singleShot(int((reconnect_after + random.random()) * 1000), self.auto_reconnect)
+    
+    def auto_reconnect(self):
+        # 等待期间用户已经返回主界面或重新连接时不再重连
+        if self.connected or not self.chat_frame.isVisible():
+            return
+        self.reconnect_to_server()
+    
     def show_reconnect_dialog(self):
         # 如果已经显示了重连对话框，直接返回，避免重复显示
         if self.showing_reconnect_dialog:
@@ -2498,20 +5586,22 @@ QFrame#formContainer {
                     except:
                         pass
                 
-                # 创建新连接
-                self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.client_socket.connect((self.ip_entry.text(), int(self.port_entry.text())))
+                # 创建新连接，加密连接会复用上次的TLS会话
+                ip, port = self.ip_entry.text(), int(self.port_entry.text())
+                self.client_socket = self.open_server_connection(ip, port)
                 # 发送昵称
                 self.client_socket.send(self.nickname.encode('utf-8'))
                 
                 # 接收服务器响应
                 response = self.client_socket.recv(1024).decode('utf-8')
+                self.remember_tls_session(ip, port)
                 
                 if response.startswith("ERROR:"):
                     # 昵称冲突或其他错误
                     self.comm.message_received.emit(f"系统: 重连失败 - {response[6:]}")
                 elif response.startswith("SUCCESS:"):
                     # 重连成功
+                    self.negotiate_caps(response)
                     self.connected = True
                     success = True
                     self.comm.message_received.emit("系统: 重连成功！")
@@ -2526,9 +5616,9 @@ QFrame#formContainer {
             except Exception as e:
                 self.comm.message_received.emit(f"系统: 重连失败 - {str(e)}")
             
-            # 等待1秒后重试
+            # 等待1~2秒后重试，随机抖动避免网络恢复后大量客户端同时重连
             if not success and retry_count < max_retries:
-                time.sleep(1)
+                time.sleep(1 + random.random())
         
         # 如果重连失败，显示失败信息并返回主界面
         if not success:
@@ -2538,6 +5628,7 @@ QFrame#formContainer {
     def return_to_main(self):
         # 返回主界面（连接界面）
         self.connected = False
+        self.file_manager.reset("连接已断开")
         # 关闭旧连接
         if self.client_socket:
             try:
@@ -2561,93 +5652,57 @@ QFrame#formContainer {
         # QR码显示已移至对话框，无需重置
     
     def get_hitokoto(self):
+        """在后台线程中获取一言，避免网络请求阻塞界面"""
+        threading.Thread(target=self.fetch_hitokoto, daemon=True).start()
+    
+    def fetch_hitokoto(self):
         """从uapis.cn/api/v1/saying获取一言内容"""
+        hitokoto_text = "一言加载失败"
         try:
             # 发送请求获取一言
             url = "https://uapis.cn/api/v1/saying"
-            response = requests.get(url, timeout=5)
-            response.raise_for_status()
+            response = http_client.get(url, timeout=5)
             
-            # 解析JSON响应
+            # 解析JSON响应，格式不符合预期时保持加载失败提示
             data = response.json()
             if isinstance(data, dict) and "text" in data:
-                self.hitokoto_text = data["text"]
-                # 更新标签文本
-                self.hitokoto_label.setText(f"{self.hitokoto_text}")
-                # 更新窗口标题
-                self.update_window_title()
-            else:
-                # 响应格式不符合预期
-                self.hitokoto_text = "一言加载失败"
-                self.hitokoto_label.setText(self.hitokoto_text)
-                self.update_window_title()
-        except requests.exceptions.RequestException as e:
-            # 网络请求错误
-            self.hitokoto_text = "一言加载失败"
-            self.hitokoto_label.setText(self.hitokoto_text)
-            self.update_window_title()
+                hitokoto_text = data["text"]
         except Exception as e:
-            # 其他错误
-            self.hitokoto_text = "一言加载失败"
-            self.hitokoto_label.setText(self.hitokoto_text)
-            self.update_window_title()
+            # 网络请求错误或其他错误
+            print(f"获取一言失败: {str(e)}")
+        self.comm.hitokoto_loaded.emit(hitokoto_text)
     
-    def get_user_ip(self):
-        """从uapis.cn/api/v1/network/myip获取用户IP地址"""
-        try:
-            # 发送请求获取用户IP信息
-            url = "https://uapis.cn/api/v1/network/myip"
-            response = requests.get(url, timeout=5)
-            response.raise_for_status()
-            
-            # 解析JSON响应
-            self.userip = response.json()
-            return self.userip
-        except requests.exceptions.RequestException as e:
-            # 网络请求错误
-            print(f"获取IP地址失败: {str(e)}")
-            self.userip = {"ip": "127.0.0.1"}  # 默认值
-            return self.userip
-        except Exception as e:
-            # 其他错误
-            print(f"解析IP地址失败: {str(e)}")
-            self.userip = {"ip": "127.0.0.1"}  # 默认值
-            return self.userip
+    def apply_hitokoto(self, hitokoto_text):
+        """在主线程中显示一言"""
+        self.hitokoto_text = hitokoto_text
+        # 更新标签文本
+        self.hitokoto_label.setText(hitokoto_text)
+        # 更新窗口标题
+        self.update_window_title()
+    
+    def qrcode_payload(self):
+        """二维码内容：当前连接的服务器地址和端口
+        服务器地址是本机回环地址时换成本机的局域网IP，方便同一局域网的其他设备扫码连接。
+        """
+        if self.server_address is None:
+            return None
+        host, port = self.server_address
+        if host == "localhost" or host.startswith("127."):
+            host = local_lan_ip()
+        payload = f"littlechat://{host}:{port}"
+        if self.server_tls:
+            payload += "?tls=1"
+        return payload
     
     def generate_qrcode(self):
-        """生成QR码，返回QPixmap对象"""
-        try:
-            # 获取用户IP地址
-            user_ip_data = self.get_user_ip()
-            
-            # 将完整的user_ip_data转换为字符串填入text字段
-            import json
-            user_ip_str = json.dumps(user_ip_data, ensure_ascii=False)
-            
-            # 生成QR码的API请求，使用较大的size参数
-            qrcode_url = "https://uapis.cn/api/v1/image/qrcode"
-            params = {
-                "text": user_ip_str,
-                "size": 512,  # 使用较大尺寸，提高清晰度
-                "format": "image"
-            }
-            
-            # 发送请求获取QR码图片
-            response = requests.get(qrcode_url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            # 将响应内容转换为QPixmap
-            pixmap = QPixmap()
-            pixmap.loadFromData(response.content)
-            
-            return pixmap
-        except requests.exceptions.RequestException as e:
-            # 网络请求错误
-            print(f"生成QR码失败: {str(e)}")
+        """在本地生成服务器地址的二维码，返回QPixmap对象，不需要网络"""
+        payload = self.qrcode_payload()
+        if payload is None:
             return None
+        try:
+            return qrcode_pixmap(payload)
         except Exception as e:
-            # 其他错误
-            print(f"显示QR码失败: {str(e)}")
+            print(f"生成QR码失败: {str(e)}")
             return None
     
     def show_qrcode_dialog(self):
@@ -2659,7 +5714,7 @@ QFrame#formContainer {
             # 创建对话框
             from PyQt5.QtWidgets import QDialog
             dialog = QDialog()
-            dialog.setWindowTitle("我的IP二维码")
+            dialog.setWindowTitle("服务器地址二维码")
             dialog.setMinimumSize(500, 500)
             dialog.setStyleSheet("background-color: rgba(255, 255, 255, 0.8);")
             
@@ -2667,7 +5722,7 @@ QFrame#formContainer {
             layout = QVBoxLayout(dialog)
             
             # 添加标题
-            title_label = QLabel("我的IP地址二维码")
+            title_label = QLabel("扫码连接到同一服务器")
             title_label.setAlignment(Qt.AlignCenter)
             title_label.setStyleSheet("""
                 QLabel {
@@ -2683,7 +5738,8 @@ QFrame#formContainer {
             # 添加QR码图片
             qrcode_label = QLabel()
             qrcode_label.setAlignment(Qt.AlignCenter)
-            qrcode_label.setPixmap(pixmap.scaled(400, 400, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+            # 二维码缩放不做平滑处理，保持模块边缘清晰
+            qrcode_label.setPixmap(pixmap.scaled(400, 400, Qt.KeepAspectRatio, Qt.FastTransformation))
             qrcode_label.setStyleSheet("""
                 QLabel {
                     background-color: white;
@@ -2694,10 +5750,8 @@ QFrame#formContainer {
             """)
             layout.addWidget(qrcode_label)
             
-            # 添加IP地址信息
-            import json
-            user_ip_str = json.dumps(self.userip, ensure_ascii=False, indent=2)
-            ip_info_label = QLabel(f"IP信息: {user_ip_str}")
+            # 添加服务器地址信息
+            ip_info_label = QLabel(f"服务器地址: {self.qrcode_payload()}")
             ip_info_label.setAlignment(Qt.AlignCenter)
             ip_info_label.setWordWrap(True)  # 使用Qt的word-wrap属性
             ip_info_label.setStyleSheet("""
@@ -2736,10 +5790,11 @@ QFrame#formContainer {
             dialog.exec_()
         else:
             # 生成失败，显示错误提示
-            QMessageBox.warning(self, "QR码生成失败", "无法生成QR码，请检查网络连接后重试")
+            QMessageBox.warning(self, "QR码生成失败", "无法生成QR码，请先连接到服务器")
     
     def check_for_updates(self):
         """检查Gitee仓库是否有新的发行版"""
+        import requests
         try:
             # 构建API请求URL
             url = f"https://gitee.com/api/v5/repos/{GITEE_OWNER}/{GITEE_REPO}/releases/latest"
@@ -2749,9 +5804,8 @@ QFrame#formContainer {
                 "Content-Type": "application/json"
             }
             
-            # 发送请求
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
+            # 发送请求，再次检查时带上次的ETag重新验证，未变化时服务器只返回304
+            response = http_client.get(url, headers=headers, timeout=10, ttl=0)
             
             # 解析响应
             latest_release = response.json()
@@ -2785,6 +5839,7 @@ QFrame#formContainer {
                 return
             
             # 比较版本
+            self.update_assets = assets
             version_diff = self.compare_versions(CURRENT_VERSION, latest_version)
             if version_diff == 2:
                 # 当前版本落后最新版本两个或更多版本，强制更新
@@ -2876,85 +5931,62 @@ QFrame#formContainer {
         # 可选更新时，用户选择稍后更新或忽略，不做处理
     
     def download_latest_release(self, download_url, latest_version, file_name):
-        """下载最新版本，参考服务端下载逻辑"""
-        try:
-            # 设置请求头，不包含Token认证
-            headers = {
-                "Accept": "*/*"  # 接受所有类型
-            }
-            
-            # 发送请求，获取响应头和文件大小
-            response = requests.get(download_url, headers=headers, stream=True, timeout=10, allow_redirects=True)
-            response.raise_for_status()
-            
-            # 获取文件大小
-            total_size = int(response.headers.get("content-length", 0))
-            
-            # 创建进度对话框
-            progress = QProgressDialog("正在下载更新...", "取消", 0, total_size, self)
-            progress.setWindowTitle("下载更新")
-            progress.setWindowModality(Qt.WindowModal)
-            progress.setMinimumDuration(0)  # 立即显示进度条
-            progress.show()
-            
-            # 开始下载
-            downloaded_size = 0
-            with open(file_name, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded_size += len(chunk)
-                        
-                        # 更新进度条
-                        progress.setValue(downloaded_size)
-                        
-                        # 更新进度条文本，显示当前下载大小和总大小
-                        if total_size > 0:
-                            current_size = downloaded_size / (1024 * 1024)  # MB
-                            total_mb = total_size / (1024 * 1024)  # MB
-                            progress_text = f"正在下载更新... {current_size:.2f} MB / {total_mb:.2f} MB"
-                            progress.setLabelText(progress_text)
-                        
-                        # 检查是否取消
-                        if progress.wasCanceled():
-                            # 删除未完成的文件
-                            import os
-                            if os.path.exists(file_name):
-                                os.remove(file_name)
-                            QMessageBox.information(self, "下载取消", "更新下载已取消")
-                            return
-            
+        """在后台下载最新版本，支持断点续传和SHA256校验"""
+        if self.download_thread is not None and self.download_thread.isRunning():
+            QMessageBox.information(self, "下载更新", "更新正在下载中，请稍候")
+            return
+        
+        # 创建进度对话框，总大小未知前显示忙碌状态
+        progress = QProgressDialog("正在下载更新...", "取消", 0, 0, self)
+        progress.setWindowTitle("下载更新")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)  # 立即显示进度条
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+        if os.path.exists(file_name + ".part.json"):
+            progress.setLabelText("发现未完成的下载，正在从断点继续...")
+        progress.show()
+        
+        def on_progress(downloaded_size, total_size):
+            # 进度条使用千分比，避免大文件超出整数范围
+            if total_size > 0:
+                progress.setMaximum(1000)
+                progress.setValue(int(downloaded_size * 1000 / total_size))
+                current_size = downloaded_size / (1024 * 1024)  # MB
+                total_mb = total_size / (1024 * 1024)  # MB
+                progress.setLabelText(f"正在下载更新... {current_size:.2f} MB / {total_mb:.2f} MB")
+            else:
+                progress.setLabelText(f"正在下载更新... {downloaded_size / (1024 * 1024):.2f} MB")
+        
+        def on_finished(downloaded_file, verified):
             progress.close()
-            
-            # 验证下载的文件
-            import os
-            if os.path.exists(file_name):
-                file_size = os.path.getsize(file_name)
-                if file_size == 0:
-                    os.remove(file_name)
-                    QMessageBox.critical(self, "下载失败", "下载的文件为空，请重试")
-                    return
-                else:
-                    QMessageBox.information(self, "下载完成", f"最新版本已下载完成：{file_name}")
-                    # 打开文件所在目录
-                    file_dir = os.path.dirname(os.path.abspath(file_name))
-                    os.startfile(file_dir)
+            message = f"最新版本已下载完成：{downloaded_file}"
+            if verified:
+                message += "\nSHA256校验通过"
+            QMessageBox.information(self, "下载完成", message)
+            # 打开文件所在目录
+            file_dir = os.path.dirname(os.path.abspath(downloaded_file))
+            if hasattr(os, "startfile"):
+                os.startfile(file_dir)
+        
+        def on_failed(error_text):
+            progress.close()
+            QMessageBox.critical(self, "下载失败", error_text)
+        
+        def on_cancelled():
+            progress.close()
+            if os.path.exists(file_name + ".part.json"):
+                QMessageBox.information(self, "下载取消", "更新下载已取消，下次下载将从断点继续")
             else:
-                QMessageBox.critical(self, "下载失败", "下载文件不存在，请重试")
-                return
-            
-        except requests.exceptions.RequestException as e:
-            QMessageBox.critical(self, "下载失败", f"网络请求错误：{str(e)}")
-            # 清理可能的无效文件
-            import os
-            if os.path.exists(file_name):
-                os.remove(file_name)
-        except Exception as e:
-            QMessageBox.critical(self, "下载失败", f"下载错误：{str(e)}")
-            # 清理可能的无效文件
-            import os
-            if os.path.exists(file_name):
-                os.remove(file_name)
+                QMessageBox.information(self, "下载取消", "更新下载已取消")
+        
+        self.download_thread = UpdateDownloadThread(download_url, file_name, self.update_assets, self)
+        self.download_thread.progress_changed.connect(on_progress)
+        self.download_thread.download_finished.connect(on_finished)
+        self.download_thread.download_failed.connect(on_failed)
+        self.download_thread.download_cancelled.connect(on_cancelled)
+        progress.canceled.connect(self.download_thread.cancel)
+        self.download_thread.start()
     
     def resizeEvent(self, event):
         # 窗口大小改变时重新调整壁纸
@@ -2970,6 +6002,10 @@ QFrame#formContainer {
         super().resizeEvent(event)
 
     def closeEvent(self, event):
+        if self.discovery_thread is not None and self.discovery_thread.isRunning():
+            self.discovery_thread.cancel()
+            self.discovery_thread.wait()
+        self.message_store.close()
         # 关闭窗口时断开连接
         if self.connected:
             self.connected = False
@@ -2985,11 +6021,16 @@ if __name__ == "__main__":
     # 创建并显示法律声明窗口
     license_window = LicenseWindow()
     
-    # 创建主窗口实例但不显示
-    main_window = ChatClient()
+    # 主窗口在用户同意许可后才创建，让法律声明窗口尽快显示
+    main_window = None
+    
+    def show_main_window():
+        global main_window
+        main_window = ChatClient()
+        main_window.show()
     
-    # 连接同意信号到显示主窗口的槽函数
-    license_window.agreed.connect(main_window.show)
+    # 连接同意信号到创建并显示主窗口的槽函数
+    license_window.agreed.connect(show_main_window)
     
     # 显示法律声明窗口
     license_window.show()
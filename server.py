@@ -1,8 +1,18 @@
 import socket
+import select
+import struct
+import sys
 import threading
 import time
 import os
-import requests
+import json
+import hashlib
+import ssl
+import zlib
+import hmac
+import ipaddress
+import queue
+from collections import deque
 
 # 版本信息
 CURRENT_VERSION = "3.2.0"
@@ -11,6 +21,46 @@ CURRENT_VERSION = "3.2.0"
 GITEE_OWNER = "MVPS680"
 GITEE_REPO = "MVPLittlechat"
 
+# 协议扩展配置
+# 服务端在SUCCESS响应中声明支持的扩展，客户端回复CAPS:选择启用，旧客户端不受影响
+SERVER_CAPS = ("frame", "ping", "file", "deflate", "shutdown")
+# 关闭服务器时先发送SHUTDOWN:原因[|RECONNECT:秒数]，等客户端收完剩余消息主动断开，超时后再强制关闭
+SHUTDOWN_DRAIN_TIMEOUT = 5
+# 帧格式：4字节负载长度 + 1字节标志位 + 负载
+FRAME_HEADER = struct.Struct("!IB")
+MAX_FRAME_SIZE = 1024 * 1024  # 单帧上限，超过视为协议错误
+FRAMED_RECV_SIZE = 65536
+FRAME_FLAG_BINARY = 0x01  # 负载为二进制数据（文件分块）而不是UTF-8文本
+# 文件分块头：传输ID + 分块在文件中的偏移 + 分块CRC32，其后为分块数据
+FILE_CHUNK_HEADER = struct.Struct("!QQI")
+# 压缩扩展：达到阈值的文本帧使用带预置字典的raw deflate压缩，并设置该标志
+FRAME_FLAG_COMPRESSED = 0x02
+COMPRESSION_LEVEL = 6
+# 预置字典收录协议中反复出现的片段，服务端和客户端必须完全一致，越常用的片段放得越靠后
+COMPRESSION_DICTIONARY = "".join((
+    "FILE_OFFER:FILE_ACCEPT:FILE_CANCEL:PROFILE:MUTED:ERROR:",
+    "{\"id\": \"size\": \"name\": \"to\": ",
+    "系统: 用户 的IP 已被管理员封禁 已被管理员解除禁言",
+    "KICKED:你已被管理员踢出聊天室",
+    "ERROR:您已被禁言 分钟，无法发送消息",
+    "系统: 已被管理员禁言 分钟",
+    "系统: 已被管理员踢出聊天室",
+    "系统: 离开了聊天室",
+    "系统: 加入了聊天室",
+    "USERS_LIST:ADMIN：",
+)).encode('utf-8')
+
+# 更新检查结果的磁盘缓存，避免每次重启都等待网络请求
+UPDATE_CACHE_FILE = "LittleChat.updatecache"
+
+# 更新下载配置
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_PARALLEL = 4  # 服务器支持Range时的最大并行分段数
+DOWNLOAD_MIN_SEGMENT_SIZE = 2 * 1024 * 1024  # 每个分段的最小大小，小文件不拆分
+DOWNLOAD_PROGRESS_INTERVAL = 0.25  # 进度回调的最小间隔（秒）
+DOWNLOAD_RETRIES = 3  # 单个分段网络错误的重试次数
+HTTP_POOL_SIZE = 4  # 共享HTTP客户端对每个主机保持的keep-alive连接数
+
 def compare_versions(current_ver, latest_ver):
     """比较版本号，返回版本差异信息
     返回值：
@@ -51,65 +101,411 @@ def compare_versions(current_ver, latest_ver):
         # 版本号格式错误，默认不需要更新
         return 0
 
-def download_latest_release(download_url, latest_version, file_name=None):
-    """下载最新版本"""
+class DownloadCancelled(Exception):
+    """下载被取消，已下载的部分会保留以便下次续传"""
+
+class ChecksumMismatch(Exception):
+    """下载文件的SHA256与发布的校验和不一致"""
+
+def _parse_content_range_total(content_range):
+    """从Content-Range响应头（bytes 0-0/12345）中解析文件总大小，未知时返回None"""
     try:
-        # 设置请求头，不包含Token认证
-        headers = {
-        }
-        
-        # 获取文件大小
-        response = requests.get(download_url, headers=headers, stream=True, timeout=10)
-        response.raise_for_status()
-        
-        total_size = int(response.headers.get("content-length", 0))
-        
-        # 如果没有提供文件名，生成默认文件名
-        if not file_name:
-            file_name = f"{GITEE_REPO}_server_v{latest_version}.zip"
+        total = content_range.rsplit("/", 1)[1].strip()
+        return int(total) if total != "*" else None
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def _save_download_meta(meta_file, meta):
+    """原子写入续传进度记录，替换前先落盘，断电后不会留下内容为空的记录"""
+    temp_file = meta_file + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, meta_file)
+
+def _load_download_meta(meta_file, part_file, url, total_size, validator):
+    """读取续传进度记录，与当前文件不匹配时返回None"""
+    try:
+        with open(meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("url") != url or meta.get("size") != total_size or meta.get("validator") != validator:
+        return None
+    if not validator:
+        # 没有ETag/Last-Modified时无法确认服务器上的文件未变化，不续传
+        return None
+    if not os.path.exists(part_file) or os.path.getsize(part_file) != total_size:
+        return None
+    return meta
+
+class HttpClient:
+    """共享的HTTP客户端：同一主机的请求复用keep-alive连接，并按URL和参数在内存中缓存响应
+    ttl为None时不缓存；否则ttl秒内直接返回缓存的响应，过期后带If-None-Match/If-Modified-Since
+    重新验证，服务器返回304时继续使用缓存（ttl为0表示每次都重新验证）
+    """
+    def __init__(self, pool_size=HTTP_POOL_SIZE):
+        self.pool_size = pool_size
+        self.session = None  # 第一次请求时创建，没有安装requests时不影响其他功能
+        self.cache = {}  # {(url, 参数): [过期时间, 响应]}
+        self.lock = threading.Lock()
+    
+    def get_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        with self.lock:
+            if self.session is None:
+                self.session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                self.session.mount("http://", adapter)
+                self.session.mount("https://", adapter)
+            return self.session
+    
+    def get(self, url, params=None, headers=None, timeout=10, ttl=None):
+        """发送GET请求，返回requests的Response；4xx/5xx响应抛出HTTPError"""
+        key = (url, tuple(sorted((params or {}).items())))
+        request_headers = dict(headers or {})
+        entry = None
+        if ttl is not None:
+            with self.lock:
+                entry = self.cache.get(key)
+        if entry is not None:
+            expires_at, cached = entry
+            if time.monotonic() < expires_at:
+                return cached
+            if cached.headers.get("ETag"):
+                request_headers["If-None-Match"] = cached.headers["ETag"]
+            if cached.headers.get("Last-Modified"):
+                request_headers["If-Modified-Since"] = cached.headers["Last-Modified"]
         
-        # 开始下载
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 开始下载更新: {file_name}")
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 文件大小: {total_size / 1024:.2f} KB")
+        response = self.get_session().get(url, params=params, headers=request_headers, timeout=timeout)
+        if entry is not None and response.status_code == 304:
+            response = entry[1]
+        else:
+            response.raise_for_status()
+        if ttl is not None:
+            with self.lock:
+                self.cache[key] = [time.monotonic() + ttl, response]
+        return response
+
+http_client = HttpClient()
+
+def file_sha256(file_name):
+    """计算文件的SHA256"""
+    sha256 = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def find_release_checksum(assets, file_name):
+    """在发行版附件中查找file_name的SHA256（<文件名>.sha256 或 SHA256SUMS），找不到返回None"""
+    import requests
+    candidates = (file_name.lower() + ".sha256", "sha256sums", "sha256sums.txt")
+    for asset in assets:
+        if asset.get("name", "").lower() not in candidates:
+            continue
+        url = asset.get("browser_download_url", "")
+        if url and not (url.startswith("http://") or url.startswith("https://")):
+            url = f"https://gitee.com{url}"
+        try:
+            response = http_client.get(url, timeout=10)
+        except requests.exceptions.RequestException:
+            continue
+        for line in response.text.splitlines():
+            parts = line.split()
+            # 单独的.sha256文件可以只有校验和，SHA256SUMS中需要文件名匹配
+            if parts and (len(parts) == 1 or parts[-1].lstrip("*") == file_name):
+                return parts[0].lower()
+    return None
+
+def download_file(url, file_name, expected_sha256=None, parallel=DOWNLOAD_PARALLEL,
+                  progress_callback=None, cancel_event=None, headers=None, timeout=10):
+    """支持断点续传和分段并行的文件下载
+    数据先写入 <file_name>.part，各分段进度记录在 <file_name>.part.json，
+    中断或取消后再次调用会从断点继续；服务器不支持Range时退化为单连接完整下载。
+    progress_callback(已下载字节, 总字节) 的调用间隔不小于DOWNLOAD_PROGRESS_INTERVAL，总大小未知时为0。
+    下载完成并通过校验后重命名为file_name并返回。
+    """
+    import requests
+    part_file = file_name + ".part"
+    meta_file = part_file + ".json"
+    base_headers = dict(headers or {})
+    cancel_event = cancel_event or threading.Event()
+    
+    with requests.Session() as session:
+        # 只请求第一个字节，同时探测文件大小和服务器是否支持Range
+        probe_headers = dict(base_headers, Range="bytes=0-0")
+        probe = session.get(url, headers=probe_headers, stream=True, timeout=timeout, allow_redirects=True)
+        probe.raise_for_status()
+        total_size = _parse_content_range_total(probe.headers.get("Content-Range")) if probe.status_code == 206 else None
+        # If-Range不接受弱ETag，此时改用Last-Modified
+        etag = probe.headers.get("ETag", "")
+        validator = etag if etag and not etag.startswith("W/") else probe.headers.get("Last-Modified", "")
+        url = probe.url  # 后续请求直接使用重定向后的地址
         
-        downloaded_size = 0
-        with open(file_name, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
+        if total_size is None:
+            # 不支持Range：沿用探测请求的响应（或重新请求）完整下载
+            if probe.status_code == 206:
+                probe.close()
+                probe = session.get(url, headers=base_headers, stream=True, timeout=timeout)
+                probe.raise_for_status()
+            _download_whole(probe, part_file, progress_callback, cancel_event)
+            if os.path.exists(meta_file):
+                os.remove(meta_file)
+        else:
+            probe.close()
+            meta = _load_download_meta(meta_file, part_file, url, total_size, validator)
+            if meta is None:
+                meta = {"url": url, "size": total_size, "validator": validator,
+                        "segments": _split_segments(total_size, parallel)}
+                with open(part_file, "wb") as f:
+                    f.truncate(total_size)
+                _save_download_meta(meta_file, meta)
+            _download_segments(session, url, base_headers, validator, timeout, part_file, meta_file, meta,
+                               progress_callback, cancel_event)
+    
+    if expected_sha256 and file_sha256(part_file) != expected_sha256.lower():
+        # 校验失败的数据不能用于续传
+        os.remove(part_file)
+        if os.path.exists(meta_file):
+            os.remove(meta_file)
+        raise ChecksumMismatch(f"{file_name} 的SHA256校验失败")
+    
+    os.replace(part_file, file_name)
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+    return file_name
+
+def _split_segments(total_size, parallel):
+    """将文件按字节范围拆分为分段，格式: [[起始, 结束, 下一个待下载字节], ...]"""
+    count = max(1, min(parallel, total_size // DOWNLOAD_MIN_SEGMENT_SIZE))
+    segment_size = -(-total_size // count) if total_size else 0
+    segments = []
+    for start in range(0, total_size, segment_size or 1):
+        end = min(start + segment_size, total_size) - 1
+        segments.append([start, end, start])
+    return segments
+
+def _download_whole(response, part_file, progress_callback, cancel_event):
+    """不支持Range时的单连接下载，取消后不保留部分文件"""
+    total_size = int(response.headers.get("content-length", 0))
+    downloaded_size = 0
+    last_report = 0.0
+    try:
+        with open(part_file, "wb") as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if cancel_event.is_set():
+                    raise DownloadCancelled()
                 if chunk:
                     f.write(chunk)
                     downloaded_size += len(chunk)
-                    
-                    # 显示下载进度
-                    if total_size > 0:
-                        progress = (downloaded_size / total_size) * 100
-                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 下载进度: {progress:.1f}% ({downloaded_size / 1024:.2f} KB / {total_size / 1024:.2f} KB)", end="\r")
+                    now = time.monotonic()
+                    if progress_callback and now - last_report >= DOWNLOAD_PROGRESS_INTERVAL:
+                        last_report = now
+                        progress_callback(downloaded_size, total_size)
+    except BaseException:
+        response.close()
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        raise
+    if total_size and not response.headers.get("content-encoding") and downloaded_size != total_size:
+        os.remove(part_file)
+        raise IOError(f"下载不完整: {downloaded_size}/{total_size} 字节")
+    if progress_callback:
+        progress_callback(downloaded_size, total_size)
+
+def _download_segments(session, url, base_headers, validator, timeout, part_file, meta_file, meta,
+                       progress_callback, cancel_event):
+    """并行下载尚未完成的分段，写入预先分配好的.part文件"""
+    import requests
+    segments = meta["segments"]
+    total_size = meta["size"]
+    lock = threading.Lock()
+    stop_event = threading.Event()  # 任一分段失败时通知其它分段停止
+    errors = []
+    state = {"last_report": 0.0, "stale": False}
+    
+    def downloaded():
+        return sum(segment[2] - segment[0] for segment in segments)
+    
+    def report(data_file, force=False):
+        # 调用方需持有lock；各分段只把已flush的数据计入进度，对同一文件fsync即可让所有已计入的数据落盘
+        now = time.monotonic()
+        if force or now - state["last_report"] >= DOWNLOAD_PROGRESS_INTERVAL:
+            state["last_report"] = now
+            # 先落盘数据再保存进度，断电后续传不会跳过没有写入磁盘的区间
+            os.fsync(data_file.fileno())
+            _save_download_meta(meta_file, meta)
+            if progress_callback:
+                progress_callback(downloaded(), total_size)
+    
+    def worker(segment):
+        retries = 0
+        with open(part_file, "r+b") as f:
+            while segment[2] <= segment[1]:
+                if cancel_event.is_set() or stop_event.is_set():
+                    return
+                range_headers = dict(base_headers, Range=f"bytes={segment[2]}-{segment[1]}")
+                if validator:
+                    # 文件在服务器上已变化时会返回200而不是206
+                    range_headers["If-Range"] = validator
+                attempt_start = segment[2]
+                try:
+                    with session.get(url, headers=range_headers, stream=True, timeout=timeout) as response:
+                        response.raise_for_status()
+                        if response.status_code != 206:
+                            state["stale"] = True
+                            raise IOError("服务器上的文件已变化，请重新下载")
+                        f.seek(segment[2])
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            if cancel_event.is_set() or stop_event.is_set():
+                                return
+                            chunk = chunk[:segment[1] + 1 - segment[2]]
+                            f.write(chunk)
+                            f.flush()
+                            with lock:
+                                segment[2] += len(chunk)
+                                report(f)
+                            if segment[2] > segment[1]:
+                                break
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError):
+                    # 网络抖动时从当前位置重试，有进展的连接不计入重试次数
+                    retries = 0 if segment[2] > attempt_start else retries + 1
+                    if retries > DOWNLOAD_RETRIES:
+                        raise
+                    time.sleep(min(retries, 5))
+    
+    def run(segment):
+        try:
+            worker(segment)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+            stop_event.set()
+    
+    pending = [segment for segment in segments if segment[2] <= segment[1]]
+    threads = [threading.Thread(target=run, args=(segment,), daemon=True) for segment in pending[1:]]
+    for thread in threads:
+        thread.start()
+    if pending:
+        run(pending[0])
+    for thread in threads:
+        thread.join()
+    
+    with lock, open(part_file, "r+b") as f:
+        report(f, force=True)
+    if errors:
+        if state["stale"]:
+            # 旧的部分文件已无效，下次重新下载
+            os.remove(meta_file)
+        raise errors[0]
+    if cancel_event.is_set():
+        raise DownloadCancelled()
+
+def download_latest_release(download_url, latest_version, file_name=None, expected_sha256=None):
+    """下载最新版本，中断后再次下载会从断点继续"""
+    import requests
+    # 如果没有提供文件名，生成默认文件名
+    if not file_name:
+        file_name = f"{GITEE_REPO}_server_v{latest_version}.zip"
+    
+    def show_progress(downloaded_size, total_size):
+        # 显示下载进度
+        if total_size > 0:
+            progress = (downloaded_size / total_size) * 100
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 下载进度: {progress:.1f}% ({downloaded_size / 1024:.2f} KB / {total_size / 1024:.2f} KB)", end="\r")
+        else:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 已下载: {downloaded_size / 1024:.2f} KB", end="\r")
+    
+    try:
+        # 开始下载
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 开始下载更新: {file_name}")
+        if os.path.exists(file_name + ".part.json"):
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔍 发现未完成的下载，将从断点继续")
+        
+        download_file(download_url, file_name, expected_sha256=expected_sha256, progress_callback=show_progress)
         
         print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 下载完成: {file_name}")
+        if expected_sha256:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ SHA256校验通过")
         
+    except ChecksumMismatch as e:
+        print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 下载失败: {str(e)}，已删除损坏的文件")
     except requests.exceptions.RequestException as e:
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 下载失败: 网络请求错误 - {str(e)}")
+        print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 下载失败: 网络请求错误 - {str(e)}")
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔍 再次下载将从断点继续")
     except Exception as e:
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 下载失败: {str(e)}")
+        print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 下载失败: {str(e)}")
+
+def fetch_latest_release(cache_ttl=0):
+    """获取Gitee最新发行版信息
+    cache_ttl秒内的磁盘缓存直接使用；过期后带上次的ETag/Last-Modified重新验证，未变化时服务器只返回304；
+    网络请求失败时退回到过期的缓存
+    返回值：(发行版信息, 是否来自缓存)
+    """
+    import requests
+    cached = None
+    try:
+        with open(UPDATE_CACHE_FILE, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = None
+    
+    if cached and cache_ttl > 0 and 0 <= time.time() - cached.get("checked_at", 0) < cache_ttl:
+        return cached.get("release", {}), True
+    
+    # 构建API请求URL
+    url = f"https://gitee.com/api/v5/repos/{GITEE_OWNER}/{GITEE_REPO}/releases/latest"
+    
+    # 设置请求头，不包含Token认证
+    headers = {
+        "Content-Type": "application/json"
+    }
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+    
+    # 发送请求
+    try:
+        response = http_client.get(url, headers=headers, timeout=10)
+        if response.status_code == 304 and cached:
+            latest_release = cached.get("release", {})
+            etag, last_modified = cached.get("etag", ""), cached.get("last_modified", "")
+        else:
+            latest_release = response.json()
+            etag, last_modified = response.headers.get("ETag", ""), response.headers.get("Last-Modified", "")
+    except requests.exceptions.RequestException:
+        if cached:
+            return cached.get("release", {}), True
+        raise
+    
+    # 写入缓存，先写临时文件再替换，避免中途退出留下损坏的缓存
+    try:
+        temp_file = UPDATE_CACHE_FILE + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump({"checked_at": time.time(), "release": latest_release,
+                       "etag": etag, "last_modified": last_modified}, f, ensure_ascii=False)
+        os.replace(temp_file, UPDATE_CACHE_FILE)
+    except OSError as e:
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  更新检查缓存写入失败: {str(e)}")
+    return latest_release, False
 
-def check_for_updates():
-    """检查Gitee仓库是否有新的发行版"""
+def check_for_updates(cache_ttl=0, interactive=True):
+    """检查Gitee仓库是否有新的发行版
+    interactive为False时只输出检查结果，不询问是否下载（后台检查时使用）
+    """
+    import requests
     try:
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔍 正在检查更新...")
         
-        # 构建API请求URL
-        url = f"https://gitee.com/api/v5/repos/{GITEE_OWNER}/{GITEE_REPO}/releases/latest"
-        
-        # 设置请求头，不包含Token认证
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        # 发送请求
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        # 解析响应
-        latest_release = response.json()
+        # 获取最新发行版信息
+        latest_release, from_cache = fetch_latest_release(cache_ttl)
+        if from_cache:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔍 使用缓存的版本信息（{UPDATE_CACHE_FILE}）")
         latest_version = latest_release.get("tag_name", "").lstrip("v")
         
         # 获取assets
@@ -127,6 +523,10 @@ def check_for_updates():
             print(release_notes)
             
             # 强制更新询问用户
+            if not interactive:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 💡 提示: 输入 'update' 命令可下载更新")
+                return
+            
             choice = input("是否立即下载更新？(y/n): ").strip().lower()
             if choice == 'y':
                 # 查找zip文件附件
@@ -197,7 +597,7 @@ def check_for_updates():
                     download_url = f"https://gitee.com{download_url}"
                 
                 if download_url:
-                    download_latest_release(download_url, latest_version, file_name)
+                    download_latest_release(download_url, latest_version, file_name, expected_sha256=find_release_checksum(assets, file_name))
                 else:
                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 获取下载链接失败！")
         elif version_diff == 1:
@@ -209,6 +609,10 @@ def check_for_updates():
             print(release_notes)
             
             # 询问用户是否更新
+            if not interactive:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 💡 提示: 输入 'update' 命令可下载更新")
+                return
+            
             choice = input("是否下载更新？(y/n): ").strip().lower()
             if choice == 'y':
                 # 查找zip文件附件
@@ -279,7 +683,7 @@ def check_for_updates():
                     download_url = f"https://gitee.com{download_url}"
                 
                 if download_url:
-                    download_latest_release(download_url, latest_version, file_name)
+                    download_latest_release(download_url, latest_version, file_name, expected_sha256=find_release_checksum(assets, file_name))
                 else:
                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 获取下载链接失败！")
         elif version_diff == 0:
@@ -296,9 +700,58 @@ def check_for_updates():
     except Exception as e:
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 检查更新失败：{str(e)}")
 
-def load_config():
-    """加载配置文件，若不存在则生成默认配置"""
-    config_file = "LittleChat.serverset"
+CONFIG_FILE = "LittleChat.serverset"
+CONFIG_WATCH_INTERVAL = 2  # 检查配置文件是否被修改的间隔（秒）
+
+# 运行中修改后立即生效的配置项，格式: {配置项: (类型, 约束)}；其余配置项需要重启服务器才能生效
+LIVE_CONFIG_SETTINGS = {
+    "max_user": ("int", 1),
+    "socket_timeout": ("int", 1),
+    "admin_prefix": ("str", None),
+    "log_level": ("choice", ("info", "warn", "error")),
+    "message_size_limit": ("int", 1),
+    "tcp_keepalive": ("bool", None),
+    "tcp_keepalive_idle": ("int", 1),
+    "tcp_keepalive_interval": ("int", 1),
+    "file_transfer": ("bool", None),
+    "file_max_size": ("int", 0),
+    "compress_threshold": ("int", 0),
+    "caps_wait": ("int", 0),
+}
+
+def parse_config_value(kind, constraint, raw):
+    """按LIVE_CONFIG_SETTINGS中的类型解析配置值，取值无效时抛出ValueError"""
+    if kind == "int":
+        try:
+            value = int(raw)
+        except ValueError:
+            raise ValueError("必须是整数")
+        if value < constraint:
+            raise ValueError(f"不能小于{constraint}")
+        return value
+    if kind == "bool":
+        if raw.lower() not in ("true", "false"):
+            raise ValueError("只能是true或false")
+        return raw.lower() == "true"
+    if kind == "choice":
+        if raw.lower() not in constraint:
+            raise ValueError(f"只能是{'、'.join(constraint)}")
+        return raw.lower()
+    return raw
+
+def config_file_state():
+    """配置文件的(修改时间, 大小)，用于判断文件是否被修改，文件不存在时返回None"""
+    try:
+        stat = os.stat(CONFIG_FILE)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def load_config(strict=False):
+    """加载配置文件，若不存在则生成默认配置
+    strict为True时读取失败直接抛出异常，供重新加载时使用，避免把默认配置当作新配置应用
+    """
+    config_file = CONFIG_FILE
     default_config = {
         "server_port": "7891",
         "max_user": "5",
@@ -307,7 +760,31 @@ def load_config():
         "socket_timeout": "1",
         "admin_prefix": "ADMIN：",
         "log_level": "info",
-        "message_size_limit": "1024"
+        "message_size_limit": "1024",
+        "heartbeat_interval": "15",
+        "heartbeat_timeout": "45",
+        "caps_wait": "300",
+        "tcp_keepalive": "true",
+        "tcp_keepalive_idle": "60",
+        "tcp_keepalive_interval": "10",
+        "update_check": "true",
+        "update_check_ttl": "21600",
+        "file_transfer": "true",
+        "file_max_size": "104857600",
+        "compress_threshold": "256",
+        "tls_mode": "off",
+        "tls_cert": "LittleChat.crt",
+        "tls_key": "LittleChat.key",
+        "moderation_store": "true",
+        "moderation_fsync": "interval",
+        "moderation_compact_entries": "1000",
+        "workers": "1",
+        "federation_port": "0",
+        "federation_host": "0.0.0.0",
+        "federation_peers": "",
+        "federation_key": "",
+        "node_name": "",
+        "discovery": "true"
     }
     
     # 检查配置文件是否存在
@@ -344,6 +821,78 @@ def load_config():
                 elif key == "message_size_limit":
                     f.write("# 单个消息的最大长度（字节）\n")
                     f.write(f"{key}={value} # 默认消息大小：1024字节\n\n")
+                elif key == "heartbeat_interval":
+                    f.write("# 向客户端发送心跳PING的间隔（秒），0表示关闭心跳\n")
+                    f.write(f"{key}={value} # 默认间隔：15秒\n\n")
+                elif key == "heartbeat_timeout":
+                    f.write("# 支持心跳的客户端超过该时间无任何数据即判定掉线（秒）\n")
+                    f.write(f"{key}={value} # 默认超时：45秒\n\n")
+                elif key == "caps_wait":
+                    f.write("# 新连接等待客户端回复CAPS的最长时间（毫秒），超时的客户端本次连接按旧协议通信，高延迟网络可适当调大，0表示不启用协议扩展\n")
+                    f.write(f"{key}={value} # 默认等待：300毫秒\n\n")
+                elif key == "tcp_keepalive":
+                    f.write("# 是否为客户端连接开启TCP保活（true/false）\n")
+                    f.write(f"{key}={value} # 默认开启：true\n\n")
+                elif key == "tcp_keepalive_idle":
+                    f.write("# 连接空闲多久后开始发送TCP保活探测（秒）\n")
+                    f.write(f"{key}={value} # 默认空闲时间：60秒\n\n")
+                elif key == "tcp_keepalive_interval":
+                    f.write("# TCP保活探测的间隔（秒）\n")
+                    f.write(f"{key}={value} # 默认探测间隔：10秒\n\n")
+                elif key == "update_check":
+                    f.write("# 启动后是否在后台检查更新（true/false），离线环境可关闭\n")
+                    f.write(f"{key}={value} # 默认开启：true\n\n")
+                elif key == "update_check_ttl":
+                    f.write("# 更新检查结果的缓存时间（秒），缓存期内启动不再请求网络\n")
+                    f.write(f"{key}={value} # 默认缓存：21600秒（6小时）\n\n")
+                elif key == "file_transfer":
+                    f.write("# 是否允许用户之间传输文件（true/false），服务器只转发不保存文件\n")
+                    f.write(f"{key}={value} # 默认开启：true\n\n")
+                elif key == "file_max_size":
+                    f.write("# 单个文件传输的最大大小（字节）\n")
+                    f.write(f"{key}={value} # 默认大小：104857600字节（100MB）\n\n")
+                elif key == "compress_threshold":
+                    f.write("# 达到该长度（字节）的消息对支持压缩的客户端使用deflate压缩发送，0表示关闭压缩\n")
+                    f.write(f"{key}={value} # 默认阈值：256字节\n\n")
+                elif key == "tls_mode":
+                    f.write("# 加密连接：off关闭，optional同时接受加密和明文连接，required只接受加密连接\n")
+                    f.write(f"{key}={value} # 默认关闭：off\n\n")
+                elif key == "tls_cert":
+                    f.write("# TLS证书文件，不存在时自动生成自签名证书\n")
+                    f.write(f"{key}={value} # 默认：LittleChat.crt\n\n")
+                elif key == "tls_key":
+                    f.write("# TLS私钥文件\n")
+                    f.write(f"{key}={value} # 默认：LittleChat.key\n\n")
+                elif key == "moderation_store":
+                    f.write("# 是否把管理员、封禁和禁言保存到磁盘，重启后自动恢复（true/false）\n")
+                    f.write(f"{key}={value} # 默认开启：true\n\n")
+                elif key == "moderation_fsync":
+                    f.write("# 管理状态写盘策略：always每次修改都fsync，interval每秒最多fsync一次，never交给操作系统\n")
+                    f.write(f"{key}={value} # 默认：interval\n\n")
+                elif key == "moderation_compact_entries":
+                    f.write("# 操作日志累计多少条后写入新快照并清空日志\n")
+                    f.write(f"{key}={value} # 默认：1000条\n\n")
+                elif key == "workers":
+                    f.write("# 工作进程数，大于1时多个进程共享端口并利用多核（仅Linux），0表示使用全部CPU核心\n")
+                    f.write(f"{key}={value} # 默认单进程：1\n\n")
+                elif key == "federation_port":
+                    f.write("# 联邦端口，其他节点通过该端口与本节点互联组成同一个聊天室，0表示不监听\n")
+                    f.write(f"{key}={value} # 默认不监听：0\n\n")
+                elif key == "federation_host":
+                    f.write("# 联邦端口绑定的地址，只在内网互联时建议填写本机内网IP\n")
+                    f.write(f"{key}={value} # 默认所有网卡：0.0.0.0\n\n")
+                elif key == "federation_peers":
+                    f.write("# 主动连接的其他节点联邦地址，多个用逗号分隔，例如 192.168.1.10:7892,192.168.2.10:7892\n")
+                    f.write(f"{key}={value} # 默认为空\n\n")
+                elif key == "federation_key":
+                    f.write("# 节点互联的共享密钥，所有节点必须一致；为空时不启用联邦\n")
+                    f.write(f"{key}={value} # 默认为空\n\n")
+                elif key == "node_name":
+                    f.write("# 本节点在联邦中的名称，必须唯一，留空则使用 主机名:端口\n")
+                    f.write(f"{key}={value} # 默认为空\n\n")
+                elif key == "discovery":
+                    f.write(f"# 是否响应局域网发现请求，客户端连接界面据此列出附近的服务器（UDP端口{DISCOVERY_PORT}）\n")
+                    f.write(f"{key}={value} # 默认开启：true\n\n")
                 else:
                     f.write(f"# {key}配置\n")
                     f.write(f"{key}={value}\n\n")
@@ -370,6 +919,8 @@ def load_config():
                     key, value = line.split("=", 1)
                     config[key.strip()] = value.strip()
     except Exception as e:
+        if strict:
+            raise
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 配置文件读取错误: {e}")
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 使用默认配置")
         return default_config
@@ -381,10 +932,916 @@ def load_config():
     
     return config
 
-class ChatServer:
+def encode_frame(payload, flags=0):
+    """将字节负载编码为长度前缀帧"""
+    return FRAME_HEADER.pack(len(payload), flags) + payload
+
+def compress_payload(data):
+    """使用预置字典压缩帧负载"""
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, zdict=COMPRESSION_DICTIONARY)
+    return compressor.compress(data) + compressor.flush()
+
+def decompress_payload(data):
+    """解压帧负载，解压后超过单帧上限视为协议错误，防止压缩炸弹"""
+    decompressor = zlib.decompressobj(-15, zdict=COMPRESSION_DICTIONARY)
+    result = decompressor.decompress(data, MAX_FRAME_SIZE)
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError("压缩帧数据不完整或解压后超过上限")
+    return result
+
+class FrameReader:
+    """从TCP字节流中切分出完整的长度前缀帧"""
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+    
+    def feed(self, data):
+        """追加收到的数据，返回已完整的帧列表 [(flags, payload), ...]"""
+        self.buffer.extend(data)
+        frames = []
+        while len(self.buffer) >= FRAME_HEADER.size:
+            length, flags = FRAME_HEADER.unpack_from(self.buffer)
+            if length > self.max_frame_size:
+                raise ValueError(f"帧长度 {length} 超过上限 {self.max_frame_size}")
+            frame_end = FRAME_HEADER.size + length
+            if len(self.buffer) < frame_end:
+                break
+            frames.append((flags, bytes(self.buffer[FRAME_HEADER.size:frame_end])))
+            del self.buffer[:frame_end]
+        return frames
+
+class ClientSession:
+    """单个客户端连接的协议状态"""
+    def __init__(self, client_socket, client_address):
+        self.socket = client_socket
+        self.address = client_address
+        self.caps = set()  # 已协商启用的协议扩展
+        self.framed = False  # 是否使用长度前缀帧
+        self.reader = FrameReader()
+        self.pending = deque()  # 已收到但尚未处理的消息
+        self.send_lock = threading.Lock()  # 多个线程可能同时向同一连接发送
+        self.last_seen = time.time()
+        self.poller = None  # 同时等待客户端数据和平滑升级通知
+        self.parked = False  # 处理线程已因平滑升级停止，连接交给新进程
+        self.backlog = None  # 协议协商结束前暂存的待发送消息，协商结束后为None
+        self.awaiting_caps = False  # 尚未收到客户端数据，此时收到的CAPS:行用于协商协议扩展
+
+class FileTransfer:
+    """服务端转发中的一次文件传输"""
+    def __init__(self, transfer_id, sender, receiver, size):
+        self.id = transfer_id
+        self.sender = sender  # 发送方socket
+        self.receiver = receiver  # 接收方socket
+        self.size = size
+        self.accepted = False  # 接收方同意前不转发分块
+
+class NicknameMap(dict):
+    """socket到昵称的映射，同时维护昵称到socket的反向索引，按昵称查找在线用户时不必遍历整个用户表"""
     def __init__(self):
+        super().__init__()
+        self.sockets = {}  # 昵称 -> socket
+    
+    def __setitem__(self, sock, nickname):
+        old = self.get(sock)
+        if old is not None and self.sockets.get(old) is sock:
+            del self.sockets[old]
+        super().__setitem__(sock, nickname)
+        self.sockets[nickname] = sock
+    
+    def __delitem__(self, sock):
+        nickname = self[sock]
+        super().__delitem__(sock)
+        # 同名用户已由新的socket接替时保留新的索引
+        if self.sockets.get(nickname) is sock:
+            del self.sockets[nickname]
+    
+    def pop(self, sock, *default):
+        if sock in self:
+            nickname = self[sock]
+            del self[sock]
+            return nickname
+        return super().pop(sock, *default)
+    
+    def clear(self):
+        super().clear()
+        self.sockets.clear()
+    
+    def socket_of(self, nickname):
+        """返回昵称对应的socket，不在线时返回None"""
+        return self.sockets.get(nickname)
+
+class ReplicatedSet(set):
+    """多进程模式下，修改会通过总线同步到其他工作进程的集合"""
+    def __init__(self, name, on_change=None):
+        super().__init__()
+        self.name = name
+        self.on_change = on_change  # 本地修改的同步回调，参数: (名称, 操作, 键, 值)
+        self.journal = None  # 持久化回调，参数同上；本地修改和apply()应用的修改都会记录
+    
+    def add(self, item):
+        super().add(item)
+        self._changed("add", item, None)
+    
+    def remove(self, item):
+        super().remove(item)
+        self._changed("remove", item, None)
+    
+    def _changed(self, op, key, value):
+        if self.journal:
+            self.journal(self.name, op, key, value)
+        if self.on_change:
+            self.on_change(self.name, op, key, value)
+    
+    def discard(self, item):
+        if item in self:
+            self.remove(item)
+    
+    def apply(self, op, key, value):
+        """应用来自其他进程的修改，不会再次触发同步"""
+        if op == "add":
+            super().add(key)
+        elif op == "remove":
+            super().discard(key)
+        elif op == "reset":
+            super().clear()
+            super().update(value)
+        elif op == "merge":
+            super().update(value)
+        if self.journal:
+            self.journal(self.name, op, key, value)
+    
+    def snapshot(self):
+        return list(self)
+
+class ReplicatedDict(dict):
+    """多进程模式下，修改会通过总线同步到其他工作进程的字典"""
+    def __init__(self, name, on_change=None):
+        super().__init__()
+        self.name = name
+        self.on_change = on_change
+        self.journal = None
+    
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed("set", key, value)
+    
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed("delete", key, None)
+    
+    def _changed(self, op, key, value):
+        if self.journal:
+            self.journal(self.name, op, key, value)
+        if self.on_change:
+            self.on_change(self.name, op, key, value)
+    
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return super().pop(key, *default)
+    
+    def apply(self, op, key, value):
+        """应用来自其他进程的修改，JSON传输后的列表还原为元组"""
+        if op == "set":
+            super().__setitem__(key, tuple(value) if isinstance(value, list) else value)
+        elif op == "delete":
+            super().pop(key, None)
+        elif op == "reset":
+            super().clear()
+            for item_key, item_value in value.items():
+                super().__setitem__(item_key, tuple(item_value) if isinstance(item_value, list) else item_value)
+        elif op == "merge":
+            # 只补充本地没有的项，已有的以本地为准
+            for item_key, item_value in value.items():
+                if item_key not in self:
+                    super().__setitem__(item_key, tuple(item_value) if isinstance(item_value, list) else item_value)
+        if self.journal:
+            self.journal(self.name, op, key, value)
+    
+    def snapshot(self):
+        return dict(self)
+
+def ip_ban_network(text):
+    """解析单个IP或CIDR网段，IPv4映射的IPv6地址（::ffff:a.b.c.d）按IPv4处理"""
+    network = ipaddress.ip_network(text.strip(), strict=False)
+    if network.version == 6 and network.prefixlen == 128 and network.network_address.ipv4_mapped:
+        network = ipaddress.ip_network(network.network_address.ipv4_mapped)
+    return network
+
+def format_ban_rule(network):
+    """单个地址的规则直接写成IP，与旧版本的封禁列表保持兼容"""
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+def parse_ip_ban_rules(text):
+    """把封禁目标解析为规范化的规则列表，不是IP格式时抛出ValueError
+    支持单个IP、CIDR网段（10.0.0.0/24、2001:db8::/32）和地址范围（10.0.0.5-10.0.0.20），
+    地址范围会拆成最少的若干个CIDR网段
+    """
+    text = text.strip()
+    if "-" in text:
+        first, last = (ipaddress.ip_address(part.strip()) for part in text.split("-", 1))
+        if first.version != last.version:
+            raise ValueError("地址范围两端的IP版本不一致")
+        if first > last:
+            first, last = last, first
+        networks = ipaddress.summarize_address_range(first, last)
+    else:
+        networks = [ip_ban_network(text)]
+    return [format_ban_rule(network) for network in networks]
+
+class IPPrefixTrie:
+    """IP封禁规则的二进制前缀树，IPv4和IPv6各一棵
+    规则按网络地址的二进制位逐位插入，查询沿目标地址的位向下走，
+    耗时只与前缀长度有关（最多32或128步），与规则数量无关
+    """
+    def __init__(self, rules=()):
+        # 节点格式: [0分支, 1分支, 在此结束的规则]
+        self.roots = {4: [None, None, None], 6: [None, None, None]}
+        for rule in rules:
+            self.insert(rule)
+    
+    @staticmethod
+    def _bits(network):
+        """网络地址的前prefixlen位，从高位到低位"""
+        value = int(network.network_address)
+        top = network.max_prefixlen - 1
+        return ((value >> (top - index)) & 1 for index in range(network.prefixlen))
+    
+    def insert(self, rule):
+        network = ip_ban_network(rule)
+        node = self.roots[network.version]
+        for bit in self._bits(network):
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        node[2] = rule
+    
+    def remove(self, rule):
+        try:
+            network = ip_ban_network(rule)
+        except ValueError:
+            return
+        node = self.roots[network.version]
+        path = []
+        for bit in self._bits(network):
+            path.append((node, bit))
+            node = node[bit]
+            if node is None:
+                return
+        node[2] = None
+        # 清理不再通向任何规则的分支
+        for parent, bit in reversed(path):
+            child = parent[bit]
+            if child[0] is None and child[1] is None and child[2] is None:
+                parent[bit] = None
+            else:
+                break
+    
+    def match(self, target):
+        """返回覆盖目标IP或网段的最宽的规则，没有时返回None"""
+        try:
+            network = ip_ban_network(target)
+        except ValueError:
+            return None
+        node = self.roots[network.version]
+        if node[2] is not None:
+            return node[2]
+        for bit in self._bits(network):
+            node = node[bit]
+            if node is None:
+                return None
+            if node[2] is not None:
+                return node[2]
+        return None
+
+class IPBanSet(ReplicatedSet):
+    """IP封禁规则集合，元素为规范化的规则字符串（单个IP或CIDR网段）
+    同时维护前缀树，检查新连接时不必逐条比较规则
+    """
+    def __init__(self, name, on_change=None):
+        super().__init__(name, on_change)
+        self.trie = IPPrefixTrie()
+    
+    def add(self, item):
+        self.trie.insert(item)
+        super().add(item)
+    
+    def remove(self, item):
+        super().remove(item)
+        self.trie.remove(item)
+    
+    def apply(self, op, key, value):
+        super().apply(op, key, value)
+        if op == "add":
+            self._index(key)
+        elif op == "remove":
+            self.trie.remove(key)
+        else:
+            self.trie = IPPrefixTrie()
+            for rule in self:
+                self._index(rule)
+    
+    def _index(self, rule):
+        try:
+            self.trie.insert(rule)
+        except ValueError:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  忽略无法解析的封禁规则: {rule}")
+    
+    def match(self, target):
+        """返回覆盖目标IP的封禁规则，未被封禁时返回None"""
+        return self.trie.match(target)
+
+class RemoteClient:
+    """连接在其他工作进程或联邦节点上的用户，在本进程的用户表中代替socket
+    向它发送消息或踢出它时，请求会通过总线或联邦连接转给所在的进程
+    worker_id为工作进程编号或节点名称
+    """
+    def __init__(self, worker_id, nickname):
+        self.worker_id = worker_id
+        self.nickname = nickname
+    
+    def close(self):
+        pass
+
+MODERATION_JOURNAL_FILE = "LittleChat.modjournal"
+MODERATION_SNAPSHOT_FILE = "LittleChat.modsnapshot"
+MODERATION_FSYNC_INTERVAL = 1.0  # interval策略下两次fsync的最小间隔（秒）
+
+class ModerationStore:
+    """管理状态（管理员、封禁、禁言）的磁盘存储：追加写的操作日志 + 定期快照
+    启动时先读快照再按顺序重放日志，耗时与文件大小成正比。运行中的修改只放入队列，
+    由后台线程批量写入，不阻塞聊天线程。日志条目达到上限时写入新快照并清空日志，
+    过期的禁言在写快照时被丢弃。
+    """
+    def __init__(self, snapshot_state, fsync_policy="interval", compact_entries=1000,
+                 journal_file=MODERATION_JOURNAL_FILE, snapshot_file=MODERATION_SNAPSHOT_FILE):
+        self.snapshot_state = snapshot_state  # 返回当前完整状态的函数，写快照时调用
+        self.fsync_policy = fsync_policy  # always：每批写入后fsync；interval：每秒最多一次；never：交给操作系统
+        self.compact_entries = compact_entries
+        self.journal_file = journal_file
+        self.snapshot_file = snapshot_file
+        self.queue = queue.Queue()
+        self.journal = None
+        self.journal_entries = 0
+        self.thread = None
+    
+    def load(self, containers):
+        """读取快照和日志恢复状态，返回重放的日志条目数；日志末尾写了一半的行会被跳过"""
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            for name, container in containers.items():
+                if name in snapshot:
+                    container.apply("reset", None, snapshot[name])
+        
+        replayed = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    container = containers.get(entry.get("n"))
+                    if container is not None:
+                        container.apply(entry["o"], entry.get("k"), entry.get("v"))
+                        replayed += 1
+        return replayed
+    
+    def start(self):
+        """整理一次已有数据后启动后台写入线程"""
+        self.compact()
+        self.thread = threading.Thread(target=self.writer_loop)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def record(self, name, op, key, value):
+        """记录一次修改，只入队不做磁盘操作"""
+        self.queue.put({"n": name, "o": op, "k": key, "v": value})
+    
+    def close(self):
+        """写完队列中剩余的修改后停止"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+            self.thread = None
+    
+    def writer_loop(self):
+        last_sync = time.time()
+        unsynced = False
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self.queue.get(timeout=MODERATION_FSYNC_INTERVAL)]
+            except queue.Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = [entry for entry in batch if entry is not None]
+            
+            try:
+                if batch:
+                    self.journal.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch))
+                    self.journal.flush()
+                    self.journal_entries += len(batch)
+                    unsynced = True
+                if unsynced and self.fsync_policy != "never" and (
+                        self.fsync_policy == "always" or stopping or time.time() - last_sync >= MODERATION_FSYNC_INTERVAL):
+                    os.fsync(self.journal.fileno())
+                    unsynced = False
+                    last_sync = time.time()
+                if self.journal_entries >= self.compact_entries:
+                    self.compact()
+                    unsynced = False
+            except (OSError, ValueError) as e:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 写入管理状态失败: {str(e)}")
+        self.journal.close()
+        self.journal = None
+    
+    def compact(self):
+        """把当前状态写成新快照（先写临时文件再替换），然后清空日志"""
+        state = self.snapshot_state()
+        now = time.time()
+        state["muted_users"] = {nickname: value for nickname, value in state.get("muted_users", {}).items()
+                                if value[0] + value[1] * 60 > now}
+        temp_file = self.snapshot_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            if self.fsync_policy != "never":
+                os.fsync(f.fileno())
+        os.replace(temp_file, self.snapshot_file)
+        
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.journal_file, "w", encoding="utf-8")
+        self.journal_entries = 0
+
+FEDERATION_ROSTER_INTERVAL = 10  # 节点定期重发用户表的间隔（秒），超过3倍间隔未收到则认为节点已离线
+FEDERATION_RETRY_INTERVAL = 5  # 连接其他节点失败后的重试间隔（秒）
+FEDERATION_EVENT_TYPES = ("broadcast", "roster", "state", "direct", "kick", "merge")
+FEDERATION_NONCE_SIZE = 16  # 握手随机数的字节数
+
+class FederationRejected(Exception):
+    """握手时对方未通过校验"""
+
+class FederationLink:
+    """与另一个节点之间的一条连接，发送由独立线程完成，避免慢节点阻塞事件分发"""
+    def __init__(self, sock, peer_name):
+        self.socket = sock
+        self.peer_name = peer_name
+        self.outbox = queue.Queue()
+        self.closed = False
+    
+    def send(self, data):
+        if not self.closed:
+            self.outbox.put(data)
+    
+    def writer_loop(self):
+        while True:
+            data = self.outbox.get()
+            if data is None or self.closed:
+                break
+            try:
+                self.socket.sendall(data)
+            except OSError:
+                break
+        self.close()
+    
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.outbox.put(None)
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+
+class Federation:
+    """把多个ChatServer节点连成一个聊天室
+    节点之间互相转发工作进程总线上的同一批事件（广播、用户表、管理状态、私发和踢人）。
+    每个事件带有来源节点、纪元和序号：各节点只处理每个来源序号递增的事件并转发给其他连接，
+    既避免了环路，又保证同一来源的事件在所有节点上按发送顺序生效。
+    连接建立时双方发布自己的完整管理状态，网络分区恢复后各节点取并集。
+    """
+    def __init__(self, server, node_name, host, port, peers, key):
+        self.server = server
+        self.node_name = node_name
+        self.host = host
+        self.port = port
+        self.peers = peers  # [(host, port), ...]
+        self.key = key
+        self.epoch = int(time.time() * 1000)  # 本次启动的纪元，节点重启后序号重新计数
+        self.seq = 0
+        self.seq_lock = threading.Lock()  # 保护序号和连接列表，保证发出的事件按序号排队
+        self.links = []
+        self.inbox = queue.Queue()  # 所有连接收到的事件由一个线程按到达顺序处理
+        self.seen = {}  # 每个来源已处理的最新事件，格式: {node_name: (epoch, seq)}
+        self.roster_times = {}  # 每个节点最近一次发布用户表的时间
+        self.listen_socket = None
+    
+    def start(self):
+        threads = [threading.Thread(target=self.dispatch_loop), threading.Thread(target=self.refresh_loop)]
+        if self.port > 0:
+            self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listen_socket.bind((self.host, self.port))
+            self.listen_socket.listen(16)
+            self.listen_socket.settimeout(1)
+            threads.append(threading.Thread(target=self.listen_loop))
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🌐 联邦节点 {self.node_name} 监听: {self.host}:{self.port}")
+        for host, port in self.peers:
+            threads.append(threading.Thread(target=self.connect_loop, args=(host, port)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+    
+    def stop(self):
+        if self.listen_socket is not None:
+            try:
+                self.listen_socket.close()
+            except OSError:
+                pass
+        with self.seq_lock:
+            links = list(self.links)
+        for link in links:
+            link.close()
+        self.inbox.put(None)
+    
+    def link_count(self):
+        with self.seq_lock:
+            return len(self.links)
+    
+    def listen_loop(self):
+        while self.server.running:
+            try:
+                sock, address = self.listen_socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            thread = threading.Thread(target=self.run_link, args=(sock, f"{address[0]}:{address[1]}", False))
+            thread.daemon = True
+            thread.start()
+    
+    def connect_loop(self, host, port):
+        """主动连接配置的节点，断开后自动重连"""
+        while self.server.running:
+            try:
+                sock = socket.create_connection((host, port), timeout=5)
+            except OSError:
+                time.sleep(FEDERATION_RETRY_INTERVAL)
+                continue
+            self.run_link(sock, f"{host}:{port}", True)
+            if self.server.running:
+                time.sleep(FEDERATION_RETRY_INTERVAL)
+    
+    def handshake_mac(self, verifier_nonce, prover_nonce, prover_name):
+        """握手应答：HMAC-SHA256(共享密钥, 校验方随机数 ‖ 应答方随机数 ‖ 应答方节点名称)"""
+        message = verifier_nonce + prover_nonce + prover_name.encode('utf-8')
+        return hmac.new(self.key.encode('utf-8'), message, hashlib.sha256).hexdigest()
+    
+    def handshake(self, sock, reader, frames, outbound):
+        """挑战应答握手，返回对方的节点名称；对方未通过校验时抛出FederationRejected
+        双方先交换节点名称和随机数，再各自用共享密钥对两个随机数和自己的名称计算HMAC，密钥本身不经过网络。
+        主动连接的一方先应答，被连接的一方校验通过后才应答，任何人连上联邦端口都拿不到可用的应答
+        """
+        def send(message):
+            sock.sendall(encode_frame(json.dumps(message, ensure_ascii=False).encode('utf-8')))
+        
+        def receive(message_type):
+            while not frames:
+                data = sock.recv(FRAMED_RECV_SIZE)
+                if not data:
+                    raise ConnectionError("握手时连接被关闭")
+                frames.extend(reader.feed(data))
+            message = json.loads(frames.pop(0)[1].decode('utf-8'))
+            if not isinstance(message, dict) or message.get("type") != message_type:
+                raise FederationRejected("握手消息格式错误")
+            return message
+        
+        nonce = os.urandom(FEDERATION_NONCE_SIZE)
+        send({"type": "hello", "node": self.node_name, "nonce": nonce.hex()})
+        hello = receive("hello")
+        peer_name = str(hello.get("node", ""))
+        if not peer_name or peer_name == self.node_name:
+            raise FederationRejected("节点名称为空或与本节点重复")
+        peer_nonce = bytes.fromhex(str(hello.get("nonce", "")))
+        if len(peer_nonce) != FEDERATION_NONCE_SIZE:
+            raise FederationRejected("握手随机数长度错误")
+        
+        answer = {"type": "auth", "mac": self.handshake_mac(peer_nonce, nonce, self.node_name)}
+        if outbound:
+            send(answer)
+        auth = receive("auth")
+        if not hmac.compare_digest(str(auth.get("mac", "")), self.handshake_mac(nonce, peer_nonce, peer_name)):
+            raise FederationRejected("共享密钥不一致")
+        if not outbound:
+            send(answer)
+        return peer_name
+    
+    def run_link(self, sock, address, outbound):
+        """握手后持续读取对方的事件，交给分发线程处理；outbound表示本节点是主动连接的一方"""
+        reader = FrameReader()
+        frames = []
+        try:
+            sock.settimeout(10)
+            peer_name = self.handshake(sock, reader, frames, outbound)
+        except FederationRejected as e:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  拒绝节点 {address} 的连接: {str(e)}")
+            sock.close()
+            return
+        except (OSError, ValueError, ConnectionError) as e:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  与节点 {address} 握手失败: {str(e)}")
+            sock.close()
+            return
+        
+        sock.settimeout(None)
+        enable_tcp_keepalive(sock, 30, 10)
+        link = FederationLink(sock, peer_name)
+        writer_thread = threading.Thread(target=link.writer_loop)
+        writer_thread.daemon = True
+        writer_thread.start()
+        with self.seq_lock:
+            self.links.append(link)
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🌐 已连接联邦节点 {peer_name} ({address})")
+        self.on_link_up()
+        
+        try:
+            for flags, payload in frames:
+                self.inbox.put((link, payload))
+            while not link.closed:
+                data = sock.recv(FRAMED_RECV_SIZE)
+                if not data:
+                    break
+                for flags, payload in reader.feed(data):
+                    self.inbox.put((link, payload))
+        except (OSError, ValueError):
+            pass
+        finally:
+            link.close()
+            with self.seq_lock:
+                if link in self.links:
+                    self.links.remove(link)
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🌐 与联邦节点 {peer_name} 的连接已断开")
+    
+    def on_link_up(self):
+        """新连接建立后发布完整的管理状态和本节点用户表"""
+        with self.server.lock:
+            state = {name: container.snapshot() for name, container in self.server.replicated_state().items()}
+        self.publish({"type": "merge", "state": state})
+        self.server.publish_roster()
+    
+    def publish(self, event):
+        """发布本节点产生的事件"""
+        if event.get("type") not in FEDERATION_EVENT_TYPES:
+            return
+        with self.seq_lock:
+            self.seq += 1
+            envelope = dict(event, origin=self.node_name, epoch=self.epoch, seq=self.seq)
+            data = encode_frame(json.dumps(envelope, ensure_ascii=False).encode('utf-8'))
+            for link in self.links:
+                link.send(data)
+    
+    def dispatch_loop(self):
+        """按到达顺序处理其他节点的事件：去重、转发给其他连接、在本节点生效"""
+        while True:
+            item = self.inbox.get()
+            if item is None:
+                return
+            link, payload = item
+            try:
+                envelope = json.loads(payload.decode('utf-8'))
+            except ValueError:
+                continue
+            origin = envelope.get("origin")
+            if origin == self.node_name or envelope.get("type") not in FEDERATION_EVENT_TYPES:
+                continue
+            epoch, seq = envelope.get("epoch", 0), envelope.get("seq", 0)
+            last_epoch, last_seq = self.seen.get(origin, (0, 0))
+            if epoch < last_epoch or (epoch == last_epoch and seq <= last_seq):
+                # 已经通过其他路径收到过
+                continue
+            self.seen[origin] = (epoch, seq)
+            
+            data = encode_frame(payload)
+            with self.seq_lock:
+                for other in self.links:
+                    if other is not link:
+                        other.send(data)
+            
+            if envelope["type"] == "roster":
+                self.roster_times[origin] = time.time()
+            try:
+                self.server.handle_federation_event(envelope)
+            except Exception as e:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 处理联邦事件失败: {str(e)}")
+    
+    def refresh_loop(self):
+        """定期重发本节点用户表，并移除长时间没有消息的节点上的用户"""
+        while self.server.running:
+            time.sleep(FEDERATION_ROSTER_INTERVAL)
+            self.server.publish_roster()
+            now = time.time()
+            expired = [node for node, last in list(self.roster_times.items())
+                       if now - last > FEDERATION_ROSTER_INTERVAL * 3]
+            for node in expired:
+                self.roster_times.pop(node, None)
+                self.server.apply_remote_roster(node, [])
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  联邦节点 {node} 已离线，移除其用户")
+            if expired:
+                self.server.broadcast_user_list(publish=False)
+
+def enable_tcp_keepalive(sock, idle, interval, count=5):
+    """开启TCP保活并尽量调整探测参数，兼容Linux、macOS和Windows"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+    elif hasattr(socket, "TCP_KEEPALIVE"):
+        # macOS使用TCP_KEEPALIVE表示空闲时间
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+    if hasattr(socket, "TCP_KEEPCNT"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+    if hasattr(socket, "SIO_KEEPALIVE_VALS"):
+        # Windows通过ioctl设置，单位为毫秒
+        sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+
+TLS_HANDSHAKE_TIMEOUT = 10  # 客户端完成TLS握手的最长时间（秒）
+
+def generate_self_signed_cert(cert_file, key_file, common_name, days=3650):
+    """生成自签名证书，优先使用cryptography库，未安装时调用openssl命令行
+    使用ECDSA P-256密钥，服务端握手签名的开销远小于RSA-2048
+    """
+    try:
+        from cryptography import x509
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.x509.oid import NameOID
+    except ImportError:
+        x509 = None
+    
+    if x509 is not None:
+        import datetime
+        key = ec.generate_private_key(ec.SECP256R1())
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cert = (x509.CertificateBuilder()
+                .subject_name(name)
+                .issuer_name(name)
+                .public_key(key.public_key())
+                .serial_number(x509.random_serial_number())
+                .not_valid_before(now - datetime.timedelta(days=1))
+                .not_valid_after(now + datetime.timedelta(days=days))
+                .add_extension(x509.SubjectAlternativeName([x509.DNSName(common_name)]), critical=False)
+                .sign(key, hashes.SHA256()))
+        with open(key_file, "wb") as f:
+            f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                      serialization.NoEncryption()))
+        with open(cert_file, "wb") as f:
+            f.write(cert.public_bytes(serialization.Encoding.PEM))
+    else:
+        import subprocess
+        try:
+            subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                            "-nodes", "-keyout", key_file, "-out", cert_file, "-days", str(days),
+                            "-subj", f"/CN={common_name}"], check=True, capture_output=True)
+        except FileNotFoundError:
+            raise RuntimeError("未安装cryptography库且找不到openssl命令，请执行 pip install cryptography 后重试")
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"openssl生成证书失败: {e.stderr.decode('utf-8', 'replace').strip()}")
+    try:
+        # 私钥只允许当前用户读取
+        os.chmod(key_file, 0o600)
+    except OSError:
+        pass
+
+def certificate_fingerprint(der_bytes):
+    """证书的SHA256指纹，客户端首次连接时记录，之后用于校验服务器身份"""
+    digest = hashlib.sha256(der_bytes).hexdigest().upper()
+    return ":".join(digest[i:i + 2] for i in range(0, len(digest), 2))
+
+def create_server_tls_context(cert_file, key_file):
+    """创建服务端TLS上下文
+    所有连接共享同一个上下文：TLS 1.3的会话票据密钥和TLS 1.2的会话缓存都保存在上下文中，
+    客户端断线重连时复用会话，跳过证书签名和完整的密钥协商
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(cert_file, key_file)
+    context.options &= ~ssl.OP_NO_TICKET
+    if hasattr(context, "num_tickets"):
+        # 客户端每次只保存一张票据，多发没有意义
+        context.num_tickets = 1
+    return context
+
+def prepare_tls_context(mode, cert_file, key_file):
+    """按配置准备TLS上下文，证书不存在时自动生成自签名证书
+    optional模式下失败只打印警告并返回None（仍接受明文连接），required模式下抛出异常
+    """
+    try:
+        if not (os.path.exists(cert_file) and os.path.exists(key_file)):
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔐 未找到证书，正在生成自签名证书 {cert_file} ...")
+            generate_self_signed_cert(cert_file, key_file, socket.gethostname())
+        context = create_server_tls_context(cert_file, key_file)
+        with open(cert_file, "r", encoding="utf-8") as f:
+            fingerprint = certificate_fingerprint(ssl.PEM_cert_to_DER_cert(f.read()))
+    except Exception as e:
+        if mode == "required":
+            raise RuntimeError(f"TLS初始化失败: {str(e)}")
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  TLS初始化失败，只接受明文连接: {str(e)}")
+        return None
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔐 TLS已启用（{mode}），证书指纹 SHA256: {fingerprint}")
+    return context
+
+DISCOVERY_PORT = 7893  # 局域网发现使用的UDP端口，所有服务器共用
+DISCOVERY_GROUP = "239.255.78.93"  # 局域网发现的组播地址，广播被路由器或防火墙拦截时仍可发现
+DISCOVERY_MAGIC = "LCDISCOVER1"  # 发现请求前缀，后面跟客户端生成的随机串
+DISCOVERY_REPLY = "LCSERVER1"  # 发现应答前缀，后面跟JSON
+DISCOVERY_PACKET_SIZE = 1024  # 发现请求的最大长度
+
+def local_lan_ip():
+    """本机在局域网中的IP地址，UDP的connect只查路由表不发送数据，离线时也能使用"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.connect(("10.255.255.255", 1))
+            return probe.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+
+HANDOFF_SOCKET_FILE = "LittleChat.handoff"  # 平滑升级时新旧进程交接连接用的Unix socket
+HANDOFF_PARK_TIMEOUT = 5  # 等待各处理线程停止读取的最长时间（秒）
+HANDOFF_TIMEOUT = 30  # 交接过程中等待对方进程的最长时间（秒）
+HANDOFF_FD_BATCH = 250  # 每条消息附带的文件描述符数，Linux单条消息最多253个
+HANDOFF_SUPPORTED = hasattr(socket, "AF_UNIX") and hasattr(socket, "send_fds") and hasattr(select, "poll")
+
+class ClientHandoff(Exception):
+    """平滑升级开始，处理线程应在读取之前停下，把连接留给新进程"""
+
+def handoff_send(sock, payload, fds=()):
+    """发送交接消息：4字节长度 + JSON，随后分批附带文件描述符（SCM_RIGHTS）"""
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    sock.sendall(struct.pack("!I", len(data)) + data)
+    for index in range(0, len(fds), HANDOFF_FD_BATCH):
+        socket.send_fds(sock, [b"F"], fds[index:index + HANDOFF_FD_BATCH])
+
+def handoff_recv(sock):
+    """接收一条交接消息，返回(JSON内容, 文件描述符列表)"""
+    def recv_exact(size):
+        # 只读取需要的字节数，避免读到后面附带文件描述符的数据
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("交接连接已断开")
+            data += chunk
+        return data
+    
+    length, = struct.unpack("!I", recv_exact(4))
+    payload = json.loads(recv_exact(length).decode("utf-8"))
+    fds = []
+    while len(fds) < payload.get("fd_count", 0):
+        data, batch, _, _ = socket.recv_fds(sock, 1, HANDOFF_FD_BATCH)
+        if not data:
+            raise ConnectionError("交接连接在文件描述符传完之前断开")
+        fds.extend(batch)
+    return payload, fds
+
+# 管理命令的参数格式，聊天中的ADMIN_COMMAND、控制台命令和网页管理共用同一张命令表
+ADMIN_COMMAND_USAGE = {
+    "kick": "kick <用户名>",
+    "op": "op <用户名>",
+    "unop": "unop <用户名>",
+    "ban": "ban <用户名|IP|网段|起始IP-结束IP>",
+    "unban": "unban <用户名|IP|网段|起始IP-结束IP>",
+    "shutup": "shutup <用户名> <时间（分钟）>",
+    "unshutup": "unshutup <用户名>",
+}
+
+class ChatServer:
+    def __init__(self, worker_id=None, bus=None, tls_context=None):
         # 加载配置
         config = load_config()
+        self.config = config  # 当前生效的配置，重新加载时用来判断哪些配置项被修改
+        self.config_state = config_file_state()
         self.port = int(config["server_port"])
         self.max_user = int(config["max_user"])
         self.max_attempts = int(config["max_attempts"])
@@ -393,18 +1850,132 @@ class ChatServer:
         self.admin_prefix = config["admin_prefix"]
         self.log_level = config["log_level"]
         self.message_size_limit = int(config["message_size_limit"])
+        self.heartbeat_interval = int(config["heartbeat_interval"])
+        self.heartbeat_timeout = int(config["heartbeat_timeout"])
+        self.caps_wait = int(config["caps_wait"])
+        self.tcp_keepalive = config["tcp_keepalive"].lower() == "true"
+        self.tcp_keepalive_idle = int(config["tcp_keepalive_idle"])
+        self.tcp_keepalive_interval = int(config["tcp_keepalive_interval"])
+        self.update_check = config["update_check"].lower() == "true"
+        self.update_check_ttl = int(config["update_check_ttl"])
+        self.file_transfer = config["file_transfer"].lower() == "true"
+        self.file_max_size = int(config["file_max_size"])
+        self.compress_threshold = int(config["compress_threshold"])
+        self.tls_mode = config["tls_mode"].lower()
+        if self.tls_mode not in ("off", "optional", "required"):
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] tls_mode 只能是 off、optional 或 required，已关闭TLS")
+            self.tls_mode = "off"
+        self.tls_cert = config["tls_cert"]
+        self.tls_key = config["tls_key"]
+        self.tls_context = tls_context  # 多进程模式下由主进程创建后共享，各工作进程的会话票据互相通用
+        self.federation_port = int(config["federation_port"])
+        self.federation_host = config["federation_host"] or "0.0.0.0"
+        self.federation_peers = parse_peer_list(config["federation_peers"])
+        self.federation_key = config["federation_key"]
+        self.node_name = config["node_name"] or f"{socket.gethostname()}:{self.port}"
+        self.discovery = config["discovery"].lower() == "true"
+        if self.heartbeat_interval > 0 and self.heartbeat_timeout <= self.heartbeat_interval:
+            # 超时时间必须覆盖至少一次心跳间隔，否则正常客户端也会被误判掉线
+            self.heartbeat_timeout = self.heartbeat_interval * 3
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] heartbeat_timeout 需大于 heartbeat_interval，已调整为 {self.heartbeat_timeout} 秒")
         
         self.server_socket = None
         self.client_sockets = []
-        self.client_nicknames = {}
+        self.client_nicknames = NicknameMap()
         self.client_profiles = {}
-        self.admins = set()  # 管理员列表
-        self.banned_users = set()  # 封禁的用户名列表（保留兼容，实际使用IP封禁）
-        self.banned_ips = set()  # 封禁的IP地址列表
-        self.muted_users = {}  # 禁言的用户名和禁言时长，格式: {nickname: (mute_time, duration)}
+        self.client_sessions = {}  # 客户端协议状态，格式: {socket: ClientSession}
+        self.file_transfers = {}  # 转发中的文件传输，格式: {transfer_id: FileTransfer}
+        # 多进程模式下的工作进程编号和总线连接，单进程模式下均为None
+        self.worker_id = worker_id
+        self.bus = bus
+        self.bus_outbox = queue.Queue()  # 待发往主进程的事件，由总线发送线程依次发出
+        self.bus_writer = None
+        # 联邦模式下与其他节点的连接，未配置时为None
+        self.federation = None
+        if worker_id is None and (self.federation_port > 0 or self.federation_peers):
+            if self.federation_key:
+                self.federation = Federation(self, self.node_name, self.federation_host, self.federation_port,
+                                             self.federation_peers, self.federation_key)
+            else:
+                # 没有共享密钥时任何能连上联邦端口的主机都能冒充节点，修改管理状态
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 未设置federation_key，联邦模式未启用")
+        # 管理状态在多进程模式下会同步到所有工作进程
+        self.admins = ReplicatedSet("admins", self.publish_state_change)  # 管理员列表
+        self.banned_users = ReplicatedSet("banned_users", self.publish_state_change)  # 封禁的用户名列表（保留兼容，实际使用IP封禁）
+        self.banned_ips = IPBanSet("banned_ips", self.publish_state_change)  # IP封禁规则（单个IP或CIDR网段）
+        self.muted_users = ReplicatedDict("muted_users", self.publish_state_change)  # 禁言的用户名和禁言时长，格式: {nickname: (mute_time, duration)}
+        # 管理命令表，三个入口都通过execute_admin_command执行
+        self.admin_commands = {
+            "kick": self.command_kick,
+            "op": self.command_op,
+            "unop": self.command_unop,
+            "ban": self.command_ban,
+            "unban": self.command_unban,
+            "shutup": self.command_shutup,
+            "unshutup": self.command_unshutup,
+        }
+        # 管理状态持久化，多进程模式下由主进程负责
+        self.moderation_store = None
+        if config["moderation_store"].lower() == "true" and worker_id is None:
+            self.moderation_store = ModerationStore(self.moderation_snapshot, config["moderation_fsync"].lower(),
+                                                    int(config["moderation_compact_entries"]))
+            self.moderation_store.load(self.replicated_state())
+            for container in self.replicated_state().values():
+                container.journal = self.moderation_store.record
         self.lock = threading.Lock()  # 线程锁，保护客户端列表
         self.running = False
         self.start_time = None  # 服务器启动时间
+        self.stopped = False
+        self.reconnect_hint = None  # 关闭时建议客户端重连的等待秒数，None表示不再重连
+        # 平滑升级：新进程通过Unix socket接管监听socket和在线连接，只支持单进程模式
+        self.handoff_socket = None
+        self.handoff_event = threading.Event()
+        self.handoff_cond = threading.Condition(self.lock)
+        self.handoff_wake = os.pipe() if HANDOFF_SUPPORTED and worker_id is None else None
+        self.handoff_exit_code = None  # 移交结束后本进程的退出码，None表示没有发生移交
+        self.discovery_socket = None  # 响应局域网发现请求的UDP socket
+    
+    def shutdown_message(self, session):
+        """按客户端是否支持shutdown扩展构造关闭通知"""
+        if self.reconnect_hint is None:
+            reason = "服务器已关闭"
+        else:
+            reason = "服务器正在重启"
+        if session is None or "shutdown" not in session.caps:
+            return f"系统: {reason}，连接即将断开"
+        if self.reconnect_hint is None:
+            return f"SHUTDOWN:{reason}"
+        return f"SHUTDOWN:{reason}|RECONNECT:{self.reconnect_hint}"
+    
+    def say_goodbye(self, client):
+        """发送关闭通知后半关闭连接：已发送的数据照常送达，客户端读到EOF后断开"""
+        try:
+            self.send_to(client, self.shutdown_message(self.client_sessions.get(client)))
+            if not isinstance(client, ssl.SSLSocket):
+                # SSLSocket.shutdown会丢弃加密状态，加密连接只等客户端收到通知后自己断开
+                client.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+    
+    def drain_clients(self, clients):
+        """向所有客户端发送关闭通知，在SHUTDOWN_DRAIN_TIMEOUT内等待它们断开
+        直接close()时接收缓冲区里未读的数据会让内核发送RST，客户端可能因此丢掉还没读到的消息
+        """
+        deadline = time.time() + SHUTDOWN_DRAIN_TIMEOUT
+        threads = []
+        for client in clients:
+            # 发送可能被慢客户端阻塞，每个连接单独发送
+            thread = threading.Thread(target=self.say_goodbye, args=(client,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
+        while time.time() < deadline:
+            with self.lock:
+                if not any(client in self.client_sockets for client in clients):
+                    return
+            time.sleep(0.05)
     
     def _get_running_time(self):
         """计算服务器运行时间"""
@@ -428,69 +1999,114 @@ class ChatServer:
         else:
             return f"{seconds}秒"
     
-    def handle_client(self, client_socket, client_address):
-        """处理单个客户端连接"""
+    def register_client(self, session):
+        """完成新连接的握手：TLS、昵称、封禁和重名检查、协议协商，返回(昵称, 是否接受)"""
+        client_socket = session.socket
+        client_address = session.address
         nickname = "未知用户"
-        try:
-            # 接收客户端昵称
-            nickname_data = client_socket.recv(1024).decode('utf-8')
-            if nickname_data:
-                nickname = nickname_data.strip()
+        # 开启TCP保活，作为不支持心跳的旧客户端的兜底掉线检测
+        if self.tcp_keepalive:
+            try:
+                enable_tcp_keepalive(client_socket, self.tcp_keepalive_idle, self.tcp_keepalive_interval)
+            except OSError as e:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 设置TCP保活失败: {str(e)}")
+        
+        # 加密连接先完成TLS握手
+        if self.tls_context is not None:
+            client_socket = self.accept_tls(client_socket, client_address)
+            if client_socket is None:
+                return nickname, False
+            session.socket = client_socket
+        
+        # 接收客户端昵称
+        nickname_data = client_socket.recv(1024).decode('utf-8')
+        if nickname_data:
+            nickname = nickname_data.strip()
+        
+        # 检查用户IP是否被封禁
+        with self.lock:
+            # 先检查IP是否被封禁，前缀树查找，耗时与规则数量无关
+            ban_rule = self.banned_ips.match(client_address[0])
+            if ban_rule:
+                # IP已被封禁，发送错误消息并关闭连接
+                error_message = "ERROR:您的IP已被封禁，无法连接"
+                self.send_to(client_socket, error_message)
+                client_socket.close()
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 被封禁IP {client_address[0]} 尝试连接（规则: {ban_rule}），使用昵称: {nickname}")
+                return nickname, False
+            # 保留用户名封禁检查，兼容旧逻辑
+            if nickname in self.banned_users:
+                # 用户已被封禁，发送错误消息并关闭连接
+                error_message = "ERROR:您已被封禁，无法连接"
+                self.send_to(client_socket, error_message)
+                client_socket.close()
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 被封禁用户 {nickname} 尝试连接")
+                return nickname, False
             
-            # 检查用户IP是否被封禁
-            with self.lock:
-                # 先检查IP是否被封禁
-                if client_address[0] in self.banned_ips:
-                    # IP已被封禁，发送错误消息并关闭连接
-                    error_message = "ERROR:您的IP已被封禁，无法连接"
-                    client_socket.send(error_message.encode('utf-8'))
-                    client_socket.close()
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 被封禁IP {client_address[0]} 尝试连接，使用昵称: {nickname}")
-                    return
-                # 保留用户名封禁检查，兼容旧逻辑
-                if nickname in self.banned_users:
-                    # 用户已被封禁，发送错误消息并关闭连接
-                    error_message = "ERROR:您已被封禁，无法连接"
-                    client_socket.send(error_message.encode('utf-8'))
-                    client_socket.close()
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 被封禁用户 {nickname} 尝试连接")
-                    return
-                
-                # 检查昵称是否已被使用
-                if nickname in self.client_nicknames.values():
-                    # 昵称已存在，发送错误消息并关闭连接
-                    error_message = "ERROR:昵称已被使用，请选择其他昵称"
-                    client_socket.send(error_message.encode('utf-8'))
-                    client_socket.close()
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 尝试使用已存在的昵称: {nickname}")
-                    return
-                
-                # 昵称可用，线程安全地添加客户端
-                self.client_sockets.append(client_socket)
-                self.client_nicknames[client_socket] = nickname
-                # 存储用户profile信息
-                self.client_profiles[client_socket] = {
-                    'nickname': nickname,
-                    'ip_address': client_address[0],
-                    'join_time': time.strftime('%Y-%m-%d %H:%M:%S'),
-                    'os_version': '未知'  # 暂时无法获取客户端操作系统
-                }
-            
-            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 已连接，昵称为: {nickname}")
+            # 检查昵称是否已被使用
+            if nickname in self.client_nicknames.values():
+                # 昵称已存在，发送错误消息并关闭连接
+                error_message = "ERROR:昵称已被使用，请选择其他昵称"
+                self.send_to(client_socket, error_message)
+                client_socket.close()
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 尝试使用已存在的昵称: {nickname}")
+                return nickname, False
             
-            # 发送成功消息给客户端
-            success_message = "SUCCESS:连接成功"
-            client_socket.send(success_message.encode('utf-8'))
+            if self.handoff_event.is_set():
+                # 平滑升级中不再登记新用户，关闭连接让客户端重连到新进程
+                client_socket.close()
+                session.parked = True
+                return nickname, False
             
-            # 广播新用户加入消息
-            self.broadcast_message(f"系统: {nickname} 加入了聊天室", exclude_socket=client_socket)
-            # 广播更新后的在线用户列表
-            self.broadcast_user_list()
+            # 昵称可用，线程安全地登记客户端
+            self.client_sessions[client_socket] = session
+            self.client_nicknames[client_socket] = nickname
+            # 存储用户profile信息
+            self.client_profiles[client_socket] = {
+                'nickname': nickname,
+                'ip_address': client_address[0],
+                'join_time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'os_version': '未知'  # 暂时无法获取客户端操作系统
+            }
+        
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 已连接，昵称为: {nickname}")
+        
+        # 发送成功消息给客户端，附带服务端支持的协议扩展
+        success_message = f"SUCCESS:连接成功|CAPS:{','.join(self.get_server_caps())}"
+        if self.heartbeat_interval > 0:
+            success_message += f"|HEARTBEAT:{self.heartbeat_interval},{self.heartbeat_timeout}"
+        self.send_to(client_socket, success_message)
+        # 不等客户端回复CAPS就加入广播列表，协商结束前发给它的消息先暂存，避免收到格式不一致的消息
+        session.backlog = []
+        session.awaiting_caps = True
+        
+        with self.lock:
+            self.client_sockets.append(client_socket)
+        
+        # 广播新用户加入消息
+        self.broadcast_message(f"系统: {nickname} 加入了聊天室", exclude_socket=client_socket)
+        # 广播更新后的在线用户列表
+        self.broadcast_user_list()
+        self.negotiate_caps(session)
+        return nickname, True
+    
+    def handle_client(self, client_socket, client_address, handoff=None):
+        """处理单个客户端连接，handoff为平滑升级时旧进程移交过来的会话状态，此时跳过握手直接恢复会话"""
+        nickname = "未知用户"
+        session = ClientSession(client_socket, client_address)
+        try:
+            if handoff is None:
+                nickname, accepted = self.register_client(session)
+                if not accepted:
+                    return
+                client_socket = session.socket
+            else:
+                nickname = self.resume_client(session, handoff)
             
             # 处理客户端消息
             while True:
-                message = client_socket.recv(self.message_size_limit).decode('utf-8')
-                if not message:
+                message = self.receive_message(session)
+                if message is None:
                     break
                 
                 if message.startswith("PROFILE_REQUEST:"):
@@ -513,12 +2129,15 @@ class ChatServer:
                         # 构造profile响应
                         profile_message = f"PROFILE:{profile_data['nickname']}|{profile_data['ip_address']}|{profile_data['join_time']}|{profile_data['os_version']}"
                         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] sending profile: {profile_message}")
-                        client_socket.send(profile_message.encode('utf-8'))
+                        self.send_to(client_socket, profile_message)
                     else:
                         # 用户不存在
                         error_message = "PROFILE_ERROR:用户不存在"
                         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] sending profile error: {error_message}")
-                        client_socket.send(error_message.encode('utf-8'))
+                        self.send_to(client_socket, error_message)
+                elif "file" in session.caps and message.startswith("FILE_"):
+                    # 处理文件传输控制消息
+                    self.handle_file_message(session, nickname, message)
                 elif message.startswith("ADMIN_COMMAND:"):
                     # 处理管理员命令
                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 收到ADMIN_COMMAND: {message}")
@@ -526,243 +2145,23 @@ class ChatServer:
                     parts = message.split(":", 2)
                     if len(parts) == 3:
                         admin_command = parts[1].lower()
-                        target_nickname = parts[2].strip()
                         
                         # 检查发送者是否是管理员
                         with self.lock:
                             is_admin = nickname in self.admins
                         
                         if is_admin:
-                            # 执行管理员命令
-                            if admin_command == 'kick':
-                                # 防止管理员自己踢自己
-                                if target_nickname != nickname:
-                                    self.kick_user(target_nickname)
-                                else:
-                                    # 发送错误消息给管理员
-                                    error_message = "ERROR:您不能对自己执行此操作"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试踢自己")
-                            elif admin_command == 'op':
-                                # 防止管理员自己给自己设为管理员
-                                if target_nickname != nickname:
-                                    # 查找目标用户的socket
-                                    target_socket = None
-                                    with self.lock:
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                target_socket = sock
-                                                break
-                                        self.admins.add(target_nickname)
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 管理员 {nickname} 已将 {target_nickname} 设为管理员")
-                                    # 通知所有用户
-                                    broadcast_msg = f"系统: {target_nickname} 已被管理员设为管理员"
-                                    self.broadcast_message(broadcast_msg)
-                                    # 向被设为管理员的用户发送特定消息，触发客户端弹窗
-                                    if target_socket:
-                                        try:
-                                            target_socket.send(f"OP:{broadcast_msg}".encode('utf-8'))
-                                        except:
-                                            pass
-                                    # 更新所有客户端的用户列表，显示管理员标识
-                                    self.broadcast_user_list()
-                                else:
-                                    # 发送错误消息给管理员
-                                    error_message = "ERROR:您已经是管理员"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试给自己设为管理员")
-                            elif admin_command == 'unop':
-                                # 防止管理员自己撤销自己的权限
-                                if target_nickname != nickname:
-                                    is_admin = False
-                                    target_socket = None
-                                    with self.lock:
-                                        # 查找目标用户的socket
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                target_socket = sock
-                                                break
-                                        if target_nickname in self.admins:
-                                            self.admins.remove(target_nickname)
-                                            is_admin = True
-                                    
-                                    if is_admin:
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 管理员 {nickname} 已撤销 {target_nickname} 的管理员权限")
-                                        # 通知所有用户 - 移出锁范围，避免死锁
-                                        broadcast_msg = f"系统: {target_nickname} 已被管理员撤销管理员权限"
-                                        self.broadcast_message(broadcast_msg)
-                                        # 向被撤销管理员权限的用户发送特定消息，触发客户端弹窗
-                                        if target_socket:
-                                            try:
-                                                target_socket.send(f"UNOP:{broadcast_msg}".encode('utf-8'))
-                                            except:
-                                                pass
-                                        # 更新所有客户端的用户列表，恢复原昵称显示
-                                        self.broadcast_user_list()
-                                    else:
-                                        error_message = "ERROR:该用户不是管理员"
-                                        client_socket.send(error_message.encode('utf-8'))
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试撤销非管理员 {target_nickname} 的权限")
-                                else:
-                                    # 发送错误消息给管理员
-                                    error_message = "ERROR:您不能撤销自己的管理员权限"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试撤销自己的权限")
-                            elif admin_command == 'ban':
-                                # 防止管理员自己封禁自己
-                                if target_nickname != nickname:
-                                    # 查找目标用户的IP地址
-                                    target_ip = None
-                                    with self.lock:
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                # 找到目标用户，获取其IP地址
-                                                if sock in self.client_profiles:
-                                                    target_ip = self.client_profiles[sock]['ip_address']
-                                                break
-                                    
-                                    if target_ip:
-                                        # 封禁目标用户的IP
-                                        with self.lock:
-                                            self.banned_ips.add(target_ip)
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 管理员 {nickname} 已封禁IP {target_ip}（用户：{target_nickname}）")
-                                        # 踢出该用户（如果在线）
-                                        self.kick_user(target_nickname)
-                                        # 通知所有用户
-                                        self.broadcast_message(f"系统: 用户 {target_nickname} 的IP {target_ip} 已被管理员封禁")
-                                    else:
-                                        # 用户不在线或找不到IP
-                                        error_message = f"ERROR:找不到用户 {target_nickname} 或其IP地址"
-                                        client_socket.send(error_message.encode('utf-8'))
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试封禁不存在的用户 {target_nickname}")
-                                else:
-                                    # 发送错误消息给管理员
-                                    error_message = "ERROR:您不能封禁自己"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试封禁自己")
-                            elif admin_command == 'unban':
-                                # 支持两种方式解除封禁：直接使用IP地址，或通过用户名查找IP
-                                target_ip = None
-                                target_user = target_nickname  # 保存原始目标名称
-                                
-                                # 检查目标是否是IP地址格式
-                                import re
-                                ip_pattern = r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$'
-                                if re.match(ip_pattern, target_nickname):
-                                    # 直接使用IP地址
-                                    target_ip = target_nickname
-                                else:
-                                    # 尝试通过用户名查找IP地址
-                                    with self.lock:
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                # 找到目标用户，获取其IP地址
-                                                if sock in self.client_profiles:
-                                                    target_ip = self.client_profiles[sock]['ip_address']
-                                                break
-                                
-                                if target_ip:
-                                    with self.lock:
-                                        if target_ip in self.banned_ips:
-                                            self.banned_ips.remove(target_ip)
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 管理员 {nickname} 已解除IP {target_ip} 的封禁")
-                                            # 通知所有用户
-                                            if target_user != target_ip:
-                                                self.broadcast_message(f"系统: 用户 {target_user} 的IP {target_ip} 已被管理员解除封禁")
-                                            else:
-                                                self.broadcast_message(f"系统: IP {target_ip} 已被管理员解除封禁")
-                                        else:
-                                            error_message = f"ERROR:该IP {target_ip} 未被封禁"
-                                            client_socket.send(error_message.encode('utf-8'))
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试解除未封禁IP {target_ip} 的封禁")
-                                else:
-                                    # 无法找到目标IP
-                                    error_message = f"ERROR:找不到目标 {target_nickname} 或其IP地址"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试解除不存在的目标 {target_nickname} 的封禁")
-                            elif admin_command == 'shutup':
-                                # 提取禁言时长
-                                duration_part = target_nickname.split(' ', 1)
-                                if len(duration_part) == 2:
-                                    actual_target = duration_part[0]
-                                    try:
-                                        duration = int(duration_part[1])
-                                        if duration > 0:
-                                            # 防止管理员自己禁言自己
-                                            if actual_target != nickname:
-                                                # 查找目标用户的socket
-                                                target_socket = None
-                                                with self.lock:
-                                                    for sock, n in self.client_nicknames.items():
-                                                        if n == actual_target:
-                                                            target_socket = sock
-                                                            break
-                                                    self.muted_users[actual_target] = (time.time(), duration)
-                                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 管理员 {nickname} 已禁言 {actual_target} {duration} 分钟")
-                                                # 通知所有用户
-                                                broadcast_msg = f"系统: {actual_target} 已被管理员禁言 {duration} 分钟"
-                                                self.broadcast_message(broadcast_msg)
-                                                # 向被禁言的用户发送特定消息，触发客户端弹窗
-                                                if target_socket:
-                                                    try:
-                                                        target_socket.send(f"MUTED:{broadcast_msg}".encode('utf-8'))
-                                                    except:
-                                                        pass
-                                            else:
-                                                error_message = "ERROR:您不能禁言自己"
-                                                client_socket.send(error_message.encode('utf-8'))
-                                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试禁言自己")
-                                        else:
-                                            error_message = "ERROR:禁言时长必须大于0"
-                                            client_socket.send(error_message.encode('utf-8'))
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试使用无效的禁言时长")
-                                    except ValueError:
-                                        error_message = "ERROR:命令格式错误: /shutup <用户名> <时间（分钟）>"
-                                        client_socket.send(error_message.encode('utf-8'))
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试使用错误的命令格式")
-                                else:
-                                    error_message = "ERROR:命令格式错误: /shutup <用户名> <时间（分钟）>"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试使用错误的命令格式")
-                            elif admin_command == 'unshutup':
-                                # 防止管理员自己解除自己的禁言
-                                if target_nickname != nickname:
-                                    # 查找目标用户的socket
-                                    target_socket = None
-                                    with self.lock:
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                target_socket = sock
-                                                break
-                                        if target_nickname in self.muted_users:
-                                            del self.muted_users[target_nickname]
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 管理员 {nickname} 已解除 {target_nickname} 的禁言")
-                                            # 通知所有用户
-                                            broadcast_msg = f"系统: {target_nickname} 已被管理员解除禁言"
-                                            self.broadcast_message(broadcast_msg)
-                                            # 向被解禁的用户发送特定消息，触发客户端弹窗
-                                            if target_socket:
-                                                try:
-                                                    target_socket.send(f"UNMUTED:{broadcast_msg}".encode('utf-8'))
-                                                except:
-                                                    pass
-                                        else:
-                                            error_message = "ERROR:该用户未被禁言"
-                                            client_socket.send(error_message.encode('utf-8'))
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试解除未禁言用户 {target_nickname} 的禁言")
-                                else:
-                                    error_message = "ERROR:您不能解除自己的禁言"
-                                    client_socket.send(error_message.encode('utf-8'))
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试解除自己的禁言")
+                            success, result = self.execute_admin_command(admin_command, parts[2], actor=nickname)
+                            if success:
+                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 管理员 {nickname}: {result}")
                             else:
-                                # 不支持的命令
-                                error_message = f"ERROR:不支持的命令: {admin_command}"
-                                client_socket.send(error_message.encode('utf-8'))
-                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 尝试执行不支持的命令: {admin_command}")
+                                # 发送错误消息给管理员
+                                self.send_to(client_socket, f"ERROR:{result}")
+                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 管理员 {nickname} 执行 {admin_command} 失败: {result}")
                         else:
                             # 发送错误消息给非管理员用户
                             error_message = "ERROR:您没有权限执行此命令"
-                            client_socket.send(error_message.encode('utf-8'))
+                            self.send_to(client_socket, error_message)
                             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 非管理员用户 {nickname} 尝试执行管理员命令")
                 else:
                     # 检查用户是否被禁言
@@ -788,53 +2187,393 @@ class ChatServer:
                     if is_muted:
                         # 用户被禁言，发送错误消息
                         error_message = f"ERROR:您已被禁言 {mute_duration} 分钟，无法发送消息"
-                        client_socket.send(error_message.encode('utf-8'))
+                        self.send_to(client_socket, error_message)
                         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 被禁言用户 {nickname} 尝试发送消息")
                     else:
                         # 普通消息，广播给其他用户
                         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 收到 {nickname} 的消息: {message}")
                         self.broadcast_message(f"{nickname}: {message}", exclude_socket=client_socket)
                 
+        except ClientHandoff:
+            # 平滑升级：连接留给新进程，不关闭也不广播离开
+            with self.handoff_cond:
+                session.parked = True
+                self.handoff_cond.notify_all()
         except ConnectionResetError:
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 强制断开连接")
+        except socket.timeout:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 心跳超时（{self.heartbeat_timeout}秒无响应），判定为掉线")
         except UnicodeDecodeError:
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 发送了无效的UTF-8数据")
         except Exception as e:
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 处理客户端 {client_address} 时发生错误: {str(e)}")
         finally:
-            # 线程安全地移除客户端
+            if not session.parked:
+                # 线程安全地移除客户端
+                with self.lock:
+                    if client_socket in self.client_sockets:
+                        self.client_sockets.remove(client_socket)
+                    if self.client_sessions.get(client_socket) is session:
+                        del self.client_sessions[client_socket]
+                        if client_socket in self.client_nicknames:
+                            del self.client_nicknames[client_socket]
+                        if client_socket in self.client_profiles:
+                            del self.client_profiles[client_socket]
+                self.cancel_file_transfers(client_socket)
+                
+                # 关闭客户端连接
+                try:
+                    client_socket.close()
+                except:
+                    pass
+                
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 已断开连接")
+                if self.running:
+                    # 广播用户离开消息
+                    self.broadcast_message(f"系统: {nickname} 离开了聊天室")
+                    # 广播更新后的在线用户列表
+                    self.broadcast_user_list()
+    
+    def accept_tls(self, client_socket, client_address):
+        """区分加密和明文连接：TLS握手的第一个字节固定为0x16，而明文客户端首先发送的昵称是可见字符
+        加密连接完成握手后返回SSLSocket；required模式下明文连接被拒绝，返回None
+        """
+        client_socket.settimeout(TLS_HANDSHAKE_TIMEOUT)
+        try:
+            first_byte = client_socket.recv(1, socket.MSG_PEEK)
+            if first_byte == b"\x16":
+                tls_socket = self.tls_context.wrap_socket(client_socket, server_side=True, do_handshake_on_connect=False)
+                tls_socket.do_handshake()
+                tls_socket.settimeout(None)
+                resumed = "，复用会话" if tls_socket.session_reused else ""
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔐 客户端 {client_address} 已建立加密连接（{tls_socket.version()}{resumed}）")
+                return tls_socket
+        except (ssl.SSLError, OSError) as e:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} TLS握手失败: {str(e)}")
+            client_socket.close()
+            return None
+        
+        if self.tls_mode == "required":
+            try:
+                client_socket.sendall("ERROR:服务器只接受加密连接，请勾选“加密连接（TLS）”后重试".encode('utf-8'))
+            except OSError:
+                pass
+            client_socket.close()
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 已拒绝客户端 {client_address} 的明文连接")
+            return None
+        client_socket.settimeout(None)
+        return client_socket
+    
+    def get_server_caps(self):
+        """返回当前配置下服务端声明支持的协议扩展"""
+        caps = list(SERVER_CAPS)
+        if self.heartbeat_interval <= 0:
+            caps.remove("ping")
+        if not self.file_transfer:
+            caps.remove("file")
+        if self.compress_threshold <= 0:
+            caps.remove("deflate")
+        return caps
+    
+    def negotiate_caps(self, session):
+        """等待客户端回复CAPS:选择协议扩展，最多等待caps_wait毫秒，旧客户端不会回复，超时后按旧协议处理
+        协议确定前发给客户端的消息都暂存在session.backlog中，确定后才按选定的格式发出
+        """
+        client_socket = session.socket
+        data = None
+        if self.caps_wait > 0:
+            client_socket.settimeout(self.caps_wait / 1000)
+            try:
+                data = client_socket.recv(FRAMED_RECV_SIZE)
+            except socket.timeout:
+                pass
+            finally:
+                client_socket.settimeout(None)
+        
+        if data == b"":
+            # 对端已关闭，交给消息循环处理
+            session.pending.append(None)
+        elif data is not None:
+            self._queue_received_data(session, data)
+        # 等待时间内没有收到CAPS:行，本次连接按旧协议通信，之后才到达的CAPS:行不会被确认
+        self.settle_caps(session, set())
+    
+    def apply_caps(self, session, data):
+        """处理客户端的CAPS:行，返回其后的数据；确认启用帧格式时后面的数据已经是帧格式"""
+        caps_line, _, rest = data.partition(b"\n")
+        requested = caps_line[len(b"CAPS:"):].decode('utf-8').split(",")
+        caps = {cap.strip() for cap in requested if cap.strip() in self.get_server_caps()}
+        if "frame" not in caps:
+            # 心跳等扩展依赖帧格式
+            caps = set()
+        if not self.settle_caps(session, caps):
+            # 客户端收不到确认帧，会继续使用原始协议
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {session.address} 超过{self.caps_wait}毫秒才回复CAPS，按旧协议处理")
+            return rest
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {session.address} 启用协议扩展: {','.join(sorted(session.caps)) or '无'}")
+        if "ping" in session.caps:
+            # 支持心跳的客户端会定期回复PONG，超时未收到任何数据即判定掉线
+            session.socket.settimeout(self.heartbeat_timeout)
+        return rest
+    
+    def settle_caps(self, session, caps):
+        """确定会话使用的协议并按该格式发出暂存的消息，协议已经确定时返回False
+        启用帧格式时先发送CAPS:确认帧，客户端收到确认帧前一直按原始协议解析，两端不会对格式作出不同的判断
+        """
+        with session.send_lock:
+            if session.backlog is None:
+                return False
+            session.caps = caps
+            session.framed = "frame" in caps
+            if session.framed:
+                session.socket.sendall(encode_frame(f"CAPS:{','.join(sorted(caps))}".encode('utf-8')))
+            for message in session.backlog:
+                data = message.encode('utf-8')
+                if session.framed:
+                    data = self.encode_message_frame(session, data)
+                session.socket.sendall(data)
+            session.backlog = None
+        return True
+    
+    def receive_message(self, session):
+        """接收下一条客户端消息，自动应答心跳帧；连接关闭时返回None"""
+        while not session.pending:
+            if self.handoff_wake is not None:
+                self.wait_readable(session)
+            if session.framed:
+                data = session.socket.recv(FRAMED_RECV_SIZE)
+            else:
+                data = session.socket.recv(self.message_size_limit)
+            if not data:
+                return None
+            self._queue_received_data(session, data)
+        return session.pending.popleft()
+    
+    def wait_readable(self, session):
+        """等待客户端数据到达，期间开始平滑升级时抛出ClientHandoff，保证交接后旧进程不会再读走数据"""
+        if self.handoff_event.is_set():
+            raise ClientHandoff()
+        if isinstance(session.socket, ssl.SSLSocket) and session.socket.pending():
+            return
+        if session.poller is None:
+            session.poller = select.poll()
+            session.poller.register(session.socket.fileno(), select.POLLIN)
+            session.poller.register(self.handoff_wake[0], select.POLLIN)
+        timeout = session.socket.gettimeout()
+        events = session.poller.poll(None if timeout is None else timeout * 1000)
+        if self.handoff_event.is_set():
+            raise ClientHandoff()
+        if not events:
+            raise socket.timeout("timed out")
+    
+    def _queue_received_data(self, session, data):
+        """解析收到的数据并放入待处理队列"""
+        session.last_seen = time.time()
+        if not session.framed:
+            if session.awaiting_caps:
+                session.awaiting_caps = False
+                if data.startswith(b"CAPS:"):
+                    rest = self.apply_caps(session, data)
+                    if rest:
+                        self._queue_received_data(session, rest)
+                    return
+            session.pending.append(data.decode('utf-8'))
+            return
+        
+        for flags, payload in session.reader.feed(data):
+            if flags & FRAME_FLAG_BINARY:
+                # 文件分块不进入消息队列，直接转发给接收方
+                self.relay_file_chunk(session, payload)
+                continue
+            if flags & FRAME_FLAG_COMPRESSED:
+                try:
+                    payload = decompress_payload(payload)
+                except (zlib.error, ValueError) as e:
+                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {session.address} 发送了无法解压的消息: {str(e)}")
+                    continue
+            message = payload.decode('utf-8')
+            if message.startswith("PING:"):
+                self.send_to(session.socket, f"PONG:{message[5:]}")
+            elif message.startswith("PONG:"):
+                # 心跳应答只用于刷新活跃时间
+                continue
+            elif len(payload) > self.message_size_limit:
+                self.send_to(session.socket, f"ERROR:消息过长，单条消息不能超过{self.message_size_limit}字节")
+            else:
+                session.pending.append(message)
+    
+    def send_to(self, client_socket, message, cache=None):
+        """按照客户端协商的协议向其发送一条消息"""
+        if isinstance(client_socket, RemoteClient):
+            # 用户连接在其他工作进程上，通过总线转发
+            self.bus_publish({"type": "direct", "nickname": client_socket.nickname, "message": message})
+            return
+        data = message.encode('utf-8')
+        session = self.client_sessions.get(client_socket)
+        if session is None:
+            client_socket.send(data)
+            return
+        
+        with session.send_lock:
+            if session.backlog is not None:
+                # 协议协商结束前暂存，协商后按选定的格式发出
+                session.backlog.append(message)
+                return
+            if session.framed:
+                data = self.encode_message_frame(session, data, cache)
+            client_socket.sendall(data)
+    
+    def encode_message_frame(self, session, data, cache=None):
+        """把文本消息编码为帧，启用deflate的客户端收到的长消息会被压缩
+        广播时传入同一个cache字典，压缩结果在所有客户端之间复用，每条广播只压缩一次
+        """
+        compress = self.compress_threshold > 0 and "deflate" in session.caps and len(data) >= self.compress_threshold
+        key = "deflate" if compress else "frame"
+        if cache is not None and key in cache:
+            return cache[key]
+        
+        frame = None
+        if compress:
+            compressed = compress_payload(data)
+            if len(compressed) < len(data):
+                frame = encode_frame(compressed, FRAME_FLAG_COMPRESSED)
+        if frame is None:
+            frame = encode_frame(data)
+        if cache is not None:
+            cache[key] = frame
+        return frame
+    
+    def send_binary(self, client_socket, payload):
+        """向使用帧格式的客户端发送二进制帧"""
+        session = self.client_sessions.get(client_socket)
+        if session is None or not session.framed:
+            return
+        with session.send_lock:
+            client_socket.sendall(encode_frame(payload, FRAME_FLAG_BINARY))
+    
+    def handle_file_message(self, session, nickname, message):
+        """处理文件传输控制消息，服务端只校验并转发，不保存文件内容"""
+        command, _, body = message.partition(":")
+        try:
+            info = json.loads(body)
+            transfer_id = int(info["id"])
+        except (ValueError, KeyError, TypeError):
+            self.send_to(session.socket, "FILE_ERROR:" + json.dumps({"id": None, "reason": "文件传输消息格式错误"}, ensure_ascii=False))
+            return
+        
+        if command == "FILE_OFFER":
+            target_nickname = str(info.get("to", ""))
+            size = info.get("size")
+            error = None
             with self.lock:
-                if client_socket in self.client_sockets:
-                    self.client_sockets.remove(client_socket)
-                    if client_socket in self.client_nicknames:
-                        del self.client_nicknames[client_socket]
-                    if client_socket in self.client_profiles:
-                        del self.client_profiles[client_socket]
+                target_socket = None
+                for sock, n in self.client_nicknames.items():
+                    # 用户列表中的管理员带有前缀
+                    if n == target_nickname or f"{self.admin_prefix}{n}" == target_nickname:
+                        target_socket = sock
+                        break
+                target_session = self.client_sessions.get(target_socket)
+                if transfer_id in self.file_transfers:
+                    error = "传输ID重复，请重新发送"
+                elif target_session is None or "file" not in target_session.caps:
+                    error = f"{target_nickname} 不在线或其客户端不支持文件传输"
+                elif target_socket is session.socket:
+                    error = "不能给自己发送文件"
+                elif not isinstance(size, int) or size < 0 or size > self.file_max_size:
+                    error = f"文件大小超过服务器限制（{self.file_max_size // (1024 * 1024)}MB）"
+                else:
+                    self.file_transfers[transfer_id] = FileTransfer(transfer_id, session.socket, target_socket, size)
+            if error:
+                self.send_to(session.socket, "FILE_ERROR:" + json.dumps({"id": transfer_id, "reason": error}, ensure_ascii=False))
+                return
             
-            # 关闭客户端连接
+            info["from"] = nickname
+            info["to"] = self.client_nicknames.get(target_socket, target_nickname)
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 📁 {nickname} 向 {info['to']} 发送文件: {info.get('name', '')} ({size} 字节)")
             try:
-                client_socket.close()
-            except:
+                self.send_to(target_socket, "FILE_OFFER:" + json.dumps(info, ensure_ascii=False))
+            except OSError:
+                self.finish_file_transfer(transfer_id, "对方已断开连接")
+            return
+        
+        with self.lock:
+            transfer = self.file_transfers.get(transfer_id)
+        if transfer is None:
+            # 已结束的传输可能还有迟到的确认消息，直接忽略
+            return
+        
+        if session.socket is transfer.receiver and command in ("FILE_ACCEPT", "FILE_REJECT", "FILE_ACK", "FILE_RESUME", "FILE_COMPLETE", "FILE_CANCEL"):
+            peer_socket = transfer.sender
+            if command == "FILE_ACCEPT":
+                transfer.accepted = True
+        elif session.socket is transfer.sender and command == "FILE_CANCEL":
+            peer_socket = transfer.receiver
+        else:
+            return
+        
+        if command in ("FILE_REJECT", "FILE_COMPLETE", "FILE_CANCEL"):
+            with self.lock:
+                self.file_transfers.pop(transfer_id, None)
+        try:
+            self.send_to(peer_socket, message)
+        except OSError:
+            self.finish_file_transfer(transfer_id, "对方已断开连接")
+    
+    def relay_file_chunk(self, session, payload):
+        """把发送方的文件分块转发给接收方"""
+        if len(payload) < FILE_CHUNK_HEADER.size:
+            return
+        transfer_id = FILE_CHUNK_HEADER.unpack_from(payload)[0]
+        with self.lock:
+            transfer = self.file_transfers.get(transfer_id)
+        if transfer is None or transfer.sender is not session.socket or not transfer.accepted:
+            return
+        try:
+            self.send_binary(transfer.receiver, payload)
+        except OSError:
+            self.finish_file_transfer(transfer_id, "对方已断开连接")
+    
+    def finish_file_transfer(self, transfer_id, reason, exclude_socket=None):
+        """中止一次文件传输并通知仍在线的一方"""
+        with self.lock:
+            transfer = self.file_transfers.pop(transfer_id, None)
+        if transfer is None:
+            return
+        cancel_message = "FILE_CANCEL:" + json.dumps({"id": transfer_id, "reason": reason}, ensure_ascii=False)
+        for sock in (transfer.sender, transfer.receiver):
+            if sock is exclude_socket:
+                continue
+            try:
+                self.send_to(sock, cancel_message)
+            except OSError:
                 pass
-            
-            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 客户端 {client_address} 已断开连接")
-            # 广播用户离开消息
-            self.broadcast_message(f"系统: {nickname} 离开了聊天室")
-            # 广播更新后的在线用户列表
-            self.broadcast_user_list()
-    
-    def broadcast_message(self, message, exclude_socket=None):
-        """广播消息给所有客户端，可选排除特定客户端"""
+    
+    def cancel_file_transfers(self, client_socket):
+        """客户端断开时中止其参与的所有文件传输"""
+        with self.lock:
+            transfer_ids = [transfer_id for transfer_id, transfer in self.file_transfers.items()
+                            if client_socket in (transfer.sender, transfer.receiver)]
+        for transfer_id in transfer_ids:
+            self.finish_file_transfer(transfer_id, "对方已断开连接", exclude_socket=client_socket)
+    
+    def broadcast_message(self, message, exclude_socket=None, publish=True):
+        """广播消息给所有客户端，可选排除特定客户端
+        多进程模式下publish为True时同时发布到总线，由其他工作进程转发给各自的客户端
+        """
+        if publish:
+            self.bus_publish({"type": "broadcast", "message": message})
         with self.lock:
             # 创建客户端列表副本，避免在迭代时修改列表
             clients_copy = self.client_sockets.copy()
         
+        # 同一条广播的帧编码和压缩结果在客户端之间复用
+        frame_cache = {}
         for client in clients_copy:
             if client == exclude_socket:
                 continue
             
             try:
-                client.send(message.encode('utf-8'))
+                self.send_to(client, message, frame_cache)
             except BrokenPipeError:
                 # 处理客户端断开但未从列表中移除的情况
                 with self.lock:
@@ -849,8 +2588,10 @@ class ChatServer:
             except Exception as e:
                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 广播消息失败: {str(e)}")
     
-    def broadcast_user_list(self):
-        """广播在线用户列表给所有客户端"""
+    def broadcast_user_list(self, publish=True):
+        """广播在线用户列表给所有客户端
+        多进程模式下publish为True时发布本进程的用户表，其他工作进程据此更新后各自广播
+        """
         with self.lock:
             # 获取当前在线用户昵称列表，并为管理员添加前缀
             users = []
@@ -864,82 +2605,742 @@ class ChatServer:
         
         # 构造用户列表消息，使用特殊格式以便客户端解析
         user_list_message = f"USERS_LIST:{','.join(users)}"
-        self.broadcast_message(user_list_message)
+        self.broadcast_message(user_list_message, publish=False)
+        if publish:
+            self.publish_roster()
+    
+    def publish_roster(self):
+        """向其他工作进程和联邦节点发布本进程的用户表"""
+        with self.lock:
+            local_profiles = [profile for sock, profile in self.client_profiles.items()
+                              if not isinstance(sock, RemoteClient)]
+        self.bus_publish({"type": "roster", "worker": self.worker_id, "users": local_profiles})
+    
+    def execute_admin_command(self, command, argument, actor=None):
+        """执行管理命令，聊天中的ADMIN_COMMAND、控制台命令和网页管理共用
+        argument为命令参数（shutup为"用户名 分钟"），actor为发出命令的管理员昵称，控制台和网页管理为None
+        每个命令只在查找目标和修改管理状态时持有一次self.lock，广播和发送在锁外进行
+        返回(是否成功, 结果说明)
+        """
+        handler = self.admin_commands.get(command)
+        if handler is None:
+            return False, f"不支持的命令: {command}"
+        argument = argument.strip()
+        if not argument:
+            return False, f"命令格式错误: {ADMIN_COMMAND_USAGE[command]}"
+        return handler(argument, actor)
+    
+    def notify_moderation(self, target_socket, kind, broadcast_msg):
+        """广播管理操作，并向被操作的在线用户发送kind前缀的消息，触发客户端弹窗"""
+        self.broadcast_message(broadcast_msg)
+        if target_socket:
+            try:
+                self.send_to(target_socket, f"{kind}:{broadcast_msg}")
+            except:
+                pass
+    
+    def command_kick(self, target, actor):
+        """kick <用户名>"""
+        if target == actor:
+            return False, "您不能对自己执行此操作"
+        with self.lock:
+            target_socket = self.client_nicknames.socket_of(target)
+        return self.kick_socket(target_socket, target)
+    
+    def command_op(self, target, actor):
+        """op <用户名>"""
+        if target == actor:
+            return False, "您已经是管理员"
+        with self.lock:
+            target_socket = self.client_nicknames.socket_of(target)
+            self.admins.add(target)
+        self.notify_moderation(target_socket, "OP", f"系统: {target} 已被管理员设为管理员")
+        # 更新所有客户端的用户列表，显示管理员标识
+        self.broadcast_user_list()
+        return True, f"已将 {target} 设为管理员"
+    
+    def command_unop(self, target, actor):
+        """unop <用户名>"""
+        if target == actor:
+            return False, "您不能撤销自己的管理员权限"
+        with self.lock:
+            target_socket = self.client_nicknames.socket_of(target)
+            is_admin = target in self.admins
+            if is_admin:
+                self.admins.remove(target)
+        if not is_admin:
+            return False, f"{target} 不是管理员"
+        self.notify_moderation(target_socket, "UNOP", f"系统: {target} 已被管理员撤销管理员权限")
+        # 更新所有客户端的用户列表，恢复原昵称显示
+        self.broadcast_user_list()
+        return True, f"已撤销 {target} 的管理员权限"
+    
+    def command_ban(self, target, actor):
+        """ban <目标>，目标可以是用户名、IP、CIDR网段或地址范围；是用户名时封禁其IP"""
+        with self.lock:
+            rules, target_user = self.resolve_ban_target(target)
+            own_profile = self.client_profiles.get(self.client_nicknames.socket_of(actor)) if actor else None
+            own_ip = own_profile.get('ip_address') if own_profile else None
+            if actor is not None and (target_user == actor or (rules and own_ip and IPPrefixTrie(rules).match(own_ip))):
+                # 防止管理员封禁自己
+                return False, "您不能封禁自己"
+            added = [rule for rule in rules if rule not in self.banned_ips]
+            for rule in added:
+                self.banned_ips.add(rule)
+            banned_clients = self.banned_clients(added) if added else []
+        if not rules:
+            return False, f"找不到用户 {target} 或其IP地址"
+        rule_text = ", ".join(rules)
+        if not added:
+            return False, f"IP {rule_text} 已在封禁列表中"
+        self.kick_clients(banned_clients)
+        if target_user:
+            self.broadcast_message(f"系统: 用户 {target_user} 的IP {rule_text} 已被管理员封禁")
+            return True, f"已封禁IP {rule_text}（用户：{target_user}）"
+        self.broadcast_message(f"系统: IP {rule_text} 已被管理员封禁")
+        return True, f"已封禁IP {rule_text}"
+    
+    def command_unban(self, target, actor):
+        """unban <目标>，目标格式同ban"""
+        with self.lock:
+            rules, target_user = self.resolve_ban_target(target)
+            removed = [rule for rule in rules if rule in self.banned_ips]
+            for rule in removed:
+                self.banned_ips.remove(rule)
+            # 目标本身没有单独的规则时，查出仍然覆盖它的网段规则
+            covering = self.banned_ips.match(rules[0]) if not removed and len(rules) == 1 else None
+        if not rules:
+            return False, f"找不到目标 {target} 或其IP地址"
+        if covering:
+            return False, f"{target} 属于封禁网段 {covering}，请解除该网段的封禁"
+        if not removed:
+            return False, f"IP {', '.join(rules)} 未被封禁"
+        rule_text = ", ".join(removed)
+        if target_user:
+            self.broadcast_message(f"系统: 用户 {target_user} 的IP {rule_text} 已被管理员解除封禁")
+        else:
+            self.broadcast_message(f"系统: IP {rule_text} 已被管理员解除封禁")
+        return True, f"已解除IP {rule_text} 的封禁"
+    
+    def command_shutup(self, target, actor):
+        """shutup <用户名> <时间（分钟）>"""
+        nickname, _, minutes = target.rpartition(' ')
+        nickname = nickname.strip()
+        try:
+            duration = int(minutes)
+        except ValueError:
+            duration = None
+        if not nickname or duration is None:
+            return False, f"命令格式错误: {ADMIN_COMMAND_USAGE['shutup']}"
+        if duration <= 0:
+            return False, "禁言时长必须大于0"
+        if nickname == actor:
+            return False, "您不能禁言自己"
+        with self.lock:
+            target_socket = self.client_nicknames.socket_of(nickname)
+            self.muted_users[nickname] = (time.time(), duration)
+        self.notify_moderation(target_socket, "MUTED", f"系统: {nickname} 已被管理员禁言 {duration} 分钟")
+        return True, f"已禁言 {nickname} {duration} 分钟"
+    
+    def command_unshutup(self, target, actor):
+        """unshutup <用户名>"""
+        if target == actor:
+            return False, "您不能解除自己的禁言"
+        with self.lock:
+            target_socket = self.client_nicknames.socket_of(target)
+            is_muted = target in self.muted_users
+            if is_muted:
+                del self.muted_users[target]
+        if not is_muted:
+            return False, f"{target} 未被禁言"
+        self.notify_moderation(target_socket, "UNMUTED", f"系统: {target} 已被管理员解除禁言")
+        return True, f"已解除 {target} 的禁言"
+    
+    def kick_socket(self, target_socket, target_nickname):
+        """踢出已查到socket的用户，返回(是否成功, 结果说明)；会广播消息，调用时不能持有self.lock"""
+        if isinstance(target_socket, RemoteClient):
+            # 由用户所在的工作进程执行踢出
+            self.bus_publish({"type": "kick", "nickname": target_nickname})
+            return True, f"已通知 {target_socket.worker_id} 踢出用户: {target_nickname}"
+        if not target_socket:
+            return False, f"用户 {target_nickname} 不存在或已离线"
+        try:
+            # 发送踢出消息给目标用户
+            self.send_to(target_socket, "KICKED:你已被管理员踢出聊天室")
+            # 关闭连接
+            target_socket.close()
+            # 广播踢出消息
+            self.broadcast_message(f"系统: {target_nickname} 已被管理员踢出聊天室")
+        except Exception as e:
+            return False, f"踢出用户 {target_nickname} 时发生错误: {str(e)}"
+        return True, f"已踢出用户: {target_nickname}"
+    
+    def kick_clients(self, targets):
+        """踢出[(socket, 昵称)]中的用户，结果打印到控制台"""
+        for target_socket, target_nickname in targets:
+            success, result = self.kick_socket(target_socket, target_nickname)
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {'✅' if success else '❌'} {result}")
     
     def kick_user(self, target_nickname):
         """踢出指定用户"""
-        target_socket = None
+        with self.lock:
+            target_socket = self.client_nicknames.socket_of(target_nickname)
+        self.kick_clients([(target_socket, target_nickname)])
+    
+    def resolve_ban_target(self, target):
+        """把ban/unban的目标解析为封禁规则，返回(规则列表, 用户名)，调用时需持有self.lock
+        目标可以是IP、CIDR网段、地址范围或在线用户名；是用户名时取其IP，找不到时规则列表为空
+        """
+        try:
+            return parse_ip_ban_rules(target), None
+        except ValueError:
+            pass
+        profile = self.client_profiles.get(self.client_nicknames.socket_of(target))
+        if profile and profile.get('ip_address'):
+            return parse_ip_ban_rules(profile['ip_address']), target
+        return [], target
+    
+    def banned_clients(self, rules=None):
+        """返回本进程中IP命中封禁规则的在线用户[(socket, 昵称)]，调用时需持有self.lock
+        传入rules时只检查这些新增的规则：单个IP的规则直接比较字符串，只有网段规则才需要解析在线用户的IP
+        """
+        if rules is None:
+            match = self.banned_ips.match
+        else:
+            hosts = {rule for rule in rules if "/" not in rule}
+            networks = IPPrefixTrie(rule for rule in rules if "/" in rule) if len(hosts) < len(rules) else None
+            
+            def match(ip):
+                # IPv4映射的IPv6地址（::ffff:a.b.c.d）按IPv4比较
+                if ip in hosts or (ip.startswith("::ffff:") and ip[7:] in hosts):
+                    return True
+                return networks is not None and networks.match(ip) is not None
+        return [(sock, self.client_nicknames[sock]) for sock, profile in self.client_profiles.items()
+                if not isinstance(sock, RemoteClient) and sock in self.client_nicknames
+                and match(profile['ip_address'])]
+    
+    def kick_banned_clients(self):
+        """踢出本进程中IP命中封禁规则的在线用户"""
+        with self.lock:
+            targets = self.banned_clients()
+        self.kick_clients(targets)
+    
+    def publish_state_change(self, name, op, key, value):
+        """管理状态变化时发布到总线"""
+        self.bus_publish({"type": "state", "name": name, "op": op, "key": key, "value": value})
+    
+    def bus_publish(self, event):
+        """向其他工作进程和联邦节点发布事件，单进程且未启用联邦时不做任何事"""
+        if self.federation is not None:
+            self.federation.publish(event)
+        if self.bus is None:
+            return
+        # 只放入队列：管理状态在持有self.lock时发布，直接发送会在主进程转发不及时时阻塞，
+        # 而总线接收线程应用其他进程的事件又需要self.lock，两个进程会互相等待
+        self.bus_outbox.put(encode_frame(json.dumps(event, ensure_ascii=False).encode('utf-8')))
+    
+    def bus_writer_loop(self):
+        """把队列中的事件依次发往主进程，收到None时退出"""
+        while True:
+            data = self.bus_outbox.get()
+            if data is None:
+                return
+            try:
+                self.bus.sendall(data)
+            except OSError as e:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 总线发送失败: {str(e)}")
+                return
+    
+    def bus_loop(self):
+        """接收主进程转发的其他工作进程的事件"""
+        reader = FrameReader()
+        while True:
+            try:
+                data = self.bus.recv(FRAMED_RECV_SIZE)
+            except OSError:
+                data = b""
+            if not data:
+                # 主进程已退出，本工作进程随之关闭
+                self.running = False
+                return
+            for flags, payload in reader.feed(data):
+                try:
+                    self.handle_bus_event(json.loads(payload.decode('utf-8')))
+                except Exception as e:
+                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 处理总线事件失败: {str(e)}")
+    
+    def replicated_state(self):
+        return {
+            "admins": self.admins,
+            "banned_users": self.banned_users,
+            "banned_ips": self.banned_ips,
+            "muted_users": self.muted_users,
+        }
+    
+    def moderation_snapshot(self):
+        """当前管理状态的完整副本，供写快照使用"""
+        with self.lock:
+            return {name: container.snapshot() for name, container in self.replicated_state().items()}
+    
+    def handle_bus_event(self, event):
+        """处理来自其他工作进程的事件，这里的操作都不再发布到总线"""
+        event_type = event.get("type")
+        if event_type == "broadcast":
+            self.broadcast_message(event["message"], publish=False)
+        elif event_type == "roster":
+            self.apply_remote_roster(event["worker"], event["users"])
+            self.broadcast_user_list(publish=False)
+        elif event_type == "state":
+            with self.lock:
+                self.replicated_state()[event["name"]].apply(event["op"], event["key"], event["value"])
+            if event["name"] == "banned_ips" and event["op"] == "add":
+                # 其他进程新增的网段可能覆盖本进程的在线用户
+                self.kick_banned_clients()
+        elif event_type == "snapshot":
+            # 工作进程启动（或重启）时由主进程下发的完整状态
+            with self.lock:
+                for name, container in self.replicated_state().items():
+                    container.apply("reset", None, event["state"][name])
+            for worker_id, users in event["rosters"].items():
+                self.apply_remote_roster(int(worker_id), users)
+        elif event_type in ("direct", "kick"):
+            target_socket = None
+            with self.lock:
+                for sock, n in self.client_nicknames.items():
+                    if n == event["nickname"] and not isinstance(sock, RemoteClient):
+                        target_socket = sock
+                        break
+            if target_socket is None:
+                return
+            if event_type == "kick":
+                self.kick_user(event["nickname"])
+            else:
+                try:
+                    self.send_to(target_socket, event["message"])
+                except OSError:
+                    pass
+        elif event_type == "shutdown":
+            self.running = False
+    
+    def handle_federation_event(self, event):
+        """处理来自其他联邦节点的事件，用户表以来源节点名称区分"""
+        if event["type"] == "roster":
+            self.apply_remote_roster(event["origin"], event["users"])
+            self.broadcast_user_list(publish=False)
+        elif event["type"] == "merge":
+            with self.lock:
+                for name, container in self.replicated_state().items():
+                    container.apply("merge", None, event["state"].get(name, {} if name == "muted_users" else []))
+        else:
+            self.handle_bus_event(event)
+    
+    def apply_remote_roster(self, worker_id, users):
+        """用其他工作进程发布的用户表替换本进程中该进程的远程用户"""
+        if worker_id == self.worker_id:
+            return
+        with self.lock:
+            for sock in [sock for sock in self.client_nicknames
+                         if isinstance(sock, RemoteClient) and sock.worker_id == worker_id]:
+                del self.client_nicknames[sock]
+                self.client_profiles.pop(sock, None)
+            for profile in users:
+                remote_client = RemoteClient(worker_id, profile["nickname"])
+                self.client_nicknames[remote_client] = profile["nickname"]
+                self.client_profiles[remote_client] = profile
+    
+    def reload_config(self):
+        """重新读取配置文件，全部校验通过后一次性应用可在运行中修改的配置项
+        返回(已生效的配置项, 需要重启才能生效的配置项)；有任何取值无效时抛出ValueError，不修改任何配置
+        """
+        if not os.path.exists(CONFIG_FILE):
+            raise ValueError(f"配置文件 {CONFIG_FILE} 不存在")
+        config = load_config(strict=True)
+        values = {}
+        errors = []
+        for key, (kind, constraint) in LIVE_CONFIG_SETTINGS.items():
+            try:
+                values[key] = parse_config_value(kind, constraint, config[key])
+            except ValueError as e:
+                errors.append(f"{key}={config[key]}（{e}）")
+        if errors:
+            raise ValueError("；".join(errors))
         
         with self.lock:
-            # 查找目标用户的socket
-            for sock, nickname in self.client_nicknames.items():
-                if nickname == target_nickname:
-                    target_socket = sock
-                    break
+            changed = [key for key, value in values.items() if getattr(self, key) != value]
+            for key in changed:
+                setattr(self, key, values[key])
+                self.config[key] = config[key]
+        restart_required = [key for key, value in config.items()
+                            if key in self.config and key not in LIVE_CONFIG_SETTINGS and self.config[key] != value]
+        if "max_user" in changed and self.server_socket is not None:
+            # 与启动时一样作为监听队列长度，对已监听的socket再次调用listen会更新队列长度
+            self.server_socket.listen(self.max_user)
+        if "admin_prefix" in changed:
+            self.broadcast_user_list(publish=False)
+        return changed, restart_required
+    
+    def apply_config_reload(self):
+        """重新加载配置文件并输出结果，由配置监视线程和reload命令调用"""
+        self.config_state = config_file_state()
+        try:
+            changed, restart_required = self.reload_config()
+        except Exception as e:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 配置文件有误，未应用任何修改: {e}")
+            return
+        if self.worker_id:
+            # 多进程模式下每个工作进程各自重新加载，只由0号工作进程输出结果
+            return
+        if changed:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔄 配置已重新加载，已生效: {', '.join(f'{key}={self.config[key]}' for key in changed)}")
+        else:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔄 配置已重新加载，没有可立即生效的修改")
+        if restart_required:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  以下配置项需要重启服务器才能生效: {', '.join(restart_required)}")
+    
+    def config_watch_loop(self):
+        """轮询配置文件的修改时间和大小，文件变化后自动重新加载
+        标准库没有跨平台的文件变化通知接口，每隔几秒stat一次的开销可以忽略
+        """
+        while self.running:
+            time.sleep(CONFIG_WATCH_INTERVAL)
+            state = config_file_state()
+            if state is not None and state != self.config_state:
+                self.apply_config_reload()
+    
+    def resume_client(self, session, state):
+        """恢复旧进程移交过来的会话，返回昵称"""
+        nickname = state["nickname"]
+        session.caps = set(state["caps"])
+        session.framed = state["framed"]
+        session.reader.buffer.extend(bytes.fromhex(state["buffer"]))
+        session.pending.extend(state["pending"])
+        session.last_seen = state["last_seen"]
+        if "ping" in session.caps:
+            session.socket.settimeout(self.heartbeat_timeout)
+        with self.lock:
+            self.client_sessions[session.socket] = session
+            self.client_nicknames[session.socket] = nickname
+            self.client_profiles[session.socket] = state["profile"]
+            self.client_sockets.append(session.socket)
+        return nickname
+    
+    def open_handoff_socket(self):
+        """监听平滑升级的Unix socket，只有同一用户的进程可以连接"""
+        try:
+            os.unlink(HANDOFF_SOCKET_FILE)
+        except FileNotFoundError:
+            pass
+        self.handoff_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.handoff_socket.bind(HANDOFF_SOCKET_FILE)
+        os.chmod(HANDOFF_SOCKET_FILE, 0o600)
+        self.handoff_socket.listen(1)
+        self.handoff_socket.settimeout(1)
+        thread = threading.Thread(target=self.handoff_listen_loop)
+        thread.daemon = True
+        thread.start()
+    
+    def close_handoff_socket(self):
+        if self.handoff_socket is None:
+            return
+        try:
+            self.handoff_socket.close()
+            os.unlink(HANDOFF_SOCKET_FILE)
+        except OSError:
+            pass
+        self.handoff_socket = None
+    
+    def handoff_listen_loop(self):
+        """等待新进程请求接管"""
+        while self.running and self.handoff_socket is not None:
+            try:
+                conn, _ = self.handoff_socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            try:
+                conn.settimeout(HANDOFF_TIMEOUT)
+                request, _ = handoff_recv(conn)
+                if request.get("type") == "takeover":
+                    self.hand_off(conn, request)
+                    return
+            except (OSError, ValueError) as e:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 处理接管请求失败: {str(e)}")
+            finally:
+                conn.close()
+    
+    def hand_off(self, conn, request):
+        """把监听socket和在线连接移交给新进程，完成后本进程退出
+        先让所有处理线程停在读取之前，确保交接后旧进程不会再读走任何客户端数据；
+        TLS连接的加密状态无法跨进程传递，这些客户端会断开并自动重连到新进程
+        """
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔄 新进程 (PID {request.get('pid')}, v{request.get('version')}) 请求接管，正在移交连接...")
+        self.close_handoff_socket()
+        self.handoff_event.set()
+        os.write(self.handoff_wake[1], b"x")
         
-        if target_socket:
+        with self.lock:
+            transfer_ids = list(self.file_transfers)
+        for transfer_id in transfer_ids:
+            self.finish_file_transfer(transfer_id, "服务器正在升级，请稍后重新发送")
+        
+        with self.handoff_cond:
+            self.handoff_cond.wait_for(lambda: all(self.client_sessions[sock].parked for sock in self.client_sockets
+                                                   if sock in self.client_sessions), HANDOFF_PARK_TIMEOUT)
+            states = []
+            sessions = []
+            for sock in list(self.client_sockets):
+                session = self.client_sessions.get(sock)
+                if session is None or not session.parked or isinstance(sock, ssl.SSLSocket):
+                    continue
+                states.append({
+                    "nickname": self.client_nicknames.get(sock),
+                    "address": list(session.address),
+                    "profile": self.client_profiles.get(sock),
+                    "caps": sorted(session.caps),
+                    "framed": session.framed,
+                    "buffer": bytes(session.reader.buffer).hex(),
+                    "pending": list(session.pending),
+                    "last_seen": session.last_seen,
+                })
+                sessions.append(session)
+                self.client_sockets.remove(sock)
+                del self.client_sessions[sock]
+                self.client_nicknames.pop(sock, None)
+                self.client_profiles.pop(sock, None)
+            remaining = len(self.client_sockets)
+        
+        # 联邦连接和管理状态的文件由新进程重新打开
+        if self.federation is not None:
+            self.federation.stop()
+        if self.moderation_store is not None:
+            self.moderation_store.close()
+        
+        # detach后旧进程里残留的发送会因为socket已失效而失败，不会写入已移交的连接
+        fds = [self.server_socket.fileno()]
+        for session in sessions:
+            with session.send_lock:
+                fds.append(session.socket.detach())
+        payload = {
+            "type": "handoff",
+            "version": CURRENT_VERSION,
+            "start_time": self.start_time,
+            "moderation": self.moderation_snapshot(),
+            "clients": states,
+            "fd_count": len(fds),
+        }
+        try:
+            handoff_send(conn, payload, fds)
+            reply, _ = handoff_recv(conn)
+            if reply.get("type") != "ack":
+                raise ValueError("新进程没有确认接管")
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 已把 {len(states)} 个连接移交给新进程，{remaining} 个加密或未就绪的连接将断开重连")
+            self.handoff_exit_code = 0
+        except (OSError, ValueError) as e:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 移交连接失败，请不带--takeover重新启动服务器: {str(e)}")
+            self.handoff_exit_code = 1
+        finally:
+            for fd in fds[1:]:
+                os.close(fd)
+        # 没能移交的连接收到关闭通知后立即重连到新进程
+        self.reconnect_hint = 0
+        self.running = False
+    
+    def take_over(self):
+        """连接正在运行的旧进程，接管它的监听socket和在线连接，失败时返回None"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(HANDOFF_TIMEOUT)
+        try:
+            sock.connect(HANDOFF_SOCKET_FILE)
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔄 正在从旧进程接管端口和在线连接...")
+            handoff_send(sock, {"type": "takeover", "pid": os.getpid(), "version": CURRENT_VERSION})
+            handoff, fds = handoff_recv(sock)
+            handoff_send(sock, {"type": "ack"})
+        except (OSError, ValueError) as e:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 接管失败，请确认旧进程正在同一目录下运行，或不带--takeover直接启动: {str(e)}")
+            return None
+        finally:
+            sock.close()
+        handoff["fds"] = fds
+        # 管理状态以旧进程退出前的为准
+        with self.lock:
+            for name, container in self.replicated_state().items():
+                container.apply("reset", None, handoff["moderation"].get(name, {} if name == "muted_users" else []))
+        return handoff
+    
+    def heartbeat_loop(self):
+        """定期向启用心跳的客户端发送PING，掉线判定由各处理线程的接收超时完成"""
+        next_ping = time.time() + self.heartbeat_interval
+        while self.running:
+            time.sleep(1)
+            if time.time() < next_ping:
+                continue
+            next_ping = time.time() + self.heartbeat_interval
+            
+            with self.lock:
+                sessions = [self.client_sessions[sock] for sock in self.client_sockets if sock in self.client_sessions]
+            
+            ping_message = f"PING:{int(time.time() * 1000)}"
+            for session in sessions:
+                if "ping" not in session.caps:
+                    continue
+                try:
+                    self.send_to(session.socket, ping_message)
+                except OSError:
+                    # 发送失败说明连接已不可用，关闭读写使处理线程尽快退出并清理
+                    try:
+                        session.socket.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+    
+    def discovery_info(self):
+        """发现应答中的服务器信息，负载按本服务器（含其他工作进程）的在线人数计算，不含联邦节点上的用户"""
+        with self.lock:
+            online = len(self.client_nicknames)
+            local = sum(1 for client in self.client_nicknames
+                        if not isinstance(client, RemoteClient) or isinstance(client.worker_id, int))
+        info = {
+            "name": self.node_name,
+            "port": self.port,
+            "version": CURRENT_VERSION,
+            "online": online,
+            "max_user": self.max_user,
+            "load": round(local / self.max_user, 3),
+            "tls": self.tls_mode,
+        }
+        if hasattr(os, "getloadavg"):
+            info["cpu"] = round(os.getloadavg()[0] / (os.cpu_count() or 1), 3)
+        return info
+    
+    def open_discovery_socket(self):
+        """监听局域网发现请求，同一台机器上的多个服务器共用端口，各自应答"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(("", DISCOVERY_PORT))
+        except OSError as e:
+            sock.close()
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  局域网发现端口 {DISCOVERY_PORT} 绑定失败，客户端将无法自动发现本服务器: {str(e)}")
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            socket.inet_aton(DISCOVERY_GROUP) + socket.inet_aton("0.0.0.0"))
+        except OSError:
+            # 没有可用的组播路由时只响应广播
+            pass
+        sock.settimeout(self.socket_timeout)
+        self.discovery_socket = sock
+        thread = threading.Thread(target=self.discovery_loop)
+        thread.daemon = True
+        thread.start()
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 📡 局域网发现已启用，UDP端口: {DISCOVERY_PORT}")
+    
+    def close_discovery_socket(self):
+        if self.discovery_socket is None:
+            return
+        try:
+            self.discovery_socket.close()
+        except OSError:
+            pass
+        self.discovery_socket = None
+    
+    def discovery_loop(self):
+        """应答发现请求：原样带回客户端的随机串，客户端据此匹配请求并计算往返延迟"""
+        sock = self.discovery_socket
+        while self.running and self.discovery_socket is not None:
             try:
-                # 发送踢出消息给目标用户
-                target_socket.send("KICKED:你已被管理员踢出聊天室".encode('utf-8'))
-                # 关闭连接
-                target_socket.close()
-                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 已踢出用户: {target_nickname}")
-                # 广播踢出消息
-                self.broadcast_message(f"系统: {target_nickname} 已被管理员踢出聊天室")
-            except Exception as e:
-                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 踢出用户 {target_nickname} 时发生错误: {str(e)}")
-        else:
-            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 用户 {target_nickname} 不存在或已离线")
+                data, address = sock.recvfrom(DISCOVERY_PACKET_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            parts = data.decode("utf-8", "replace").split(" ", 1)
+            if len(parts) != 2 or parts[0] != DISCOVERY_MAGIC or not 0 < len(parts[1]) <= 64:
+                continue
+            info = dict(self.discovery_info(), nonce=parts[1])
+            reply = f"{DISCOVERY_REPLY} {json.dumps(info, ensure_ascii=False)}"
+            try:
+                sock.sendto(reply.encode("utf-8"), address)
+            except OSError:
+                continue
     
-    def start(self):
-        """启动服务器"""
+    def start(self, takeover=False):
+        """启动服务器，takeover为True时从正在运行的旧进程接管端口和在线连接"""
         print("=" * 60)
         print("" * 20 + "聊天服务器启动中...")
         print("=" * 60)
-        
-        # 检查更新
-        check_for_updates()
         try:
+            # 准备TLS证书，多进程模式下由主进程统一准备
+            if self.tls_mode != "off" and self.tls_context is None:
+                self.tls_context = prepare_tls_context(self.tls_mode, self.tls_cert, self.tls_key)
+            
+            # 旧进程关闭管理状态文件之后才能启动本进程的写入
+            handoff = self.take_over() if takeover else None
+            if takeover and handoff is None:
+                return
+            
+            # 启动管理状态的后台写入
+            if self.moderation_store is not None:
+                self.moderation_store.start()
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 💾 已恢复管理状态: {len(self.admins)} 个管理员，"
+                      f"{len(self.banned_ips)} 个封禁IP，{len(self.muted_users)} 个禁言")
+            
             bind_attempts = 0
             bind_success = False
-            
             while bind_attempts < self.max_attempts and not bind_success:
                 try:
-                    # 创建套接字
-                    self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    
-                    # 关键：确保在bind之前设置SO_REUSEADDR选项
-                    # 对于Windows，这个选项必须在bind之前设置才有效
-                    # 特别是打包为exe后，这个设置至关重要
-                    self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 已设置 SO_REUSEADDR 选项，允许端口复用")
-                    
-                    bind_attempts += 1
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 尝试绑定到端口 {self.port}... (尝试 {bind_attempts}/{self.max_attempts})")
-                    
-                    # 绑定地址和端口
-                    self.server_socket.bind(('0.0.0.0', self.port))
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 成功绑定到端口 {self.port}")
-                    
-                    # 开始监听连接
-                    self.server_socket.listen(self.max_user)
+                    if handoff is not None:
+                        # 沿用旧进程的监听socket，等待中的新连接都留在监听队列里
+                        self.server_socket = socket.socket(fileno=handoff["fds"][0])
+                        self.port = self.server_socket.getsockname()[1]
+                        self.start_time = handoff["start_time"]
+                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 已从旧进程 v{handoff['version']} 接管端口 {self.port} 和 {len(handoff['clients'])} 个在线连接")
+                    else:
+                        # 创建套接字
+                        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                        
+                        # 关键：确保在bind之前设置SO_REUSEADDR选项
+                        # 对于Windows，这个选项必须在bind之前设置才有效
+                        # 特别是打包为exe后，这个设置至关重要
+                        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 已设置 SO_REUSEADDR 选项，允许端口复用")
+                        if self.bus is not None:
+                            # 多进程模式：各工作进程绑定同一端口，由内核分配新连接
+                            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                        
+                        bind_attempts += 1
+                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 尝试绑定到端口 {self.port}... (尝试 {bind_attempts}/{self.max_attempts})")
+                        
+                        # 绑定地址和端口
+                        self.server_socket.bind(('0.0.0.0', self.port))
+                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 成功绑定到端口 {self.port}")
+                        
+                        # 开始监听连接
+                        self.server_socket.listen(self.max_user)
+                        self.start_time = time.time()  # 记录服务器启动时间
                     self.running = True
-                    self.start_time = time.time()  # 记录服务器启动时间
                     
-                    # 服务器启动成功提示
-                    print("=" * 60)
-                    print("" * 20 + f"聊天服务器启动成功 v{CURRENT_VERSION}  作者：MVP请勿做商业用途或非法活动")
-                    print("=" * 60)
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 服务器状态: 运行中")
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 监听地址: 0.0.0.0")
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 监听端口: {self.port}")
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 服务器IP: {socket.gethostbyname(socket.gethostname())}")
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 最大连接数: {self.max_user}")
-                    print("=" * 60)
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 等待客户端连接...")
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 提示: 输入 'quit'、'exit' 或 'stop' 可关闭服务器")
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 提示: 服务端目录下的LittleChat.serverset文件是服务器配置文件，试试改一改它吧！")
-                    print("=" * 60)
+                    # 服务器启动成功提示，多进程模式下只由0号工作进程输出
+                    if self.worker_id:
+                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 工作进程 {self.worker_id} 已启动 (PID {os.getpid()})")
+                    else:
+                        print("=" * 60)
+                        print("" * 20 + f"聊天服务器启动成功 v{CURRENT_VERSION}  作者：MVP请勿做商业用途或非法活动")
+                        print("=" * 60)
+                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 服务器状态: 运行中")
+                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 监听地址: 0.0.0.0")
+                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 监听端口: {self.port}")
+                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 服务器IP: {local_lan_ip()}")
+                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 最大连接数: {self.max_user}")
+                        print("=" * 60)
+                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 等待客户端连接...")
+                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 提示: 输入 'quit'、'exit' 或 'stop' 可关闭服务器")
+                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 提示: 服务端目录下的LittleChat.serverset文件是服务器配置文件，试试改一改它吧！")
+                        if self.handoff_wake is not None and self.bus is None:
+                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 提示: 升级时在同一目录运行 python server.py --takeover，新进程接管连接后本进程自动退出，用户不会掉线")
+                        print("=" * 60)
                     
                     bind_success = True
                 except OSError as e:
@@ -975,18 +3376,33 @@ class ChatServer:
                                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  收到退出命令，正在关闭服务器...")
                                 self.running = False
                                 break
+                            elif command.startswith('stop '):
+                                seconds = command[5:].strip()
+                                if seconds.isdigit():
+                                    print("\n" + "=" * 60)
+                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  收到退出命令，正在关闭服务器，客户端将在 {seconds} 秒后自动重连...")
+                                    self.reconnect_hint = int(seconds)
+                                    self.running = False
+                                    break
+                                else:
+                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 命令格式错误: stop <重连等待秒数>")
                             elif command in ['help', '?']:
                                 print("-" * 60)
                                 print("可用命令:")
                                 print("  quit, exit, stop  - 关闭服务器")
+                                print("  stop <秒数>       - 关闭服务器，通知客户端在指定秒数后自动重连（计划内重启时使用）")
                                 print("  help, ?          - 显示帮助信息")
                                 print("  status           - 显示服务器状态")
                                 print("  version          - 显示当前版本号")
+                                print("  update           - 检查并下载更新")
+                                print("  gencert          - 重新生成TLS自签名证书（重启后生效）")
+                                print("  reload           - 立即重新加载配置文件（修改后也会自动加载）")
                                 print("  op <用户名>       - 将指定用户设置为管理员")
                                 print("  unop <用户名>     - 撤销指定用户的管理员权限")
                                 print("  kick <用户名>     - 踢出指定用户")
-                                print("  ban <用户名>      - 封禁指定用户的IP")
-                                print("  unban <用户名或IP>    - 解除指定IP的封禁")
+                                print("  ban <目标>        - 封禁IP，目标可以是用户名、IP、CIDR网段(10.0.0.0/24、2001:db8::/32)或范围(起始IP-结束IP)")
+                                print("  unban <目标>      - 解除封禁，目标格式同ban")
+                                print("  banlist          - 列出所有IP封禁规则")
                                 print("  shutup <用户名> <时间> - 禁言指定时长（分钟）")
                                 print("  unshutup <用户名> - 解除指定用户的禁言")
                                 print("-" * 60)
@@ -994,213 +3410,53 @@ class ChatServer:
                                 print("-" * 60)
                                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔍 服务器版本: v{CURRENT_VERSION}")
                                 print("-" * 60)
+                            elif command == 'update':
+                                print("-" * 60)
+                                check_for_updates()
+                                print("-" * 60)
+                            elif command == 'gencert':
+                                print("-" * 60)
+                                try:
+                                    generate_self_signed_cert(self.tls_cert, self.tls_key, socket.gethostname())
+                                    with open(self.tls_cert, "r", encoding="utf-8") as f:
+                                        fingerprint = certificate_fingerprint(ssl.PEM_cert_to_DER_cert(f.read()))
+                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔐 已生成新证书 {self.tls_cert}，指纹 SHA256: {fingerprint}")
+                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔐 重启服务器后生效，客户端会提示证书指纹已变化")
+                                except Exception as e:
+                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 生成证书失败: {str(e)}")
+                                print("-" * 60)
+                            elif command == 'reload':
+                                print("-" * 60)
+                                self.apply_config_reload()
+                                print("-" * 60)
                             elif command == 'status':
                                 print("-" * 60)
                                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔍 服务器状态: {'运行中' if self.running else '已关闭'}")
                                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🚪 监听端口: {self.port}")
                                 with self.lock:
                                     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 👥 在线客户端: {len(self.client_sockets)}")
+                                    if self.bus is not None:
+                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 👥 所有工作进程在线用户: {len(self.client_nicknames)}")
+                                    if self.federation is not None:
+                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 👥 所有联邦节点在线用户: {len(self.client_nicknames)}")
+                                if self.federation is not None:
+                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🌐 联邦节点: {self.node_name}，已连接 {self.federation.link_count()} 个节点")
                                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🕒 运行时长: {self._get_running_time()}")
+                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔐 加密连接: {self.tls_mode if self.tls_context is not None else 'off'}")
+                                print("-" * 60)
+                            elif command.partition(' ')[0] in self.admin_commands:
+                                # op/unop/kick/ban/unban/shutup/unshutup由命令表统一执行
+                                admin_command, _, argument = command.partition(' ')
+                                success, result = self.execute_admin_command(admin_command, argument)
+                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {'✅' if success else '❌'} {result}")
+                            elif command == 'banlist':
+                                with self.lock:
+                                    rules = sorted(self.banned_ips)
+                                print("-" * 60)
+                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 共 {len(rules)} 条IP封禁规则")
+                                for rule in rules:
+                                    print(f"  {rule}")
                                 print("-" * 60)
-                            elif command.startswith('op '):
-                                # 处理op命令
-                                parts = command.split(' ', 1)
-                                if len(parts) == 2:
-                                    target_nickname = parts[1].strip()
-                                    # 查找目标用户的socket
-                                    target_socket = None
-                                    with self.lock:
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                target_socket = sock
-                                                break
-                                        self.admins.add(target_nickname)
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 已将 {target_nickname} 设置为管理员")
-                                    # 通知所有用户
-                                    broadcast_msg = f"系统: {target_nickname} 已成为管理员"
-                                    self.broadcast_message(broadcast_msg)
-                                    # 向被设为管理员的用户发送特定消息，触发客户端弹窗
-                                    if target_socket:
-                                        try:
-                                            target_socket.send(f"OP:{broadcast_msg}".encode('utf-8'))
-                                        except:
-                                            pass
-                                    # 更新所有客户端的用户列表，显示管理员标识
-                                    self.broadcast_user_list()
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 命令格式错误: op <用户名>")
-                            elif command.startswith('unop '):
-                                # 处理unop命令
-                                parts = command.split(' ', 1)
-                                if len(parts) == 2:
-                                    target_nickname = parts[1].strip()
-                                    is_admin = False
-                                    target_socket = None
-                                    with self.lock:
-                                        # 查找目标用户的socket
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                target_socket = sock
-                                                break
-                                        if target_nickname in self.admins:
-                                            self.admins.remove(target_nickname)
-                                            is_admin = True
-                                    
-                                    if is_admin:
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 已撤销 {target_nickname} 的管理员权限")
-                                        # 通知所有用户
-                                        broadcast_msg = f"系统: {target_nickname} 已被撤销管理员权限"
-                                        self.broadcast_message(broadcast_msg)
-                                        # 向被撤销管理员权限的用户发送特定消息，触发客户端弹窗
-                                        if target_socket:
-                                            try:
-                                                target_socket.send(f"UNOP:{broadcast_msg}".encode('utf-8'))
-                                            except:
-                                                pass
-                                        # 更新所有客户端的用户列表，恢复原昵称显示
-                                        self.broadcast_user_list()
-                                    else:
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ {target_nickname} 不是管理员")
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 命令格式错误: unop <用户名>")
-                            elif command.startswith('ban '):
-                                # 处理ban命令
-                                parts = command.split(' ', 1)
-                                if len(parts) == 2:
-                                    target_nickname = parts[1].strip()
-                                    # 查找目标用户的IP地址
-                                    target_ip = None
-                                    with self.lock:
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                # 找到目标用户，获取其IP地址
-                                                if sock in self.client_profiles:
-                                                    target_ip = self.client_profiles[sock]['ip_address']
-                                                break
-                                    
-                                    if target_ip:
-                                        # 封禁目标用户的IP
-                                        with self.lock:
-                                            self.banned_ips.add(target_ip)
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 已封禁IP {target_ip}（用户：{target_nickname}）")
-                                        # 踢出该用户（如果在线）
-                                        self.kick_user(target_nickname)
-                                        # 通知所有用户
-                                        self.broadcast_message(f"系统: 用户 {target_nickname} 的IP {target_ip} 已被封禁")
-                                    else:
-                                        # 用户不在线或找不到IP
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 找不到用户 {target_nickname} 或其IP地址")
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 命令格式错误: ban <用户名>")
-                            elif command.startswith('unban '):
-                                # 处理unban命令
-                                parts = command.split(' ', 1)
-                                if len(parts) == 2:
-                                    target = parts[1].strip()
-                                    target_ip = None
-                                    target_user = target  # 保存原始目标名称
-                                    
-                                    # 检查目标是否是IP地址格式
-                                    import re
-                                    ip_pattern = r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$'
-                                    if re.match(ip_pattern, target):
-                                        # 直接使用IP地址
-                                        target_ip = target
-                                    else:
-                                        # 尝试通过用户名查找IP地址
-                                        with self.lock:
-                                            for sock, n in self.client_nicknames.items():
-                                                if n == target:
-                                                    # 找到目标用户，获取其IP地址
-                                                    if sock in self.client_profiles:
-                                                        target_ip = self.client_profiles[sock]['ip_address']
-                                                    break
-                                    
-                                    if target_ip:
-                                        with self.lock:
-                                            if target_ip in self.banned_ips:
-                                                self.banned_ips.remove(target_ip)
-                                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 已解除IP {target_ip} 的封禁")
-                                                # 通知所有用户
-                                                if target_user != target_ip:
-                                                    self.broadcast_message(f"系统: 用户 {target_user} 的IP {target_ip} 已被解除封禁")
-                                                else:
-                                                    self.broadcast_message(f"系统: IP {target_ip} 已被解除封禁")
-                                            else:
-                                                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ IP {target_ip} 未被封禁")
-                                    else:
-                                        # 无法找到目标IP
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 找不到目标 {target} 或其IP地址")
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 命令格式错误: unban <用户名或IP>")
-                            elif command.startswith('shutup '):
-                                # 处理shutup命令
-                                parts = command.split(' ', 2)
-                                if len(parts) == 3:
-                                    target_nickname = parts[1].strip()
-                                    try:
-                                        duration = int(parts[2].strip())
-                                        if duration > 0:
-                                            # 查找目标用户的socket
-                                            target_socket = None
-                                            with self.lock:
-                                                for sock, n in self.client_nicknames.items():
-                                                    if n == target_nickname:
-                                                        target_socket = sock
-                                                        break
-                                                self.muted_users[target_nickname] = (time.time(), duration)
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 已禁言 {target_nickname} {duration} 分钟")
-                                            # 通知所有用户
-                                            broadcast_msg = f"系统: {target_nickname} 已被禁言 {duration} 分钟"
-                                            self.broadcast_message(broadcast_msg)
-                                            # 向被禁言的用户发送特定消息，触发客户端弹窗
-                                            if target_socket:
-                                                try:
-                                                    target_socket.send(f"MUTED:{broadcast_msg}".encode('utf-8'))
-                                                except:
-                                                    pass
-                                        else:
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 禁言时长必须大于0")
-                                    except ValueError:
-                                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 命令格式错误: shutup <用户名> <时间（分钟）>")
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 命令格式错误: shutup <用户名> <时间（分钟）>")
-                            elif command.startswith('unshutup '):
-                                # 处理unshutup命令
-                                parts = command.split(' ', 1)
-                                if len(parts) == 2:
-                                    target_nickname = parts[1].strip()
-                                    target_socket = None
-                                    with self.lock:
-                                        # 查找目标用户的socket
-                                        for sock, n in self.client_nicknames.items():
-                                            if n == target_nickname:
-                                                target_socket = sock
-                                                break
-                                        if target_nickname in self.muted_users:
-                                            del self.muted_users[target_nickname]
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 已解除 {target_nickname} 的禁言")
-                                            # 通知所有用户
-                                            broadcast_msg = f"系统: {target_nickname} 已被解除禁言"
-                                            self.broadcast_message(broadcast_msg)
-                                            # 向被解禁的用户发送特定消息，触发客户端弹窗
-                                            if target_socket:
-                                                try:
-                                                    target_socket.send(f"UNMUTED:{broadcast_msg}".encode('utf-8'))
-                                                except:
-                                                    pass
-                                        else:
-                                            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ {target_nickname} 未被禁言")
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 命令格式错误: unshutup <用户名>")
-                            elif command.startswith('kick '):
-                                # 处理kick命令
-                                parts = command.split(' ', 1)
-                                if len(parts) == 2:
-                                    target_nickname = parts[1].strip()
-                                    self.kick_user(target_nickname)
-                                else:
-                                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 命令格式错误: kick <用户名>")
                             elif command:
                                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❓ 未知命令: {command}")
                                 print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 💡 提示: 输入 'help' 查看可用命令")
@@ -1219,13 +3475,62 @@ class ChatServer:
                         except Exception as e:
                             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 命令处理错误: {str(e)}")
                 
-                # 创建并启动命令监听线程
-                command_thread = threading.Thread(target=command_listener)
-                command_thread.daemon = True  # 设置为守护线程
-                command_thread.start()
+                # 创建并启动命令监听线程，多进程模式下只有0号工作进程读取控制台
+                if not self.worker_id:
+                    command_thread = threading.Thread(target=command_listener)
+                    command_thread.daemon = True  # 设置为守护线程
+                    command_thread.start()
+                
+                # 启动总线线程，接收其他工作进程的事件
+                if self.bus is not None:
+                    self.bus_writer = threading.Thread(target=self.bus_writer_loop)
+                    self.bus_writer.daemon = True
+                    self.bus_writer.start()
+                    bus_thread = threading.Thread(target=self.bus_loop)
+                    bus_thread.daemon = True
+                    bus_thread.start()
+                
+                # 连接其他联邦节点
+                if self.federation is not None:
+                    self.federation.start()
+                
+                # 启动心跳线程
+                if self.heartbeat_interval > 0:
+                    heartbeat_thread = threading.Thread(target=self.heartbeat_loop)
+                    heartbeat_thread.daemon = True
+                    heartbeat_thread.start()
+                
+                # 响应局域网发现请求，多进程模式下只由0号工作进程应答
+                if self.discovery and not self.worker_id:
+                    self.open_discovery_socket()
+                
+                # 恢复旧进程移交的连接，然后等待下一次平滑升级
+                if handoff is not None:
+                    for state, fd in zip(handoff["clients"], handoff["fds"][1:]):
+                        client_thread = threading.Thread(target=self.handle_client,
+                                                         args=(socket.socket(fileno=fd), tuple(state["address"]), state))
+                        client_thread.daemon = True
+                        client_thread.start()
+                if self.handoff_wake is not None and self.bus is None:
+                    self.open_handoff_socket()
+                
+                # 监视配置文件，修改后自动重新加载
+                config_thread = threading.Thread(target=self.config_watch_loop)
+                config_thread.daemon = True
+                config_thread.start()
+                
+                # 在后台检查更新，不阻塞端口监听
+                if self.update_check and not self.worker_id:
+                    update_thread = threading.Thread(target=check_for_updates, kwargs={"cache_ttl": self.update_check_ttl, "interactive": False})
+                    update_thread.daemon = True
+                    update_thread.start()
                 
                 while self.running:
                     try:
+                        if self.handoff_event.is_set():
+                            # 平滑升级中，新连接留在监听队列里由新进程接受
+                            time.sleep(0.1)
+                            continue
                         # 设置超时，定期检查running状态
                         self.server_socket.settimeout(self.socket_timeout)  # 从配置文件读取超时时间
                         client_socket, client_address = self.server_socket.accept()
@@ -1255,36 +3560,63 @@ class ChatServer:
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 💡 建议: 检查端口是否被占用或权限是否足够")
             self.running = False
         finally:
+            self.close_handoff_socket()
+            self.close_discovery_socket()
+            if self.federation is not None:
+                self.federation.stop()
+            if self.moderation_store is not None:
+                self.moderation_store.close()
             self.stop()
+            if self.handoff_exit_code is not None:
+                # 控制台线程仍阻塞在input()中，解释器正常退出时会因拿不到stdin的锁而中止，
+                # 连接已经移交，输出日志后直接结束进程
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(self.handoff_exit_code)
     
     def stop(self):
-        """停止服务器"""
-        if not self.running:
+        """停止服务器：先停止接受新连接，通知客户端并等它们收完剩余消息，最后关闭仍未断开的连接"""
+        if self.stopped:
             return
+        self.stopped = True
         
         print("-" * 60)
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🔄 正在关闭服务器...")
         self.running = False
         
-        # 关闭所有客户端连接
+        # 关闭服务器套接字
+        if self.server_socket:
+            try:
+                self.server_socket.close()
+            except:
+                pass
+        
+        with self.lock:
+            transfer_ids = list(self.file_transfers)
+        for transfer_id in transfer_ids:
+            self.finish_file_transfer(transfer_id, "服务器正在关闭")
+        
         with self.lock:
             client_count = len(self.client_sockets)
             clients_copy = self.client_sockets.copy()
+        self.drain_clients(clients_copy)
+        
+        # 关闭超时仍未断开的连接
+        with self.lock:
+            remaining = self.client_sockets.copy()
             self.client_sockets.clear()
             self.client_nicknames.clear()
         
-        for client in clients_copy:
+        for client in remaining:
             try:
                 client.close()
             except:
                 pass
         
-        # 关闭服务器套接字
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except:
-                pass
+        if self.bus_writer is not None:
+            # 等总线发送线程发出排队中的事件，退出前的管理操作不会丢失
+            self.bus_outbox.put(None)
+            self.bus_writer.join(BUS_FLUSH_TIMEOUT)
         
         print("=" * 60)
         print("" * 20 + "✅ 服务器已关闭 ✅")
@@ -1295,10 +3627,248 @@ class ChatServer:
         print("=" * 60)
 
 
+BUS_FLUSH_TIMEOUT = 2  # 退出时等待总线发出剩余事件的最长时间（秒）
+
+class ClusterSupervisor:
+    """多进程模式的主进程
+    启动多个工作进程共享监听端口（SO_REUSEPORT），通过Unix socket总线在工作进程之间转发
+    广播、用户表和管理操作，并保存一份管理状态副本，供重启的工作进程恢复
+    """
+    def __init__(self, worker_count, tls_context=None):
+        self.worker_count = worker_count
+        self.tls_context = tls_context
+        self.workers = {}  # {worker_id: (pid, 总线socket, 启动时间)}
+        self.readers = {}
+        self.outboxes = {}  # {worker_id: 待发送的数据}，总线socket为非阻塞模式，主循环在可写时发出
+        self.state = {
+            "admins": ReplicatedSet("admins"),
+            "banned_users": ReplicatedSet("banned_users"),
+            "banned_ips": ReplicatedSet("banned_ips"),
+            "muted_users": ReplicatedDict("muted_users"),
+        }
+        self.rosters = {}  # {worker_id: [profile, ...]}
+        self.state_lock = threading.Lock()  # 保护状态副本，写快照的后台线程也会读取
+        self.running = True
+        # 多进程模式下由主进程持久化管理状态：所有修改都会经过主进程
+        self.moderation_store = None
+        config = load_config()
+        if config["moderation_store"].lower() == "true":
+            self.moderation_store = ModerationStore(self.state_snapshot, config["moderation_fsync"].lower(),
+                                                    int(config["moderation_compact_entries"]))
+            self.moderation_store.load(self.state)
+            for container in self.state.values():
+                container.journal = self.moderation_store.record
+    
+    def state_snapshot(self):
+        with self.state_lock:
+            return {name: container.snapshot() for name, container in self.state.items()}
+    
+    def spawn(self, worker_id):
+        """fork一个工作进程，并下发当前的完整状态"""
+        parent_socket, child_socket = socket.socketpair()
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            # 工作进程
+            parent_socket.close()
+            for other_pid, other_socket, started in self.workers.values():
+                other_socket.close()
+            exit_code = 0
+            try:
+                ChatServer(worker_id=worker_id, bus=child_socket, tls_context=self.tls_context).start()
+            except BaseException as e:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 工作进程 {worker_id} 异常退出: {str(e)}")
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(exit_code)
+        
+        child_socket.close()
+        # 主进程只有一个线程，阻塞在某个工作进程的发送上会使所有工作进程都无法转发
+        parent_socket.setblocking(False)
+        self.workers[worker_id] = (pid, parent_socket, time.time())
+        self.readers[worker_id] = FrameReader()
+        self.outboxes[worker_id] = bytearray()
+        self.send(worker_id, {
+            "type": "snapshot",
+            "state": self.state_snapshot(),
+            "rosters": self.rosters,
+        })
+    
+    def send(self, worker_id, event):
+        """把事件放入工作进程的发送缓冲区，socket缓冲区已满时由主循环在可写时继续发送"""
+        outbox = self.outboxes.get(worker_id)
+        if outbox is None:
+            return
+        outbox += encode_frame(json.dumps(event, ensure_ascii=False).encode('utf-8'))
+        self.flush(worker_id)
+    
+    def flush(self, worker_id):
+        """非阻塞地发出缓冲区中的数据，发不完的部分留在缓冲区"""
+        outbox = self.outboxes.get(worker_id)
+        if not outbox:
+            return
+        try:
+            sent = self.workers[worker_id][1].send(outbox)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            # 工作进程已退出，由主循环收到EOF后处理
+            outbox.clear()
+            return
+        del outbox[:sent]
+    
+    def forward(self, source_id, event):
+        """把事件转发给除来源外的所有工作进程"""
+        for worker_id in list(self.workers):
+            if worker_id != source_id:
+                self.send(worker_id, event)
+    
+    def handle_event(self, worker_id, event):
+        # 更新主进程保存的副本，再转发
+        if event.get("type") == "state":
+            with self.state_lock:
+                self.state[event["name"]].apply(event["op"], event["key"], event["value"])
+        elif event.get("type") == "roster":
+            self.rosters[worker_id] = event["users"]
+        self.forward(worker_id, event)
+    
+    def on_worker_exit(self, worker_id):
+        """工作进程退出：0号进程正常退出表示控制台执行了关闭命令，其他情况自动重启"""
+        pid, bus_socket, started = self.workers.pop(worker_id)
+        self.readers.pop(worker_id, None)
+        self.outboxes.pop(worker_id, None)
+        bus_socket.close()
+        _, status = os.waitpid(pid, 0)
+        exit_code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+        
+        # 该进程上的用户已断开，通知其他工作进程更新用户表
+        self.rosters.pop(worker_id, None)
+        self.forward(worker_id, {"type": "roster", "worker": worker_id, "users": []})
+        
+        if worker_id == 0 and exit_code == 0:
+            self.running = False
+        elif self.running:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  工作进程 {worker_id} 已退出（退出码 {exit_code}），正在重启...")
+            if time.time() - started < 5:
+                # 启动后很快退出，稍等再重启，避免反复崩溃占满CPU
+                time.sleep(1)
+            self.spawn(worker_id)
+    
+    def run(self):
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 🚀 多进程模式: 启动 {self.worker_count} 个工作进程 (主进程 PID {os.getpid()})")
+        if self.moderation_store is not None:
+            self.moderation_store.start()
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 💾 已恢复管理状态: {len(self.state['admins'])} 个管理员，"
+                  f"{len(self.state['banned_ips'])} 个封禁IP，{len(self.state['muted_users'])} 个禁言")
+        for worker_id in range(self.worker_count):
+            self.spawn(worker_id)
+        
+        try:
+            while self.running:
+                sockets = {worker[1]: worker_id for worker_id, worker in self.workers.items()}
+                pending = [bus_socket for bus_socket, worker_id in sockets.items() if self.outboxes.get(worker_id)]
+                readable, writable, _ = select.select(list(sockets), pending, [], 1.0)
+                for bus_socket in writable:
+                    self.flush(sockets[bus_socket])
+                for bus_socket in readable:
+                    worker_id = sockets[bus_socket]
+                    try:
+                        data = bus_socket.recv(FRAMED_RECV_SIZE)
+                    except (BlockingIOError, InterruptedError):
+                        continue
+                    except OSError:
+                        data = b""
+                    if not data:
+                        self.on_worker_exit(worker_id)
+                        continue
+                    for flags, payload in self.readers[worker_id].feed(data):
+                        self.handle_event(worker_id, json.loads(payload.decode('utf-8')))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+    
+    def shutdown(self):
+        """通知所有工作进程关闭并等待退出"""
+        self.running = False
+        for worker_id, (pid, bus_socket, started) in list(self.workers.items()):
+            self.send(worker_id, {"type": "shutdown"})
+            # 主循环已停止，剩余数据改为限时阻塞发送
+            outbox = self.outboxes.pop(worker_id, b"")
+            bus_socket.settimeout(BUS_FLUSH_TIMEOUT)
+            try:
+                bus_socket.sendall(outbox)
+            except OSError:
+                pass
+        deadline = time.time() + 10
+        for worker_id, (pid, bus_socket, started) in list(self.workers.items()):
+            while True:
+                finished_pid, _ = os.waitpid(pid, os.WNOHANG)
+                if finished_pid or time.time() > deadline:
+                    break
+                time.sleep(0.1)
+            if not finished_pid:
+                os.kill(pid, 15)
+                os.waitpid(pid, 0)
+            bus_socket.close()
+        self.workers.clear()
+        if self.moderation_store is not None:
+            self.moderation_store.close()
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ✅ 所有工作进程已退出")
+
+def parse_peer_list(value):
+    """解析逗号分隔的 主机:端口 列表"""
+    peers = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(":")
+        try:
+            peers.append((host.strip("[]"), int(port)))
+        except ValueError:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  忽略无效的节点地址: {item}")
+    return peers
+
+def resolve_worker_count(config):
+    """根据配置确定工作进程数，不支持的平台退回单进程"""
+    try:
+        worker_count = int(config.get("workers", "1"))
+    except ValueError:
+        worker_count = 1
+    if worker_count <= 0:
+        worker_count = os.cpu_count() or 1
+    if worker_count > 1 and (config.get("federation_port", "0") not in ("", "0") or config.get("federation_peers")):
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  联邦模式暂不支持多进程，已使用单进程模式")
+        worker_count = 1
+    if worker_count > 1 and not (sys.platform.startswith("linux") and hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT")):
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ⚠️  多进程模式需要Linux的SO_REUSEPORT支持，已使用单进程模式")
+        worker_count = 1
+    return worker_count
+
 def start_server():
-    """启动聊天服务器"""
+    """启动聊天服务器，带--takeover参数时从同一目录下正在运行的旧进程平滑接管"""
+    config = load_config()
+    worker_count = resolve_worker_count(config)
+    takeover = "--takeover" in sys.argv[1:]
+    if takeover and (worker_count > 1 or not HANDOFF_SUPPORTED):
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ 平滑升级只支持Linux/macOS上的单进程模式")
+        return
+    if worker_count > 1:
+        # 在fork之前创建TLS上下文，所有工作进程共用同一组会话票据密钥，
+        # 客户端重连被分配到其他工作进程时也能复用会话
+        tls_context = None
+        if config["tls_mode"].lower() in ("optional", "required"):
+            try:
+                tls_context = prepare_tls_context(config["tls_mode"].lower(), config["tls_cert"], config["tls_key"])
+            except RuntimeError as e:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] ❌ {str(e)}")
+                return
+        ClusterSupervisor(worker_count, tls_context).run()
+        return
     server = ChatServer()
-    server.start()
+    server.start(takeover=takeover)
 
 
 if __name__ == "__main__":